@@ -54,13 +54,14 @@ async def main(db_path: Path) -> None:
     async with aiosqlite.connect(db_path) as connection:
         await connection.execute("pragma journal_mode=wal")
         await connection.execute("pragma synchronous=FULL")
-        await connection.execute("pragma query_only=ON")
+        # not query_only, BlockStore.create() adds the generators table to
+        # databases that don't have it yet
         db_version: int = await lookup_db_version(connection)
 
         db_wrapper = DBWrapper2(connection, db_version=db_version)
         await db_wrapper.add_connection(await aiosqlite.connect(db_path))
 
-        block_store = await BlockStore.create(db_wrapper)
+        block_store = await BlockStore.create(db_wrapper, use_cache=True, generator_cache_size=1000)
         coin_store = await CoinStore.create(db_wrapper)
 
         start_time = monotonic()
@@ -70,7 +71,8 @@ async def main(db_path: Path) -> None:
 
         peak = blockchain.get_peak()
         assert peak is not None
-        timing = 0.0
+        cold = 0.0
+        warm = 0.0
         for i in range(REPETITIONS):
             block = BlockInfo(
                 peak.header_hash,
@@ -78,13 +80,21 @@ async def main(db_path: Path) -> None:
                 random_refs(),
             )
 
+            # the first call looks the generators up in the database, the
+            # second one finds them in the generator cache
             start_time = monotonic()
             gen = await blockchain.get_block_generator(block)
-            one_call = monotonic() - start_time
-            timing += one_call
+            cold += monotonic() - start_time
             assert gen is not None
 
-        print(f"get_block_generator(): {timing/REPETITIONS:0.3f}s")
+            start_time = monotonic()
+            gen = await blockchain.get_block_generator(block)
+            warm += monotonic() - start_time
+            assert gen is not None
+
+        print(f"get_block_generator(): {cold/REPETITIONS:0.3f}s")
+        print(f"get_block_generator() (cached): {warm/REPETITIONS:0.3f}s")
+        print(f"generator lookups: {block_store.get_generator_stats()}")
 
         blockchain.shut_down()
 
@@ -0,0 +1,89 @@
+from __future__ import annotations
+
+import random
+from time import perf_counter
+from typing import List
+
+from hddcoin.full_node.fee_estimate_store import FeeStore
+from hddcoin.full_node.fee_estimation import MempoolItemInfo
+from hddcoin.full_node.fee_estimator_constants import LONG_BLOCK_PERIOD, LONG_DECAY
+from hddcoin.full_node.fee_tracker import FeeTracker, init_buckets
+from hddcoin.util.ints import uint32, uint64
+
+random.seed(123456789)
+
+BLOCKS = 1000
+TXS_PER_BLOCK = 100
+ESTIMATES = 1000
+
+
+def random_items(height: int) -> List[MempoolItemInfo]:
+    return [
+        MempoolItemInfo(
+            uint64(random.randint(1000000, 10000000)),
+            uint64(random.choice([0, 10000, 200000, random.randint(0, 100000000)])),
+            uint32(height - random.randint(1, 300)),
+        )
+        for _ in range(TXS_PER_BLOCK)
+    ]
+
+
+class NestedLists:
+    """
+    The moving averages of the long horizon, stored as lists of Python floats,
+    the way FeeStat used to store them, and decayed element by element on
+    every block.
+    """
+
+    def __init__(self) -> None:
+        buckets = len(init_buckets())
+        self.confirmed_average = [[0.0] * buckets for _ in range(LONG_BLOCK_PERIOD)]
+        self.failed_average = [[0.0] * buckets for _ in range(LONG_BLOCK_PERIOD)]
+        self.tx_ct_avg = [0.0] * buckets
+        self.m_fee_rate_avg = [0.0] * buckets
+
+    def update_moving_averages(self) -> None:
+        for j in range(0, len(self.tx_ct_avg)):
+            for i in range(0, len(self.confirmed_average)):
+                self.confirmed_average[i][j] *= LONG_DECAY
+                self.failed_average[i][j] *= LONG_DECAY
+
+            self.tx_ct_avg[j] *= LONG_DECAY
+            self.m_fee_rate_avg[j] *= LONG_DECAY
+
+
+def main() -> None:
+    blocks = [random_items(height) for height in range(300, 300 + BLOCKS)]
+
+    nested = NestedLists()
+    start = perf_counter()
+    for _ in range(BLOCKS):
+        nested.update_moving_averages()
+    decay_lists = perf_counter() - start
+
+    tracker = FeeTracker(FeeStore())
+    start = perf_counter()
+    for _ in range(BLOCKS):
+        tracker.long_horizon.update_moving_averages()
+    decay_arrays = perf_counter() - start
+    print(f"decay, nested lists:  {decay_lists * 1000000 / BLOCKS:0.1f} us per block")
+    print(f"decay, scaled arrays: {decay_arrays * 1000000 / BLOCKS:0.1f} us per block")
+
+    tracker = FeeTracker(FeeStore())
+    start = perf_counter()
+    for height, items in enumerate(blocks, start=300):
+        tracker.process_block(uint32(height), items)
+        for item in items:
+            tracker.add_tx(item)
+    process_time = perf_counter() - start
+    print(f"process_block: {process_time * 1000000 / BLOCKS:0.1f} us per block ({TXS_PER_BLOCK} txs)")
+
+    start = perf_counter()
+    for _ in range(ESTIMATES):
+        tracker.estimate_fees()
+    estimate_time = perf_counter() - start
+    print(f"estimate_fees: {estimate_time * 1000000 / ESTIMATES:0.1f} us per call")
+
+
+if __name__ == "__main__":
+    main()
@@ -3,7 +3,7 @@ from __future__ import annotations
 import asyncio
 from dataclasses import dataclass
 from time import monotonic
-from typing import Dict, Optional
+from typing import Dict, List, Optional
 
 from chia_rs import G2Element
 from clvm.casts import int_to_bytes
@@ -14,7 +14,7 @@ from hddcoin.types.blockchain_format.coin import Coin
 from hddcoin.types.blockchain_format.program import Program
 from hddcoin.types.blockchain_format.sized_bytes import bytes32
 from hddcoin.types.coin_record import CoinRecord
-from hddcoin.types.coin_spend import CoinSpend
+from hddcoin.types.coin_spend import make_spend
 from hddcoin.types.condition_opcodes import ConditionOpcode
 from hddcoin.types.spend_bundle import SpendBundle
 from hddcoin.util.ints import uint32, uint64
@@ -62,7 +62,7 @@ def make_spend_bundle(coin: Coin, height: int) -> SpendBundle:
             int_to_bytes(coin.amount // 2 - height * 10),
         ],
     ]
-    spend = CoinSpend(coin, IDENTITY_PUZZLE, Program.to(conditions))
+    spend = make_spend(coin, IDENTITY_PUZZLE, Program.to(conditions))
     return SpendBundle([spend], G2Element())
 
 
@@ -125,6 +125,36 @@ async def run_mempool_benchmark() -> None:
     print(f"  time: {stop - start:0.4f}s")
     print(f"  per block: {(stop - start) / height * 1000:0.2f}ms")
 
+    # make all coins spent by mempool items available, they would be in the
+    # coin store
+    coin_records = {}
+    for item in mempool.mempool.all_items():
+        for cs in item.spend_bundle.coin_spends:
+            coin_records[cs.coin.name()] = CoinRecord(cs.coin, uint32(1), uint32(0), False, uint64(timestamp // 2))
+
+    # the most recent block is replaced by another one, at the same height. It
+    # rolls back the coins spent by the 10 most recent items, and spends the
+    # most recent coin
+    rolled_back: List[bytes32] = [
+        item.spend_bundle.coin_spends[0].coin.name()
+        for item in mempool.mempool.all_items()
+        if item.height_added_to_mempool == height
+    ]
+    for reorg_aware in [True, False]:
+        print(f"\nrunning new_peak() with a reorg ({'reorg-aware' if reorg_aware else 'slow path'})")
+        print("  mempool size: ", mempool.mempool.size())
+        rec = BenchBlockRecord(
+            header_hash=make_hash(NUM_ITERS * (2 if reorg_aware else 3)),
+            height=uint32(height),
+            timestamp=timestamp,
+            prev_transaction_block_height=uint32(height - 1),
+            prev_transaction_block_hash=make_hash(height - 1),
+        )
+        start = monotonic()
+        await mempool.new_peak(rec, [most_recent_coin_id], rolled_back if reorg_aware else None)
+        stop = monotonic()
+        print(f"  time: {stop - start:0.4f}s")
+
 
 if __name__ == "__main__":
     import logging
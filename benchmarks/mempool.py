@@ -10,19 +10,29 @@ from typing import Dict, Iterator, List, Optional, Tuple
 
 from hddcoin.consensus.coinbase import create_farmer_coin, create_pool_coin
 from hddcoin.consensus.default_constants import DEFAULT_CONSTANTS
+from hddcoin.full_node.bitcoin_fee_estimator import create_bitcoin_fee_estimator
+from hddcoin.full_node.fee_estimation import MempoolInfo
+from hddcoin.full_node.mempool import Mempool
 from hddcoin.full_node.mempool_manager import MempoolManager
 from hddcoin.simulator.wallet_tools import WalletTool
 from hddcoin.types.blockchain_format.coin import Coin
 from hddcoin.types.blockchain_format.sized_bytes import bytes32
+from hddcoin.types.clvm_cost import CLVMCost
 from hddcoin.types.coin_record import CoinRecord
+from hddcoin.types.fee_rate import FeeRate
 from hddcoin.types.mempool_inclusion_status import MempoolInclusionStatus
 from hddcoin.types.spend_bundle import SpendBundle
 from hddcoin.util.ints import uint32, uint64
 from hddcoin.util.misc import to_batches
+from tests.core.mempool.test_mempool_manager import mk_item
 
 NUM_ITERS = 200
 NUM_PEERS = 5
 
+# the number of items in the mempool, for the benchmark of the mempool's own
+# data structures
+NUM_ITEMS = 100000
+
 
 @contextmanager
 def enable_profiler(profile: bool, name: str) -> Iterator[None]:
@@ -260,6 +270,65 @@ async def run_mempool_benchmark() -> None:
         print(f"  per call: {(stop - start) / len(blocks) * 1000:0.2f}ms")
 
 
+def run_mempool_index_benchmark() -> None:
+    print("\n== Mempool with %d items" % NUM_ITEMS)
+    # every item has a cost of 1000, the mempool fits all of them. Blocks fit
+    # a tenth of them
+    item_cost = 1000
+    mempool_info = MempoolInfo(
+        CLVMCost(uint64(NUM_ITEMS * item_cost)),
+        FeeRate(uint64(5)),
+        CLVMCost(uint64(NUM_ITEMS * item_cost // 10)),
+    )
+    fee_estimator = create_bitcoin_fee_estimator(uint64(mempool_info.max_block_clvm_cost))
+    mempool = Mempool(mempool_info, fee_estimator)
+
+    items = []
+    replacements = []
+    for i in range(NUM_ITEMS):
+        coin = Coin(make_hash(i), make_hash(i + NUM_ITEMS), uint64(1000000))
+        items.append(mk_item([coin], cost=item_cost, fee=(i * 7919) % 100000))
+        coin = Coin(make_hash(i + 2 * NUM_ITEMS), make_hash(i + NUM_ITEMS), uint64(1000000))
+        replacements.append(mk_item([coin], cost=item_cost, fee=100000 + i))
+
+    print("\nProfiling add_to_pool()")
+    with enable_profiler(True, "index-add"):
+        start = monotonic()
+        for item in items:
+            mempool.add_to_pool(item)
+        stop = monotonic()
+    print(f"  time: {stop - start:0.4f}s")
+    print(f"  per call: {(stop - start) / NUM_ITEMS * 1000000:0.2f}us")
+
+    print("\nProfiling get_min_fee_rate()")
+    with enable_profiler(True, "index-min-fee-rate"):
+        start = monotonic()
+        for _ in range(100):
+            mempool.get_min_fee_rate(item_cost * 100)
+        stop = monotonic()
+    print(f"  time: {stop - start:0.4f}s")
+    print(f"  per call: {(stop - start) / 100 * 1000:0.2f}ms")
+
+    print("\nProfiling create_bundle_from_mempool_items()")
+    with enable_profiler(True, "index-create"):
+        start = monotonic()
+        for _ in range(10):
+            mempool.create_bundle_from_mempool_items(lambda _: True)
+        stop = monotonic()
+    print(f"  time: {stop - start:0.4f}s")
+    print(f"  per call: {(stop - start) / 10 * 1000:0.2f}ms")
+
+    print("\nProfiling add_to_pool() with a full mempool")
+    with enable_profiler(True, "index-add-full"):
+        start = monotonic()
+        for item in replacements[:10000]:
+            mempool.add_to_pool(item)
+        stop = monotonic()
+    print(f"  time: {stop - start:0.4f}s")
+    print(f"  per call: {(stop - start) / 10000 * 1000000:0.2f}us")
+    assert mempool.size() == NUM_ITEMS
+
+
 if __name__ == "__main__":
     import logging
 
@@ -267,3 +336,4 @@ if __name__ == "__main__":
     logger.addHandler(logging.StreamHandler())
     logger.setLevel(logging.WARNING)
     asyncio.run(run_mempool_benchmark())
+    run_mempool_index_benchmark()
@@ -409,6 +409,10 @@ def convert_v1_to_v2(in_path: Path, out_path: Path) -> None:
             out_db.execute("CREATE INDEX IF NOT EXISTS coin_spent_index on coin_record(spent_index)")
             out_db.execute("CREATE INDEX IF NOT EXISTS coin_puzzle_hash on coin_record(puzzle_hash)")
             out_db.execute("CREATE INDEX IF NOT EXISTS coin_parent_index on coin_record(coin_parent)")
+            out_db.execute(
+                "CREATE INDEX IF NOT EXISTS coin_puzzle_hash_confirmed_index "
+                "on coin_record(puzzle_hash, confirmed_index, coin_name)"
+            )
             out_db.commit()
             print("      hint store")
 
@@ -46,13 +46,15 @@ from hddcoin.types.header_block import HeaderBlock
 from hddcoin.types.unfinished_block import UnfinishedBlock
 from hddcoin.types.unfinished_header_block import UnfinishedHeaderBlock
 from hddcoin.types.weight_proof import SubEpochChallengeSegment
+from hddcoin.util import cached_bls
 from hddcoin.util.errors import ConsensusError, Err
 from hddcoin.util.generator_tools import get_block_header
 from hddcoin.util.hash import std_hash
 from hddcoin.util.inline_executor import InlineExecutor
 from hddcoin.util.ints import uint16, uint32, uint64, uint128
 from hddcoin.util.priority_mutex import PriorityMutex
-from hddcoin.util.setproctitle import getproctitle, setproctitle
+from hddcoin.util.setproctitle import getproctitle
+from hddcoin.util.shared_pairing_cache import SharedPairingCache
 
 log = logging.getLogger(__name__)
 
@@ -127,6 +129,7 @@ class Blockchain(BlockchainInterface):
         multiprocessing_context: Optional[BaseContext] = None,
         *,
         single_threaded: bool = False,
+        pairing_cache: Optional[SharedPairingCache] = None,
     ) -> Blockchain:
         """
         Initializes a blockchain with the BlockRecords from disk, assuming they have all been
@@ -148,8 +151,8 @@ class Blockchain(BlockchainInterface):
             self.pool = ProcessPoolExecutor(
                 max_workers=num_workers,
                 mp_context=multiprocessing_context,
-                initializer=setproctitle,
-                initargs=(f"{getproctitle()}_worker",),
+                initializer=cached_bls.init_validation_worker,
+                initargs=(f"{getproctitle()}_worker", pairing_cache),
             )
             log.info(f"Started {num_workers} processes for block validation")
 
@@ -164,6 +167,7 @@ class Blockchain(BlockchainInterface):
     def shut_down(self) -> None:
         self._shut_down = True
         self.pool.shutdown(wait=True)
+        self.__height_map.close()
 
     async def _load_chain_from_store(self, blockchain_dir: Path) -> None:
         """
@@ -1012,6 +1016,9 @@ class Blockchain(BlockchainInterface):
             return None
         return segments
 
+    async def get_sub_epoch_challenge_segments_bytes(self, ses_block_hash: bytes32) -> Optional[bytes]:
+        return await self.block_store.get_sub_epoch_challenge_segments_bytes(ses_block_hash)
+
     # Returns 'True' if the info is already in the set, otherwise returns 'False' and stores it.
     def seen_compact_proofs(self, vdf_info: VDFInfo, height: uint32) -> bool:
         pot_tuple = (vdf_info, height)
@@ -98,6 +98,9 @@ class BlockchainInterface:
     ) -> Optional[List[SubEpochChallengeSegment]]:
         pass
 
+    async def get_sub_epoch_challenge_segments_bytes(self, sub_epoch_summary_hash: bytes32) -> Optional[bytes]:
+        pass
+
     def seen_compact_proofs(self, vdf_info: VDFInfo, height: uint32) -> bool:
         # ignoring hinting error until we handle our interfaces more formally
         return  # type: ignore[return-value]
@@ -7,8 +7,6 @@ from concurrent.futures import Executor
 from dataclasses import dataclass
 from typing import Awaitable, Callable, Dict, List, Optional, Sequence, Tuple
 
-from chia_rs import AugSchemeMPL, G1Element
-
 from hddcoin.consensus.block_header_validation import validate_finished_header_block
 from hddcoin.consensus.block_record import BlockRecord
 from hddcoin.consensus.blockchain_interface import BlockchainInterface
@@ -28,6 +26,7 @@ from hddcoin.types.full_block import FullBlock
 from hddcoin.types.generator_types import BlockGenerator
 from hddcoin.types.header_block import HeaderBlock
 from hddcoin.types.unfinished_block import UnfinishedBlock
+from hddcoin.util import cached_bls
 from hddcoin.util.block_cache import BlockCache
 from hddcoin.util.condition_tools import pkm_pairs
 from hddcoin.util.errors import Err, ValidationError
@@ -123,10 +122,11 @@ def batch_pre_validate_blocks(
                         if npc_result is not None and block.transactions_info is not None:
                             assert npc_result.conds
                             pairs_pks, pairs_msgs = pkm_pairs(npc_result.conds, constants.AGG_SIG_ME_ADDITIONAL_DATA)
-                            # Using AugSchemeMPL.aggregate_verify, so it's safe to use from_bytes_unchecked
-                            pks_objects: List[G1Element] = [G1Element.from_bytes_unchecked(pk) for pk in pairs_pks]
-                            if not AugSchemeMPL.aggregate_verify(
-                                pks_objects, pairs_msgs, block.transactions_info.aggregated_signature
+                            # The pairings of transactions we've seen in the mempool are likely to be in the
+                            # (shared) pairing cache already. When most of them aren't, this falls back to
+                            # AugSchemeMPL.aggregate_verify without caching anything
+                            if not cached_bls.aggregate_verify(
+                                pairs_pks, pairs_msgs, block.transactions_info.aggregated_signature
                             ):
                                 error_int = uint16(Err.BAD_AGGREGATE_SIGNATURE.value)
                             else:
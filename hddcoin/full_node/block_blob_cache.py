@@ -0,0 +1,360 @@
+from __future__ import annotations
+
+import dataclasses
+import logging
+import mmap
+import os
+import struct
+import zlib
+from collections import OrderedDict
+from pathlib import Path
+from typing import Any, BinaryIO, Dict, Iterable, List, Optional, Tuple
+
+import aiofiles
+
+from hddcoin.types.blockchain_format.sized_bytes import bytes32
+from hddcoin.util.files import write_file_async
+from hddcoin.util.ints import uint32, uint64
+from hddcoin.util.streamable import Streamable, streamable
+
+log = logging.getLogger(__name__)
+
+# every block in the cache file is preceded by its header hash, height, length
+# and the crc32 of the block
+ENTRY_HEADER = struct.Struct(">32sIII")
+
+# the number of blocks added to the cache file between saving its index
+INDEX_FLUSH_INTERVAL = 100
+
+
+@streamable
+@dataclasses.dataclass(frozen=True)
+class BlockBlobFileIndex(Streamable):
+    file_size: uint64
+    write_pos: uint64
+    # (header hash, height, offset, length), oldest first
+    entries: List[Tuple[bytes32, uint32, uint64, uint32]]
+
+
+@dataclasses.dataclass
+class BlockBlobLRU:
+    """
+    The first tier of the block cache. Holds decompressed blocks in memory, up
+    to max_bytes in total.
+    """
+
+    max_bytes: int
+    size: int = 0
+    hits: int = 0
+    misses: int = 0
+    # header hash -> (height, block), the least recently used first
+    _blobs: OrderedDict[bytes32, Tuple[uint32, bytes]] = dataclasses.field(default_factory=OrderedDict)
+
+    def __len__(self) -> int:
+        return len(self._blobs)
+
+    def __contains__(self, header_hash: bytes32) -> bool:
+        return header_hash in self._blobs
+
+    def get(self, header_hash: bytes32) -> Optional[bytes]:
+        entry = self._blobs.get(header_hash)
+        if entry is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self._blobs.move_to_end(header_hash)
+        return entry[1]
+
+    def height_of(self, header_hash: bytes32) -> Optional[uint32]:
+        entry = self._blobs.get(header_hash)
+        return None if entry is None else entry[0]
+
+    def put(self, header_hash: bytes32, height: uint32, blob: bytes) -> List[Tuple[bytes32, uint32]]:
+        """
+        Returns the (header hash, height) of the blocks evicted to make room.
+        """
+        if len(blob) > self.max_bytes:
+            return []
+        self.remove(header_hash)
+        self._blobs[header_hash] = (height, blob)
+        self.size += len(blob)
+        evicted: List[Tuple[bytes32, uint32]] = []
+        while self.size > self.max_bytes:
+            evicted_hash, (evicted_height, evicted_blob) = self._blobs.popitem(last=False)
+            self.size -= len(evicted_blob)
+            evicted.append((evicted_hash, evicted_height))
+        return evicted
+
+    def remove(self, header_hash: bytes32) -> None:
+        entry = self._blobs.pop(header_hash, None)
+        if entry is not None:
+            self.size -= len(entry[1])
+
+    def get_stats(self) -> Dict[str, int]:
+        return {
+            "entries": len(self._blobs),
+            "size": self.size,
+            "max_size": self.max_bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+        }
+
+
+class BlockBlobFile:
+    """
+    The second tier of the block cache. A memory mapped file holding the most
+    recently added blocks, uncompressed, used as a ring buffer. The index of
+    the file is saved next to it, so the cache survives restarts. Blocks are
+    checksummed, anything overwritten after the index was saved is detected
+    when it's read, and treated as a miss.
+    """
+
+    max_bytes: int
+    hits: int
+    misses: int
+    _path: Path
+    _index_path: Path
+    _file: BinaryIO
+    _mmap: mmap.mmap
+    _write_pos: int
+    # header hash -> (height, offset, length), in the order they were written
+    _entries: OrderedDict[bytes32, Tuple[uint32, int, int]]
+    _unsaved: int
+
+    @classmethod
+    async def create(cls, path: Path, max_bytes: int) -> BlockBlobFile:
+        self = cls()
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._path = path
+        self._index_path = path.with_name(path.name + "-index")
+        self._write_pos = 0
+        self._entries = OrderedDict()
+        self._unsaved = 0
+
+        index: Optional[BlockBlobFileIndex] = None
+        try:
+            async with aiofiles.open(self._index_path, "rb") as f:
+                index = BlockBlobFileIndex.from_bytes(await f.read())
+        except Exception:
+            # it's OK if this file doesn't exist, we start with an empty cache
+            pass
+
+        os.makedirs(path.parent, mode=0o700, exist_ok=True)
+        fd = os.open(path, os.O_RDWR | os.O_CREAT | getattr(os, "O_BINARY", 0), 0o600)
+        self._file = os.fdopen(fd, "r+b")
+        try:
+            if os.fstat(fd).st_size != max_bytes:
+                # the cache was resized, start over
+                index = None
+                os.ftruncate(fd, max_bytes)
+            self._mmap = mmap.mmap(fd, max_bytes)
+        except BaseException:
+            self._file.close()
+            raise
+
+        if index is not None and index.file_size == max_bytes and index.write_pos <= max_bytes:
+            self._write_pos = index.write_pos
+            for header_hash, height, offset, length in index.entries:
+                if offset + ENTRY_HEADER.size + length <= max_bytes:
+                    self._entries[header_hash] = (height, offset, length)
+        return self
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def __contains__(self, header_hash: bytes32) -> bool:
+        return header_hash in self._entries
+
+    def get(self, header_hash: bytes32) -> Optional[bytes]:
+        entry = self._entries.get(header_hash)
+        if entry is not None:
+            _, offset, length = entry
+            stored_hash, _, stored_length, crc = ENTRY_HEADER.unpack_from(self._mmap, offset)
+            start = offset + ENTRY_HEADER.size
+            if stored_hash == header_hash and stored_length == length:
+                blob = self._mmap[start : start + length]
+                if zlib.crc32(blob) == crc:
+                    self.hits += 1
+                    return blob
+            # this part of the file was overwritten after the index was saved
+            del self._entries[header_hash]
+        self.misses += 1
+        return None
+
+    def height_of(self, header_hash: bytes32) -> Optional[uint32]:
+        entry = self._entries.get(header_hash)
+        return None if entry is None else entry[0]
+
+    def put(self, header_hash: bytes32, height: uint32, blob: bytes) -> List[Tuple[bytes32, uint32]]:
+        """
+        Returns the (header hash, height) of the blocks evicted to make room.
+        """
+        size = ENTRY_HEADER.size + len(blob)
+        # don't let a single block flush most of the cache
+        if size > self.max_bytes // 4:
+            return []
+        self.remove(header_hash)
+        evicted: List[Tuple[bytes32, uint32]] = []
+        if self._write_pos + size > self.max_bytes:
+            # wrap around. The blocks at the end of the file are the oldest
+            # ones now
+            while len(self._entries) > 0 and next(iter(self._entries.values()))[1] >= self._write_pos:
+                evicted.append(self._evict())
+            self._write_pos = 0
+        end = self._write_pos + size
+        while len(self._entries) > 0 and self._write_pos <= next(iter(self._entries.values()))[1] < end:
+            evicted.append(self._evict())
+
+        ENTRY_HEADER.pack_into(self._mmap, self._write_pos, header_hash, height, len(blob), zlib.crc32(blob))
+        self._mmap[self._write_pos + ENTRY_HEADER.size : end] = blob
+        self._entries[header_hash] = (height, self._write_pos, len(blob))
+        self._write_pos = end
+        self._unsaved += 1
+        return evicted
+
+    def remove(self, header_hash: bytes32) -> None:
+        self._entries.pop(header_hash, None)
+
+    async def maybe_flush(self) -> None:
+        if self._unsaved < INDEX_FLUSH_INTERVAL:
+            return
+        await self.flush()
+
+    async def flush(self) -> None:
+        self._unsaved = 0
+        index = BlockBlobFileIndex(
+            uint64(self.max_bytes),
+            uint64(self._write_pos),
+            [(k, v[0], uint64(v[1]), uint32(v[2])) for k, v in self._entries.items()],
+        )
+        await write_file_async(self._index_path, bytes(index))
+
+    async def close(self) -> None:
+        """
+        Saves the index and unmaps the file. The cache can't be used anymore
+        after this.
+        """
+        if self._file.closed:
+            return
+        try:
+            await self.flush()
+        finally:
+            self._mmap.close()
+            self._file.close()
+
+    def get_stats(self) -> Dict[str, int]:
+        size = sum(ENTRY_HEADER.size + length for _, _, length in self._entries.values())
+        return {
+            "entries": len(self._entries),
+            "size": size,
+            "max_size": self.max_bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+        }
+
+    def _evict(self) -> Tuple[bytes32, uint32]:
+        header_hash, (height, _, _) = self._entries.popitem(last=False)
+        return header_hash, height
+
+
+@dataclasses.dataclass
+class BlockBlobCache:
+    """
+    Caches decompressed blocks, by header hash and, for blocks in the main
+    chain, by height. The in-memory tier holds the blocks read most recently,
+    the optional on-disk tier the blocks added most recently.
+    """
+
+    memory: BlockBlobLRU
+    disk: Optional[BlockBlobFile] = None
+    # height -> header hash, for the cached blocks known to be in the main chain
+    _main_chain: Dict[uint32, bytes32] = dataclasses.field(default_factory=dict)
+
+    @classmethod
+    async def create(cls, memory_mb: int, disk_path: Optional[Path] = None, disk_mb: int = 0) -> BlockBlobCache:
+        disk: Optional[BlockBlobFile] = None
+        if disk_path is not None and disk_mb > 0:
+            disk = await BlockBlobFile.create(disk_path, disk_mb * 1024 * 1024)
+        return cls(BlockBlobLRU(memory_mb * 1024 * 1024), disk)
+
+    def get(self, header_hash: bytes32) -> Optional[bytes]:
+        ret = self.memory.get(header_hash)
+        if ret is None and self.disk is not None:
+            ret = self.disk.get(header_hash)
+        return ret
+
+    def get_at_height(self, height: uint32) -> Optional[bytes]:
+        header_hash = self._main_chain.get(height)
+        if header_hash is None:
+            self.memory.misses += 1
+            return None
+        ret = self.get(header_hash)
+        if ret is None:
+            del self._main_chain[height]
+        return ret
+
+    def put(self, header_hash: bytes32, height: uint32, blob: bytes, *, in_main_chain: bool = False) -> None:
+        """
+        Adds a block read from the database, to the in-memory tier.
+        """
+        self._forget(self.memory.put(header_hash, height, blob))
+        if in_main_chain:
+            self._main_chain[height] = header_hash
+
+    def add_new_block(self, header_hash: bytes32, height: uint32, blob: bytes) -> None:
+        """
+        Adds a block that was just added to the blockchain, to both tiers.
+        """
+        self._forget(self.memory.put(header_hash, height, blob))
+        if self.disk is not None:
+            self._forget(self.disk.put(header_hash, height, blob))
+
+    def remove(self, header_hash: bytes32) -> None:
+        self.memory.remove(header_hash)
+        if self.disk is not None:
+            self.disk.remove(header_hash)
+
+    def set_in_chain(self, header_hashes: Iterable[bytes32]) -> None:
+        for header_hash in header_hashes:
+            height = self.memory.height_of(header_hash)
+            if height is None and self.disk is not None:
+                height = self.disk.height_of(header_hash)
+            if height is not None:
+                self._main_chain[height] = header_hash
+
+    def rollback(self, height: int) -> None:
+        for h in [h for h in self._main_chain if h > height]:
+            del self._main_chain[h]
+
+    def clear_main_chain(self) -> None:
+        # used when the database transaction changing the main chain was
+        # rolled back, and we can't tell which blocks are in it anymore
+        self._main_chain.clear()
+
+    async def maybe_flush(self) -> None:
+        if self.disk is not None:
+            await self.disk.maybe_flush()
+
+    async def close(self) -> None:
+        # the in-memory tier keeps working, in case the block store is still
+        # used while shutting down
+        disk = self.disk
+        self.disk = None
+        if disk is not None:
+            await disk.close()
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {
+            "memory": self.memory.get_stats(),
+            "disk": None if self.disk is None else self.disk.get_stats(),
+        }
+
+    def _forget(self, evicted: List[Tuple[bytes32, uint32]]) -> None:
+        for header_hash, height in evicted:
+            if self._main_chain.get(height) != header_hash:
+                continue
+            if header_hash in self.memory or (self.disk is not None and header_hash in self.disk):
+                continue
+            del self._main_chain[height]
@@ -1,9 +1,12 @@
 from __future__ import annotations
 
+import asyncio
 import logging
+import mmap
+import os
 from dataclasses import dataclass
 from pathlib import Path
-from typing import Dict, List, Optional, Tuple
+from typing import BinaryIO, Dict, List, Optional, Tuple
 
 import aiofiles
 
@@ -11,11 +14,16 @@ from hddcoin.types.blockchain_format.sized_bytes import bytes32
 from hddcoin.types.blockchain_format.sub_epoch_summary import SubEpochSummary
 from hddcoin.util.db_wrapper import DBWrapper2
 from hddcoin.util.files import write_file_async
+from hddcoin.util.hash import std_hash
 from hddcoin.util.ints import uint32
 from hddcoin.util.streamable import Streamable, streamable
 
 log = logging.getLogger(__name__)
 
+# the number of hashes, right below the flushed height, that are covered by the
+# checksum in the tail file
+TAIL_CHECKSUM_ENTRIES = 1000
+
 
 @streamable
 @dataclass(frozen=True)
@@ -23,17 +31,53 @@ class SesCache(Streamable):
     content: List[Tuple[uint32, bytes]]
 
 
+@streamable
+@dataclass(frozen=True)
+class HeightToHashTail(Streamable):
+    # the number of hashes at the start of the height-to-hash file that were
+    # flushed to disk, together with the sub epoch summaries
+    count: uint32
+    # the hash of the last TAIL_CHECKSUM_ENTRIES flushed hashes and the sub
+    # epoch summary cache file
+    checksum: bytes32
+
+
+def tail_checksum(hashes: bytes, ses_buf: bytes) -> bytes32:
+    return std_hash(hashes + ses_buf)
+
+
 class BlockHeightMap:
     db: DBWrapper2
 
     # the below dictionaries are loaded from the database, from the peak
     # and back in time on startup.
 
-    # Defines the path from genesis to the peak, no orphan blocks
-    # this buffer contains all block hashes that are part of the current peak
-    # ordered by height. i.e. __height_to_hash[0..32] is the genesis hash
-    # __height_to_hash[32..64] is the hash for height 1 and so on
-    __height_to_hash: bytearray
+    # Defines the path from genesis to the peak, no orphan blocks.
+    # The height-to-hash file contains all block hashes that are part of the
+    # current peak ordered by height. i.e. bytes [0..32] is the genesis hash
+    # [32..64] is the hash for height 1 and so on. The file is memory mapped, so
+    # starting up doesn't require reading it. It may be longer than the chain,
+    # hashes past __count are stale
+    __file: Optional[BinaryIO]
+    __height_to_hash: Optional[mmap.mmap]
+
+    # the number of hashes in the memory mapped file
+    __mapped: int
+
+    # hashes for heights past the end of the file, i.e. the blocks added since
+    # the last flush. __tail[0..32] is the hash for height __mapped
+    __tail: bytearray
+
+    # the number of blocks in the chain, i.e. the peak height + 1
+    __count: int
+
+    # the number of hashes at the start of the file that are covered by the tail
+    # file. These must not be modified until the next flush, so updates to them
+    # are kept in __pending
+    __flushed: int
+
+    # updated hashes for heights below __flushed
+    __pending: Dict[int, bytes32]
 
     # All sub-epoch summaries that have been included in the blockchain from the beginning until and including the peak
     # (height_included, SubEpochSummary). Note: ONLY for the blocks in the path to the peak
@@ -44,14 +88,13 @@ class BlockHeightMap:
     # disk
     __counter: int
 
-    # this is the lowest height whose hash has been updated since the last flush
-    # to disk. When it's time to write to disk, we can start flushing from this
-    # offset
-    __first_dirty: int
-
     # the file we're saving the height-to-hash cache to
     __height_to_hash_filename: Path
 
+    # the file recording how much of the height-to-hash file has been flushed,
+    # and the checksum of its tail
+    __tail_filename: Path
+
     # the file we're saving the sub epoch summary cache to
     __ses_filename: Path
 
@@ -63,17 +106,31 @@ class BlockHeightMap:
         self.db = db
 
         self.__counter = 0
-        self.__first_dirty = 0
-        self.__height_to_hash = bytearray()
+        self.__file = None
+        self.__height_to_hash = None
+        self.__mapped = 0
+        self.__tail = bytearray()
+        self.__count = 0
+        self.__flushed = 0
+        self.__pending = {}
         self.__sub_epoch_summaries = {}
         self.__height_to_hash_filename = blockchain_dir / "height-to-hash"
+        self.__tail_filename = blockchain_dir / "height-to-hash-tail"
         self.__ses_filename = blockchain_dir / "sub-epoch-summaries"
+        self.__open()
+        try:
+            await self.__load()
+        except BaseException:
+            self.close()
+            raise
+        return self
 
+    async def __load(self) -> None:
         async with self.db.reader_no_transaction() as conn:
             async with conn.execute("SELECT hash FROM current_peak WHERE key = 0") as cursor:
                 peak_row = await cursor.fetchone()
                 if peak_row is None:
-                    return self
+                    return
 
             async with conn.execute(
                 "SELECT header_hash,prev_hash,height,sub_epoch_summary FROM full_blocks WHERE header_hash=?",
@@ -81,36 +138,40 @@ class BlockHeightMap:
             ) as cursor:
                 row = await cursor.fetchone()
                 if row is None:
-                    return self
+                    return
 
+        ses_buf = b""
         try:
-            async with aiofiles.open(self.__height_to_hash_filename, "rb") as f:
-                self.__height_to_hash = bytearray(await f.read())
+            async with aiofiles.open(self.__ses_filename, "rb") as f:
+                ses_buf = await f.read()
+                self.__sub_epoch_summaries = {k: v for (k, v) in SesCache.from_bytes(ses_buf).content}
         except Exception:
             # it's OK if this file doesn't exist, we can rebuild it
             pass
 
+        tail: Optional[HeightToHashTail] = None
         try:
-            async with aiofiles.open(self.__ses_filename, "rb") as f:
-                self.__sub_epoch_summaries = {k: v for (k, v) in SesCache.from_bytes(await f.read()).content}
+            async with aiofiles.open(self.__tail_filename, "rb") as f:
+                tail = HeightToHashTail.from_bytes(await f.read())
         except Exception:
-            # it's OK if this file doesn't exist, we can rebuild it
+            # it's OK if this file doesn't exist, we fall back to reconciling the
+            # cache with the DB until we find a matching sub epoch summary
             pass
 
         peak: bytes32 = row[0]
         prev_hash: bytes32 = row[1]
         height = row[2]
 
-        # allocate memory for height to hash map
-        # this may also truncate it, if thie file on disk had an invalid size
-        new_size = (height + 1) * 32
-        size = len(self.__height_to_hash)
-        if size > new_size:
-            del self.__height_to_hash[new_size:]
-        else:
-            self.__height_to_hash += bytearray([0] * (new_size - size))
+        # grow the height to hash file to fit the chain. We never shrink it,
+        # hashes past the peak are ignored
+        self.__count = height + 1
+        if self.__mapped < self.__count:
+            self.__remap(self.__count)
 
-        self.__first_dirty = height + 1
+        if tail is not None and tail.count <= self.__mapped:
+            start = max(0, tail.count - TAIL_CHECKSUM_ENTRIES) * 32
+            if tail_checksum(self.__read(start, tail.count * 32), ses_buf) == tail.checksum:
+                self.__flushed = tail.count
 
         if self.get_hash(height) != peak:
             self.__set_hash(height, peak)
@@ -123,14 +184,12 @@ class BlockHeightMap:
         # epoch summaries caches are in sync with the DB
         await self._load_blocks_from(height, prev_hash)
 
-        await self.maybe_flush()
-
-        return self
+        await self.__flush()
 
     def update_height(self, height: uint32, header_hash: bytes32, ses: Optional[SubEpochSummary]) -> None:
         # we're only updating the last hash. If we've reorged, we already rolled
         # back, making this the new peak
-        assert height * 32 <= len(self.__height_to_hash)
+        assert height <= self.__count
         self.__set_hash(height, header_hash)
         if ses is not None:
             self.__sub_epoch_summaries[height] = bytes(ses)
@@ -138,28 +197,45 @@ class BlockHeightMap:
     async def maybe_flush(self) -> None:
         if self.__counter < 1000:
             return
+        await self.__flush()
 
-        assert (len(self.__height_to_hash) % 32) == 0
-        offset = self.__first_dirty * 32
-
-        ses_buf = bytes(SesCache([(k, v) for (k, v) in self.__sub_epoch_summaries.items()]))
-
+    async def __flush(self) -> None:
         self.__counter = 0
+        count = self.__count
+
+        if len(self.__pending) > 0:
+            # we're about to modify hashes the tail file vouches for.
+            # Invalidate it first, in case we crash half-way through
+            await write_file_async(self.__tail_filename, bytes(HeightToHashTail(uint32(0), bytes32([0] * 32))))
+            self.__flushed = 0
+            assert self.__height_to_hash is not None
+            for height, block_hash in self.__pending.items():
+                self.__height_to_hash[height * 32 : height * 32 + 32] = block_hash
+            self.__pending.clear()
+
+        if len(self.__tail) > 0:
+            # append the blocks added since the last flush to the file
+            tail = self.__tail
+            offset = self.__mapped * 32
+            self.__tail = bytearray()
+            self.__remap(self.__mapped + len(tail) // 32)
+            assert self.__height_to_hash is not None
+            self.__height_to_hash[offset : offset + len(tail)] = tail
+
+        if self.__height_to_hash is None:
+            return
 
-        try:
-            async with aiofiles.open(self.__height_to_hash_filename, "r+b") as f:
-                map_buf = self.__height_to_hash[offset:].copy()
-                await f.seek(offset)
-                await f.write(map_buf)
-        except Exception:
-            # if the file doesn't exist, write the whole buffer
-            async with aiofiles.open(self.__height_to_hash_filename, "wb") as f:
-                map_buf = self.__height_to_hash.copy()
-                await f.write(map_buf)
+        # only the dirty pages are written back
+        await asyncio.get_running_loop().run_in_executor(None, self.__height_to_hash.flush)
 
-        self.__first_dirty = len(self.__height_to_hash) // 32
+        ses_buf = bytes(SesCache([(k, v) for (k, v) in self.__sub_epoch_summaries.items()]))
         await write_file_async(self.__ses_filename, ses_buf)
 
+        start = max(0, count - TAIL_CHECKSUM_ENTRIES) * 32
+        checksum = tail_checksum(self.__read(start, count * 32), ses_buf)
+        await write_file_async(self.__tail_filename, bytes(HeightToHashTail(uint32(count), checksum)))
+        self.__flushed = count
+
     # load height-to-hash map entries from the DB starting at height back in
     # time until we hit a match in the existing map, at which point we can
     # assume all previous blocks have already been populated
@@ -197,6 +273,10 @@ class BlockHeightMap:
                 entry = ordered[prev_hash]
                 assert height == entry[0] + 1
                 height = entry[0]
+                if height < self.__flushed and self.get_hash(height) == prev_hash:
+                    # the flushed part of the cache is a consistent chain, and
+                    # matches the DB from here on back
+                    return
                 if entry[2] is not None:
                     if (
                         self.get_hash(height) == prev_hash
@@ -216,19 +296,76 @@ class BlockHeightMap:
                 self.__set_hash(height, prev_hash)
                 prev_hash = entry[1]
 
+    def __open(self) -> None:
+        os.makedirs(self.__height_to_hash_filename.parent, mode=0o700, exist_ok=True)
+        fd = os.open(self.__height_to_hash_filename, os.O_RDWR | os.O_CREAT | getattr(os, "O_BINARY", 0), 0o600)
+        self.__file = os.fdopen(fd, "r+b")
+        size = os.fstat(fd).st_size
+        # ignore a partially written hash at the end of the file
+        self.__mapped = size // 32
+        if self.__mapped > 0:
+            try:
+                self.__height_to_hash = mmap.mmap(fd, self.__mapped * 32)
+            except BaseException:
+                self.close()
+                raise
+
+    def close(self) -> None:
+        """
+        Unmaps and closes the height-to-hash file. Hashes not flushed yet are
+        not written to it, they are loaded from the database on the next start
+        """
+        if self.__height_to_hash is not None:
+            self.__height_to_hash.close()
+            self.__height_to_hash = None
+        if self.__file is not None:
+            self.__file.close()
+            self.__file = None
+
+    def __remap(self, num_hashes: int) -> None:
+        # the mapping is re-created rather than resized, since not all platforms
+        # support resizing a memory map, nor truncating a mapped file
+        assert self.__file is not None
+        if self.__height_to_hash is not None:
+            self.__height_to_hash.close()
+        fd = self.__file.fileno()
+        if os.fstat(fd).st_size < num_hashes * 32:
+            os.ftruncate(fd, num_hashes * 32)
+        self.__height_to_hash = mmap.mmap(fd, num_hashes * 32)
+        self.__mapped = num_hashes
+
+    def __read(self, start: int, end: int) -> bytes:
+        if self.__height_to_hash is None:
+            return b""
+        return self.__height_to_hash[start:end]
+
     def __set_hash(self, height: int, block_hash: bytes32) -> None:
-        idx = height * 32
-        self.__height_to_hash[idx : idx + 32] = block_hash
+        assert height <= self.__count
+        if height < self.__flushed:
+            self.__pending[height] = block_hash
+        elif height < self.__mapped:
+            assert self.__height_to_hash is not None
+            idx = height * 32
+            self.__height_to_hash[idx : idx + 32] = block_hash
+        else:
+            idx = (height - self.__mapped) * 32
+            self.__tail[idx : idx + 32] = block_hash
+        self.__count = max(self.__count, height + 1)
         self.__counter += 1
-        self.__first_dirty = min(self.__first_dirty, height)
 
     def get_hash(self, height: uint32) -> bytes32:
+        assert height < self.__count
+        if len(self.__pending) > 0 and height in self.__pending:
+            return self.__pending[height]
         idx = height * 32
-        assert idx + 32 <= len(self.__height_to_hash)
-        return bytes32(self.__height_to_hash[idx : idx + 32])
+        if height < self.__mapped:
+            assert self.__height_to_hash is not None
+            return bytes32(self.__height_to_hash[idx : idx + 32])
+        idx -= self.__mapped * 32
+        return bytes32(self.__tail[idx : idx + 32])
 
     def contains_height(self, height: uint32) -> bool:
-        return height * 32 < len(self.__height_to_hash)
+        return height < self.__count
 
     def rollback(self, fork_height: int) -> None:
         # fork height may be -1, in which case all blocks are different and we
@@ -239,8 +376,12 @@ class BlockHeightMap:
                 heights_to_delete.append(ses_included_height)
         for height in heights_to_delete:
             del self.__sub_epoch_summaries[height]
-        del self.__height_to_hash[(fork_height + 1) * 32 :]
-        self.__first_dirty = min(self.__first_dirty, fork_height + 1)
+        # the hashes past the fork point are left in the file, they will be
+        # overwritten as the new chain is added
+        self.__count = min(self.__count, fork_height + 1)
+        del self.__tail[max(0, self.__count - self.__mapped) * 32 :]
+        for pending_height in [h for h in self.__pending if h >= self.__count]:
+            del self.__pending[pending_height]
 
     def get_ses(self, height: uint32) -> SubEpochSummary:
         return SubEpochSummary.from_bytes(self.__sub_epoch_summaries[height])
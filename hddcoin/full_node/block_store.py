@@ -1,14 +1,18 @@
 from __future__ import annotations
 
+import asyncio
 import dataclasses
+import functools
 import logging
 import sqlite3
+from pathlib import Path
 from typing import Dict, List, Optional, Tuple
 
 import typing_extensions
 import zstd
 
 from hddcoin.consensus.block_record import BlockRecord
+from hddcoin.full_node.block_blob_cache import BlockBlobCache, BlockBlobLRU
 from hddcoin.types.blockchain_format.serialized_program import SerializedProgram
 from hddcoin.types.blockchain_format.sized_bytes import bytes32
 from hddcoin.types.full_block import FullBlock
@@ -21,6 +25,14 @@ from hddcoin.util.lru_cache import LRUCache
 
 log = logging.getLogger(__name__)
 
+# the generators of this many blocks (about a day of blocks) are kept in the
+# generators table, the older ones are looked up by parsing their blocks
+DEFAULT_GENERATOR_TABLE_BLOCKS = 4608
+
+# ranges of blocks taking up more than this in the database are decompressed
+# in a thread, rather than blocking the event loop. zstd releases the GIL
+THREAD_DECOMPRESSION_THRESHOLD = 512 * 1024
+
 
 def decompress(block_bytes: bytes) -> FullBlock:
     return FullBlock.from_bytes(zstd.decompress(block_bytes))
@@ -36,22 +48,60 @@ def decompress_blob(block_bytes: bytes) -> bytes:
     return ret
 
 
+def decompress_blobs(blocks_bytes: List[bytes]) -> List[bytes]:
+    return [decompress_blob(block_bytes) for block_bytes in blocks_bytes]
+
+
+@dataclasses.dataclass
+class GeneratorLookupStats:
+    cache_hits: int = 0
+    table_reads: int = 0
+    block_reads: int = 0
+
+
 @typing_extensions.final
 @dataclasses.dataclass
 class BlockStore:
     block_cache: LRUCache[bytes32, FullBlock]
     db_wrapper: DBWrapper2
     ses_challenge_cache: LRUCache[bytes32, List[SubEpochChallengeSegment]]
+    # decompressed blocks, saving us from decompressing the blocks we serve
+    # to peers and look up generators in over and over
+    blob_cache: BlockBlobCache = dataclasses.field(default_factory=lambda: BlockBlobCache(BlockBlobLRU(0)))
+    # the generators of main chain blocks, by height. Like the main chain
+    # blocks in blob_cache, the ones above the fork point are dropped on
+    # rollback
+    generator_cache: LRUCache[uint32, SerializedProgram] = dataclasses.field(default_factory=lambda: LRUCache(0))
+    # the generators table holds the generators of the blocks at most this
+    # far below the most recent block added. 0 disables it
+    generator_table_blocks: int = DEFAULT_GENERATOR_TABLE_BLOCKS
+    generator_stats: GeneratorLookupStats = dataclasses.field(default_factory=lambda: GeneratorLookupStats())
+    # bumped when a rollback starts, and again once it's committed. Reads that
+    # started in between may have seen the orphaned blocks as in the main
+    # chain, so they don't add what they read to the caches by height
+    _main_chain_generation: int = 0
 
     @classmethod
-    async def create(cls, db_wrapper: DBWrapper2, *, use_cache: bool = True) -> BlockStore:
+    async def create(
+        cls,
+        db_wrapper: DBWrapper2,
+        *,
+        use_cache: bool = True,
+        blob_cache_mb: int = 64,
+        disk_cache_path: Optional[Path] = None,
+        disk_cache_mb: int = 0,
+        generator_cache_size: int = 64,
+        generator_table_blocks: int = DEFAULT_GENERATOR_TABLE_BLOCKS,
+    ) -> BlockStore:
         if db_wrapper.db_version != 2:
             raise RuntimeError(f"BlockStore does not support database schema v{db_wrapper.db_version}")
 
         if use_cache:
-            self = cls(LRUCache(1000), db_wrapper, LRUCache(50))
+            blob_cache = await BlockBlobCache.create(blob_cache_mb, disk_cache_path, disk_cache_mb)
+            self = cls(LRUCache(1000), db_wrapper, LRUCache(50), blob_cache, LRUCache(generator_cache_size))
         else:
             self = cls(LRUCache(0), db_wrapper, LRUCache(0))
+        self.generator_table_blocks = generator_table_blocks
 
         async with self.db_wrapper.writer_maybe_transaction() as conn:
             log.info("DB: Creating block store tables and indexes.")
@@ -81,6 +131,17 @@ class BlockStore:
             log.info("DB: Creating index height")
             await conn.execute("CREATE INDEX IF NOT EXISTS height on full_blocks(height)")
 
+            # The generators of the recent blocks that have one, so the
+            # generators referenced by a block can be looked up without
+            # decompressing and parsing the blocks they're in. They're stored
+            # uncompressed, on top of the blocks in full_blocks, so the ones
+            # more than generator_table_blocks below the latest block are
+            # deleted
+            await conn.execute(
+                "CREATE TABLE IF NOT EXISTS generators(header_hash blob PRIMARY KEY, height bigint, generator blob)"
+            )
+            await conn.execute("CREATE INDEX IF NOT EXISTS generator_height on generators(height)")
+
             # Sub epoch segments for weight proofs
             await conn.execute(
                 "CREATE TABLE IF NOT EXISTS sub_epoch_segments_v3("
@@ -102,9 +163,22 @@ class BlockStore:
 
         return self
 
+    async def close(self) -> None:
+        await self.blob_cache.close()
+
+    def _rollback_caches(self, height: int) -> None:
+        self._main_chain_generation += 1
+        self.blob_cache.rollback(height)
+        for h in [h for h in self.generator_cache.cache if h > height]:
+            self.generator_cache.remove(h)
+
     async def rollback(self, height: int) -> None:
+        # until the rollback is committed, readers still see the orphaned
+        # blocks as in the main chain. The caches are trimmed again once it is
+        self._rollback_caches(height)
         async with self.db_wrapper.writer_maybe_transaction() as conn:
             await conn.execute("UPDATE full_blocks SET in_main_chain=0 WHERE height>? AND in_main_chain=1", (height,))
+            self.db_wrapper.after_commit(functools.partial(self._rollback_caches, height))
 
     async def set_in_chain(self, header_hashes: List[Tuple[bytes32]]) -> None:
         async with self.db_wrapper.writer_maybe_transaction() as conn:
@@ -113,6 +187,8 @@ class BlockStore:
             ) as cursor:
                 if cursor.rowcount != len(header_hashes):
                     raise RuntimeError(f"The blockchain database is corrupt. All of {header_hashes} should exist")
+            in_chain = [hh for (hh,) in header_hashes]
+            self.db_wrapper.after_commit(functools.partial(self.blob_cache.set_in_chain, in_chain))
 
     async def replace_proof(self, header_hash: bytes32, block: FullBlock) -> None:
         assert header_hash == block.header_hash
@@ -120,6 +196,7 @@ class BlockStore:
         block_bytes: bytes = compress(block)
 
         self.block_cache.put(header_hash, block)
+        self.blob_cache.remove(header_hash)
 
         async with self.db_wrapper.writer_maybe_transaction() as conn:
             await conn.execute(
@@ -133,6 +210,8 @@ class BlockStore:
 
     async def add_full_block(self, header_hash: bytes32, block: FullBlock, block_record: BlockRecord) -> None:
         self.block_cache.put(header_hash, block)
+        block_bytes = bytes(block)
+        self.blob_cache.add_new_block(header_hash, block.height, block_bytes)
 
         ses: Optional[bytes] = (
             None if block_record.sub_epoch_summary_included is None else bytes(block_record.sub_epoch_summary_included)
@@ -157,10 +236,19 @@ class BlockStore:
                     ses,
                     int(block.is_fully_compactified()),
                     False,  # in_main_chain
-                    compress(block),
+                    zstd.compress(block_bytes),
                     bytes(block_record),
                 ),
             )
+            if block.transactions_generator is not None and self.generator_table_blocks > 0:
+                await conn.execute(
+                    "INSERT OR IGNORE INTO generators VALUES(?, ?, ?)",
+                    (header_hash, block.height, bytes(block.transactions_generator)),
+                )
+                await conn.execute(
+                    "DELETE FROM generators WHERE height<?", (block.height - self.generator_table_blocks,)
+                )
+        await self.blob_cache.maybe_flush()
 
     async def persist_sub_epoch_challenge_segments(
         self, ses_block_hash: bytes32, segments: List[SubEpochChallengeSegment]
@@ -192,7 +280,22 @@ class BlockStore:
             return challenge_segments
         return None
 
+    async def get_sub_epoch_challenge_segments_bytes(self, ses_block_hash: bytes32) -> Optional[bytes]:
+        """
+        Returns the serialized SubEpochSegments, as stored, without parsing them
+        """
+        async with self.db_wrapper.reader_no_transaction() as conn:
+            row = await execute_fetchone(
+                conn, "SELECT challenge_segments from sub_epoch_segments_v3 WHERE ses_block_hash=?", (ses_block_hash,)
+            )
+        if row is None:
+            return None
+        return bytes(row[0])
+
     def rollback_cache_block(self, header_hash: bytes32) -> None:
+        self.blob_cache.remove(header_hash)
+        self.blob_cache.clear_main_chain()
+        self.generator_cache.cache.clear()
         try:
             self.block_cache.remove(header_hash)
         except KeyError:
@@ -200,15 +303,32 @@ class BlockStore:
             # block to the cache yet
             pass
 
+    def _decompress_blob(
+        self, header_hash: bytes32, height: uint32, block_bytes: bytes, *, in_main_chain: bool = False
+    ) -> bytes:
+        ret = decompress_blob(block_bytes)
+        self.blob_cache.put(header_hash, uint32(height), ret, in_main_chain=in_main_chain)
+        return ret
+
+    async def _get_blob(self, header_hash: bytes32) -> Optional[bytes]:
+        cached = self.blob_cache.get(header_hash)
+        if cached is not None:
+            return cached
+        async with self.db_wrapper.reader_no_transaction() as conn:
+            row = await execute_fetchone(
+                conn, "SELECT block, height from full_blocks WHERE header_hash=?", (header_hash,)
+            )
+        if row is None:
+            return None
+        return self._decompress_blob(header_hash, row[1], row[0])
+
     async def get_full_block(self, header_hash: bytes32) -> Optional[FullBlock]:
         cached: Optional[FullBlock] = self.block_cache.get(header_hash)
         if cached is not None:
             return cached
-        async with self.db_wrapper.reader_no_transaction() as conn:
-            async with conn.execute("SELECT block from full_blocks WHERE header_hash=?", (header_hash,)) as cursor:
-                row = await cursor.fetchone()
-        if row is not None:
-            block = decompress(row[0])
+        block_bytes = await self._get_blob(header_hash)
+        if block_bytes is not None:
+            block = FullBlock.from_bytes(block_bytes)
             self.block_cache.put(header_hash, block)
             return block
         return None
@@ -217,14 +337,7 @@ class BlockStore:
         cached = self.block_cache.get(header_hash)
         if cached is not None:
             return bytes(cached)
-        async with self.db_wrapper.reader_no_transaction() as conn:
-            async with conn.execute("SELECT block from full_blocks WHERE header_hash=?", (header_hash,)) as cursor:
-                row = await cursor.fetchone()
-        if row is not None:
-            ret: bytes = zstd.decompress(row[0])
-            return ret
-
-        return None
+        return await self._get_blob(header_hash)
 
     async def get_full_blocks_at(self, heights: List[uint32]) -> List[FullBlock]:
         if len(heights) == 0:
@@ -245,75 +358,139 @@ class BlockStore:
                 cached.foliage.prev_block_hash, cached.transactions_generator, cached.transactions_generator_ref_list
             )
 
-        formatted_str = "SELECT block, height from full_blocks WHERE header_hash=?"
-        async with self.db_wrapper.reader_no_transaction() as conn:
-            row = await execute_fetchone(conn, formatted_str, (header_hash,))
-            if row is None:
-                return None
-            block_bytes = zstd.decompress(row[0])
+        block_bytes = await self._get_blob(header_hash)
+        if block_bytes is None:
+            return None
 
-            try:
-                return block_info_from_block(block_bytes)
-            except Exception as e:
-                log.exception(f"cheap parser failed for block at height {row[1]}: {e}")
-                # this is defensive, on the off-chance that
-                # block_info_from_block() fails, fall back to the reliable
-                # definition of parsing a block
-                b = FullBlock.from_bytes(block_bytes)
-                return GeneratorBlockInfo(
-                    b.foliage.prev_block_hash, b.transactions_generator, b.transactions_generator_ref_list
-                )
+        try:
+            return block_info_from_block(memoryview(block_bytes))
+        except Exception as e:
+            log.exception(f"cheap parser failed for block {header_hash}: {e}")
+            # this is defensive, on the off-chance that
+            # block_info_from_block() fails, fall back to the reliable
+            # definition of parsing a block
+            b = FullBlock.from_bytes(block_bytes)
+            return GeneratorBlockInfo(
+                b.foliage.prev_block_hash, b.transactions_generator, b.transactions_generator_ref_list
+            )
 
     async def get_generator(self, header_hash: bytes32) -> Optional[SerializedProgram]:
         cached = self.block_cache.get(header_hash)
         if cached is not None:
             return cached.transactions_generator
 
-        formatted_str = "SELECT block, height from full_blocks WHERE header_hash=?"
         async with self.db_wrapper.reader_no_transaction() as conn:
-            row = await execute_fetchone(conn, formatted_str, (header_hash,))
-            if row is None:
-                return None
-            block_bytes = zstd.decompress(row[0])
+            row = await execute_fetchone(conn, "SELECT generator FROM generators WHERE header_hash=?", (header_hash,))
+        if row is not None:
+            return SerializedProgram.from_bytes(row[0])
+
+        # the block doesn't have a generator, or it's older than the ones in
+        # the generators table
+        block_bytes = await self._get_blob(header_hash)
+        if block_bytes is None:
+            return None
 
+        try:
+            return generator_from_block(memoryview(block_bytes))
+        except Exception as e:
+            log.error(f"cheap parser failed for block {header_hash}: {e}")
+            # this is defensive, on the off-chance that
+            # generator_from_block() fails, fall back to the reliable
+            # definition of parsing a block
+            b = FullBlock.from_bytes(block_bytes)
+            return b.transactions_generator
+
+    async def get_generators_at(self, heights: List[uint32]) -> List[SerializedProgram]:
+        if len(heights) == 0:
+            return []
+
+        generators: Dict[uint32, SerializedProgram] = {}
+        for height in heights:
+            cached = self.generator_cache.get(height)
+            if cached is not None:
+                generators[height] = cached
+        self.generator_stats.cache_hits += len(generators)
+
+        # the generators read while a rollback is under way may be the ones
+        # of orphaned blocks, they're not cached by height
+        generation = self._main_chain_generation
+        read: Dict[uint32, SerializedProgram] = {}
+        missing = [h for h in heights if h not in generators]
+        if len(missing) > 0:
+            formatted_str = (
+                f"SELECT full_blocks.height, generators.generator FROM full_blocks "
+                f"JOIN generators ON generators.header_hash=full_blocks.header_hash "
+                f'WHERE full_blocks.in_main_chain=1 AND full_blocks.height in ({"?," * (len(missing) - 1)}?)'
+            )
+            async with self.db_wrapper.reader_no_transaction() as conn:
+                async with conn.execute(formatted_str, missing) as cursor:
+                    async for row in cursor:
+                        read[uint32(row[0])] = SerializedProgram.from_bytes(row[1])
+            self.generator_stats.table_reads += len(read)
+
+        # the generators older than the ones in the generators table, and the
+        # ones of blocks without a generator, which are an error
+        missing = [h for h in missing if h not in read]
+        if len(missing) > 0:
+            from_blocks = await self._get_generators_from_blocks(missing)
+            self.generator_stats.block_reads += len(from_blocks)
+            read.update(from_blocks)
+
+        generators.update(read)
+        if generation == self._main_chain_generation:
+            for height, gen in read.items():
+                self.generator_cache.put(height, gen)
+        return [generators[h] for h in heights]
+
+    async def _get_generators_from_blocks(self, heights: List[uint32]) -> Dict[uint32, SerializedProgram]:
+        blobs: Dict[uint32, bytes] = {}
+        for height in heights:
+            cached = self.blob_cache.get_at_height(height)
+            if cached is not None:
+                blobs[height] = cached
+
+        missing = [h for h in heights if h not in blobs]
+        if len(missing) > 0:
+            formatted_str = (
+                f"SELECT block, height, header_hash from full_blocks "
+                f'WHERE in_main_chain=1 AND height in ({"?," * (len(missing) - 1)}?)'
+            )
+            generation = self._main_chain_generation
+            async with self.db_wrapper.reader_no_transaction() as conn:
+                async with conn.execute(formatted_str, missing) as cursor:
+                    rows = list(await cursor.fetchall())
+            in_main_chain = generation == self._main_chain_generation
+            for row in rows:
+                height = uint32(row[1])
+                blobs[height] = self._decompress_blob(bytes32(row[2]), height, row[0], in_main_chain=in_main_chain)
+
+        generators: Dict[uint32, SerializedProgram] = {}
+        for height, block_bytes in blobs.items():
             try:
-                return generator_from_block(block_bytes)
+                gen = generator_from_block(memoryview(block_bytes))
             except Exception as e:
-                log.error(f"cheap parser failed for block at height {row[1]}: {e}")
+                log.error(f"cheap parser failed for block at height {height}: {e}")
                 # this is defensive, on the off-chance that
                 # generator_from_block() fails, fall back to the reliable
                 # definition of parsing a block
                 b = FullBlock.from_bytes(block_bytes)
-                return b.transactions_generator
-
-    async def get_generators_at(self, heights: List[uint32]) -> List[SerializedProgram]:
-        if len(heights) == 0:
-            return []
+                gen = b.transactions_generator
+            if gen is None:
+                raise ValueError(Err.GENERATOR_REF_HAS_NO_GENERATOR)
+            generators[height] = gen
 
-        generators: Dict[uint32, SerializedProgram] = {}
-        formatted_str = (
-            f"SELECT block, height from full_blocks "
-            f'WHERE in_main_chain=1 AND height in ({"?," * (len(heights) - 1)}?)'
-        )
-        async with self.db_wrapper.reader_no_transaction() as conn:
-            async with conn.execute(formatted_str, heights) as cursor:
-                async for row in cursor:
-                    block_bytes = zstd.decompress(row[0])
-
-                    try:
-                        gen = generator_from_block(block_bytes)
-                    except Exception as e:
-                        log.error(f"cheap parser failed for block at height {row[1]}: {e}")
-                        # this is defensive, on the off-chance that
-                        # generator_from_block() fails, fall back to the reliable
-                        # definition of parsing a block
-                        b = FullBlock.from_bytes(block_bytes)
-                        gen = b.transactions_generator
-                    if gen is None:
-                        raise ValueError(Err.GENERATOR_REF_HAS_NO_GENERATOR)
-                    generators[uint32(row[1])] = gen
+        return generators
 
-        return [generators[h] for h in heights]
+    def get_generator_stats(self) -> Dict[str, int]:
+        """
+        How the generators referenced by blocks were looked up: from the cache,
+        from the generators table or by parsing the blocks they're in.
+        """
+        return {
+            "entries": len(self.generator_cache.cache),
+            "capacity": self.generator_cache.capacity,
+            **dataclasses.asdict(self.generator_stats),
+        }
 
     async def get_block_records_by_hash(self, header_hashes: List[bytes32]) -> List[BlockRecord]:
         """
@@ -371,15 +548,23 @@ class BlockStore:
             return []
 
         assert len(header_hashes) < self.db_wrapper.host_parameter_limit
-        formatted_str = (
-            f'SELECT header_hash, block from full_blocks WHERE header_hash in ({"?," * (len(header_hashes) - 1)}?)'
-        )
         all_blocks: Dict[bytes32, bytes] = {}
-        async with self.db_wrapper.reader_no_transaction() as conn:
-            async with conn.execute(formatted_str, header_hashes) as cursor:
-                for row in await cursor.fetchall():
-                    header_hash = bytes32(row[0])
-                    all_blocks[header_hash] = decompress_blob(row[1])
+        for header_hash in header_hashes:
+            cached = self.blob_cache.get(header_hash)
+            if cached is not None:
+                all_blocks[header_hash] = cached
+
+        missing = [hh for hh in header_hashes if hh not in all_blocks]
+        if len(missing) > 0:
+            formatted_str = (
+                f"SELECT header_hash, block, height from full_blocks "
+                f'WHERE header_hash in ({"?," * (len(missing) - 1)}?)'
+            )
+            async with self.db_wrapper.reader_no_transaction() as conn:
+                async with conn.execute(formatted_str, missing) as cursor:
+                    for row in await cursor.fetchall():
+                        header_hash = bytes32(row[0])
+                        all_blocks[header_hash] = self._decompress_blob(header_hash, row[2], row[1])
 
         ret: List[bytes] = []
         for hh in header_hashes:
@@ -399,17 +584,25 @@ class BlockStore:
         if len(header_hashes) == 0:
             return []
 
-        formatted_str = (
-            f'SELECT header_hash, block from full_blocks WHERE header_hash in ({"?," * (len(header_hashes) - 1)}?)'
-        )
         all_blocks: Dict[bytes32, FullBlock] = {}
-        async with self.db_wrapper.reader_no_transaction() as conn:
-            async with conn.execute(formatted_str, header_hashes) as cursor:
-                for row in await cursor.fetchall():
-                    header_hash = bytes32(row[0])
-                    full_block: FullBlock = decompress(row[1])
-                    all_blocks[header_hash] = full_block
-                    self.block_cache.put(header_hash, full_block)
+        for header_hash in header_hashes:
+            cached = self.blob_cache.get(header_hash)
+            if cached is not None:
+                all_blocks[header_hash] = FullBlock.from_bytes(cached)
+
+        missing = [hh for hh in header_hashes if hh not in all_blocks]
+        if len(missing) > 0:
+            formatted_str = (
+                f"SELECT header_hash, block, height from full_blocks "
+                f'WHERE header_hash in ({"?," * (len(missing) - 1)}?)'
+            )
+            async with self.db_wrapper.reader_no_transaction() as conn:
+                async with conn.execute(formatted_str, missing) as cursor:
+                    for row in await cursor.fetchall():
+                        header_hash = bytes32(row[0])
+                        full_block = FullBlock.from_bytes(self._decompress_blob(header_hash, row[2], row[1]))
+                        all_blocks[header_hash] = full_block
+                        self.block_cache.put(header_hash, full_block)
         ret: List[FullBlock] = []
         for hh in header_hashes:
             if hh not in all_blocks:
@@ -462,17 +655,48 @@ class BlockStore:
         Returns a list with all full blocks in range between start and stop
         if present.
         """
+        return [blob for blob, _ in await self.get_block_blobs_in_range(start, stop)]
+
+    async def get_block_blobs_in_range(
+        self,
+        start: int,
+        stop: int,
+    ) -> List[Tuple[bytes, Optional[bytes]]]:
+        """
+        Like get_block_bytes_in_range(), along with each block zstd compressed,
+        as it's stored in the database, unless it was read from the cache.
+        """
 
         assert self.db_wrapper.db_version == 2
+        ret: List[Tuple[bytes, Optional[bytes]]] = []
+        for height in range(start, stop + 1):
+            cached = self.blob_cache.get_at_height(uint32(height))
+            if cached is None:
+                break
+            ret.append((cached, None))
+        else:
+            return ret
+
+        generation = self._main_chain_generation
         async with self.db_wrapper.reader_no_transaction() as conn:
             async with conn.execute(
-                "SELECT block FROM full_blocks WHERE height >= ? AND height <= ? and in_main_chain=1",
+                "SELECT block, height, header_hash FROM full_blocks "
+                "WHERE height >= ? AND height <= ? and in_main_chain=1 ORDER BY height",
                 (start, stop),
             ) as cursor:
                 rows: List[sqlite3.Row] = list(await cursor.fetchall())
-                if len(rows) != (stop - start) + 1:
-                    raise ValueError(f"Some blocks in range {start}-{stop} were not found.")
-                return [decompress_blob(row[0]) for row in rows]
+        if len(rows) != (stop - start) + 1:
+            raise ValueError(f"Some blocks in range {start}-{stop} were not found.")
+
+        compressed_blocks: List[bytes] = [row[0] for row in rows]
+        if sum(len(compressed) for compressed in compressed_blocks) >= THREAD_DECOMPRESSION_THRESHOLD:
+            blobs = await asyncio.get_running_loop().run_in_executor(None, decompress_blobs, compressed_blocks)
+        else:
+            blobs = decompress_blobs(compressed_blocks)
+        in_main_chain = generation == self._main_chain_generation
+        for row, blob in zip(rows, blobs):
+            self.blob_cache.put(bytes32(row[2]), uint32(row[1]), blob, in_main_chain=in_main_chain)
+        return [(blob, compressed) for blob, compressed in zip(blobs, compressed_blocks)]
 
     async def get_peak(self) -> Optional[Tuple[bytes32, uint32]]:
         async with self.db_wrapper.reader_no_transaction() as conn:
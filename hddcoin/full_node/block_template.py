@@ -0,0 +1,130 @@
+from __future__ import annotations
+
+import dataclasses
+import logging
+from typing import Dict, List, Optional, Tuple
+
+from chia_rs import AugSchemeMPL, G2Element
+
+from hddcoin.consensus.block_creation import compute_block_cost
+from hddcoin.consensus.constants import ConsensusConstants
+from hddcoin.consensus.default_constants import DEFAULT_CONSTANTS
+from hddcoin.full_node.bundle_tools import simple_solution_generator, simple_solution_generator_backrefs
+from hddcoin.types.blockchain_format.coin import Coin
+from hddcoin.types.coin_spend import CoinSpend
+from hddcoin.types.eligible_coin_spends import EligibleCoinSpends
+from hddcoin.types.generator_types import BlockGenerator
+from hddcoin.types.mempool_item import MempoolItem
+from hddcoin.types.spend_bundle import SpendBundle
+from hddcoin.util.ints import uint32, uint64
+
+log = logging.getLogger(__name__)
+
+
+@dataclasses.dataclass
+class BlockTemplate:
+    """
+    The transactions of the next block, picked from the mempool items in order
+    of decreasing fee per cost until the block is full. The items are added
+    one at a time, so the template can be kept up to date as new items arrive
+    in the mempool, as long as they sort after all the items that were tried.
+    The spend bundle, its generators and their cost are computed when they're
+    first asked for, and kept until the next item is added.
+    """
+
+    max_block_clvm_cost: int
+    # This contains a map of coin ID to a coin spend solution and its isolated cost
+    # We reconstruct it for every template we create from mempool items because we
+    # deduplicate on the first coin spend solution that comes with the highest
+    # fee rate item, and that can change across templates
+    eligible_coin_spends: EligibleCoinSpends = dataclasses.field(default_factory=EligibleCoinSpends)
+    coin_spends: List[CoinSpend] = dataclasses.field(default_factory=list)
+    additions: List[Coin] = dataclasses.field(default_factory=list)
+    aggregated_signature: G2Element = dataclasses.field(default_factory=G2Element)
+    cost: int = 0  # Checks that total cost does not exceed block maximum
+    fees: int = 0  # Checks that total fees don't exceed 64 bits
+    spend_bundles: int = 0
+    # set when an item didn't fit, no more items can be added after that
+    full: bool = False
+    # the fee per cost of the last item that was tried
+    last_fee_per_cost: Optional[float] = None
+    _spend_bundle: Optional[SpendBundle] = None
+    # backrefs -> generator
+    _generators: Dict[bool, BlockGenerator] = dataclasses.field(default_factory=dict)
+    # (backrefs, height) -> cost of the generator
+    _costs: Dict[Tuple[bool, uint32], uint64] = dataclasses.field(default_factory=dict)
+
+    def add_item(self, item: MempoolItem) -> bool:
+        """
+        Adds the item to the block, unless it's a duplicate spend of a coin
+        the block spends differently. Returns False if the block is full.
+        """
+        assert not self.full
+        self.last_fee_per_cost = item.fee_per_cost
+        fee = int(item.fee)
+        try:
+            unique_coin_spends, cost_saving, unique_additions = self.eligible_coin_spends.get_deduplication_info(
+                bundle_coin_spends=item.bundle_coin_spends, max_cost=item.npc_result.cost
+            )
+        except Exception as e:
+            log.debug(f"Exception while checking a mempool item for deduplication: {e}")
+            return True
+        item_cost = item.npc_result.cost - cost_saving
+        log.debug("Cumulative cost: %d, fee per cost: %0.4f", self.cost, fee / item_cost)
+        if item_cost + self.cost > self.max_block_clvm_cost or fee + self.fees > DEFAULT_CONSTANTS.MAX_COIN_AMOUNT:
+            self.full = True
+            return False
+        self.coin_spends.extend(unique_coin_spends)
+        self.additions.extend(unique_additions)
+        self.aggregated_signature = AugSchemeMPL.aggregate(
+            [self.aggregated_signature, item.spend_bundle.aggregated_signature]
+        )
+        self.cost += item_cost
+        self.fees += fee
+        self.spend_bundles += 1
+        self._spend_bundle = None
+        self._generators.clear()
+        self._costs.clear()
+        return True
+
+    def accepts_after(self, fee_per_cost: float) -> bool:
+        """
+        Whether an item with this fee per cost, added to the mempool after all
+        the items that were tried, would be tried last when building the
+        template from scratch. If so, adding it to this template gives the
+        same result.
+        """
+        return self.last_fee_per_cost is None or fee_per_cost <= self.last_fee_per_cost
+
+    def spend_bundle(self) -> SpendBundle:
+        if self._spend_bundle is None:
+            self._spend_bundle = SpendBundle(list(self.coin_spends), self.aggregated_signature)
+        return self._spend_bundle
+
+    def generator(self, backrefs: bool) -> BlockGenerator:
+        """
+        The block generator running the spends, serialized with back
+        references (allowed after the hard fork) or without.
+        """
+        generator = self._generators.get(backrefs)
+        if generator is None:
+            if backrefs:
+                generator = simple_solution_generator_backrefs(self.spend_bundle())
+            else:
+                generator = simple_solution_generator(self.spend_bundle())
+            self._generators[backrefs] = generator
+        return generator
+
+    def compute_cost(self, generator: BlockGenerator, constants: ConsensusConstants, height: uint32) -> uint64:
+        """
+        A drop-in for compute_block_cost, which remembers the cost of this
+        template's generators.
+        """
+        for backrefs, cached in self._generators.items():
+            if cached is generator:
+                cost = self._costs.get((backrefs, height))
+                if cost is None:
+                    cost = compute_block_cost(generator, constants, height)
+                    self._costs[(backrefs, height)] = cost
+                return cost
+        return compute_block_cost(generator, constants, height)
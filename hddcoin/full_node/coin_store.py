@@ -1,14 +1,17 @@
 from __future__ import annotations
 
+import bisect
 import dataclasses
+import functools
 import logging
 import sqlite3
 import time
-from typing import Any, Collection, Dict, List, Optional, Set, Tuple
+from typing import Any, AsyncGenerator, Collection, Dict, List, Optional, Set, Tuple
 
 import typing_extensions
 from aiosqlite import Cursor
 
+from hddcoin.full_node.unspent_coin_index import UnspentCoinIndex
 from hddcoin.protocols.wallet_protocol import CoinState
 from hddcoin.types.blockchain_format.coin import Coin
 from hddcoin.types.blockchain_format.sized_bytes import bytes32
@@ -21,6 +24,10 @@ from hddcoin.util.misc import to_batches
 log = logging.getLogger(__name__)
 
 
+def _coin_state_row_key(row: sqlite3.Row) -> Tuple[int, bytes]:
+    return int(row[0]), bytes(row[7])
+
+
 @typing_extensions.final
 @dataclasses.dataclass
 class CoinStore:
@@ -30,9 +37,12 @@ class CoinStore:
 
     db_wrapper: DBWrapper2
     coins_added_at_height_cache: LRUCache[uint32, List[CoinRecord]]
+    # optional in-memory index of unspent coins, serving the hot lookups
+    # without going to the database
+    unspent_index: Optional[UnspentCoinIndex] = None
 
     @classmethod
-    async def create(cls, db_wrapper: DBWrapper2) -> CoinStore:
+    async def create(cls, db_wrapper: DBWrapper2, *, unspent_index_mb: int = 0) -> CoinStore:
         if db_wrapper.db_version != 2:
             raise RuntimeError(f"CoinStore does not support database schema v{db_wrapper.db_version}")
         self = CoinStore(db_wrapper, LRUCache(100))
@@ -66,8 +76,50 @@ class CoinStore:
             log.info("DB: Creating index coin_parent_index")
             await conn.execute("CREATE INDEX IF NOT EXISTS coin_parent_index on coin_record(coin_parent)")
 
+            log.info("DB: Creating index coin_puzzle_hash_confirmed_index")
+            await conn.execute(
+                "CREATE INDEX IF NOT EXISTS coin_puzzle_hash_confirmed_index "
+                "on coin_record(puzzle_hash, confirmed_index, coin_name)"
+            )
+
+        if unspent_index_mb > 0:
+            self.unspent_index = UnspentCoinIndex.create(unspent_index_mb)
+            await self._load_unspent_index(self.unspent_index)
+
         return self
 
+    async def _load_unspent_index(self, index: UnspentCoinIndex) -> None:
+        start = time.monotonic()
+        # load the most recent unspent coins. If they don't all fit, the index
+        # can still serve lookups by coin id
+        async with self.db_wrapper.reader_no_transaction() as conn:
+            async with conn.execute(
+                "SELECT confirmed_index, spent_index, coinbase, puzzle_hash, "
+                "coin_parent, amount, timestamp FROM coin_record INDEXED BY coin_spent_index WHERE spent_index=0 "
+                "ORDER BY confirmed_index DESC LIMIT ?",
+                (index.capacity + 1,),
+            ) as cursor:
+                rows = list(await cursor.fetchall())
+        complete = len(rows) <= index.capacity
+        index.load(
+            (
+                CoinRecord(self.row_to_coin(row), row[0], row[1], row[2], row[6])
+                for row in reversed(rows[: index.capacity])
+            ),
+            complete,
+        )
+        log.info(
+            f"Loaded {len(index)} unspent coins into the in-memory index in {time.monotonic() - start:0.2f}s "
+            f"({'complete' if complete else 'partial'})"
+        )
+
+    def _get_unspent_index(self) -> Optional[UnspentCoinIndex]:
+        # changes only reach the index once their transaction commits, so
+        # the task making them has to read them from the database until then
+        if self.db_wrapper.in_write_transaction():
+            return None
+        return self.unspent_index
+
     async def num_unspent(self) -> int:
         async with self.db_wrapper.reader_no_transaction() as conn:
             async with conn.execute("SELECT COUNT(*) FROM coin_record WHERE spent_index=0") as cursor:
@@ -134,6 +186,12 @@ class CoinStore:
 
     # Checks DB and DiffStores for CoinRecord with coin_name and returns it
     async def get_coin_record(self, coin_name: bytes32) -> Optional[CoinRecord]:
+        unspent_index = self._get_unspent_index()
+        if unspent_index is not None:
+            record = unspent_index.get(coin_name)
+            if record is not None:
+                return record
+
         async with self.db_wrapper.reader_no_transaction() as conn:
             async with conn.execute(
                 "SELECT confirmed_index, spent_index, coinbase, puzzle_hash, "
@@ -152,6 +210,12 @@ class CoinStore:
 
         coins: List[CoinRecord] = []
 
+        unspent_index = self._get_unspent_index()
+        if unspent_index is not None:
+            coins, names = unspent_index.get_many(names)
+            if len(names) == 0:
+                return coins
+
         async with self.db_wrapper.reader_no_transaction() as conn:
             cursors: List[Cursor] = []
             for batch in to_batches(names, SQLITE_MAX_VARIABLE_NUMBER):
@@ -235,6 +299,12 @@ class CoinStore:
         start_height: uint32 = uint32(0),
         end_height: uint32 = uint32((2**32) - 1),
     ) -> List[CoinRecord]:
+        unspent_index = self._get_unspent_index()
+        if not include_spent_coins and unspent_index is not None:
+            records = unspent_index.get_by_puzzle_hashes([puzzle_hash])
+            if records is not None:
+                return [r for r in records if start_height <= r.confirmed_block_index < end_height]
+
         coins = set()
 
         async with self.db_wrapper.reader_no_transaction() as conn:
@@ -260,6 +330,12 @@ class CoinStore:
         if len(puzzle_hashes) == 0:
             return []
 
+        unspent_index = self._get_unspent_index()
+        if not include_spent_coins and unspent_index is not None:
+            records = unspent_index.get_by_puzzle_hashes(set(puzzle_hashes))
+            if records is not None:
+                return [r for r in records if start_height <= r.confirmed_block_index < end_height]
+
         coins = set()
         puzzle_hashes_db: Tuple[Any, ...]
         puzzle_hashes_db = tuple(puzzle_hashes)
@@ -288,7 +364,14 @@ class CoinStore:
         if len(names) == 0:
             return []
 
-        coins = set()
+        coins: Set[CoinRecord] = set()
+
+        unspent_index = self._get_unspent_index()
+        if unspent_index is not None:
+            found, names = unspent_index.get_many(names)
+            coins.update(r for r in found if start_height <= r.confirmed_block_index < end_height)
+            if len(names) == 0:
+                return list(coins)
 
         async with self.db_wrapper.reader_no_transaction() as conn:
             async with conn.execute(
@@ -348,6 +431,122 @@ class CoinStore:
 
         return coins
 
+    def _coin_states_in_order_query(self, num_puzzle_hashes: int, include_spent_coins: bool) -> str:
+        # the rows are ordered by (confirmed_index, coin_name), which the
+        # index can seek to, so reading on from a given row doesn't need to
+        # scan the rows before it
+        return (
+            f"SELECT confirmed_index, spent_index, coinbase, puzzle_hash, "
+            f"coin_parent, amount, timestamp, coin_name FROM coin_record "
+            f"INDEXED BY coin_puzzle_hash_confirmed_index "
+            f'WHERE puzzle_hash in ({"?," * (num_puzzle_hashes - 1)}?) '
+            f"AND (confirmed_index, coin_name)>(?, ?) AND (confirmed_index>=? OR spent_index>=?) "
+            f"{'' if include_spent_coins else 'AND spent_index=0 '}"
+            "ORDER BY confirmed_index, coin_name"
+        )
+
+    async def get_coin_states_by_puzzle_hashes_paginated(
+        self,
+        include_spent_coins: bool,
+        puzzle_hashes: Collection[bytes32],
+        min_height: uint32 = uint32(0),
+        *,
+        start_height: uint32 = uint32(0),
+        start_after: Optional[bytes32] = None,
+        max_items: int = 10000,
+    ) -> Tuple[List[CoinState], Optional[Tuple[uint32, bytes32]]]:
+        """
+        Returns a page of the coin states matching any of the puzzle hashes,
+        ordered by confirmed height and coin id, starting at start_height, or
+        after the coin start_after at start_height. Also returns the
+        (start_height, start_after) of the next page, or None if this was the
+        last one.
+        """
+        if len(puzzle_hashes) == 0:
+            return [], None
+
+        # a row comes after (start_height, b"") if it's at start_height or above
+        after = (start_height, b"" if start_after is None else start_after)
+        rows: List[sqlite3.Row] = []
+        async with self.db_wrapper.reader_no_transaction() as conn:
+            for batch in to_batches(puzzle_hashes, SQLITE_MAX_VARIABLE_NUMBER):
+                async with conn.execute(
+                    self._coin_states_in_order_query(len(batch.entries), include_spent_coins) + " LIMIT ?",
+                    tuple(batch.entries) + after + (min_height, min_height, max_items + 1),
+                ) as cursor:
+                    rows.extend(await cursor.fetchall())
+
+        # every batch returned the first rows it has, so the first rows of all
+        # of them are the first rows overall
+        rows.sort(key=_coin_state_row_key)
+        if len(rows) <= max_items:
+            return [self.row_to_coin_state(row) for row in rows], None
+        last = rows[max_items - 1]
+        return [self.row_to_coin_state(row) for row in rows[:max_items]], (uint32(last[0]), bytes32(last[7]))
+
+    async def stream_coin_states_by_puzzle_hashes(
+        self,
+        include_spent_coins: bool,
+        puzzle_hashes: Collection[bytes32],
+        min_height: uint32 = uint32(0),
+        *,
+        chunk_size: int = 10000,
+    ) -> AsyncGenerator[List[CoinState], None]:
+        """
+        Yields the coin states matching any of the puzzle hashes in chunks of
+        chunk_size, ordered by confirmed height and coin id. They are all read
+        in one read transaction, so they are consistent even if the chain
+        changes in between chunks. Callers that stop before the end must close
+        the generator, to give the connection back.
+        """
+        if len(puzzle_hashes) == 0:
+            return
+
+        async with self.db_wrapper.reader() as conn:
+            cursors: List[Cursor] = []
+            try:
+                for batch in to_batches(puzzle_hashes, SQLITE_MAX_VARIABLE_NUMBER):
+                    cursors.append(
+                        await conn.execute(
+                            self._coin_states_in_order_query(len(batch.entries), include_spent_coins),
+                            tuple(batch.entries) + (0, b"", min_height, min_height),
+                        )
+                    )
+
+                # the rows read but not yielded yet, in order
+                rows: List[sqlite3.Row] = []
+                # the key of the last row read from each cursor that may have
+                # more rows
+                last_keys: Dict[int, Optional[Tuple[int, bytes]]] = {i: None for i in range(len(cursors))}
+                while len(last_keys) > 0:
+                    # read on from the cursor furthest behind
+                    behind = min(last_keys, key=lambda i: last_keys[i] or (-1, b""))
+                    new_rows = list(await cursors[behind].fetchmany(chunk_size))
+                    if len(new_rows) < chunk_size:
+                        del last_keys[behind]
+                    else:
+                        last_keys[behind] = _coin_state_row_key(new_rows[-1])
+                    rows.extend(new_rows)
+                    rows.sort(key=_coin_state_row_key)
+
+                    # the rows up to the last row read from the cursor
+                    # furthest behind are in their final order. The others may
+                    # still have rows to go in between
+                    if len(last_keys) == 0:
+                        ready = len(rows)
+                    else:
+                        keys = [k for k in last_keys.values() if k is not None]
+                        if len(keys) < len(last_keys):
+                            continue
+                        ready = bisect.bisect_right([_coin_state_row_key(row) for row in rows], min(keys))
+                        ready -= ready % chunk_size
+                    for i in range(0, ready, chunk_size):
+                        yield [self.row_to_coin_state(row) for row in rows[i : i + chunk_size]]
+                    del rows[:ready]
+            finally:
+                for cursor in cursors:
+                    await cursor.close()
+
     async def get_coin_records_by_parent_ids(
         self,
         include_spent_coins: bool,
@@ -418,6 +617,8 @@ class CoinStore:
         """
 
         coin_changes: Dict[bytes32, CoinRecord] = {}
+        # coins that are spent again after the rollback
+        unspent_records: List[CoinRecord] = []
         # Add coins that are confirmed in the reverted blocks to the list of updated coins.
         async with self.db_wrapper.writer_maybe_transaction() as conn:
             async with conn.execute(
@@ -444,8 +645,13 @@ class CoinStore:
                     record = CoinRecord(coin, row[0], uint32(0), row[2], row[6])
                     if record.name not in coin_changes:
                         coin_changes[record.name] = record
+                        unspent_records.append(record)
 
             await conn.execute("UPDATE coin_record SET spent_index=0 WHERE spent_index>?", (block_index,))
+            if self.unspent_index is not None:
+                self.db_wrapper.after_commit(
+                    functools.partial(self._rollback_unspent_index, list(coin_changes.keys()), unspent_records)
+                )
         self.coins_added_at_height_cache = LRUCache(self.coins_added_at_height_cache.capacity)
         return list(coin_changes.values())
 
@@ -471,6 +677,8 @@ class CoinStore:
                     "INSERT INTO coin_record VALUES(?, ?, ?, ?, ?, ?, ?, ?)",
                     values2,
                 )
+                if self.unspent_index is not None:
+                    self.db_wrapper.after_commit(functools.partial(self.unspent_index.add, records))
 
     # Update coin_record to be spent in DB
     async def _set_spent(self, coin_names: List[bytes32], index: uint32) -> None:
@@ -495,3 +703,10 @@ class CoinStore:
                 raise ValueError(
                     f"Invalid operation to set spent, total updates {rows_updated} expected {len(coin_names)}"
                 )
+            if self.unspent_index is not None:
+                self.db_wrapper.after_commit(functools.partial(self.unspent_index.remove, coin_names))
+
+    def _rollback_unspent_index(self, removed: List[bytes32], unspent_records: List[CoinRecord]) -> None:
+        assert self.unspent_index is not None
+        self.unspent_index.remove(removed)
+        self.unspent_index.add(unspent_records)
@@ -0,0 +1,104 @@
+from __future__ import annotations
+
+from bisect import bisect_right
+from typing import Any, Dict, List, Optional
+
+from hddcoin.full_node.fee_tracker import init_buckets
+
+# the lowest fee per cost of every bucket. The buckets are the fee estimator's
+# ones (which are in fee per 1000 cost), with a bucket for 0 in front of them
+BUCKET_LOWER_BOUNDS: List[float] = [0.0] + [fee_rate / 1000 for fee_rate in init_buckets()[:-1]]
+
+# the cost weighted percentiles of the fee per cost in the snapshots
+PERCENTILES = [5, 10, 25, 50, 75, 90, 95]
+
+
+class FeeRateHistogram:
+    """
+    The number and total cost of the items in the mempool, by fee per cost.
+    It's updated as items are added and removed, so snapshots of it don't need
+    to go through the items. Fee rates are only as precise as the buckets,
+    each one being 5% wider than the previous one.
+    """
+
+    _costs: List[int]
+    _counts: List[int]
+    _max_block_cost: int
+    _snapshot: Optional[Dict[str, Any]]
+
+    def __init__(self, max_block_cost: int) -> None:
+        self._costs = [0] * len(BUCKET_LOWER_BOUNDS)
+        self._counts = [0] * len(BUCKET_LOWER_BOUNDS)
+        self._max_block_cost = max_block_cost
+        self._snapshot = None
+
+    def add(self, fee_per_cost: float, cost: int) -> None:
+        bucket = bucket_index(fee_per_cost)
+        self._costs[bucket] += cost
+        self._counts[bucket] += 1
+        self._snapshot = None
+
+    def remove(self, fee_per_cost: float, cost: int) -> None:
+        bucket = bucket_index(fee_per_cost)
+        self._costs[bucket] -= cost
+        self._counts[bucket] -= 1
+        assert self._costs[bucket] >= 0 and self._counts[bucket] >= 0
+        self._snapshot = None
+
+    def get_snapshot(self) -> Dict[str, Any]:
+        """
+        The non-empty buckets, highest fee per cost first, with the cost of
+        all items paying at least as much as the bucket's items, the cost
+        weighted percentiles of the fee per cost, and the fee per cost needed
+        to make it into the next block. The snapshot is computed once, and
+        reused until the mempool changes.
+        """
+        if self._snapshot is None:
+            self._snapshot = self._make_snapshot()
+        return self._snapshot
+
+    def _make_snapshot(self) -> Dict[str, Any]:
+        total_cost = sum(self._costs)
+
+        buckets: List[Dict[str, Any]] = []
+        # the fee per cost an item needs to pay to be among the items filling
+        # the next block, if the mempool has more than a block's worth of cost
+        next_block_fee_per_cost = 0.0
+        cumulative_cost = 0
+        for bucket in range(len(self._costs) - 1, -1, -1):
+            if self._counts[bucket] == 0:
+                continue
+            cumulative_cost += self._costs[bucket]
+            buckets.append(
+                {
+                    "fee_per_cost": BUCKET_LOWER_BOUNDS[bucket],
+                    "count": self._counts[bucket],
+                    "cost": self._costs[bucket],
+                    "cumulative_cost": cumulative_cost,
+                }
+            )
+            if next_block_fee_per_cost == 0 and cumulative_cost >= self._max_block_cost:
+                next_block_fee_per_cost = BUCKET_LOWER_BOUNDS[min(bucket + 1, len(BUCKET_LOWER_BOUNDS) - 1)]
+
+        percentiles: Dict[str, float] = {}
+        if total_cost > 0:
+            # the buckets are in descending order, so walk them backwards
+            cost_below = 0
+            remaining = list(PERCENTILES)
+            for entry in reversed(buckets):
+                cost_below += entry["cost"]
+                while len(remaining) > 0 and cost_below * 100 >= remaining[0] * total_cost:
+                    percentiles[str(remaining.pop(0))] = entry["fee_per_cost"]
+
+        return {
+            "count": sum(self._counts),
+            "total_cost": total_cost,
+            "max_block_cost": self._max_block_cost,
+            "next_block_fee_per_cost": next_block_fee_per_cost,
+            "percentiles": percentiles,
+            "buckets": buckets,
+        }
+
+
+def bucket_index(fee_per_cost: float) -> int:
+    return max(bisect_right(BUCKET_LOWER_BOUNDS, fee_per_cost) - 1, 0)
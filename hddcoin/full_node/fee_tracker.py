@@ -1,9 +1,11 @@
 from __future__ import annotations
 
 import logging
+from array import array
 from bisect import bisect_left
 from dataclasses import dataclass
-from typing import List, Optional, Tuple
+from operator import add
+from typing import Any, Dict, Iterable, List, Optional, Tuple
 
 from hddcoin.full_node.fee_estimate_store import FeeStore
 from hddcoin.full_node.fee_estimation import MempoolItemInfo
@@ -29,6 +31,9 @@ from hddcoin.full_node.fee_estimator_constants import (
 from hddcoin.full_node.fee_history import FeeStatBackup, FeeTrackerBackup
 from hddcoin.util.ints import uint8, uint32, uint64
 
+# rescale the moving averages when their scale factor drops below this
+MIN_SCALE = 1e-100
+
 
 @dataclass
 class BucketResult:
@@ -62,37 +67,48 @@ def get_estimate_time_intervals() -> List[uint64]:
 
 # Implementation of bitcoin core fee estimation algorithm
 # https://gist.github.com/morcos/d3637f015bc4e607e1fd10d8351e9f41
+#
+# The statistics are kept in flat arrays of doubles (one per confirmation
+# period) rather than lists of Python floats. Decaying every moving average on
+# every block would touch each element of every array, so instead the stored
+# values are relative to a common factor (avg_scale), which is all that's
+# decayed. The real value of an element is the stored value times avg_scale,
+# and new data points are added divided by it. When avg_scale gets too small
+# the arrays are rescaled, which happens every few thousand blocks.
 class FeeStat:  # TxConfirmStats
     buckets: List[float]  # These elements represent the upper-bound of the range for the bucket
 
     # For each bucket xL
     # Count the total number of txs in each bucket
     # Track historical moving average of this total over block
-    tx_ct_avg: List[float]
+    tx_ct_avg: array[float]
 
     # Count the total number of txs confirmed within Y blocks in each bucket
     # Track the historical moving average of these totals over blocks
-    confirmed_average: List[List[float]]  # confirmed_average [y][x]
+    confirmed_average: List[array[float]]  # confirmed_average [y][x]
 
     # Track moving average of txs which have been evicted from the mempool
     # after failing to be confirmed within Y block
-    failed_average: List[List[float]]  # failed_average [y][x]
+    failed_average: List[array[float]]  # failed_average [y][x]
 
     # Sum the total fee_rate of all txs in each bucket
     # Track historical moving average of this total over blocks
-    m_fee_rate_avg: List[float]
+    m_fee_rate_avg: array[float]
 
     decay: float
 
+    # The moving averages above are stored divided by this
+    avg_scale: float
+
     # Resolution of blocks with which confirmations are tracked
     scale: int
 
     # Mempool counts of outstanding transactions
     # For each bucket x, track the number of transactions in mempool
     # that are unconfirmed for each possible confirmation value y
-    unconfirmed_txs: List[List[int]]
+    unconfirmed_txs: List[array[int]]
     # transactions still unconfirmed after get_max_confirmed for each bucket
-    old_unconfirmed_txs: List[int]
+    old_unconfirmed_txs: array[int]
     max_confirms: int
     fee_store: FeeStore
 
@@ -106,63 +122,71 @@ class FeeStat:  # TxConfirmStats
         my_type: str,
     ):
         self.buckets = buckets
-        self.confirmed_average = [[] for _ in range(0, max_periods)]
-        self.failed_average = [[] for _ in range(0, max_periods)]
         self.decay = decay
         self.scale = scale
-        self.max_confirms = self.scale * len(self.confirmed_average)
+        self.avg_scale = 1.0
+        self.max_confirms = self.scale * max_periods
         self.log = logging.Logger(__name__)
         self.fee_store = fee_store
         self.type = my_type
         self.max_periods = max_periods
 
-        for i in range(0, max_periods):
-            self.confirmed_average[i] = [0 for _ in range(0, len(buckets))]
-            self.failed_average[i] = [0 for _ in range(0, len(buckets))]
-
-        self.tx_ct_avg = [0 for _ in range(0, len(buckets))]
-        self.m_fee_rate_avg = [0 for _ in range(0, len(buckets))]
+        self.confirmed_average = [_zeros("d", len(buckets)) for _ in range(0, max_periods)]
+        self.failed_average = [_zeros("d", len(buckets)) for _ in range(0, max_periods)]
+        self.tx_ct_avg = _zeros("d", len(buckets))
+        self.m_fee_rate_avg = _zeros("d", len(buckets))
 
-        self.unconfirmed_txs = [[] for _ in range(0, self.max_confirms)]
-        for i in range(0, self.max_confirms):
-            self.unconfirmed_txs[i] = [0 for _ in range(0, len(buckets))]
-
-        self.old_unconfirmed_txs = [0 for _ in range(0, len(buckets))]
+        self.unconfirmed_txs = [_zeros("q", len(buckets)) for _ in range(0, self.max_confirms)]
+        self.old_unconfirmed_txs = _zeros("q", len(buckets))
 
     def tx_confirmed(self, blocks_to_confirm: int, item: MempoolItemInfo) -> None:
-        if blocks_to_confirm < 1:
-            raise ValueError("tx_confirmed called with < 1 block to confirm")
-
-        periods_to_confirm = int((blocks_to_confirm + self.scale - 1) / self.scale)
-
         fee_rate = item.fee_per_cost * 1000
-        bucket_index = get_bucket_index(self.buckets, fee_rate)
-
-        for i in range(periods_to_confirm, len(self.confirmed_average)):
-            self.confirmed_average[i - 1][bucket_index] += 1
+        self.txs_confirmed([(blocks_to_confirm, get_bucket_index(self.buckets, fee_rate), fee_rate)])
 
-        self.tx_ct_avg[bucket_index] += 1
-        self.m_fee_rate_avg[bucket_index] += fee_rate
+    def txs_confirmed(self, txs: Iterable[Tuple[int, int, float]]) -> None:
+        """
+        Records the transactions included in a block, as tuples of the number
+        of blocks it took to confirm them, their bucket index and fee rate.
+        """
+        counts: Dict[Tuple[int, int], int] = {}
+        for blocks_to_confirm, bucket_index, fee_rate in txs:
+            if blocks_to_confirm < 1:
+                raise ValueError("tx_confirmed called with < 1 block to confirm")
+            periods_to_confirm = int((blocks_to_confirm + self.scale - 1) / self.scale)
+            key = (periods_to_confirm, bucket_index)
+            counts[key] = counts.get(key, 0) + 1
+            self.m_fee_rate_avg[bucket_index] += fee_rate / self.avg_scale
+
+        for (periods_to_confirm, bucket_index), count in counts.items():
+            value = count / self.avg_scale
+            for i in range(periods_to_confirm, len(self.confirmed_average)):
+                self.confirmed_average[i - 1][bucket_index] += value
+            self.tx_ct_avg[bucket_index] += value
 
     def update_moving_averages(self) -> None:
-        for j in range(0, len(self.buckets)):
-            for i in range(0, len(self.confirmed_average)):
-                self.confirmed_average[i][j] *= self.decay
-                self.failed_average[i][j] *= self.decay
+        self.avg_scale *= self.decay
+        if self.avg_scale < MIN_SCALE:
+            self.rescale()
 
-            self.tx_ct_avg[j] *= self.decay
-            self.m_fee_rate_avg[j] *= self.decay
+    def rescale(self) -> None:
+        """
+        Applies the scale to the stored moving averages, and resets it to 1.
+        """
+        avg_scale = self.avg_scale
+        self.confirmed_average = [_scaled(row, avg_scale) for row in self.confirmed_average]
+        self.failed_average = [_scaled(row, avg_scale) for row in self.failed_average]
+        self.tx_ct_avg = _scaled(self.tx_ct_avg, avg_scale)
+        self.m_fee_rate_avg = _scaled(self.m_fee_rate_avg, avg_scale)
+        self.avg_scale = 1.0
 
     def clear_current(self, block_height: uint32) -> None:
-        for i in range(0, len(self.buckets)):
-            self.old_unconfirmed_txs[i] += self.unconfirmed_txs[block_height % len(self.unconfirmed_txs)][i]
-            self.unconfirmed_txs[block_height % len(self.unconfirmed_txs)][i] = 0
+        block_index = block_height % len(self.unconfirmed_txs)
+        self.old_unconfirmed_txs = array("q", map(add, self.old_unconfirmed_txs, self.unconfirmed_txs[block_index]))
+        self.unconfirmed_txs[block_index] = _zeros("q", len(self.buckets))
 
-    def new_mempool_tx(self, block_height: uint32, fee_rate: float) -> int:
-        bucket_index: int = get_bucket_index(self.buckets, fee_rate)
+    def new_mempool_tx(self, block_height: uint32, bucket_index: int) -> None:
         block_index = block_height % len(self.unconfirmed_txs)
         self.unconfirmed_txs[block_index][bucket_index] += 1
-        return bucket_index
 
     def remove_tx(self, latest_seen_height: uint32, item: MempoolItemInfo, bucket_index: int) -> None:
         if item.height_added_to_mempool is None:
@@ -187,35 +211,20 @@ class FeeStat:  # TxConfirmStats
             for i in range(0, len(self.failed_average)):
                 if i >= periods_ago:
                     break
-                self.failed_average[i][bucket_index] += 1
+                self.failed_average[i][bucket_index] += 1 / self.avg_scale
 
     def create_backup(self) -> FeeStatBackup:
-        str_tx_ct_abg: List[str] = []
-        str_confirmed_average: List[List[str]] = []
-        str_failed_average: List[List[str]] = []
-        str_m_fee_rate_avg: List[str] = []
-        for i in range(0, self.max_periods):
-            str_i_list_conf = []
-            for j in range(0, len(self.confirmed_average[i])):
-                str_i_list_conf.append(float.hex(float(self.confirmed_average[i][j])))
-
-            str_confirmed_average.append(str_i_list_conf)
-
-            str_i_list_fail = []
-            for j in range(0, len(self.failed_average[i])):
-                str_i_list_fail.append(float.hex(float(self.failed_average[i][j])))
-
-            str_failed_average.append(str_i_list_fail)
-
-        for i in range(0, len(self.tx_ct_avg)):
-            str_tx_ct_abg.append(float.hex(float(self.tx_ct_avg[i])))
-
-        for i in range(0, len(self.m_fee_rate_avg)):
-            str_m_fee_rate_avg.append(float.hex(float(self.m_fee_rate_avg[i])))
+        # the backup holds the actual moving averages, not the scaled ones
+        avg_scale = self.avg_scale
+        str_confirmed_average = [[float.hex(v * avg_scale) for v in row] for row in self.confirmed_average]
+        str_failed_average = [[float.hex(v * avg_scale) for v in row] for row in self.failed_average]
+        str_tx_ct_abg = [float.hex(v * avg_scale) for v in self.tx_ct_avg]
+        str_m_fee_rate_avg = [float.hex(v * avg_scale) for v in self.m_fee_rate_avg]
 
         return FeeStatBackup(self.type, str_tx_ct_abg, str_confirmed_average, str_failed_average, str_m_fee_rate_avg)
 
     def import_backup(self, backup: FeeStatBackup) -> None:
+        self.avg_scale = 1.0
         for i in range(0, self.max_periods):
             for j in range(0, len(self.confirmed_average[i])):
                 self.confirmed_average[i][j] = float.fromhex(backup.confirmed_average[i][j])
@@ -270,30 +279,35 @@ class FeeStat:  # TxConfirmStats
             in_mempool=0.0,
             left_mempool=0.0,
         )
+        if period_target - 1 < 0 or period_target - 1 >= len(self.confirmed_average):
+            return EstimateResult(
+                requested_time=uint64(conf_target * SECONDS_PER_BLOCK),
+                pass_bucket=pass_bucket,
+                fail_bucket=fail_bucket,
+                median=-1.0,
+            )
+
+        avg_scale = self.avg_scale
+        confirmed = [v * avg_scale for v in self.confirmed_average[period_target - 1]]
+        failed = [v * avg_scale for v in self.failed_average[period_target - 1]]
+        tx_ct = [v * avg_scale for v in self.tx_ct_avg]
+        # the number of txs in each bucket that have been in the mempool for at
+        # least conf_target blocks
+        unconfirmed = [
+            self.unconfirmed_txs[(block_height - conf_ct) % bins] for conf_ct in range(conf_target, self.max_confirms)
+        ]
+        in_mempool = [sum(counts) for counts in zip(*unconfirmed, self.old_unconfirmed_txs)]
+
         for bucket in range(max_bucket_index, -1, -1):
             if new_bucket_range:
                 cur_near_bucket = bucket
                 new_bucket_range = False
 
             cur_far_bucket = bucket
-            if period_target - 1 < 0 or period_target - 1 >= len(self.confirmed_average):
-                return EstimateResult(
-                    requested_time=uint64(conf_target * SECONDS_PER_BLOCK),
-                    pass_bucket=pass_bucket,
-                    fail_bucket=fail_bucket,
-                    median=-1.0,
-                )
-
-            ca_len = len(self.confirmed_average[period_target - 1])
-            if bucket < 0 or bucket >= ca_len:
-                raise RuntimeError(f"bucket index ({bucket}) out of range (0, {ca_len})")
-
-            n_conf += self.confirmed_average[period_target - 1][bucket]
-            total_num += self.tx_ct_avg[bucket]
-            fail_num += self.failed_average[period_target - 1][bucket]
-            for conf_ct in range(conf_target, self.max_confirms):
-                extra_num += self.unconfirmed_txs[(block_height - conf_ct) % bins][bucket]
-            extra_num += self.old_unconfirmed_txs[bucket]
+            n_conf += confirmed[bucket]
+            total_num += tx_ct[bucket]
+            fail_num += failed[bucket]
+            extra_num += in_mempool[bucket]
 
             # If we have enough transaction data points in this range of buckets,
             # we can test for success
@@ -340,13 +354,13 @@ class FeeStat:  # TxConfirmStats
         max_bucket = max(best_near_bucket, best_far_bucket)
 
         for i in range(min_bucket, max_bucket + 1):
-            tx_sum += self.tx_ct_avg[i]
+            tx_sum += tx_ct[i]
 
         if found_answer and tx_sum != 0:
             tx_sum = tx_sum / 2
             for i in range(min_bucket, max_bucket):
-                if self.tx_ct_avg[i] < tx_sum:
-                    tx_sum -= self.tx_ct_avg[i]
+                if tx_ct[i] < tx_sum:
+                    tx_sum -= tx_ct[i]
                 else:
                     # This is the correct bucket
                     median = self.m_fee_rate_avg[i] / self.tx_ct_avg[i]
@@ -386,6 +400,14 @@ class FeeStat:  # TxConfirmStats
         return result
 
 
+def _zeros(typecode: str, n: int) -> array[Any]:
+    return array(typecode, bytes(n * array(typecode).itemsize))
+
+
+def _scaled(values: array[float], factor: float) -> array[float]:
+    return array("d", [v * factor for v in values])
+
+
 def clamp(n: int, smallest: int, largest: int) -> int:
     return max(smallest, min(n, largest))
 
@@ -491,24 +513,43 @@ class FeeTracker:
         self.med_horizon.update_moving_averages()
         self.long_horizon.update_moving_averages()
 
+        txs: List[Tuple[int, int, float]] = []
         for item in items:
-            self.process_block_tx(block_height, item)
+            tx = self.confirmed_tx(block_height, item)
+            if tx is not None:
+                txs.append(tx)
+
+        self.short_horizon.txs_confirmed(txs)
+        self.med_horizon.txs_confirmed(txs)
+        self.long_horizon.txs_confirmed(txs)
 
         if self.first_recorded_height == 0 and len(items) > 0:
             self.first_recorded_height = block_height
             self.log.info(f"Fee Estimator first recorded height: {self.first_recorded_height}")
 
-    def process_block_tx(self, current_height: uint32, item: MempoolItemInfo) -> None:
+    def confirmed_tx(self, current_height: uint32, item: MempoolItemInfo) -> Optional[Tuple[int, int, float]]:
+        """
+        The number of blocks it took to confirm the transaction, its bucket
+        index and fee rate, or None if it shouldn't be counted.
+        """
         if item.height_added_to_mempool is None:
             raise ValueError("process_block_tx called with item.height_added_to_mempool=None")
 
         blocks_to_confirm = current_height - item.height_added_to_mempool
         if blocks_to_confirm <= 0:
+            return None
+
+        fee_rate = item.fee_per_cost * 1000
+        return blocks_to_confirm, get_bucket_index(self.buckets, fee_rate), fee_rate
+
+    def process_block_tx(self, current_height: uint32, item: MempoolItemInfo) -> None:
+        tx = self.confirmed_tx(current_height, item)
+        if tx is None:
             return
 
-        self.short_horizon.tx_confirmed(blocks_to_confirm, item)
-        self.med_horizon.tx_confirmed(blocks_to_confirm, item)
-        self.long_horizon.tx_confirmed(blocks_to_confirm, item)
+        self.short_horizon.txs_confirmed([tx])
+        self.med_horizon.txs_confirmed([tx])
+        self.long_horizon.txs_confirmed([tx])
 
     def add_tx(self, item: MempoolItemInfo) -> None:
         if item.height_added_to_mempool < self.latest_seen_height:
@@ -6,6 +6,7 @@ import dataclasses
 import logging
 import multiprocessing
 import random
+import secrets
 import sqlite3
 import time
 import traceback
@@ -39,27 +40,36 @@ from hddcoin.consensus.blockchain_interface import BlockchainInterface
 from hddcoin.consensus.constants import ConsensusConstants
 from hddcoin.consensus.cost_calculator import NPCResult
 from hddcoin.consensus.difficulty_adjustment import get_next_sub_slot_iters_and_difficulty
+from hddcoin.consensus.find_fork_point import find_fork_point_in_chain
 from hddcoin.consensus.make_sub_epoch_summary import next_sub_epoch_summary
 from hddcoin.consensus.multiprocess_validation import PreValidationResult
 from hddcoin.consensus.pot_iterations import calculate_sp_iters
-from hddcoin.full_node.block_store import BlockStore
+from hddcoin.full_node.block_store import DEFAULT_GENERATOR_TABLE_BLOCKS, BlockStore
 from hddcoin.full_node.bundle_tools import detect_potential_template_generator
 from hddcoin.full_node.coin_store import CoinStore
 from hddcoin.full_node.full_node_api import FullNodeAPI
 from hddcoin.full_node.full_node_store import FullNodeStore, FullNodeStorePeakResult
 from hddcoin.full_node.hint_management import get_hints_and_subscription_coin_ids
 from hddcoin.full_node.hint_store import HintStore
-from hddcoin.full_node.mempool_manager import MempoolManager
+from hddcoin.full_node.mempool_manager import MEMPOOL_INVENTORY_SIZE, MEMPOOL_SYNC_MAX_TRANSACTIONS, MempoolManager
 from hddcoin.full_node.signage_point import SignagePoint
 from hddcoin.full_node.subscriptions import PeerSubscriptions
+from hddcoin.full_node.sync_pipeline import (
+    PreValidatedBatch,
+    SyncPipelineStats,
+    UncommittedChain,
+    pre_validate_on_uncommitted_chain,
+)
 from hddcoin.full_node.sync_store import Peak, SyncStore
 from hddcoin.full_node.tx_processing_queue import TransactionQueue
 from hddcoin.full_node.weight_proof import WeightProofHandler
 from hddcoin.protocols import farmer_protocol, full_node_protocol, timelord_protocol, wallet_protocol
 from hddcoin.protocols.full_node_protocol import RequestBlocks, RespondBlock, RespondBlocks, RespondSignagePoint
 from hddcoin.protocols.protocol_message_types import ProtocolMessageTypes
+from hddcoin.protocols.shared_protocol import Capability
 from hddcoin.protocols.wallet_protocol import CoinState, CoinStateUpdate
 from hddcoin.rpc.rpc_server import StateChangedProtocol
+from hddcoin.server.capabilities import negotiated
 from hddcoin.server.node_discovery import FullNodePeers
 from hddcoin.server.outbound_message import Message, NodeType, make_msg
 from hddcoin.server.peer_store_resolver import PeerStoreResolver
@@ -96,6 +106,15 @@ from hddcoin.util.log_exceptions import log_exceptions
 from hddcoin.util.path import path_from_root
 from hddcoin.util.profiler import mem_profile_task, profile_task
 from hddcoin.util.safe_cancel_task import cancel_task_safe
+from hddcoin.util.shared_pairing_cache import SharedPairingCache
+
+# add_transaction() failed without looking at the transaction. These don't
+# count against the peer that sent it
+TRANSACTION_NOT_VALIDATED_ERRORS = {
+    Err.NO_TRANSACTIONS_WHILE_SYNCING,
+    Err.ALREADY_INCLUDING_TRANSACTION,
+    Err.MEMPOOL_NOT_INITIALIZED,
+}
 
 
 # This is the result of calling peak_post_processing, which is then fed into peak_post_processing_2
@@ -145,6 +164,7 @@ class FullNode:
     #       config would end up on stdout if handled here.
     multiprocessing_context: Optional[BaseContext] = None
     _ui_tasks: Set[asyncio.Task[None]] = dataclasses.field(default_factory=set)
+    _mempool_sync_tasks: Set[asyncio.Task[None]] = dataclasses.field(default_factory=set)
     subscriptions: PeerSubscriptions = dataclasses.field(default_factory=PeerSubscriptions)
     _transaction_queue_task: Optional[asyncio.Task[None]] = None
     simulator_transaction_callback: Optional[Callable[[bytes32], Awaitable[None]]] = None
@@ -161,6 +181,8 @@ class FullNode:
     _block_store: Optional[BlockStore] = None
     _coin_store: Optional[CoinStore] = None
     _mempool_manager: Optional[MempoolManager] = None
+    # the BLS pairing cache shared with the validation worker processes
+    pairing_cache: Optional[SharedPairingCache] = None
     _init_weight_proof: Optional[asyncio.Task[None]] = None
     _blockchain: Optional[Blockchain] = None
     _timelord_lock: Optional[asyncio.Lock] = None
@@ -168,6 +190,8 @@ class FullNode:
     # hashes of peaks that failed long sync on chip13 Validation
     bad_peak_cache: Dict[bytes32, uint32] = dataclasses.field(default_factory=dict)
     wallet_sync_task: Optional[asyncio.Task[None]] = None
+    # timing of the stages of the current (or last) long sync
+    sync_pipeline_stats: Optional[SyncPipelineStats] = None
 
     @property
     def server(self) -> HDDcoinServer:
@@ -232,12 +256,16 @@ class FullNode:
         db_sync = db_synchronous_on(self.config.get("db_sync", "auto"))
         self.log.info(f"opening blockchain DB: synchronous={db_sync}")
 
+        slow_query_seconds = self.config.get("db_slow_query_seconds", 0)
         async with DBWrapper2.managed(
             self.db_path,
             db_version=db_version,
-            reader_count=4,
+            reader_count=self.config.get("db_readers", 4),
+            low_priority_reader_count=self.config.get("db_rpc_readers", 2),
             log_path=sql_log_path,
             synchronous=db_sync,
+            statement_cache_size=self.config.get("db_statement_cache_size", 256),
+            slow_query_seconds=slow_query_seconds if slow_query_seconds > 0 else None,
         ) as self._db_wrapper:
             if self.db_wrapper.db_version != 2:
                 async with self.db_wrapper.reader_no_transaction() as conn:
@@ -256,15 +284,30 @@ class FullNode:
                                 # empty except it has the database_version table
                                 pass
 
-            self._block_store = await BlockStore.create(self.db_wrapper)
+            self._block_store = await BlockStore.create(
+                self.db_wrapper,
+                blob_cache_mb=self.config.get("block_cache_mb", 64),
+                disk_cache_path=self.db_path.parent / "block-cache",
+                disk_cache_mb=self.config.get("block_disk_cache_mb", 0),
+                generator_table_blocks=self.config.get("generator_table_blocks", DEFAULT_GENERATOR_TABLE_BLOCKS),
+            )
             self._hint_store = await HintStore.create(self.db_wrapper)
-            self._coin_store = await CoinStore.create(self.db_wrapper)
+            self._coin_store = await CoinStore.create(
+                self.db_wrapper, unspent_index_mb=self.config.get("unspent_coin_index_mb", 0)
+            )
             self.log.info("Initializing blockchain from disk")
             start_time = time.time()
             reserved_cores = self.config.get("reserved_cores", 0)
             single_threaded = self.config.get("single_threaded", False)
             multiprocessing_start_method = process_config_start_method(config=self.config, log=self.log)
             self.multiprocessing_context = multiprocessing.get_context(method=multiprocessing_start_method)
+            pairing_cache_size = self.config.get("shared_pairing_cache_size", 50000)
+            if pairing_cache_size > 0:
+                try:
+                    self.pairing_cache = SharedPairingCache.create(pairing_cache_size)
+                    cached_bls.set_shared_cache(self.pairing_cache)
+                except OSError as e:
+                    self.log.warning(f"failed to create the shared pairing cache, using per process caches: {e}")
             self._blockchain = await Blockchain.create(
                 coin_store=self.coin_store,
                 block_store=self.block_store,
@@ -273,6 +316,7 @@ class FullNode:
                 reserved_cores=reserved_cores,
                 multiprocessing_context=self.multiprocessing_context,
                 single_threaded=single_threaded,
+                pairing_cache=self.pairing_cache,
             )
 
             self._mempool_manager = MempoolManager(
@@ -280,6 +324,7 @@ class FullNode:
                 consensus_constants=self.constants,
                 multiprocessing_context=self.multiprocessing_context,
                 single_threaded=single_threaded,
+                pairing_cache=self.pairing_cache,
             )
 
             # Transactions go into this queue from the server, and get sent to respond_transaction
@@ -354,6 +399,12 @@ class FullNode:
                 # same for mempool_manager
                 if self._mempool_manager is not None:
                     self.mempool_manager.shut_down()
+                # the worker processes using it are gone now
+                if self.pairing_cache is not None:
+                    if cached_bls.get_shared_cache() is self.pairing_cache:
+                        cached_bls.set_shared_cache(None)
+                    self.pairing_cache.close()
+                    self.pairing_cache = None
 
                 if self.full_node_peers is not None:
                     asyncio.create_task(self.full_node_peers.close())
@@ -363,6 +414,8 @@ class FullNode:
                     self._transaction_queue_task.cancel()
                 cancel_task_safe(task=self.wallet_sync_task, log=self.log)
                 cancel_task_safe(task=self._sync_task, log=self.log)
+                for task in list(self._mempool_sync_tasks):
+                    cancel_task_safe(task, self.log)
 
                 for task_id, task in list(self.full_node_store.tx_fetch_tasks.items()):
                     cancel_task_safe(task, self.log)
@@ -371,6 +424,10 @@ class FullNode:
                 if self._sync_task is not None:
                     with contextlib.suppress(asyncio.CancelledError):
                         await self._sync_task
+                if self.weight_proof_handler is not None:
+                    await self.weight_proof_handler.shut_down()
+                if self._block_store is not None:
+                    await self._block_store.close()
 
     @property
     def block_store(self) -> BlockStore:
@@ -454,6 +511,9 @@ class FullNode:
                 "creation_time": con.creation_time,
                 "bytes_read": con.bytes_read,
                 "bytes_written": con.bytes_written,
+                "compression": con.compression_stats.to_json_dict(),
+                "stats": con.stats.to_json_dict(),
+                "outbound_queue": con.outgoing_queue.qsize(),
                 "last_message_time": con.last_message_time,
                 "peak_height": peak_height,
                 "peak_weight": peak_weight,
@@ -466,10 +526,16 @@ class FullNode:
     def _set_state_changed_callback(self, callback: StateChangedProtocol) -> None:
         self.state_changed_callback = callback
 
-    async def _handle_one_transaction(self, entry: TransactionQueueEntry) -> None:
+    async def _handle_one_transaction(
+        self, entry: TransactionQueueEntry, pre_validated: Optional[Union[NPCResult, Err]] = None
+    ) -> None:
         peer = entry.peer
         try:
-            inc_status, err = await self.add_transaction(entry.transaction, entry.spend_name, peer, entry.test)
+            inc_status, err = await self.add_transaction(
+                entry.transaction, entry.spend_name, peer, entry.test, pre_validated=pre_validated
+            )
+            if peer is not None and err not in TRANSACTION_NOT_VALIDATED_ERRORS:
+                self.transaction_queue.record_result(peer.peer_node_id, inc_status != MempoolInclusionStatus.FAILED)
             self.transaction_responses.append((entry.spend_name, inc_status, err))
             if len(self.transaction_responses) > 50:
                 self.transaction_responses = self.transaction_responses[1:]
@@ -489,14 +555,67 @@ class FullNode:
             # We use a semaphore to make sure we don't send more than 200 concurrent calls of respond_transaction.
             # However, doing them one at a time would be slow, because they get sent to other processes.
             await self.add_transaction_semaphore.acquire()
-            item: TransactionQueueEntry = await self.transaction_queue.pop()
-            asyncio.create_task(self._handle_one_transaction(item))
+            # Transactions arriving in a burst are pre-validated together, in a single call to the process pool.
+            # Every one of them still holds its own semaphore slot until it's been added to the mempool
+            entries = await self.transaction_queue.pop_many(self.config.get("transaction_batch_size", 50))
+            for _ in entries[1:]:
+                await self.add_transaction_semaphore.acquire()
+            if len(entries) == 1:
+                asyncio.create_task(self._handle_one_transaction(entries[0]))
+            else:
+                asyncio.create_task(self._handle_transaction_batch(entries))
+
+    async def _handle_transaction_batch(self, entries: List[TransactionQueueEntry]) -> None:
+        pre_validated: Dict[bytes32, Union[NPCResult, Err]] = {}
+        try:
+            pre_validated = await self._pre_validate_transactions(entries)
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            # add_transaction() validates whatever we couldn't, one at a time
+            error_stack = traceback.format_exc()
+            self.log.error(f"Error in _pre_validate_transactions: {error_stack}")
+        await asyncio.gather(
+            *(self._handle_one_transaction(entry, pre_validated.get(entry.spend_name)) for entry in entries)
+        )
+
+    async def _pre_validate_transactions(
+        self, entries: List[TransactionQueueEntry]
+    ) -> Dict[bytes32, Union[NPCResult, Err]]:
+        """
+        Runs the CLVM and checks the signatures of the transactions add_transaction() would have to validate,
+        in a single call to the process pool.
+        """
+        if self.sync_store.get_sync_mode() or self.mempool_manager.peak is None:
+            return {}
+        synced = await self.synced()
+        to_validate: Dict[bytes32, TransactionQueueEntry] = {}
+        for entry in entries:
+            if not entry.test and not synced:
+                continue
+            if self.mempool_manager.get_spendbundle(entry.spend_name) is not None:
+                continue
+            if self.mempool_manager.seen(entry.spend_name):
+                continue
+            to_validate.setdefault(entry.spend_name, entry)
+        if len(to_validate) == 0:
+            return {}
+        results = await self.mempool_manager.pre_validate_spendbundles(
+            [(entry.transaction, None) for entry in to_validate.values()]
+        )
+        return dict(zip(to_validate.keys(), results))
 
     async def initialize_weight_proof(self) -> None:
+        segment_processes = self.config.get("weight_proof_segment_processes", 0)
+        if self.config.get("single_threaded", False):
+            segment_processes = 0
         self.weight_proof_handler = WeightProofHandler(
             constants=self.constants,
             blockchain=self.blockchain,
             multiprocessing_context=self.multiprocessing_context,
+            # the worker processes read the v2 schema directly
+            db_path=self.db_path if self.db_wrapper.db_version == 2 else None,
+            segment_processes=segment_processes,
         )
         peak = self.blockchain.get_peak()
         if peak is not None:
@@ -844,6 +963,27 @@ class FullNode:
         else:
             return True
 
+    async def _sync_mempool_by_short_ids(self, connection: WSHDDcoinConnection) -> None:
+        """
+        Asks the peer for the short ids of the transactions in its mempool, and then for the ones we don't have.
+        """
+        # a fresh salt for every sync, so nobody can pick transactions whose short ids collide with others
+        salt = uint64(secrets.randbits(64))
+        request = full_node_protocol.RequestMempoolInventory(uint32(MEMPOOL_INVENTORY_SIZE), salt)
+        response = await connection.call_api(FullNodeAPI.request_mempool_inventory, request)
+        if not isinstance(response, full_node_protocol.RespondMempoolInventory):
+            return
+        missing = self.mempool_manager.get_missing_short_ids(response.short_ids[:MEMPOOL_INVENTORY_SIZE], salt)
+        self.log.debug(
+            f"Peer {connection.peer_info.host} has {len(missing)} of {len(response.short_ids)} mempool items missing"
+        )
+        if len(missing) > 0:
+            missing_request = full_node_protocol.RequestMempoolTransactionsByShortId(
+                missing[:MEMPOOL_SYNC_MAX_TRANSACTIONS], salt
+            )
+            msg = make_msg(ProtocolMessageTypes.request_mempool_transactions_by_short_id, missing_request)
+            await connection.send_message(msg)
+
     async def on_connect(self, connection: WSHDDcoinConnection) -> None:
         """
         Whenever we connect to another node / wallet, send them our current heads. Also send heads to farmers
@@ -863,11 +1003,18 @@ class FullNode:
             synced = await self.synced()
             peak_height = self.blockchain.get_peak_height()
             if synced and peak_height is not None:
-                my_filter = self.mempool_manager.get_filter()
-                mempool_request = full_node_protocol.RequestMempoolTransactions(my_filter)
+                if negotiated(
+                    Capability.MEMPOOL_SHORT_IDS, connection.local_capabilities, connection.peer_capabilities
+                ):
+                    task = asyncio.create_task(self._sync_mempool_by_short_ids(connection))
+                    self._mempool_sync_tasks.add(task)
+                    task.add_done_callback(self._mempool_sync_tasks.discard)
+                else:
+                    my_filter = self.mempool_manager.get_filter()
+                    mempool_request = full_node_protocol.RequestMempoolTransactions(my_filter)
 
-                msg = make_msg(ProtocolMessageTypes.request_mempool_transactions, mempool_request)
-                await connection.send_message(msg)
+                    msg = make_msg(ProtocolMessageTypes.request_mempool_transactions, mempool_request)
+                    await connection.send_message(msg)
 
         peak_full: Optional[FullBlock] = await self.blockchain.get_full_peak()
 
@@ -1050,17 +1197,28 @@ class FullNode:
         summaries: List[SubEpochSummary],
     ) -> None:
         buffer_size = 4
+        pre_validated_buffer_size = 2
         self.log.info(f"Start syncing from fork point at {fork_point_height} up to {target_peak_sb_height}")
         peers_with_peak: List[WSHDDcoinConnection] = self.get_peers_with_peak(peak_hash)
         fork_point_height = await check_fork_next_block(
             self.blockchain, fork_point_height, peers_with_peak, node_next_block_check
         )
         batch_size = self.constants.MAX_BLOCK_COUNT_PER_REQUESTS
+        stats = SyncPipelineStats(fork_point_height, target_peak_sb_height)
+        self.sync_pipeline_stats = stats
+        # blocks that have been pre-validated, but not added to the blockchain yet
+        uncommitted = UncommittedChain()
 
         # normally "fork_point" or "fork_height" refers to the first common
         # block between the main chain and the fork. Here "fork_point_height"
         # seems to refer to the first diverging block
 
+        # The sync is a pipeline of three stages, connected by bounded queues:
+        # fetching blocks from peers, pre-validating them (CLVM and signatures
+        # in the process pool) and adding them to the blockchain (a single
+        # writer). Each stage works on a different batch, so throughput is
+        # bound by the slowest stage, rather than the sum of all three.
+
         async def fetch_block_batches(
             batch_queue: asyncio.Queue[Optional[Tuple[WSHDDcoinConnection, List[FullBlock]]]]
         ) -> None:
@@ -1074,6 +1232,7 @@ class FullNode:
                     end_height = min(target_peak_sb_height, start_height + batch_size - 1)
                     request = RequestBlocks(uint32(start_height), uint32(end_height), True)
                     fetched = False
+                    fetch_start = time.monotonic()
                     for peer in random.sample(new_peers_with_peak, len(new_peers_with_peak)):
                         if peer.closed:
                             continue
@@ -1081,7 +1240,10 @@ class FullNode:
                         if response is None:
                             await peer.close()
                         elif isinstance(response, RespondBlocks):
+                            stats.fetch.record(len(response.blocks), time.monotonic() - fetch_start)
+                            put_start = time.monotonic()
                             await batch_queue.put((peer, response.blocks))
+                            stats.fetch.output_wait_time += time.monotonic() - put_start
                             fetched = True
                             break
                     if fetched is False:
@@ -1096,19 +1258,68 @@ class FullNode:
                 # finished signal with None
                 await batch_queue.put(None)
 
-        async def validate_block_batches(
-            inner_batch_queue: asyncio.Queue[Optional[Tuple[WSHDDcoinConnection, List[FullBlock]]]]
+        async def pre_validate_block_batches(
+            inner_batch_queue: asyncio.Queue[Optional[Tuple[WSHDDcoinConnection, List[FullBlock]]]],
+            pre_validated_queue: asyncio.Queue[Optional[PreValidatedBatch]],
         ) -> None:
-            fork_info: Optional[ForkInfo] = None
-
             while True:
+                stats.pre_validate.queue_depth = inner_batch_queue.qsize()
+                wait_start = time.monotonic()
                 res: Optional[Tuple[WSHDDcoinConnection, List[FullBlock]]] = await inner_batch_queue.get()
                 if res is None:
                     self.log.debug("done fetching blocks")
+                    await pre_validated_queue.put(None)
                     return None
                 peer, blocks = res
+                blocks_to_validate = await self.skip_blocks_we_already_have(blocks, None)
+                # we can only run ahead of the writer when this batch extends
+                # the blocks it hasn't added yet. Otherwise (e.g. when syncing
+                # a fork) wait for it to catch up
+                if len(blocks_to_validate) > 0 and not uncommitted.can_extend(blocks_to_validate[0]):
+                    await uncommitted.wait_empty()
+                stats.pre_validate.input_wait_time += time.monotonic() - wait_start
+
+                pre_validate_start = time.monotonic()
+                pre_validation_results: List[PreValidationResult] = []
+                error: Optional[Err] = None
+                if len(blocks_to_validate) > 0:
+                    pre_validation_results = await pre_validate_on_uncommitted_chain(
+                        self.blockchain, uncommitted, blocks_to_validate, summaries
+                    )
+                    error = self.check_pre_validation_results(pre_validation_results, peer.get_peer_logging())
+                pre_validate_time = time.monotonic() - pre_validate_start
+                stats.pre_validate.record(len(blocks_to_validate), pre_validate_time)
+                self.log.log(
+                    logging.WARNING if pre_validate_time > 10 else logging.DEBUG,
+                    f"Block pre-validation time: {pre_validate_time:0.2f} seconds "
+                    f"({len(blocks_to_validate)} blocks, start height: {blocks[0].height})",
+                )
+
+                put_start = time.monotonic()
+                await pre_validated_queue.put(
+                    PreValidatedBatch(peer, blocks, blocks_to_validate, pre_validation_results, error)
+                )
+                stats.pre_validate.output_wait_time += time.monotonic() - put_start
+                if error is not None:
+                    # the writer will fail the sync once it gets to this batch
+                    await pre_validated_queue.put(None)
+                    return None
+
+        async def add_block_batches(pre_validated_queue: asyncio.Queue[Optional[PreValidatedBatch]]) -> None:
+            fork_info: Optional[ForkInfo] = None
+
+            while True:
+                stats.commit.queue_depth = pre_validated_queue.qsize()
+                wait_start = time.monotonic()
+                batch: Optional[PreValidatedBatch] = await pre_validated_queue.get()
+                stats.commit.input_wait_time += time.monotonic() - wait_start
+                if batch is None:
+                    self.log.debug("done validating blocks")
+                    return None
+                peer, blocks = batch.peer, batch.blocks
                 start_height = blocks[0].height
                 end_height = blocks[-1].height
+                commit_start = time.monotonic()
 
                 # in case we're validating a reorg fork (i.e. not extending the
                 # main chain), we need to record the coin set from that fork in
@@ -1132,12 +1343,12 @@ class FullNode:
                             assert fork_hash is not None
                             fork_info = ForkInfo(fork_point_height - 1, fork_point_height - 1, fork_hash)
 
-                success, state_change_summary, err = await self.add_block_batch(
-                    blocks,
-                    peer.get_peer_logging(),
-                    fork_info,
-                    summaries,
-                )
+                try:
+                    success, state_change_summary, err = await self.add_pre_validated_block_batch(
+                        batch, fork_info, summaries
+                    )
+                finally:
+                    uncommitted.remove(batch.blocks_to_validate)
                 if success is False:
                     await peer.close(600)
                     # check CHIP-0013 exception
@@ -1162,18 +1373,29 @@ class FullNode:
                 # clean_block_record() will not necessarily honor this cut-off
                 # height, in that case.
                 self.blockchain.clean_block_record(end_height - self.constants.BLOCKS_CACHE_SIZE)
+                stats.commit.record(len(blocks), time.monotonic() - commit_start)
 
         batch_queue_input: asyncio.Queue[Optional[Tuple[WSHDDcoinConnection, List[FullBlock]]]] = asyncio.Queue(
             maxsize=buffer_size
         )
+        pre_validated_queue: asyncio.Queue[Optional[PreValidatedBatch]] = asyncio.Queue(
+            maxsize=pre_validated_buffer_size
+        )
         fetch_task = asyncio.Task(fetch_block_batches(batch_queue_input))
-        validate_task = asyncio.Task(validate_block_batches(batch_queue_input))
+        pre_validate_task = asyncio.Task(pre_validate_block_batches(batch_queue_input, pre_validated_queue))
+        add_task = asyncio.Task(add_block_batches(pre_validated_queue))
         try:
             with log_exceptions(log=self.log, message="sync from fork point failed"):
-                await asyncio.gather(fetch_task, validate_task)
+                await asyncio.gather(fetch_task, pre_validate_task, add_task)
         except Exception:
-            assert validate_task.done()
-            fetch_task.cancel()  # no need to cancel validate_task, if we end up here validate_task is already done
+            for task in (fetch_task, pre_validate_task, add_task):
+                task.cancel()
+        finally:
+            stats.end_time = time.monotonic()
+            self.log.info(
+                f"Sync pipeline finished in {stats.end_time - stats.start_time:0.2f} seconds, "
+                f"bottleneck: {stats.bottleneck()}"
+            )
 
     def get_peers_with_peak(self, peak_hash: bytes32) -> List[WSHDDcoinConnection]:
         peer_ids: Set[bytes32] = self.sync_store.get_peers_that_have_peak([peak_hash])
@@ -1239,16 +1461,48 @@ class FullNode:
         # Precondition: All blocks must be contiguous blocks, index i+1 must be the parent of index i
         # Returns a bool for success, as well as a StateChangeSummary if the peak was advanced
 
+        blocks_to_validate = await self.skip_blocks_we_already_have(all_blocks, fork_info)
+
+        if len(blocks_to_validate) == 0:
+            return True, None, None
+
+        # Validates signatures in multiprocessing since they take a while, and we don't have cached transactions
+        # for these blocks (unlike during normal operation where we validate one at a time)
+        pre_validate_start = time.monotonic()
+        pre_validation_results: List[PreValidationResult] = await self.blockchain.pre_validate_blocks_multiprocessing(
+            blocks_to_validate, {}, wp_summaries=wp_summaries, validate_signatures=True
+        )
+        pre_validate_end = time.monotonic()
+        pre_validate_time = pre_validate_end - pre_validate_start
+
+        self.log.log(
+            logging.WARNING if pre_validate_time > 10 else logging.DEBUG,
+            f"Block pre-validation time: {pre_validate_end - pre_validate_start:0.2f} seconds "
+            f"({len(blocks_to_validate)} blocks, start height: {blocks_to_validate[0].height})",
+        )
+        error = self.check_pre_validation_results(pre_validation_results, peer_info)
+        if error is not None:
+            return False, None, error
+
+        return await self.add_pre_validated_blocks(blocks_to_validate, pre_validation_results, peer_info, fork_info)
+
+    async def skip_blocks_we_already_have(
+        self, all_blocks: List[FullBlock], fork_info: Optional[ForkInfo]
+    ) -> List[FullBlock]:
+        """
+        Returns the blocks of the (contiguous) batch that still need to be
+        validated. The blocks before it are already in the database. Those are
+        still included in fork_info (if there is one), as they may not be part
+        of the main chain.
+        """
         block_dict: Dict[bytes32, FullBlock] = {}
         for block in all_blocks:
             block_dict[block.header_hash] = block
 
-        blocks_to_validate: List[FullBlock] = []
         for i, block in enumerate(all_blocks):
             header_hash = block.header_hash
             if not await self.blockchain.contains_block_from_db(header_hash):
-                blocks_to_validate = all_blocks[i:]
-                break
+                return all_blocks[i:]
 
             if fork_info is None:
                 continue
@@ -1272,29 +1526,49 @@ class FullNode:
                 # removals in fork_info.
                 await self.blockchain.advance_fork_info(block, fork_info, block_dict)
                 await self.blockchain.run_single_block(block, fork_info, block_dict)
+        return []
+
+    def check_pre_validation_results(
+        self, pre_validation_results: List[PreValidationResult], peer_info: PeerInfo
+    ) -> Optional[Err]:
+        for result in pre_validation_results:
+            if result.error is not None:
+                self.log.error(f"Invalid block from peer: {peer_info} {Err(result.error)}")
+                return Err(result.error)
+        return None
 
-        if len(blocks_to_validate) == 0:
+    async def add_pre_validated_block_batch(
+        self,
+        batch: PreValidatedBatch,
+        fork_info: Optional[ForkInfo],
+        wp_summaries: Optional[List[SubEpochSummary]],
+    ) -> Tuple[bool, Optional[StateChangeSummary], Optional[Err]]:
+        # Adds a batch that went through the pre-validation stage of the sync
+        # pipeline. Same return value as add_block_batch()
+        peer_info = batch.peer.get_peer_logging()
+        if batch.error is not None:
+            return False, None, batch.error
+
+        blocks_to_add = await self.skip_blocks_we_already_have(batch.blocks, fork_info)
+        if len(blocks_to_add) == 0:
             return True, None, None
 
-        # Validates signatures in multiprocessing since they take a while, and we don't have cached transactions
-        # for these blocks (unlike during normal operation where we validate one at a time)
-        pre_validate_start = time.monotonic()
-        pre_validation_results: List[PreValidationResult] = await self.blockchain.pre_validate_blocks_multiprocessing(
-            blocks_to_validate, {}, wp_summaries=wp_summaries, validate_signatures=True
-        )
-        pre_validate_end = time.monotonic()
-        pre_validate_time = pre_validate_end - pre_validate_start
-
-        self.log.log(
-            logging.WARNING if pre_validate_time > 10 else logging.DEBUG,
-            f"Block pre-validation time: {pre_validate_end - pre_validate_start:0.2f} seconds "
-            f"({len(blocks_to_validate)} blocks, start height: {blocks_to_validate[0].height})",
-        )
-        for i, block in enumerate(blocks_to_validate):
-            if pre_validation_results[i].error is not None:
-                self.log.error(f"Invalid block from peer: {peer_info} {Err(pre_validation_results[i].error)}")
-                return False, None, Err(pre_validation_results[i].error)
+        # blocks may have been added since pre-validation, but never removed,
+        # so blocks_to_add is a suffix of the pre-validated blocks
+        if len(blocks_to_add) > len(batch.blocks_to_validate):
+            self.log.warning("pre-validated batch is out of date, pre-validating it again")
+            return await self.add_block_batch(batch.blocks, peer_info, fork_info, wp_summaries)
+        pre_validation_results = batch.pre_validation_results[len(batch.blocks_to_validate) - len(blocks_to_add) :]
+        return await self.add_pre_validated_blocks(blocks_to_add, pre_validation_results, peer_info, fork_info)
 
+    async def add_pre_validated_blocks(
+        self,
+        blocks_to_validate: List[FullBlock],
+        pre_validation_results: List[PreValidationResult],
+        peer_info: PeerInfo,
+        fork_info: Optional[ForkInfo],
+    ) -> Tuple[bool, Optional[StateChangeSummary], Optional[Err]]:
+        add_start = time.monotonic()
         agg_state_change_summary: Optional[StateChangeSummary] = None
 
         for i, block in enumerate(blocks_to_validate):
@@ -1336,8 +1610,7 @@ class FullNode:
         if agg_state_change_summary is not None:
             self._state_changed("new_peak")
             self.log.debug(
-                f"Total time for {len(blocks_to_validate)} blocks: {time.time() - pre_validate_start}, "
-                f"advanced: True"
+                f"Total time for {len(blocks_to_validate)} blocks: {time.monotonic() - add_start}, advanced: True"
             )
         return True, agg_state_change_summary, None
 
@@ -1365,7 +1638,7 @@ class FullNode:
                 await self.peak_post_processing_2(peak_fb, None, state_change_summary, ppp_result)
 
         if peak is not None and self.weight_proof_handler is not None:
-            await self.weight_proof_handler.get_proof_of_weight(peak.header_hash)
+            await self.weight_proof_handler.get_proof_of_weight_bytes(peak.header_hash)
             self._state_changed("block")
 
     def has_valid_pool_sig(self, block: Union[UnfinishedBlock, FullBlock]) -> bool:
@@ -1542,8 +1815,11 @@ class FullNode:
 
         # Update the mempool (returns successful pending transactions added to the mempool)
         spent_coins: List[bytes32] = [coin_id for coin_id, _ in state_change_summary.removals]
+        rolled_back_coins: Optional[List[bytes32]] = None
+        if await self._state_change_covers_mempool(state_change_summary):
+            rolled_back_coins = [cr.name for cr in state_change_summary.rolled_back_records]
         mempool_new_peak_result: List[Tuple[SpendBundle, NPCResult, bytes32]] = await self.mempool_manager.new_peak(
-            self.blockchain.get_peak(), spent_coins
+            self.blockchain.get_peak(), spent_coins, rolled_back_coins
         )
 
         # Check if we detected a spent transaction, to load up our generator cache
@@ -1555,6 +1831,26 @@ class FullNode:
 
         return PeakPostProcessingResult(mempool_new_peak_result, fns_peak_result, hints_to_add, lookup_coin_ids)
 
+    async def _state_change_covers_mempool(self, state_change_summary: StateChangeSummary) -> bool:
+        """
+        Returns whether the coins changed by this state change are all the
+        coins that changed between the mempool's peak and the new peak. That's
+        the case if the mempool's peak forks off the new chain at or above the
+        fork point of the state change.
+        """
+        new_peak = state_change_summary.peak
+        if not new_peak.is_transaction_block:
+            # the mempool only needs to know whether the coin set changed
+            return True
+        mempool_peak = self.mempool_manager.peak
+        if mempool_peak is None or mempool_peak.height < state_change_summary.fork_height:
+            return False
+        if not self.blockchain.contains_block(mempool_peak.header_hash):
+            return False
+        mempool_peak_record = self.blockchain.block_record(mempool_peak.header_hash)
+        fork_height = await find_fork_point_in_chain(self.blockchain, mempool_peak_record, new_peak)
+        return fork_height >= state_change_summary.fork_height
+
     async def peak_post_processing_2(
         self,
         block: FullBlock,
@@ -2259,6 +2555,7 @@ class FullNode:
         peer: Optional[WSHDDcoinConnection] = None,
         test: bool = False,
         tx_bytes: Optional[bytes] = None,
+        pre_validated: Optional[Union[NPCResult, Err]] = None,
     ) -> Tuple[MempoolInclusionStatus, Optional[Err]]:
         if self.sync_store.get_sync_mode():
             return MempoolInclusionStatus.FAILED, Err.NO_TRANSACTIONS_WHILE_SYNCING
@@ -2279,14 +2576,20 @@ class FullNode:
             error: Optional[Err] = Err.NO_TRANSACTIONS_WHILE_SYNCING
             self.mempool_manager.remove_seen(spend_name)
         else:
-            try:
-                cost_result = await self.mempool_manager.pre_validate_spendbundle(transaction, tx_bytes, spend_name)
-            except ValidationError as e:
+            if isinstance(pre_validated, Err):
                 self.mempool_manager.remove_seen(spend_name)
-                return MempoolInclusionStatus.FAILED, e.code
-            except Exception:
-                self.mempool_manager.remove_seen(spend_name)
-                raise
+                return MempoolInclusionStatus.FAILED, pre_validated
+            elif pre_validated is not None:
+                cost_result = pre_validated
+            else:
+                try:
+                    cost_result = await self.mempool_manager.pre_validate_spendbundle(transaction, tx_bytes, spend_name)
+                except ValidationError as e:
+                    self.mempool_manager.remove_seen(spend_name)
+                    return MempoolInclusionStatus.FAILED, e.code
+                except Exception:
+                    self.mempool_manager.remove_seen(spend_name)
+                    raise
             async with self.blockchain.priority_mutex.acquire(priority=BlockchainMutexPriority.low):
                 if self.mempool_manager.get_spendbundle(spend_name) is not None:
                     self.mempool_manager.remove_seen(spend_name)
@@ -2511,7 +2814,9 @@ class FullNode:
             if response is not None and isinstance(response, full_node_protocol.RespondCompactVDF):
                 await self.add_compact_vdf(response, peer)
 
-    async def request_compact_vdf(self, request: full_node_protocol.RequestCompactVDF, peer: WSHDDcoinConnection) -> None:
+    async def request_compact_vdf(
+        self, request: full_node_protocol.RequestCompactVDF, peer: WSHDDcoinConnection
+    ) -> None:
         header_block = await self.blockchain.get_header_block_by_height(
             request.height, request.header_hash, tx_filter=False
         )
@@ -8,23 +8,21 @@ import time
 import traceback
 from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timezone
-from typing import TYPE_CHECKING, Dict, List, Optional, Set, Tuple
+from typing import TYPE_CHECKING, Callable, Dict, List, Optional, Set, Tuple, Union
 
 from chia_rs import AugSchemeMPL, G1Element, G2Element
 from chiabip158 import PyBIP158
 
-from hddcoin.consensus.block_creation import create_unfinished_block
+from hddcoin.consensus.block_creation import compute_block_cost, create_unfinished_block
 from hddcoin.consensus.block_record import BlockRecord
 from hddcoin.consensus.blockchain import BlockchainMutexPriority
+from hddcoin.consensus.constants import ConsensusConstants
 from hddcoin.consensus.pot_iterations import calculate_ip_iters, calculate_iterations_quality, calculate_sp_iters
-from hddcoin.full_node.bundle_tools import (
-    best_solution_generator_from_template,
-    simple_solution_generator,
-    simple_solution_generator_backrefs,
-)
+from hddcoin.full_node.bundle_tools import best_solution_generator_from_template
 from hddcoin.full_node.fee_estimate import FeeEstimate, FeeEstimateGroup, fee_rate_v2_to_v1
 from hddcoin.full_node.fee_estimator_interface import FeeEstimatorInterface
 from hddcoin.full_node.mempool_check_conditions import get_name_puzzle_conditions, get_puzzle_and_solution_for_coin
+from hddcoin.full_node.mempool_manager import MEMPOOL_INVENTORY_SIZE, MEMPOOL_SYNC_MAX_TRANSACTIONS
 from hddcoin.full_node.signage_point import SignagePoint
 from hddcoin.full_node.tx_processing_queue import TransactionQueueFull
 from hddcoin.protocols import farmer_protocol, full_node_protocol, introducer_protocol, timelord_protocol, wallet_protocol
@@ -39,6 +37,7 @@ from hddcoin.protocols.wallet_protocol import (
     RespondFeeEstimates,
     RespondSESInfo,
 )
+from hddcoin.server.message_compression import PrecompressedBytes
 from hddcoin.server.outbound_message import Message, make_msg
 from hddcoin.server.server import HDDcoinServer
 from hddcoin.server.ws_connection import WSHDDcoinConnection
@@ -58,7 +57,7 @@ from hddcoin.types.spend_bundle import SpendBundle
 from hddcoin.types.transaction_queue_entry import TransactionQueueEntry
 from hddcoin.types.unfinished_block import UnfinishedBlock
 from hddcoin.util.api_decorators import api_request
-from hddcoin.util.full_block_utils import header_block_from_block
+from hddcoin.util.full_block_utils import block_without_generator, header_block_from_block
 from hddcoin.util.generator_tools import get_block_header, tx_removals_and_additions
 from hddcoin.util.hash import std_hash
 from hddcoin.util.ints import uint8, uint32, uint64, uint128
@@ -70,6 +69,14 @@ if TYPE_CHECKING:
 else:
     FullNode = object
 
+# the serialized size of a CoinState with both heights set: the coin (32 + 32 +
+# 8 bytes) and two optional uint32
+COIN_STATE_MAX_SIZE = 82
+
+# the number of coin states read from the database at a time, when responding
+# to RegisterForPhUpdates
+SUBSCRIBE_RESPONSE_CHUNK_SIZE = 10000
+
 
 class FullNodeAPI:
     log: logging.Logger
@@ -274,11 +281,11 @@ class FullNodeAPI:
         if request.tip in self.full_node.pow_creation:
             event = self.full_node.pow_creation[request.tip]
             await event.wait()
-            wp = await self.full_node.weight_proof_handler.get_proof_of_weight(request.tip)
+            wp_bytes = await self.full_node.weight_proof_handler.get_proof_of_weight_bytes(request.tip)
         else:
             event = asyncio.Event()
             self.full_node.pow_creation[request.tip] = event
-            wp = await self.full_node.weight_proof_handler.get_proof_of_weight(request.tip)
+            wp_bytes = await self.full_node.weight_proof_handler.get_proof_of_weight_bytes(request.tip)
             event.set()
         tips = list(self.full_node.pow_creation.keys())
 
@@ -287,7 +294,7 @@ class FullNodeAPI:
             for i in range(0, 4):
                 self.full_node.pow_creation.pop(tips[i])
 
-        if wp is None:
+        if wp_bytes is None:
             self.log.error(f"failed creating weight proof for peak {request.tip}")
             return None
 
@@ -297,9 +304,8 @@ class FullNodeAPI:
             and self.full_node.full_node_store.serialized_wp_message_tip == request.tip
         ):
             return self.full_node.full_node_store.serialized_wp_message
-        message = make_msg(
-            ProtocolMessageTypes.respond_proof_of_weight, full_node_protocol.RespondProofOfWeight(wp, request.tip)
-        )
+        # this is the serialization of RespondProofOfWeight(wp, request.tip)
+        message = make_msg(ProtocolMessageTypes.respond_proof_of_weight, wp_bytes + request.tip)
         self.full_node.full_node_store.serialized_wp_message_tip = request.tip
         self.full_node.full_node_store.serialized_wp_message = message
         return message
@@ -344,47 +350,56 @@ class FullNodeAPI:
                 msg = make_msg(ProtocolMessageTypes.reject_blocks, reject)
                 return msg
 
-        if not request.include_transaction_block:
-            blocks: List[FullBlock] = []
-            for i in range(request.start_height, request.end_height + 1):
-                header_hash_i: Optional[bytes32] = self.full_node.blockchain.height_to_hash(uint32(i))
-                if header_hash_i is None:
-                    reject = RejectBlocks(request.start_height, request.end_height)
-                    return make_msg(ProtocolMessageTypes.reject_blocks, reject)
-
-                block: Optional[FullBlock] = await self.full_node.block_store.get_full_block(header_hash_i)
-                if block is None:
-                    reject = RejectBlocks(request.start_height, request.end_height)
-                    return make_msg(ProtocolMessageTypes.reject_blocks, reject)
-                block = dataclasses.replace(block, transactions_generator=None)
-                blocks.append(block)
-            msg = make_msg(
-                ProtocolMessageTypes.respond_blocks,
-                full_node_protocol.RespondBlocks(request.start_height, request.end_height, blocks),
-            )
+        blocks_bytes: List[bytes] = []
+        # the blocks as they're stored, zstd compressed, for peers we send
+        # compressed messages to. None for the blocks that were cached
+        compressed_blocks: List[Optional[bytes]] = []
+        if self.full_node.block_store.db_wrapper.db_version == 2:
+            try:
+                blobs = await self.full_node.block_store.get_block_blobs_in_range(
+                    request.start_height, request.end_height
+                )
+            except ValueError:
+                reject = RejectBlocks(request.start_height, request.end_height)
+                return make_msg(ProtocolMessageTypes.reject_blocks, reject)
+            blocks_bytes = [blob for blob, _ in blobs]
+            compressed_blocks = [compressed for _, compressed in blobs]
         else:
-            blocks_bytes: List[bytes] = []
             for i in range(request.start_height, request.end_height + 1):
-                header_hash_i = self.full_node.blockchain.height_to_hash(uint32(i))
+                header_hash_i: Optional[bytes32] = self.full_node.blockchain.height_to_hash(uint32(i))
                 if header_hash_i is None:
                     reject = RejectBlocks(request.start_height, request.end_height)
                     return make_msg(ProtocolMessageTypes.reject_blocks, reject)
                 block_bytes: Optional[bytes] = await self.full_node.block_store.get_full_block_bytes(header_hash_i)
                 if block_bytes is None:
                     reject = RejectBlocks(request.start_height, request.end_height)
-                    msg = make_msg(ProtocolMessageTypes.reject_blocks, reject)
-                    return msg
-
+                    return make_msg(ProtocolMessageTypes.reject_blocks, reject)
                 blocks_bytes.append(block_bytes)
 
-            respond_blocks_manually_streamed: bytes = (
-                uint32(request.start_height).stream_to_bytes()
-                + uint32(request.end_height).stream_to_bytes()
-                + uint32(len(blocks_bytes)).stream_to_bytes()
-            )
-            for block_bytes in blocks_bytes:
-                respond_blocks_manually_streamed += block_bytes
-            msg = make_msg(ProtocolMessageTypes.respond_blocks, respond_blocks_manually_streamed)
+        # RespondBlocks is streamed by hand, straight from the serialized
+        # blocks, so the whole message is built with a single join
+        parts: List[Union[bytes, memoryview]] = [
+            uint32(request.start_height).stream_to_bytes()
+            + uint32(request.end_height).stream_to_bytes()
+            + uint32(len(blocks_bytes)).stream_to_bytes()
+        ]
+        # the blocks sent as they're stored, if the message is compressed
+        segments: List[Tuple[int, int, bytes]] = []
+        if request.include_transaction_block:
+            offset = len(parts[0])
+            for blob, compressed in zip(blocks_bytes, compressed_blocks):
+                if compressed is not None:
+                    segments.append((offset, len(blob), compressed))
+                offset += len(blob)
+            parts.extend(blocks_bytes)
+        else:
+            for blob in blocks_bytes:
+                head, tail = block_without_generator(memoryview(blob))
+                parts.extend((head, b"\x00", tail))
+        data = b"".join(parts)
+        if len(segments) > 0:
+            data = PrecompressedBytes(data, segments)
+        msg = make_msg(ProtocolMessageTypes.respond_blocks, data)
 
         return msg
 
@@ -680,6 +695,33 @@ class FullNodeAPI:
             await peer.send_message(msg)
         return None
 
+    @api_request(reply_types=[ProtocolMessageTypes.respond_mempool_inventory])
+    async def request_mempool_inventory(self, request: full_node_protocol.RequestMempoolInventory) -> Optional[Message]:
+        short_ids = self.full_node.mempool_manager.get_inventory(
+            min(request.max_items, MEMPOOL_INVENTORY_SIZE), request.salt
+        )
+        response = full_node_protocol.RespondMempoolInventory(short_ids)
+        return make_msg(ProtocolMessageTypes.respond_mempool_inventory, response)
+
+    @api_request()
+    async def respond_mempool_inventory(self, request: full_node_protocol.RespondMempoolInventory) -> None:
+        self.log.debug("Received unsolicited/late mempool inventory")
+
+    @api_request(peer_required=True)
+    async def request_mempool_transactions_by_short_id(
+        self,
+        request: full_node_protocol.RequestMempoolTransactionsByShortId,
+        peer: WSHDDcoinConnection,
+    ) -> Optional[Message]:
+        items = self.full_node.mempool_manager.get_items_by_short_ids(
+            request.short_ids, request.salt, limit=MEMPOOL_SYNC_MAX_TRANSACTIONS
+        )
+        for item in items:
+            transaction = full_node_protocol.RespondTransaction(item)
+            msg = make_msg(ProtocolMessageTypes.respond_transaction, transaction)
+            await peer.send_message(msg)
+        return None
+
     # FARMER PROTOCOL
     @api_request(peer_required=True)
     async def declare_proof_of_space(
@@ -737,6 +779,7 @@ class FullNodeAPI:
             block_generator: Optional[BlockGenerator] = None
             additions: Optional[List[Coin]] = []
             removals: Optional[List[Coin]] = []
+            compute_cost: Callable[[BlockGenerator, ConsensusConstants, uint32], uint64] = compute_block_cost
             async with self.full_node.blockchain.priority_mutex.acquire(priority=BlockchainMutexPriority.high):
                 peak: Optional[BlockRecord] = self.full_node.blockchain.get_peak()
 
@@ -761,23 +804,26 @@ class FullNodeAPI:
                     while not curr_l_tb.is_transaction_block:
                         curr_l_tb = self.full_node.blockchain.block_record(curr_l_tb.prev_hash)
                     try:
-                        mempool_bundle = self.full_node.mempool_manager.create_bundle_from_mempool(
-                            curr_l_tb.header_hash
-                        )
+                        block_template = self.full_node.mempool_manager.create_block_template(curr_l_tb.header_hash)
                     except Exception as e:
                         self.log.error(f"Traceback: {traceback.format_exc()}")
                         self.full_node.log.error(f"Error making spend bundle {e} peak: {peak}")
-                        mempool_bundle = None
-                    if mempool_bundle is not None:
-                        spend_bundle, additions = mempool_bundle
+                        block_template = None
+                    if block_template is not None:
+                        # the template is kept up to date as transactions
+                        # arrive, and its spend bundle, generator and cost are
+                        # only computed once per template
+                        spend_bundle = block_template.spend_bundle()
+                        additions = list(block_template.additions)
                         removals = spend_bundle.removals()
                         self.full_node.log.info(f"Add rem: {len(additions)} {len(removals)}")
                         aggregate_signature = spend_bundle.aggregated_signature
+                        compute_cost = block_template.compute_cost
                         # when the hard fork activates, block generators are
                         # allowed to be serialized with the improved CLVM
                         # serialization format, supporting back-references
                         if peak.height >= self.full_node.constants.HARD_FORK_HEIGHT:
-                            block_generator = simple_solution_generator_backrefs(spend_bundle)
+                            block_generator = block_template.generator(backrefs=True)
                         else:
                             if self.full_node.full_node_store.previous_generator is not None:
                                 self.log.info(
@@ -788,7 +834,7 @@ class FullNodeAPI:
                                     self.full_node.full_node_store.previous_generator, spend_bundle
                                 )
                             else:
-                                block_generator = simple_solution_generator(spend_bundle)
+                                block_generator = block_template.generator(backrefs=False)
 
             def get_plot_sig(to_sign: bytes32, _extra: G1Element) -> G2Element:
                 if to_sign == request.challenge_chain_sp:
@@ -931,6 +977,7 @@ class FullNodeAPI:
                 removals,
                 prev_b,
                 finished_sub_slots,
+                compute_cost=compute_cost,
             )
             self.log.info("Made the unfinished block")
             if prev_b is not None:
@@ -1498,9 +1545,13 @@ class FullNodeAPI:
         if trusted:
             max_subscriptions = self.full_node.config.get("trusted_max_subscribe_items", 2000000)
             max_items = self.full_node.config.get("trusted_max_subscribe_response_items", 500000)
+            max_bytes = self.full_node.config.get("trusted_max_subscribe_response_bytes", 64 * 1024 * 1024)
         else:
             max_subscriptions = self.full_node.config.get("max_subscribe_items", 200000)
             max_items = self.full_node.config.get("max_subscribe_response_items", 100000)
+            max_bytes = self.full_node.config.get("max_subscribe_response_bytes", 16 * 1024 * 1024)
+        # the byte budget is enforced as a limit on the number of coin states
+        max_items = min(max_items, max_bytes // COIN_STATE_MAX_SIZE)
 
         # the returned puzzle hashes are the ones we ended up subscribing to.
         # It will have filtered duplicates and ones exceeding the subscription
@@ -1516,11 +1567,24 @@ class FullNodeAPI:
         # state that goes into the response. CoinState updates may be sent
         # before we send the response
 
-        # Send all coins with requested puzzle hash that have been created after the specified height
-        states: Set[CoinState] = await self.full_node.coin_store.get_coin_states_by_puzzle_hashes(
-            include_spent_coins=True, puzzle_hashes=puzzle_hashes, min_height=request.min_height, max_items=max_items
+        # Send all coins with requested puzzle hash that have been created after
+        # the specified height. They are read in height order, one chunk at a
+        # time, so if the response is truncated, the peer gets the oldest coins
+        states: Set[CoinState] = set()
+        stream = self.full_node.coin_store.stream_coin_states_by_puzzle_hashes(
+            include_spent_coins=True,
+            puzzle_hashes=puzzle_hashes,
+            min_height=request.min_height,
+            chunk_size=min(max_items, SUBSCRIBE_RESPONSE_CHUNK_SIZE),
         )
-        max_items -= len(states)
+        try:
+            async for chunk in stream:
+                states.update(chunk[:max_items])
+                max_items -= len(chunk)
+                if max_items <= 0:
+                    break
+        finally:
+            await stream.aclose()
 
         hint_coin_ids: Set[bytes32] = set()
         if max_items > 0:
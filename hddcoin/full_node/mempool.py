@@ -4,18 +4,17 @@ import logging
 import sqlite3
 from datetime import datetime
 from enum import Enum
-from typing import Callable, Dict, Iterator, List, Optional, Tuple
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple
 
-from chia_rs import AugSchemeMPL, Coin, G2Element
+from chia_rs import Coin
 
-from hddcoin.consensus.default_constants import DEFAULT_CONSTANTS
+from hddcoin.full_node.block_template import BlockTemplate
 from hddcoin.full_node.fee_estimation import FeeMempoolInfo, MempoolInfo, MempoolItemInfo
 from hddcoin.full_node.fee_estimator_interface import FeeEstimatorInterface
+from hddcoin.full_node.fee_rate_histogram import FeeRateHistogram
+from hddcoin.full_node.mempool_index import MempoolPriorityIndex
 from hddcoin.types.blockchain_format.sized_bytes import bytes32
 from hddcoin.types.clvm_cost import CLVMCost
-from hddcoin.types.coin_spend import CoinSpend
-from hddcoin.types.eligible_coin_spends import EligibleCoinSpends
-from hddcoin.types.internal_mempool_item import InternalMempoolItem
 from hddcoin.types.mempool_item import MempoolItem
 from hddcoin.types.spend_bundle import SpendBundle
 from hddcoin.util.db_wrapper import SQLITE_MAX_VARIABLE_NUMBER
@@ -36,13 +35,19 @@ class MempoolRemoveReason(Enum):
     BLOCK_INCLUSION = 2
     POOL_FULL = 3
     EXPIRED = 4
+    REORG = 5
 
 
 class Mempool:
     _db_conn: sqlite3.Connection
-    # it's expensive to serialize and deserialize G2Element, so we keep those in
-    # this separate dictionary
-    _items: Dict[bytes32, InternalMempoolItem]
+    # the items themselves, ordered by fee rate and indexed by the coins they
+    # spend. The tx table only answers the queries on expiration
+    _index: MempoolPriorityIndex
+    # the cost of the items, by fee rate
+    _histogram: FeeRateHistogram
+    # the transactions of the next block, if they've been picked since the
+    # last time items were removed
+    _block_template: Optional[BlockTemplate]
 
     # the most recent block height and timestamp that we know of
     _block_height: uint32
@@ -53,11 +58,13 @@ class Mempool:
 
     def __init__(self, mempool_info: MempoolInfo, fee_estimator: FeeEstimatorInterface):
         self._db_conn = sqlite3.connect(":memory:")
-        self._items = {}
+        self._index = MempoolPriorityIndex()
         self._block_height = uint32(0)
         self._timestamp = uint64(0)
         self._total_fee = 0
         self._total_cost = 0
+        self._histogram = FeeRateHistogram(mempool_info.max_block_clvm_cost)
+        self._block_template = None
 
         with self._db_conn:
             # name means SpendBundle hash
@@ -80,49 +87,17 @@ class Mempool:
                 """
             )
             self._db_conn.execute("CREATE INDEX name_idx ON tx(name)")
-            self._db_conn.execute("CREATE INDEX feerate ON tx(fee_per_cost)")
             self._db_conn.execute(
                 "CREATE INDEX assert_before ON tx(assert_before_height, assert_before_seconds) "
                 "WHERE assert_before_height IS NOT NULL OR assert_before_seconds IS NOT NULL"
             )
 
-            # This table maps coin IDs to spend bundles hashes
-            self._db_conn.execute(
-                """CREATE TABLE spends(
-                coin_id BLOB NOT NULL,
-                tx BLOB NOT NULL,
-                UNIQUE(coin_id, tx))
-                """
-            )
-            self._db_conn.execute("CREATE INDEX spend_by_coin ON spends(coin_id)")
-            self._db_conn.execute("CREATE INDEX spend_by_bundle ON spends(tx)")
-
         self.mempool_info: MempoolInfo = mempool_info
         self.fee_estimator: FeeEstimatorInterface = fee_estimator
 
     def __del__(self) -> None:
         self._db_conn.close()
 
-    def _row_to_item(self, row: sqlite3.Row) -> MempoolItem:
-        name = bytes32(row[0])
-        fee = int(row[2])
-        assert_height = row[3]
-        assert_before_height = row[4]
-        assert_before_seconds = row[5]
-        item = self._items[name]
-
-        return MempoolItem(
-            item.spend_bundle,
-            uint64(fee),
-            item.npc_result,
-            name,
-            uint32(item.height_added_to_mempool),
-            assert_height,
-            assert_before_height,
-            assert_before_seconds,
-            bundle_coin_spends=item.bundle_coin_spends,
-        )
-
     def total_mempool_fees(self) -> int:
         return self._total_fee
 
@@ -130,56 +105,28 @@ class Mempool:
         return CLVMCost(uint64(self._total_cost))
 
     def all_items(self) -> Iterator[MempoolItem]:
-        with self._db_conn:
-            cursor = self._db_conn.execute("SELECT * FROM tx")
-            for row in cursor:
-                yield self._row_to_item(row)
+        return self._index.items()
 
     def all_item_ids(self) -> List[bytes32]:
-        with self._db_conn:
-            cursor = self._db_conn.execute("SELECT name FROM tx")
-            return [bytes32(row[0]) for row in cursor]
+        return [item.name for item in self._index.items()]
 
-    # TODO: move "process_mempool_items()" into this class in order to do this a
-    # bit more efficiently
     def items_by_feerate(self) -> Iterator[MempoolItem]:
-        with self._db_conn:
-            cursor = self._db_conn.execute("SELECT * FROM tx ORDER BY fee_per_cost DESC, seq ASC")
-            for row in cursor:
-                yield self._row_to_item(row)
+        return self._index.by_feerate()
 
     def size(self) -> int:
-        with self._db_conn:
-            cursor = self._db_conn.execute("SELECT Count(name) FROM tx")
-            val = cursor.fetchone()
-            return 0 if val is None else int(val[0])
+        return len(self._index)
 
     def get_item_by_id(self, item_id: bytes32) -> Optional[MempoolItem]:
-        with self._db_conn:
-            cursor = self._db_conn.execute("SELECT * FROM tx WHERE name=?", (item_id,))
-            row = cursor.fetchone()
-            return None if row is None else self._row_to_item(row)
+        return self._index.get(item_id)
+
+    def get_items_by_short_id(self, salt: int) -> Dict[int, List[MempoolItem]]:
+        return self._index.by_short_id(salt)
 
-    # TODO: we need a bulk lookup function like this too
     def get_items_by_coin_id(self, spent_coin_id: bytes32) -> List[MempoolItem]:
-        with self._db_conn:
-            cursor = self._db_conn.execute(
-                "SELECT * FROM tx WHERE name in (SELECT tx FROM spends WHERE coin_id=?)",
-                (spent_coin_id,),
-            )
-            return [self._row_to_item(row) for row in cursor]
+        return self._index.items_spending([spent_coin_id])
 
     def get_items_by_coin_ids(self, spent_coin_ids: List[bytes32]) -> List[MempoolItem]:
-        items: List[MempoolItem] = []
-        for batch in to_batches(spent_coin_ids, SQLITE_MAX_VARIABLE_NUMBER):
-            args = ",".join(["?"] * len(batch.entries))
-            with self._db_conn:
-                cursor = self._db_conn.execute(
-                    f"SELECT * FROM tx WHERE name IN (SELECT tx FROM spends WHERE coin_id IN ({args}))",
-                    tuple(batch.entries),
-                )
-                items.extend(self._row_to_item(row) for row in cursor)
-        return items
+        return self._index.items_spending(spent_coin_ids)
 
     def get_min_fee_rate(self, cost: int) -> Optional[float]:
         """
@@ -193,21 +140,23 @@ class Mempool:
         current_cost = self._total_cost
 
         # Iterates through all spends in increasing fee per cost
-        with self._db_conn:
-            cursor = self._db_conn.execute("SELECT cost,fee_per_cost FROM tx ORDER BY fee_per_cost ASC, seq DESC")
-
-            item_cost: int
-            fee_per_cost: float
-            for item_cost, fee_per_cost in cursor:
-                current_cost -= item_cost
-                # Removing one at a time, until our transaction of size cost fits
-                if current_cost + cost <= self.mempool_info.max_size_in_cost:
-                    return fee_per_cost
-
-            log.info(
-                f"Transaction with cost {cost} does not fit in mempool of max cost {self.mempool_info.max_size_in_cost}"
-            )
-            return None
+        for item in self._index.by_feerate_ascending():
+            current_cost -= item.cost
+            # Removing one at a time, until our transaction of size cost fits
+            if current_cost + cost <= self.mempool_info.max_size_in_cost:
+                return item.fee_per_cost
+
+        log.info(
+            f"Transaction with cost {cost} does not fit in mempool of max cost {self.mempool_info.max_size_in_cost}"
+        )
+        return None
+
+    def get_fee_histogram(self) -> Dict[str, Any]:
+        """
+        The cost of the items in the mempool by fee per cost, its percentiles
+        and the fee per cost needed to get into the next block.
+        """
+        return self._histogram.get_snapshot()
 
     def new_tx_block(self, block_height: uint32, timestamp: uint64) -> None:
         """
@@ -233,38 +182,28 @@ class Mempool:
         if items == []:
             return
 
-        removed_items: List[MempoolItemInfo] = []
-        if reason != MempoolRemoveReason.BLOCK_INCLUSION:
-            for batch in to_batches(items, SQLITE_MAX_VARIABLE_NUMBER):
-                args = ",".join(["?"] * len(batch.entries))
-                with self._db_conn:
-                    cursor = self._db_conn.execute(
-                        f"SELECT name, cost, fee FROM tx WHERE name in ({args})", batch.entries
-                    )
-                    for row in cursor:
-                        name = bytes32(row[0])
-                        internal_item = self._items[name]
-                        item = MempoolItemInfo(int(row[1]), int(row[2]), internal_item.height_added_to_mempool)
-                        removed_items.append(item)
+        # check every item first, so a missing one doesn't leave the index,
+        # the totals and the DB out of sync
+        for name in items:
+            if self._index.get(name) is None:
+                raise KeyError(name)
 
+        self._block_template = None
+        removed_items: List[MempoolItemInfo] = []
         for name in items:
-            self._items.pop(name)
+            item = self._index.remove(name)
+            assert item is not None
+            self._total_cost -= item.cost
+            self._total_fee -= item.fee
+            self._histogram.remove(item.fee_per_cost, item.cost)
+            removed_items.append(MempoolItemInfo(item.cost, item.fee, item.height_added_to_mempool))
+        assert self._total_cost >= 0
+        assert self._total_fee >= 0
 
         for batch in to_batches(items, SQLITE_MAX_VARIABLE_NUMBER):
             args = ",".join(["?"] * len(batch.entries))
             with self._db_conn:
-                cursor = self._db_conn.execute(
-                    f"SELECT SUM(cost), SUM(fee) FROM tx WHERE name in ({args})", batch.entries
-                )
-                cost_to_remove, fee_to_remove = cursor.fetchone()
-
                 self._db_conn.execute(f"DELETE FROM tx WHERE name in ({args})", batch.entries)
-                self._db_conn.execute(f"DELETE FROM spends WHERE tx in ({args})", batch.entries)
-
-            self._total_cost -= cost_to_remove
-            self._total_fee -= fee_to_remove
-            assert self._total_cost >= 0
-            assert self._total_fee >= 0
 
         if reason != MempoolRemoveReason.BLOCK_INCLUSION:
             info = FeeMempoolInfo(
@@ -325,19 +264,9 @@ class Mempool:
 
             if self._total_cost + item.cost > self.mempool_info.max_size_in_cost:
                 # pick the items with the lowest fee per cost to remove
-                cursor = self._db_conn.execute(
-                    """SELECT name FROM tx
-                    WHERE name NOT IN (
-                        SELECT name FROM (
-                            SELECT name,
-                            SUM(cost) OVER (ORDER BY fee_per_cost DESC, seq ASC) AS total_cost
-                            FROM tx) AS tx_with_cost
-                        WHERE total_cost <= ?)
-                    """,
-                    (self.mempool_info.max_size_in_cost - item.cost,),
+                to_remove = self._index.lowest_feerate_items(
+                    self._total_cost + item.cost - self.mempool_info.max_size_in_cost
                 )
-                to_remove = [bytes32(row[0]) for row in cursor]
-
                 self.remove_from_pool(to_remove, MempoolRemoveReason.POOL_FULL)
 
             # TODO: In the future, for the "fee_per_cost" field, opt for
@@ -357,15 +286,20 @@ class Mempool:
                 ),
             )
 
-            all_coin_spends = [(s.coin_id, item.name) for s in item.npc_result.conds.spends]
-            self._db_conn.executemany("INSERT INTO spends VALUES(?, ?)", all_coin_spends)
-
-            self._items[item.name] = InternalMempoolItem(
-                item.spend_bundle, item.npc_result, item.height_added_to_mempool, item.bundle_coin_spends
-            )
+            self._index.add(item)
 
             self._total_cost += item.cost
             self._total_fee += item.fee
+            self._histogram.add(item.fee_per_cost, item.cost)
+
+            # the new item goes at the end of the block template if it sorts
+            # after all the items that were tried for it, otherwise the
+            # template has to be built again
+            if self._block_template is not None:
+                if not self._block_template.accepts_after(item.fee_per_cost):
+                    self._block_template = None
+                elif not self._block_template.full:
+                    self._block_template.add_item(item)
 
         info = FeeMempoolInfo(self.mempool_info, self.total_mempool_cost(), self.total_mempool_fees(), datetime.now())
         self.fee_estimator.add_mempool_item(info, MempoolItemInfo(item.cost, item.fee, item.height_added_to_mempool))
@@ -381,52 +315,30 @@ class Mempool:
     def create_bundle_from_mempool_items(
         self, item_inclusion_filter: Callable[[bytes32], bool]
     ) -> Optional[Tuple[SpendBundle, List[Coin]]]:
-        cost_sum = 0  # Checks that total cost does not exceed block maximum
-        fee_sum = 0  # Checks that total fees don't exceed 64 bits
-        processed_spend_bundles = 0
-        additions: List[Coin] = []
-        # This contains a map of coin ID to a coin spend solution and its isolated cost
-        # We reconstruct it for every bundle we create from mempool items because we
-        # deduplicate on the first coin spend solution that comes with the highest
-        # fee rate item, and that can change across calls
-        eligible_coin_spends = EligibleCoinSpends()
-        coin_spends: List[CoinSpend] = []
-        sigs: List[G2Element] = []
         log.info(f"Starting to make block, max cost: {self.mempool_info.max_block_clvm_cost}")
-        with self._db_conn:
-            cursor = self._db_conn.execute("SELECT name, fee FROM tx ORDER BY fee_per_cost DESC, seq ASC")
-        for row in cursor:
-            name = bytes32(row[0])
-            fee = int(row[1])
-            item = self._items[name]
-            if not item_inclusion_filter(name):
-                continue
-            try:
-                unique_coin_spends, cost_saving, unique_additions = eligible_coin_spends.get_deduplication_info(
-                    bundle_coin_spends=item.bundle_coin_spends, max_cost=item.npc_result.cost
-                )
-                item_cost = item.npc_result.cost - cost_saving
-                log.info("Cumulative cost: %d, fee per cost: %0.4f", cost_sum, fee / item_cost)
-                if (
-                    item_cost + cost_sum > self.mempool_info.max_block_clvm_cost
-                    or fee + fee_sum > DEFAULT_CONSTANTS.MAX_COIN_AMOUNT
-                ):
-                    break
-                coin_spends.extend(unique_coin_spends)
-                additions.extend(unique_additions)
-                sigs.append(item.spend_bundle.aggregated_signature)
-                cost_sum += item_cost
-                fee_sum += fee
-                processed_spend_bundles += 1
-            except Exception as e:
-                log.debug(f"Exception while checking a mempool item for deduplication: {e}")
-                continue
-        if processed_spend_bundles == 0:
+        template = BlockTemplate(self.mempool_info.max_block_clvm_cost)
+        for item in self._index.by_feerate():
+            if item_inclusion_filter(item.name) and not template.add_item(item):
+                break
+        if template.spend_bundles == 0:
             return None
         log.info(
-            f"Cumulative cost of block (real cost should be less) {cost_sum}. Proportion "
-            f"full: {cost_sum / self.mempool_info.max_block_clvm_cost}"
+            f"Cumulative cost of block (real cost should be less) {template.cost}. Proportion "
+            f"full: {template.cost / self.mempool_info.max_block_clvm_cost}"
         )
-        aggregated_signature = AugSchemeMPL.aggregate(sigs)
-        agg = SpendBundle(coin_spends, aggregated_signature)
-        return agg, additions
+        return template.spend_bundle(), template.additions
+
+    def get_block_template(self) -> BlockTemplate:
+        """
+        The transactions of the next block, with all the items in the mempool
+        to pick from. The template is kept as items are added to the mempool,
+        and only built again when it has to be.
+        """
+        if self._block_template is None:
+            log.info(f"Starting to make block template, max cost: {self.mempool_info.max_block_clvm_cost}")
+            template = BlockTemplate(self.mempool_info.max_block_clvm_cost)
+            for item in self._index.by_feerate():
+                if not template.add_item(item):
+                    break
+            self._block_template = template
+        return self._block_template
@@ -0,0 +1,126 @@
+from __future__ import annotations
+
+import dataclasses
+import hashlib
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+
+from sortedcontainers import SortedDict
+
+from hddcoin.types.blockchain_format.sized_bytes import bytes32
+from hddcoin.types.mempool_item import MempoolItem
+
+
+@dataclasses.dataclass
+class MempoolPriorityIndex:
+    """
+    The in-memory indices of the items in the mempool. Items are kept sorted by
+    fee per cost, highest first, with ties broken by the order they were added
+    in. Next to that, every spent coin id maps to the items spending it.
+    """
+
+    # (-fee per cost, sequence number) -> item
+    _by_feerate: SortedDict[Tuple[float, int], MempoolItem] = dataclasses.field(default_factory=SortedDict)
+    # spend bundle name -> its key in _by_feerate
+    _keys: Dict[bytes32, Tuple[float, int]] = dataclasses.field(default_factory=dict)
+    # coin id -> names of the items spending it. The values are used as
+    # insertion ordered sets
+    _by_coin_id: Dict[bytes32, Dict[bytes32, None]] = dataclasses.field(default_factory=dict)
+    _seq: int = 0
+
+    def __len__(self) -> int:
+        return len(self._keys)
+
+    def __contains__(self, name: bytes32) -> bool:
+        return name in self._keys
+
+    def add(self, item: MempoolItem) -> None:
+        assert item.name not in self._keys
+        self._seq += 1
+        key = (-item.fee_per_cost, self._seq)
+        self._by_feerate[key] = item
+        self._keys[item.name] = key
+        for coin_id in _spent_coin_ids(item):
+            self._by_coin_id.setdefault(coin_id, {})[item.name] = None
+
+    def remove(self, name: bytes32) -> Optional[MempoolItem]:
+        key = self._keys.pop(name, None)
+        if key is None:
+            return None
+        item: MempoolItem = self._by_feerate.pop(key)
+        for coin_id in _spent_coin_ids(item):
+            names = self._by_coin_id[coin_id]
+            names.pop(name, None)
+            if len(names) == 0:
+                del self._by_coin_id[coin_id]
+        return item
+
+    def get(self, name: bytes32) -> Optional[MempoolItem]:
+        key = self._keys.get(name)
+        return None if key is None else self._by_feerate[key]
+
+    def by_short_id(self, salt: int) -> Dict[int, List[MempoolItem]]:
+        """
+        All items, by their short id under the salt. Different items may share
+        a short id, so each one maps to all the items having it.
+        """
+        ret: Dict[int, List[MempoolItem]] = {}
+        for item in self.items():
+            ret.setdefault(short_id(item.name, salt), []).append(item)
+        return ret
+
+    def items(self) -> Iterator[MempoolItem]:
+        """
+        All items, in the order they were added.
+        """
+        for key in self._keys.values():
+            yield self._by_feerate[key]
+
+    def by_feerate(self) -> Iterator[MempoolItem]:
+        """
+        All items, highest fee per cost first.
+        """
+        return iter(self._by_feerate.values())
+
+    def by_feerate_ascending(self) -> Iterator[MempoolItem]:
+        """
+        All items, lowest fee per cost first.
+        """
+        return reversed(self._by_feerate.values())
+
+    def items_spending(self, coin_ids: Iterable[bytes32]) -> List[MempoolItem]:
+        """
+        The items spending any of the coins, each one listed once.
+        """
+        names: Dict[bytes32, None] = {}
+        for coin_id in coin_ids:
+            names.update(self._by_coin_id.get(coin_id, {}))
+        return [self._by_feerate[self._keys[name]] for name in names]
+
+    def lowest_feerate_items(self, cost: int) -> List[bytes32]:
+        """
+        The names of the items with the lowest fee per cost, adding up to at
+        least the specified cost (or all of them).
+        """
+        ret: List[bytes32] = []
+        for item in self.by_feerate_ascending():
+            if cost <= 0:
+                break
+            ret.append(item.name)
+            cost -= item.cost
+        return ret
+
+
+def short_id(name: bytes32, salt: int) -> int:
+    """
+    The short id of a spend bundle, used when syncing mempools with peers. It's
+    an 8 byte hash of the spend bundle name, keyed with a salt the requesting
+    peer picks for every sync. Without the salt, anyone could grind spend
+    bundles whose short ids collide with the ones of other transactions.
+    """
+    key = salt.to_bytes(8, "big")
+    return int.from_bytes(hashlib.blake2b(name, digest_size=8, key=key).digest(), "big")
+
+
+def _spent_coin_ids(item: MempoolItem) -> List[bytes32]:
+    assert item.npc_result.conds is not None
+    return [bytes32(spend.coin_id) for spend in item.npc_result.conds.spends]
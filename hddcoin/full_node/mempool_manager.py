@@ -1,13 +1,14 @@
 from __future__ import annotations
 
 import asyncio
+import itertools
 import logging
 import time
 from concurrent.futures import Executor
 from concurrent.futures.process import ProcessPoolExecutor
 from dataclasses import dataclass
 from multiprocessing.context import BaseContext
-from typing import Awaitable, Callable, Dict, List, Optional, Set, Tuple, TypeVar
+from typing import Awaitable, Callable, Dict, List, Optional, Set, Tuple, TypeVar, Union
 
 from chia_rs import ELIGIBLE_FOR_DEDUP, GTElement
 from chiabip158 import PyBIP158
@@ -16,11 +17,13 @@ from hddcoin.consensus.block_record import BlockRecordProtocol
 from hddcoin.consensus.constants import ConsensusConstants
 from hddcoin.consensus.cost_calculator import NPCResult
 from hddcoin.full_node.bitcoin_fee_estimator import create_bitcoin_fee_estimator
+from hddcoin.full_node.block_template import BlockTemplate
 from hddcoin.full_node.bundle_tools import simple_solution_generator
 from hddcoin.full_node.fee_estimation import FeeBlockInfo, MempoolInfo, MempoolItemInfo
 from hddcoin.full_node.fee_estimator_interface import FeeEstimatorInterface
 from hddcoin.full_node.mempool import MEMPOOL_ITEM_FEE_LIMIT, Mempool, MempoolRemoveReason
 from hddcoin.full_node.mempool_check_conditions import get_name_puzzle_conditions, mempool_check_time_locks
+from hddcoin.full_node.mempool_index import short_id
 from hddcoin.full_node.pending_tx_cache import ConflictTxCache, PendingTxCache
 from hddcoin.types.blockchain_format.coin import Coin
 from hddcoin.types.blockchain_format.sized_bytes import bytes32, bytes48
@@ -39,7 +42,8 @@ from hddcoin.util.errors import Err, ValidationError
 from hddcoin.util.inline_executor import InlineExecutor
 from hddcoin.util.ints import uint32, uint64
 from hddcoin.util.lru_cache import LRUCache
-from hddcoin.util.setproctitle import getproctitle, setproctitle
+from hddcoin.util.setproctitle import getproctitle
+from hddcoin.util.shared_pairing_cache import SharedPairingCache
 
 log = logging.getLogger(__name__)
 
@@ -47,6 +51,12 @@ log = logging.getLogger(__name__)
 # this amount. 0.00001 HDD
 MEMPOOL_MIN_FEE_INCREASE = uint64(10000000)
 
+# when syncing mempools with a peer, the number of short ids of its highest fee
+# per cost transactions we look at, and the number of those we don't have that
+# we ask for
+MEMPOOL_INVENTORY_SIZE = 10000
+MEMPOOL_SYNC_MAX_TRANSACTIONS = 100
+
 
 # TODO: once the 1.8.0 soft-fork has activated, we don't really need to pass
 # the constants through here
@@ -59,6 +69,45 @@ def validate_clvm_and_signature(
     the NPCResult and a cache of the new pairings validated (if not error)
     """
 
+    shared_cache = cached_bls.get_shared_cache()
+    if shared_cache is not None:
+        # the new pairings are written to the cache shared with the main process directly
+        return (*_validate_clvm_and_signature(spend_bundle_bytes, max_cost, constants, height, shared_cache), {})
+    cache: LRUCache[bytes32, GTElement] = LRUCache(10000)
+    err, result_bytes = _validate_clvm_and_signature(spend_bundle_bytes, max_cost, constants, height, cache)
+    if err is not None:
+        return err, b"", {}
+    return None, result_bytes, {k: bytes(v) for k, v in cache.cache.items()}
+
+
+def validate_clvm_and_signatures(
+    spend_bundles_bytes: List[bytes], max_cost: int, constants: ConsensusConstants, height: uint32
+) -> Tuple[List[Tuple[Optional[Err], bytes]], Dict[bytes32, bytes]]:
+    """
+    Like validate_clvm_and_signature(), but for a batch of spendbundles, to
+    amortize the cost of dispatching work to the ProcessPoolExecutor. Every
+    spendbundle is validated on its own, and gets its own (error, NPCResult)
+    entry in the returned list, but the pairings are shared across all of them.
+    Returns the results, and a cache of all new pairings validated
+    """
+    shared_cache = cached_bls.get_shared_cache()
+    cache: cached_bls.PairingCache = LRUCache(10000) if shared_cache is None else shared_cache
+    results = [
+        _validate_clvm_and_signature(spend_bundle_bytes, max_cost, constants, height, cache)
+        for spend_bundle_bytes in spend_bundles_bytes
+    ]
+    if not isinstance(cache, LRUCache):
+        return results, {}
+    return results, {k: bytes(v) for k, v in cache.cache.items()}
+
+
+def _validate_clvm_and_signature(
+    spend_bundle_bytes: bytes,
+    max_cost: int,
+    constants: ConsensusConstants,
+    height: uint32,
+    cache: cached_bls.PairingCache,
+) -> Tuple[Optional[Err], bytes]:
     additional_data = constants.AGG_SIG_ME_ADDITIONAL_DATA
 
     try:
@@ -70,7 +119,7 @@ def validate_clvm_and_signature(
         )
 
         if result.error is not None:
-            return Err(result.error), b"", {}
+            return Err(result.error), b""
 
         pks: List[bytes48] = []
         msgs: List[bytes] = []
@@ -78,18 +127,14 @@ def validate_clvm_and_signature(
         pks, msgs = pkm_pairs(result.conds, additional_data)
 
         # Verify aggregated signature
-        cache: LRUCache[bytes32, GTElement] = LRUCache(10000)
         if not cached_bls.aggregate_verify(pks, msgs, bundle.aggregated_signature, True, cache):
-            return Err.BAD_AGGREGATE_SIGNATURE, b"", {}
-        new_cache_entries: Dict[bytes32, bytes] = {}
-        for k, v in cache.cache.items():
-            new_cache_entries[k] = bytes(v)
+            return Err.BAD_AGGREGATE_SIGNATURE, b""
     except ValidationError as e:
-        return e.code, b"", {}
+        return e.code, b""
     except Exception:
-        return Err.UNKNOWN, b"", {}
+        return Err.UNKNOWN, b""
 
-    return None, bytes(result), new_cache_entries
+    return None, bytes(result)
 
 
 @dataclass
@@ -162,6 +207,10 @@ class MempoolManager:
     seen_cache_size: int
     peak: Optional[BlockRecordProtocol]
     mempool: Mempool
+    # set when a reorg changed the coin set under a peak that isn't a
+    # transaction block. We can't tell which coins changed, by the time we see
+    # the next transaction block
+    _reorg_missed: bool
 
     def __init__(
         self,
@@ -170,6 +219,7 @@ class MempoolManager:
         multiprocessing_context: Optional[BaseContext] = None,
         *,
         single_threaded: bool = False,
+        pairing_cache: Optional[SharedPairingCache] = None,
     ):
         self.constants: ConsensusConstants = consensus_constants
 
@@ -197,8 +247,8 @@ class MempoolManager:
             self.pool = ProcessPoolExecutor(
                 max_workers=2,
                 mp_context=multiprocessing_context,
-                initializer=setproctitle,
-                initargs=(f"{getproctitle()}_worker",),
+                initializer=cached_bls.init_validation_worker,
+                initargs=(f"{getproctitle()}_worker", pairing_cache),
             )
 
         # The mempool will correspond to a certain peak
@@ -210,6 +260,7 @@ class MempoolManager:
             CLVMCost(uint64(self.max_block_clvm_cost)),
         )
         self.mempool: Mempool = Mempool(mempool_info, self.fee_estimator)
+        self._reorg_missed = False
 
     def shut_down(self) -> None:
         self.pool.shutdown(wait=True)
@@ -224,13 +275,28 @@ class MempoolManager:
         if self.peak is None or self.peak.header_hash != last_tb_header_hash:
             return None
         if item_inclusion_filter is None:
-
-            def always(bundle_name: bytes32) -> bool:
-                return True
-
-            item_inclusion_filter = always
+            template = self.create_block_template(last_tb_header_hash)
+            return None if template is None else (template.spend_bundle(), list(template.additions))
         return self.mempool.create_bundle_from_mempool_items(item_inclusion_filter)
 
+    def create_block_template(self, last_tb_header_hash: bytes32) -> Optional[BlockTemplate]:
+        """
+        Returns the transactions for a new block on top of the specified transaction block, or None if there aren't
+        any. The template is reused until the mempool changes, and as long as transactions are only added to the
+        mempool, it's extended rather than built again. The spend bundle, its generator and its cost are computed
+        once per template.
+        """
+        if self.peak is None or self.peak.header_hash != last_tb_header_hash:
+            return None
+        template = self.mempool.get_block_template()
+        if template.spend_bundles == 0:
+            return None
+        log.info(
+            f"Cumulative cost of block (real cost should be less) {template.cost}. Proportion "
+            f"full: {template.cost / template.max_block_clvm_cost}"
+        )
+        return template
+
     def get_filter(self) -> bytes:
         all_transactions: Set[bytes32] = set()
         byte_array_list = []
@@ -309,6 +375,48 @@ class MempoolManager:
         )
         return ret
 
+    async def pre_validate_spendbundles(
+        self, new_spends: List[Tuple[SpendBundle, Optional[bytes]]]
+    ) -> List[Union[NPCResult, Err]]:
+        """
+        Like pre_validate_spendbundle(), but validates a batch of spendbundles
+        in a single call to the process pool. Returns the NPCResult, or the
+        error, of every spendbundle, in the same order.
+        """
+        start_time = time.time()
+        assert self.peak is not None
+
+        ret: List[Union[NPCResult, Err]] = [Err.INVALID_SPEND_BUNDLE] * len(new_spends)
+        indices: List[int] = []
+        spends_bytes: List[bytes] = []
+        for i, (new_spend, new_spend_bytes) in enumerate(new_spends):
+            if new_spend.coin_spends == []:
+                continue
+            indices.append(i)
+            spends_bytes.append(bytes(new_spend) if new_spend_bytes is None else new_spend_bytes)
+
+        if len(spends_bytes) == 0:
+            return ret
+        results, new_cache_entries = await asyncio.get_running_loop().run_in_executor(
+            self.pool,
+            validate_clvm_and_signatures,
+            spends_bytes,
+            self.max_block_clvm_cost,
+            self.constants,
+            self.peak.height,
+        )
+
+        for cache_entry_key, cached_entry_value in new_cache_entries.items():
+            LOCAL_CACHE.put(cache_entry_key, GTElement.from_bytes_unchecked(cached_entry_value))
+        for i, (err, cached_result_bytes) in zip(indices, results):
+            ret[i] = err if err is not None else NPCResult.from_bytes(cached_result_bytes)
+        duration = time.time() - start_time
+        log.log(
+            logging.DEBUG if duration < 2 else logging.WARNING,
+            f"pre_validate_spendbundles took {duration:0.4f} seconds for {len(new_spends)} spend bundles",
+        )
+        return ret
+
     async def add_spend_bundle(
         self, new_spend: SpendBundle, npc_result: NPCResult, spend_name: bytes32, first_added_height: uint32
     ) -> Tuple[Optional[uint64], MempoolInclusionStatus, Optional[Err]]:
@@ -596,15 +704,28 @@ class MempoolManager:
         return item
 
     async def new_peak(
-        self, new_peak: Optional[BlockRecordProtocol], spent_coins: Optional[List[bytes32]]
+        self,
+        new_peak: Optional[BlockRecordProtocol],
+        spent_coins: Optional[List[bytes32]],
+        rolled_back_coins: Optional[List[bytes32]] = None,
     ) -> List[Tuple[SpendBundle, NPCResult, bytes32]]:
         """
         Called when a new peak is available, we try to recreate a mempool for the new tip.
+        spent_coins are the coins spent since the fork point, rolled_back_coins
+        the coins that were created or spent in the blocks rolled back by a
+        reorg. If the new peak doesn't extend our current peak, and we know
+        both, only the mempool items affected by the reorg are re-validated.
         """
         if new_peak is None:
             return []
         # we're only interested in transaction blocks
         if new_peak.is_transaction_block is False:
+            if (
+                rolled_back_coins is None
+                or len(rolled_back_coins) > 0
+                or (spent_coins is not None and len(spent_coins) > 0)
+            ):
+                self._reorg_missed = True
             return []
         if self.peak == new_peak:
             return []
@@ -615,22 +736,22 @@ class MempoolManager:
         self.mempool.new_tx_block(new_peak.height, new_peak.timestamp)
 
         use_optimization: bool = self.peak is not None and new_peak.prev_transaction_block_hash == self.peak.header_hash
+        old_peak = self.peak
         self.peak = new_peak
+        reorg_missed = self._reorg_missed
+        self._reorg_missed = False
 
         if use_optimization and spent_coins is not None:
             # We don't reinitialize a mempool, just kick removed items
-            # transactions in the mempool may be spending multiple coins,
-            # when looking up transactions by all coin IDs, we're likely to
-            # find the same transaction multiple times. We put them in a set
-            # to deduplicate
-            spendbundle_ids_to_remove: Set[bytes32] = set()
-            for spend in spent_coins:
-                items: List[MempoolItem] = self.mempool.get_items_by_coin_id(spend)
-                for item in items:
-                    included_items.append(MempoolItemInfo(item.cost, item.fee, item.height_added_to_mempool))
-                    self.remove_seen(item.name)
-                    spendbundle_ids_to_remove.add(item.name)
-            self.mempool.remove_from_pool(list(spendbundle_ids_to_remove), MempoolRemoveReason.BLOCK_INCLUSION)
+            self._remove_spent(spent_coins, included_items)
+        elif old_peak is not None and spent_coins is not None and rolled_back_coins is not None and not reorg_missed:
+            start = time.monotonic()
+            readmitted = await self._update_after_reorg(old_peak, spent_coins, rolled_back_coins, included_items)
+            log.info(
+                f"updated the mempool after a reorg in {time.monotonic() - start:0.3f}s. "
+                f"peak: {old_peak.header_hash} new-peak: {new_peak.header_hash} "
+                f"re-validated {readmitted} items"
+            )
         else:
             log.warning(
                 "updating the mempool using the slow-path. "
@@ -672,6 +793,87 @@ class MempoolManager:
         self.mempool.fee_estimator.new_block(FeeBlockInfo(new_peak.height, included_items))
         return txs_added
 
+    def _remove_spent(self, spent_coins: List[bytes32], included_items: List[MempoolItemInfo]) -> None:
+        # transactions in the mempool may be spending multiple coins, when
+        # looking up transactions by all coin IDs, we're likely to find the
+        # same transaction multiple times
+        items = self.mempool.get_items_by_coin_ids(spent_coins)
+        for item in items:
+            included_items.append(MempoolItemInfo(item.cost, item.fee, item.height_added_to_mempool))
+            self.remove_seen(item.name)
+        self.mempool.remove_from_pool([item.name for item in items], MempoolRemoveReason.BLOCK_INCLUSION)
+
+    async def _update_after_reorg(
+        self,
+        old_peak: BlockRecordProtocol,
+        spent_coins: List[bytes32],
+        rolled_back_coins: List[bytes32],
+        included_items: List[MempoolItemInfo],
+    ) -> int:
+        """
+        Brings the mempool in line with the new peak, after a reorg. Items
+        spending coins spent in the new chain are removed. Items spending coins
+        that were created or spent in the rolled back blocks, or with time-locks
+        that may no longer be satisfied, are removed and added back, re-using
+        their NPCResult. All other items are left as they are. Returns the
+        number of items re-validated.
+        """
+        assert self.peak is not None and self.peak.timestamp is not None
+        self._remove_spent(spent_coins, included_items)
+
+        affected: Dict[bytes32, MempoolItem] = {}
+        for item in self.mempool.get_items_by_coin_ids(rolled_back_coins):
+            affected[item.name] = item
+        assert old_peak.timestamp is not None
+        if self.peak.height < old_peak.height or self.peak.timestamp < old_peak.timestamp:
+            # the new peak is lower or earlier, some time-locks that were
+            # satisfied may not be anymore
+            for item in self.mempool.all_items():
+                if item.name in affected:
+                    continue
+                if (item.assert_height is not None and item.assert_height > self.peak.height) or asserts_seconds(item):
+                    affected[item.name] = item
+        self.mempool.remove_from_pool(list(affected.keys()), MempoolRemoveReason.REORG)
+
+        for item in affected.values():
+            _, result, err = await self.add_spend_bundle(
+                item.spend_bundle, item.npc_result, item.spend_bundle_name, item.height_added_to_mempool
+            )
+            if result != MempoolInclusionStatus.SUCCESS:
+                # allow the spend bundle to be resubmitted
+                self.remove_seen(item.name)
+            if result == MempoolInclusionStatus.FAILED and err == Err.DOUBLE_SPEND:
+                included_items.append(MempoolItemInfo(item.cost, item.fee, item.height_added_to_mempool))
+        return len(affected)
+
+    def get_inventory(self, limit: int, salt: uint64) -> List[uint64]:
+        """
+        The short ids of the items with the highest fee per cost, highest first
+        """
+        items = itertools.islice(self.mempool.items_by_feerate(), limit)
+        return [uint64(short_id(item.name, salt)) for item in items]
+
+    def get_missing_short_ids(self, short_ids: List[uint64], salt: uint64) -> List[uint64]:
+        """
+        The short ids of a peer's inventory that aren't in our mempool, in the same order
+        """
+        ours = self.mempool.get_items_by_short_id(salt)
+        return [i for i in short_ids if i not in ours]
+
+    def get_items_by_short_ids(self, short_ids: List[uint64], salt: uint64, limit: int = 100) -> List[SpendBundle]:
+        """
+        The spend bundles with the short ids, up to limit. All the items sharing
+        a short id are included
+        """
+        ours = self.mempool.get_items_by_short_id(salt)
+        items: List[SpendBundle] = []
+        for i in short_ids:
+            for item in ours.pop(i, []):
+                if len(items) >= limit:
+                    return items
+                items.append(item.spend_bundle)
+        return items
+
     def get_items_not_in_filter(self, mempool_filter: PyBIP158, limit: int = 100) -> List[SpendBundle]:
         items: List[SpendBundle] = []
 
@@ -699,6 +901,18 @@ def optional_max(a: Optional[T], b: Optional[T]) -> Optional[T]:
     return max((v for v in [a, b] if v is not None), default=None)
 
 
+def asserts_seconds(item: MempoolItem) -> bool:
+    """
+    Returns whether the item asserts a minimum timestamp, absolute or relative.
+    Unlike the height, MempoolItem doesn't keep the resolved timestamp.
+    """
+    conds = item.npc_result.conds
+    assert conds is not None
+    if conds.seconds_absolute > 0:
+        return True
+    return any(spend.seconds_relative is not None for spend in conds.spends)
+
+
 def can_replace(
     conflicting_items: List[MempoolItem],
     removal_names: Set[bytes32],
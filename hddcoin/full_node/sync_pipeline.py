@@ -0,0 +1,253 @@
+from __future__ import annotations
+
+import asyncio
+import dataclasses
+import time
+from typing import Any, Dict, List, Optional
+
+from hddcoin.consensus.block_record import BlockRecord
+from hddcoin.consensus.blockchain import Blockchain
+from hddcoin.consensus.blockchain_interface import BlockchainInterface
+from hddcoin.consensus.multiprocess_validation import PreValidationResult, pre_validate_blocks_multiprocessing
+from hddcoin.server.ws_connection import WSHDDcoinConnection
+from hddcoin.types.block_protocol import BlockInfo
+from hddcoin.types.blockchain_format.sized_bytes import bytes32
+from hddcoin.types.blockchain_format.sub_epoch_summary import SubEpochSummary
+from hddcoin.types.full_block import FullBlock
+from hddcoin.types.generator_types import BlockGenerator
+from hddcoin.util.errors import Err
+from hddcoin.util.ints import uint32
+
+
+@dataclasses.dataclass
+class SyncStageStats:
+    batches: int = 0
+    blocks: int = 0
+    # seconds spent doing the actual work of the stage
+    busy_time: float = 0.0
+    # seconds spent waiting for the previous stage (or the writer) to hand over work
+    input_wait_time: float = 0.0
+    # seconds spent blocked on a full output queue, i.e. backpressure from the next stage
+    output_wait_time: float = 0.0
+    # number of batches waiting in the input queue of this stage, when last sampled
+    queue_depth: int = 0
+
+    def record(self, blocks: int, busy_time: float) -> None:
+        self.batches += 1
+        self.blocks += blocks
+        self.busy_time += busy_time
+
+    def to_json_dict(self) -> Dict[str, Any]:
+        ret: Dict[str, Any] = dataclasses.asdict(self)
+        ret["blocks_per_second"] = self.blocks / self.busy_time if self.busy_time > 0 else 0.0
+        return ret
+
+
+@dataclasses.dataclass
+class SyncPipelineStats:
+    fork_point_height: uint32
+    target_height: uint32
+    start_time: float = dataclasses.field(default_factory=time.monotonic)
+    end_time: Optional[float] = None
+    fetch: SyncStageStats = dataclasses.field(default_factory=SyncStageStats)
+    pre_validate: SyncStageStats = dataclasses.field(default_factory=SyncStageStats)
+    commit: SyncStageStats = dataclasses.field(default_factory=SyncStageStats)
+
+    def stages(self) -> Dict[str, SyncStageStats]:
+        return {"fetch": self.fetch, "pre_validate": self.pre_validate, "commit": self.commit}
+
+    def bottleneck(self) -> str:
+        # the stage that spent the most time working is the one limiting throughput
+        return max(self.stages().items(), key=lambda item: item[1].busy_time)[0]
+
+    def to_json_dict(self) -> Dict[str, Any]:
+        end_time = self.end_time if self.end_time is not None else time.monotonic()
+        return {
+            "fork_point_height": self.fork_point_height,
+            "target_height": self.target_height,
+            "running": self.end_time is None,
+            "elapsed_time": end_time - self.start_time,
+            "bottleneck": self.bottleneck(),
+            "stages": {name: stage.to_json_dict() for name, stage in self.stages().items()},
+        }
+
+
+@dataclasses.dataclass(frozen=True)
+class PreValidatedBatch:
+    peer: WSHDDcoinConnection
+    # the whole batch, as received from the peer
+    blocks: List[FullBlock]
+    # the suffix of blocks that were not in the database yet, and their pre validation results
+    blocks_to_validate: List[FullBlock]
+    pre_validation_results: List[PreValidationResult]
+    error: Optional[Err] = None
+
+
+class UncommittedChain:
+    """
+    Blocks that passed pre-validation during a long sync, but have not been
+    added to the blockchain by the writer yet. As long as these blocks extend
+    the peak, the pre-validation stage can validate the next batch on top of
+    them, without waiting for the writer.
+    """
+
+    def __init__(self) -> None:
+        self.blocks: Dict[bytes32, FullBlock] = {}
+        self.block_records: Dict[bytes32, BlockRecord] = {}
+        self.height_to_hash: Dict[uint32, bytes32] = {}
+        self.tip: Optional[bytes32] = None
+        # whether the first uncommitted block extends the peak of the blockchain
+        self.extends_peak = False
+        self._empty = asyncio.Event()
+        self._empty.set()
+
+    def __len__(self) -> int:
+        return len(self.blocks)
+
+    def can_extend(self, block: FullBlock) -> bool:
+        return len(self.blocks) == 0 or (self.extends_peak and block.prev_header_hash == self.tip)
+
+    def add(self, blocks: List[FullBlock], block_records: List[BlockRecord], extends_peak: bool) -> None:
+        if len(self.blocks) == 0:
+            self.extends_peak = extends_peak
+        for block, block_record in zip(blocks, block_records):
+            self.blocks[block.header_hash] = block
+            self.block_records[block.header_hash] = block_record
+            self.height_to_hash[block.height] = block.header_hash
+        self.tip = blocks[-1].header_hash
+        self._empty.clear()
+
+    def remove(self, blocks: List[FullBlock]) -> None:
+        for block in blocks:
+            if self.blocks.pop(block.header_hash, None) is None:
+                continue
+            del self.block_records[block.header_hash]
+            if self.height_to_hash.get(block.height) == block.header_hash:
+                del self.height_to_hash[block.height]
+        if len(self.blocks) == 0:
+            self.tip = None
+            self.extends_peak = False
+            self._empty.set()
+
+    async def wait_empty(self) -> None:
+        await self._empty.wait()
+
+
+class UncommittedChainView(BlockchainInterface):
+    """
+    A view of the blockchain with the uncommitted blocks on top of the peak.
+    Block records added by pre-validation only go into this view, so the
+    underlying Blockchain object is never modified.
+    """
+
+    def __init__(self, blockchain: Blockchain, chain: UncommittedChain) -> None:
+        self._blockchain = blockchain
+        # take snapshots, the writer removes blocks from the chain while we
+        # pre-validate
+        self._uncommitted: Dict[bytes32, BlockRecord] = dict(chain.block_records) if chain.extends_peak else {}
+        self._height_to_hash: Dict[uint32, bytes32] = dict(chain.height_to_hash) if chain.extends_peak else {}
+        self._scratch: Dict[bytes32, BlockRecord] = {}
+        # block records pre-validation computed, and removed again when it was done
+        self.removed: Dict[bytes32, BlockRecord] = {}
+
+    def get_peak(self) -> Optional[BlockRecord]:
+        return self._blockchain.get_peak()
+
+    def block_record(self, header_hash: bytes32) -> BlockRecord:
+        ret = self._scratch.get(header_hash)
+        if ret is None:
+            ret = self._uncommitted.get(header_hash)
+        if ret is None:
+            ret = self._blockchain.block_record(header_hash)
+        return ret
+
+    def height_to_block_record(self, height: uint32) -> BlockRecord:
+        header_hash = self.height_to_hash(height)
+        if header_hash is None:
+            raise ValueError(f"Height is not in blockchain: {height}")
+        return self.block_record(header_hash)
+
+    def get_ses_heights(self) -> List[uint32]:
+        return self._blockchain.get_ses_heights()
+
+    def get_ses(self, height: uint32) -> SubEpochSummary:
+        return self._blockchain.get_ses(height)
+
+    def height_to_hash(self, height: uint32) -> Optional[bytes32]:
+        ret = self._height_to_hash.get(height)
+        if ret is None:
+            ret = self._blockchain.height_to_hash(height)
+        return ret
+
+    def contains_height(self, height: uint32) -> bool:
+        return height in self._height_to_hash or self._blockchain.contains_height(height)
+
+    def contains_block(self, header_hash: bytes32) -> bool:
+        return (
+            header_hash in self._scratch
+            or header_hash in self._uncommitted
+            or self._blockchain.contains_block(header_hash)
+        )
+
+    async def contains_block_from_db(self, header_hash: bytes32) -> bool:
+        return self.contains_block(header_hash) or await self._blockchain.contains_block_from_db(header_hash)
+
+    async def get_block_record_from_db(self, header_hash: bytes32) -> Optional[BlockRecord]:
+        ret = self._scratch.get(header_hash)
+        if ret is None:
+            ret = self._uncommitted.get(header_hash)
+        if ret is None:
+            ret = await self._blockchain.get_block_record_from_db(header_hash)
+        return ret
+
+    def add_block_record(self, block_record: BlockRecord) -> None:
+        self._scratch[block_record.header_hash] = block_record
+
+    def remove_block_record(self, header_hash: bytes32) -> None:
+        self.removed[header_hash] = self._scratch.pop(header_hash)
+
+
+async def pre_validate_on_uncommitted_chain(
+    blockchain: Blockchain,
+    chain: UncommittedChain,
+    blocks: List[FullBlock],
+    wp_summaries: Optional[List[SubEpochSummary]],
+) -> List[PreValidationResult]:
+    """
+    Pre-validates blocks on top of the uncommitted chain. If all blocks pass,
+    they are added to the uncommitted chain. The caller must make sure
+    chain.can_extend(blocks[0]) holds.
+    """
+    view = UncommittedChainView(blockchain, chain)
+    # the previous generators may be referenced from blocks that are not in the
+    # database yet
+    uncommitted_blocks: Dict[bytes32, FullBlock] = dict(chain.blocks) if chain.extends_peak else {}
+
+    async def get_block_generator(
+        block: BlockInfo, additional_blocks: Dict[bytes32, FullBlock]
+    ) -> Optional[BlockGenerator]:
+        return await blockchain.get_block_generator(block, {**uncommitted_blocks, **additional_blocks})
+
+    peak = blockchain.get_peak()
+    extends_peak = (
+        chain.extends_peak
+        if len(chain) > 0
+        else (blocks[0].prev_header_hash == peak.header_hash if peak is not None else blocks[0].height == 0)
+    )
+    pre_validation_results = await pre_validate_blocks_multiprocessing(
+        blockchain.constants,
+        view,
+        blocks,
+        blockchain.pool,
+        True,
+        {},
+        get_block_generator,
+        4,
+        wp_summaries,
+        validate_signatures=True,
+    )
+    if len(pre_validation_results) != len(blocks) or any(r.error is not None for r in pre_validation_results):
+        return pre_validation_results
+    block_records = [view.removed.get(b.header_hash) or view.block_record(b.header_hash) for b in blocks]
+    chain.add(blocks, block_records, extends_peak)
+    return pre_validation_results
@@ -2,9 +2,10 @@ from __future__ import annotations
 
 import asyncio
 import logging
-from dataclasses import dataclass
+from collections import OrderedDict, deque
+from dataclasses import dataclass, field
 from queue import SimpleQueue
-from typing import Dict, List, Optional
+from typing import Any, Deque, Dict, List, Optional, Tuple
 
 from hddcoin.types.blockchain_format.sized_bytes import bytes32
 from hddcoin.types.transaction_queue_entry import TransactionQueueEntry
@@ -14,30 +15,77 @@ class TransactionQueueFull(Exception):
     pass
 
 
+# the estimated CLVM cost of a spend bundle is its size times this. It's the
+# same as the consensus COST_PER_BYTE
+ESTIMATED_COST_PER_BYTE = 12000
+
+# the cost every peer may spend each round, before it's weighted by the peer's
+# history. It's the estimated cost of a 4 kB spend bundle
+DEFAULT_QUANTUM = 4096 * ESTIMATED_COST_PER_BYTE
+
+# the weight of a peer whose transactions are all rejected. Peers never go
+# below it, so they can recover
+MIN_PEER_WEIGHT = 0.1
+
+# the number of peers we keep the accepted/rejected counters of
+MAX_PEER_STATS = 1000
+
+
+def estimated_cost(tx: TransactionQueueEntry) -> int:
+    size = len(tx.transaction_bytes) if tx.transaction_bytes is not None else len(bytes(tx.transaction))
+    return size * ESTIMATED_COST_PER_BYTE
+
+
+@dataclass
+class PeerTransactionStats:
+    accepted: int = 0
+    rejected: int = 0
+    dropped: int = 0
+
+    @property
+    def weight(self) -> float:
+        return max((self.accepted + 1) / (self.accepted + self.rejected + 1), MIN_PEER_WEIGHT)
+
+
+@dataclass
+class PeerTransactionQueue:
+    # (transaction, estimated cost)
+    entries: Deque[Tuple[TransactionQueueEntry, int]] = field(default_factory=deque)
+    deficit: int = 0
+    queued_cost: int = 0
+
+
 @dataclass
 class TransactionQueue:
     """
     This class replaces one queue by using a high priority queue for local transactions and separate queues for peers.
     Local transactions are processed first.
-    Then the next transaction is taken from the next non-empty queue after the last processed queue. (round-robin)
-    This decreases the effects of one peer spamming your node with transactions.
+    Peer queues are served by deficit round-robin. Every time the cursor visits a peer, its deficit grows by the
+    quantum, scaled by the share of the peer's transactions that were accepted. The next transaction is taken from the
+    first queue whose deficit covers the estimated cost of the transaction at its head.
+    This decreases the effects of one peer spamming your node with transactions, expensive ones in particular.
     """
 
     _list_cursor: int  # this is which index
     _queue_length: asyncio.Semaphore
     _index_to_peer_map: List[bytes32]
-    _queue_dict: Dict[bytes32, SimpleQueue[TransactionQueueEntry]]
+    _queue_dict: Dict[bytes32, PeerTransactionQueue]
     _high_priority_queue: SimpleQueue[TransactionQueueEntry]
+    # the least recently updated first
+    _peer_stats: OrderedDict[bytes32, PeerTransactionStats]
     peer_size_limit: int
+    quantum: int
     log: logging.Logger
 
-    def __init__(self, peer_size_limit: int, log: logging.Logger) -> None:
+    def __init__(self, peer_size_limit: int, log: logging.Logger, quantum: int = DEFAULT_QUANTUM) -> None:
         self._list_cursor = 0
         self._queue_length = asyncio.Semaphore(0)  # default is 1
         self._index_to_peer_map = []
         self._queue_dict = {}
         self._high_priority_queue = SimpleQueue()  # we don't limit the number of high priority transactions
+        self._peer_stats = OrderedDict()
         self.peer_size_limit = peer_size_limit
+        self.quantum = quantum
         self.log = log
 
     async def put(self, tx: TransactionQueueEntry, peer_id: Optional[bytes32], high_priority: bool = False) -> None:
@@ -45,11 +93,15 @@ class TransactionQueue:
             self._high_priority_queue.put(tx)
         else:
             if peer_id not in self._queue_dict:
-                self._queue_dict[peer_id] = SimpleQueue()
+                self._queue_dict[peer_id] = PeerTransactionQueue()
                 self._index_to_peer_map.append(peer_id)
-            if self._queue_dict[peer_id].qsize() < self.peer_size_limit:
-                self._queue_dict[peer_id].put(tx)
+            peer_queue = self._queue_dict[peer_id]
+            if len(peer_queue.entries) < self.peer_size_limit:
+                cost = estimated_cost(tx)
+                peer_queue.entries.append((tx, cost))
+                peer_queue.queued_cost += cost
             else:
+                self._get_peer_stats(peer_id).dropped += 1
                 self.log.warning(f"Transaction queue full for peer {peer_id}")
                 raise TransactionQueueFull(f"Transaction queue full for peer {peer_id}")
         self._queue_length.release()  # increment semaphore to indicate that we have a new item in the queue
@@ -58,21 +110,113 @@ class TransactionQueue:
         await self._queue_length.acquire()
         if not self._high_priority_queue.empty():
             return self._high_priority_queue.get()
-        result: Optional[TransactionQueueEntry] = None
         while True:
-            peer_queue = self._queue_dict[self._index_to_peer_map[self._list_cursor]]
-            if not peer_queue.empty():
-                result = peer_queue.get()
-            self._list_cursor += 1
-            if self._list_cursor > len(self._index_to_peer_map) - 1:
-                # reset iterator
-                self._list_cursor = 0
-                new_peer_map = []
-                for peer_id in self._index_to_peer_map:
-                    if self._queue_dict[peer_id].empty():
-                        self._queue_dict.pop(peer_id)
-                    else:
-                        new_peer_map.append(peer_id)
-                self._index_to_peer_map = new_peer_map
-            if result is not None:
-                return result
+            for _ in range(len(self._index_to_peer_map)):
+                result = self._visit_next_peer()
+                if result is not None:
+                    return result
+            # nobody could afford the transaction at the head of their queue
+            # this round. Skip ahead to the round where the first peer can
+            self._skip_rounds()
+
+    def record_result(self, peer_id: bytes32, accepted: bool) -> None:
+        """
+        Records whether a transaction received from the peer was valid. Peers whose transactions are rejected get a
+        smaller share of the validation time.
+        """
+        stats = self._get_peer_stats(peer_id)
+        if accepted:
+            stats.accepted += 1
+        else:
+            stats.rejected += 1
+
+    def get_stats(self) -> Dict[str, Any]:
+        peers: Dict[bytes32, Dict[str, Any]] = {}
+        for peer_id in self._peer_stats.keys() | self._queue_dict.keys():
+            stats = self._peer_stats.get(peer_id, PeerTransactionStats())
+            peer_queue = self._queue_dict.get(peer_id, PeerTransactionQueue())
+            peers[peer_id] = {
+                "peer_id": peer_id.hex(),
+                "queued": len(peer_queue.entries),
+                "queued_cost": peer_queue.queued_cost,
+                "deficit": peer_queue.deficit,
+                "weight": stats.weight,
+                "accepted": stats.accepted,
+                "rejected": stats.rejected,
+                "dropped": stats.dropped,
+            }
+        return {
+            "high_priority_queued": self._high_priority_queue.qsize(),
+            "peers": sorted(peers.values(), key=lambda p: (-p["queued"], p["peer_id"])),
+        }
+
+    def _peer_quantum(self, peer_id: bytes32) -> int:
+        stats = self._peer_stats.get(peer_id)
+        weight = 1.0 if stats is None else stats.weight
+        return max(int(self.quantum * weight), 1)
+
+    def _get_peer_stats(self, peer_id: bytes32) -> PeerTransactionStats:
+        stats = self._peer_stats.get(peer_id)
+        if stats is None:
+            stats = PeerTransactionStats()
+            self._peer_stats[peer_id] = stats
+            if len(self._peer_stats) > MAX_PEER_STATS:
+                self._peer_stats.popitem(last=False)
+        else:
+            self._peer_stats.move_to_end(peer_id)
+        return stats
+
+    def _visit_next_peer(self) -> Optional[TransactionQueueEntry]:
+        result: Optional[TransactionQueueEntry] = None
+        peer_id = self._index_to_peer_map[self._list_cursor]
+        peer_queue = self._queue_dict[peer_id]
+        if len(peer_queue.entries) > 0:
+            quantum = self._peer_quantum(peer_id)
+            peer_queue.deficit += quantum
+            tx, cost = peer_queue.entries[0]
+            if cost <= peer_queue.deficit:
+                peer_queue.entries.popleft()
+                peer_queue.queued_cost -= cost
+                # cheap transactions don't let a peer save up for an
+                # expensive one
+                peer_queue.deficit = min(peer_queue.deficit - cost, quantum)
+                result = tx
+        self._list_cursor += 1
+        if self._list_cursor > len(self._index_to_peer_map) - 1:
+            # reset iterator
+            self._list_cursor = 0
+            new_peer_map = []
+            for peer_id in self._index_to_peer_map:
+                if len(self._queue_dict[peer_id].entries) == 0:
+                    self._queue_dict.pop(peer_id)
+                else:
+                    new_peer_map.append(peer_id)
+            self._index_to_peer_map = new_peer_map
+        return result
+
+    def _skip_rounds(self) -> None:
+        rounds: Optional[int] = None
+        for peer_id in self._index_to_peer_map:
+            peer_queue = self._queue_dict[peer_id]
+            if len(peer_queue.entries) > 0:
+                missing = peer_queue.entries[0][1] - peer_queue.deficit
+                quantum = self._peer_quantum(peer_id)
+                # the deficit grows once more on the next visit
+                peer_rounds = (missing + quantum - 1) // quantum - 1
+                rounds = peer_rounds if rounds is None else min(rounds, peer_rounds)
+        if rounds is None or rounds <= 0:
+            return
+        for peer_id in self._index_to_peer_map:
+            peer_queue = self._queue_dict[peer_id]
+            if len(peer_queue.entries) > 0:
+                peer_queue.deficit += rounds * self._peer_quantum(peer_id)
+
+    async def pop_many(self, limit: int) -> List[TransactionQueueEntry]:
+        """
+        Waits for the next transaction, and returns it along with up to limit - 1
+        more transactions that are already queued, in the same order pop() would.
+        """
+        ret = [await self.pop()]
+        while len(ret) < limit and not self._queue_length.locked():
+            ret.append(await self.pop())
+        return ret
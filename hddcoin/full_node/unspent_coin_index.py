@@ -0,0 +1,129 @@
+from __future__ import annotations
+
+import dataclasses
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+
+from hddcoin.types.blockchain_format.sized_bytes import bytes32
+from hddcoin.types.coin_record import CoinRecord
+
+# A rough estimate of the memory used by one entry in the index: the
+# CoinRecord, its coin id and the puzzle hash index entry
+BYTES_PER_UNSPENT_COIN = 512
+
+
+@dataclasses.dataclass
+class UnspentCoinIndex:
+    """
+    An in-memory index of unspent coins, mirroring the coin_record table. It is
+    kept up-to-date by the CoinStore as blocks are added and rolled back.
+
+    Lookups by coin id are answered from the index whenever the coin is in it,
+    everything else falls back to the database. Lookups by puzzle hash can only
+    be answered from the index as long as it holds *every* unspent coin, i.e.
+    it's "complete". Once the index hits its capacity it evicts the oldest
+    entries and stops being complete.
+    """
+
+    capacity: int
+    complete: bool = False
+    hits: int = 0
+    misses: int = 0
+    # coin id -> record. Insertion ordered, the oldest entry is evicted first
+    _records: Dict[bytes32, CoinRecord] = dataclasses.field(default_factory=dict)
+    _by_puzzle_hash: Dict[bytes32, Set[bytes32]] = dataclasses.field(default_factory=dict)
+
+    @classmethod
+    def create(cls, max_memory_mb: int) -> UnspentCoinIndex:
+        return cls(capacity=max_memory_mb * 1024 * 1024 // BYTES_PER_UNSPENT_COIN)
+
+    def __len__(self) -> int:
+        return len(self._records)
+
+    def load(self, records: Iterable[CoinRecord], complete: bool) -> None:
+        self.clear()
+        self.complete = complete
+        # evicting entries while loading clears the complete flag again
+        self.add(records)
+
+    def clear(self) -> None:
+        # after clearing, the index no longer knows about all unspent coins
+        self._records.clear()
+        self._by_puzzle_hash.clear()
+        self.complete = False
+
+    def add(self, records: Iterable[CoinRecord]) -> None:
+        for record in records:
+            if record.spent_block_index != 0:
+                continue
+            name = record.name
+            self._records[name] = record
+            self._by_puzzle_hash.setdefault(record.coin.puzzle_hash, set()).add(name)
+        while len(self._records) > self.capacity:
+            self._evict()
+
+    def remove(self, names: Iterable[bytes32]) -> None:
+        for name in names:
+            record = self._records.pop(name, None)
+            if record is not None:
+                self._remove_from_puzzle_hash(record)
+
+    def get(self, name: bytes32) -> Optional[CoinRecord]:
+        record = self._records.get(name)
+        if record is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return record
+
+    def get_many(self, names: Iterable[bytes32]) -> Tuple[List[CoinRecord], List[bytes32]]:
+        """
+        Returns the records found in the index, and the names of the ones that
+        have to be looked up in the database.
+        """
+        found: List[CoinRecord] = []
+        missing: List[bytes32] = []
+        for name in names:
+            record = self._records.get(name)
+            if record is None:
+                missing.append(name)
+            else:
+                found.append(record)
+        self.hits += len(found)
+        self.misses += len(missing)
+        return found, missing
+
+    def get_by_puzzle_hashes(self, puzzle_hashes: Iterable[bytes32]) -> Optional[List[CoinRecord]]:
+        """
+        Returns all unspent coins with any of the puzzle hashes, or None if the
+        index is not complete and the database has to be queried instead.
+        """
+        if not self.complete:
+            self.misses += 1
+            return None
+        self.hits += 1
+        ret: List[CoinRecord] = []
+        for puzzle_hash in puzzle_hashes:
+            for name in self._by_puzzle_hash.get(puzzle_hash, ()):
+                ret.append(self._records[name])
+        return ret
+
+    def get_stats(self) -> Dict[str, int]:
+        return {
+            "size": len(self._records),
+            "capacity": self.capacity,
+            "complete": int(self.complete),
+            "hits": self.hits,
+            "misses": self.misses,
+        }
+
+    def _evict(self) -> None:
+        name = next(iter(self._records))
+        self._remove_from_puzzle_hash(self._records.pop(name))
+        self.complete = False
+
+    def _remove_from_puzzle_hash(self, record: CoinRecord) -> None:
+        puzzle_hash = record.coin.puzzle_hash
+        names = self._by_puzzle_hash[puzzle_hash]
+        names.discard(record.name)
+        if len(names) == 0:
+            del self._by_puzzle_hash[puzzle_hash]
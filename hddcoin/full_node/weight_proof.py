@@ -6,10 +6,13 @@ import logging
 import math
 import pathlib
 import random
+import sqlite3
 import tempfile
-from concurrent.futures.process import ProcessPoolExecutor
+import time
+from concurrent.futures.process import BrokenProcessPool, ProcessPoolExecutor
 from multiprocessing.context import BaseContext
-from typing import IO, Dict, List, Optional, Tuple
+from pathlib import Path
+from typing import IO, Any, Dict, Iterator, List, Optional, Tuple
 
 from hddcoin.consensus.block_header_validation import validate_finished_header_block
 from hddcoin.consensus.block_record import BlockRecord
@@ -24,6 +27,7 @@ from hddcoin.consensus.pot_iterations import (
     is_overflow_block,
 )
 from hddcoin.consensus.vdf_info_computation import get_signage_point_vdf_info
+from hddcoin.full_node.block_store import decompress_blob
 from hddcoin.types.blockchain_format.classgroup import ClassgroupElement
 from hddcoin.types.blockchain_format.proof_of_space import verify_and_get_quality_string
 from hddcoin.types.blockchain_format.sized_bytes import bytes32
@@ -31,6 +35,7 @@ from hddcoin.types.blockchain_format.slots import ChallengeChainSubSlot, RewardC
 from hddcoin.types.blockchain_format.sub_epoch_summary import SubEpochSummary
 from hddcoin.types.blockchain_format.vdf import VDFInfo, VDFProof, validate_vdf
 from hddcoin.types.end_of_slot_bundle import EndOfSubSlotBundle
+from hddcoin.types.full_block import FullBlock
 from hddcoin.types.header_block import HeaderBlock
 from hddcoin.types.weight_proof import (
     RecentChainData,
@@ -41,6 +46,7 @@ from hddcoin.types.weight_proof import (
     WeightProof,
 )
 from hddcoin.util.block_cache import BlockCache
+from hddcoin.util.generator_tools import get_block_header
 from hddcoin.util.hash import std_hash
 from hddcoin.util.ints import uint8, uint32, uint64, uint128
 from hddcoin.util.misc import to_batches
@@ -53,6 +59,57 @@ def _create_shutdown_file() -> IO[bytes]:
     return tempfile.NamedTemporaryFile(prefix="hddcoin_full_node_weight_proof_handler_executor_shutdown_trigger")
 
 
+@dataclasses.dataclass
+class WeightProofValidationMetrics:
+    """
+    Tracks a single weight proof validation. "work bytes" are the serialized
+    parts of the proof handed to the worker processes and not processed yet,
+    which is what the validation holds in memory on top of the proof itself
+    """
+
+    start_time: float = dataclasses.field(default_factory=time.monotonic)
+    work_bytes: int = 0
+    peak_work_bytes: int = 0
+
+    def add_work(self, size: int) -> None:
+        self.work_bytes += size
+        self.peak_work_bytes = max(self.peak_work_bytes, self.work_bytes)
+
+    def remove_work(self, size: int) -> None:
+        self.work_bytes -= size
+
+
+@dataclasses.dataclass
+class WeightProofValidationStats:
+    validated: int = 0
+    rejected: int = 0
+    # seconds from the start of the validation until the proof was rejected
+    last_time_to_reject: float = 0.0
+    max_time_to_reject: float = 0.0
+    total_time_to_reject: float = 0.0
+    last_validation_time: float = 0.0
+    last_peak_work_bytes: int = 0
+    max_peak_work_bytes: int = 0
+
+    def record(self, metrics: WeightProofValidationMetrics, valid: bool) -> None:
+        elapsed = time.monotonic() - metrics.start_time
+        if valid:
+            self.validated += 1
+            self.last_validation_time = elapsed
+        else:
+            self.rejected += 1
+            self.last_time_to_reject = elapsed
+            self.max_time_to_reject = max(self.max_time_to_reject, elapsed)
+            self.total_time_to_reject += elapsed
+        self.last_peak_work_bytes = metrics.peak_work_bytes
+        self.max_peak_work_bytes = max(self.max_peak_work_bytes, metrics.peak_work_bytes)
+
+    def to_json_dict(self) -> Dict[str, Any]:
+        ret: Dict[str, Any] = dataclasses.asdict(self)
+        ret["avg_time_to_reject"] = self.total_time_to_reject / self.rejected if self.rejected > 0 else 0.0
+        return ret
+
+
 class WeightProofHandler:
     LAMBDA_L = 100
     C = 0.5
@@ -63,16 +120,56 @@ class WeightProofHandler:
         constants: ConsensusConstants,
         blockchain: BlockchainInterface,
         multiprocessing_context: Optional[BaseContext] = None,
+        db_path: Optional[Path] = None,
+        segment_processes: int = 0,
     ):
         self.tip: Optional[bytes32] = None
+        # the serialized weight proof for self.tip
+        self.proof_bytes: Optional[bytes] = None
+        # and the parsed one, if it was asked for
         self.proof: Optional[WeightProof] = None
         self.constants = constants
         self.blockchain = blockchain
         self.lock = asyncio.Lock()
         self._num_processes = 4
         self.multiprocessing_context = multiprocessing_context
+        self.validation_stats = WeightProofValidationStats()
+        # when set, sub epoch challenge segments are created in a pool of this
+        # many processes, each reading the blocks it needs from the (v2)
+        # database at db_path, instead of on the event loop
+        self._db_path = db_path
+        self._segment_processes = segment_processes if db_path is not None else 0
+        # the pool is started the first time segments are created, and kept
+        # until shut_down()
+        self._segment_pool: Optional[ProcessPoolExecutor] = None
+        # the header blocks and block records of the last recent chain, by
+        # header hash. A new tip only has to load the blocks added since
+        self._recent_headers: Dict[bytes32, HeaderBlock] = {}
+        self._recent_records: Dict[bytes32, BlockRecord] = {}
+        # weight proofs are put together from serialized parts. Everything up
+        # to the last sub epoch summaries doesn't change as the chain grows,
+        # only the recent chain has to be serialized for a new tip.
+        # ses height -> (sub epoch summary, serialized SubEpochData)
+        self._sub_epoch_data_bytes: Dict[uint32, Tuple[SubEpochSummary, bytes]] = {}
+        # header hash -> serialized header block, for the last recent chain
+        self._recent_header_bytes: Dict[bytes32, bytes] = {}
 
     async def get_proof_of_weight(self, tip: bytes32) -> Optional[WeightProof]:
+        wp_bytes = await self.get_proof_of_weight_bytes(tip)
+        if wp_bytes is None:
+            return None
+        if self.proof_bytes is not wp_bytes:
+            # the proof was replaced by one for another tip in the meantime
+            return WeightProof.from_bytes(wp_bytes)
+        if self.proof is None:
+            self.proof = WeightProof.from_bytes(wp_bytes)
+        return self.proof
+
+    async def get_proof_of_weight_bytes(self, tip: bytes32) -> Optional[bytes]:
+        """
+        Returns the serialized weight proof for the tip, without creating the
+        WeightProof object
+        """
         tip_rec = self.blockchain.try_block_record(tip)
         if tip_rec is None:
             log.error("unknown tip")
@@ -83,15 +180,15 @@ class WeightProofHandler:
             return None
 
         async with self.lock:
-            if self.proof is not None:
-                if self.proof.recent_chain_data[-1].header_hash == tip:
-                    return self.proof
-            wp = await self._create_proof_of_weight(tip)
-            if wp is None:
+            if self.proof_bytes is not None and self.tip == tip:
+                return self.proof_bytes
+            wp_bytes = await self._create_proof_of_weight_bytes(tip)
+            if wp_bytes is None:
                 return None
-            self.proof = wp
+            self.proof_bytes = wp_bytes
+            self.proof = None
             self.tip = tip
-            return wp
+            return wp_bytes
 
     def get_sub_epoch_data(self, tip_height: uint32, summary_heights: List[uint32]) -> List[SubEpochData]:
         sub_epoch_data: List[SubEpochData] = []
@@ -103,12 +200,42 @@ class WeightProofHandler:
             sub_epoch_data.append(_create_sub_epoch_data(ses))
         return sub_epoch_data
 
+    def _get_sub_epoch_data_bytes(self, tip_height: uint32, summary_heights: List[uint32]) -> List[bytes]:
+        sub_epoch_data: List[bytes] = []
+        for ses_height in summary_heights:
+            if ses_height > tip_height:
+                break
+            ses = self.blockchain.get_ses(ses_height)
+            cached = self._sub_epoch_data_bytes.get(ses_height)
+            # the summary at this height changes if there was a reorg
+            if cached is None or cached[0] != ses:
+                cached = (ses, bytes(_create_sub_epoch_data(ses)))
+                self._sub_epoch_data_bytes[ses_height] = cached
+            sub_epoch_data.append(cached[1])
+        return sub_epoch_data
+
+    def _get_recent_chain_bytes(self, recent_chain: List[HeaderBlock]) -> bytes:
+        header_bytes: Dict[bytes32, bytes] = {}
+        for header_block in recent_chain:
+            b = self._recent_header_bytes.get(header_block.header_hash)
+            header_bytes[header_block.header_hash] = bytes(header_block) if b is None else b
+        self._recent_header_bytes = header_bytes
+        return b"".join([uint32(len(header_bytes)).stream_to_bytes(), *header_bytes.values()])
+
     async def _create_proof_of_weight(self, tip: bytes32) -> Optional[WeightProof]:
         """
         Creates a weight proof object
         """
+        wp_bytes = await self._create_proof_of_weight_bytes(tip)
+        if wp_bytes is None:
+            return None
+        return WeightProof.from_bytes(wp_bytes)
+
+    async def _create_proof_of_weight_bytes(self, tip: bytes32) -> Optional[bytes]:
+        """
+        Creates a serialized weight proof
+        """
         assert self.blockchain is not None
-        sub_epoch_segments: List[SubEpochChallengeSegment] = []
         tip_rec = self.blockchain.try_block_record(tip)
         if tip_rec is None:
             log.error("failed not tip in cache")
@@ -124,7 +251,7 @@ class WeightProofHandler:
         prev_ses_block = await self.blockchain.get_block_record_from_db(zero_hash)
         if prev_ses_block is None:
             return None
-        sub_epoch_data = self.get_sub_epoch_data(tip_rec.height, summary_heights)
+        sub_epoch_data = self._get_sub_epoch_data_bytes(tip_rec.height, summary_heights)
         # use second to last ses as seed
         seed = self.get_seed_for_proof(summary_heights, tip_rec.height)
         rng = random.Random(seed)
@@ -134,6 +261,8 @@ class WeightProofHandler:
         if ses_blocks is None:
             return None
 
+        # (sub epoch start, ses block, sub epoch number) of the sampled sub epochs
+        sampled: List[Tuple[BlockRecord, BlockRecord, uint32]] = []
         for sub_epoch_n, ses_height in enumerate(summary_heights):
             if ses_height > tip_rec.height:
                 break
@@ -151,19 +280,61 @@ class WeightProofHandler:
 
             if _sample_sub_epoch(prev_ses_block.weight, ses_block.weight, weight_to_check):
                 sample_n += 1
-                segments = await self.blockchain.get_sub_epoch_challenge_segments(ses_block.header_hash)
-                if segments is None:
-                    segments = await self.__create_sub_epoch_segments(ses_block, prev_ses_block, uint32(sub_epoch_n))
-                    if segments is None:
-                        log.error(
-                            f"failed while building segments for sub epoch {sub_epoch_n}, ses height {ses_height} "
-                        )
-                        return None
-                    await self.blockchain.persist_sub_epoch_challenge_segments(ses_block.header_hash, segments)
-                sub_epoch_segments.extend(segments)
+                sampled.append((prev_ses_block, ses_block, uint32(sub_epoch_n)))
             prev_ses_block = ses_block
+
+        sub_epoch_segments = await self._get_sampled_segments(sampled)
+        if sub_epoch_segments is None:
+            return None
         log.debug(f"sub_epochs: {len(sub_epoch_data)}")
-        return WeightProof(sub_epoch_data, sub_epoch_segments, recent_chain)
+        # this is the serialization of WeightProof
+        segments_count = 0
+        for segments_bytes in sub_epoch_segments:
+            segments_count += int.from_bytes(segments_bytes[:4], "big")
+        return b"".join(
+            [
+                uint32(len(sub_epoch_data)).stream_to_bytes(),
+                *sub_epoch_data,
+                uint32(segments_count).stream_to_bytes(),
+                *(memoryview(segments_bytes)[4:] for segments_bytes in sub_epoch_segments),
+                self._get_recent_chain_bytes(recent_chain),
+            ]
+        )
+
+    async def _get_sampled_segments(
+        self, sampled: List[Tuple[BlockRecord, BlockRecord, uint32]]
+    ) -> Optional[List[bytes]]:
+        """
+        Returns the serialized SubEpochSegments of the sampled sub epochs, as
+        stored in the database, creating the ones that aren't there yet
+        """
+        results: List[Optional[bytes]] = []
+        missing: List[int] = []
+        for _, ses_block, _ in sampled:
+            segments_bytes = await self.blockchain.get_sub_epoch_challenge_segments_bytes(ses_block.header_hash)
+            if segments_bytes is None:
+                missing.append(len(results))
+            results.append(segments_bytes)
+
+        created: List[Optional[List[SubEpochChallengeSegment]]] = []
+        if len(missing) > 0 and self._segment_processes > 0:
+            executor = self._segment_executor()
+            created = await asyncio.gather(
+                *(self.__create_persist_segment(*sampled[idx], executor=executor) for idx in missing)
+            )
+        else:
+            for idx in missing:
+                created.append(await self.__create_persist_segment(*sampled[idx]))
+        for idx, segments in zip(missing, created):
+            if segments is None:
+                return None
+            results[idx] = bytes(SubEpochSegments(segments))
+
+        sub_epoch_segments: List[bytes] = []
+        for segments_bytes in results:
+            assert segments_bytes is not None
+            sub_epoch_segments.append(segments_bytes)
+        return sub_epoch_segments
 
     def get_seed_for_proof(self, summary_heights: List[uint32], tip_height: uint32) -> bytes32:
         count = 0
@@ -190,8 +361,7 @@ class WeightProofHandler:
                 min_height = ses_height - 1
                 break
         log.debug(f"start {min_height} end {tip_height}")
-        headers = await self.blockchain.get_header_blocks_in_range(min_height, tip_height, tx_filter=False)
-        blocks = await self.blockchain.get_block_records_in_range(min_height, tip_height)
+        headers, blocks = await self._get_recent_blocks(min_height, tip_height)
         ses_count = 0
         curr_height = tip_height
         blocks_n = 0
@@ -224,6 +394,32 @@ class WeightProofHandler:
         )
         return recent_chain
 
+    async def _get_recent_blocks(
+        self, min_height: int, tip_height: uint32
+    ) -> Tuple[Dict[bytes32, HeaderBlock], Dict[bytes32, BlockRecord]]:
+        headers: Dict[bytes32, HeaderBlock] = {}
+        blocks: Dict[bytes32, BlockRecord] = {}
+        # reuse the blocks of the previous recent chain that are still in the
+        # main chain, and only load the ones from the first height that isn't
+        fetch_from = tip_height + 1
+        for height in range(min_height, tip_height + 1):
+            header_hash = self.blockchain.height_to_hash(uint32(height))
+            if (
+                header_hash is None
+                or header_hash not in self._recent_headers
+                or header_hash not in self._recent_records
+            ):
+                fetch_from = height
+                break
+            headers[header_hash] = self._recent_headers[header_hash]
+            blocks[header_hash] = self._recent_records[header_hash]
+        if fetch_from <= tip_height:
+            headers.update(await self.blockchain.get_header_blocks_in_range(fetch_from, tip_height, tx_filter=False))
+            blocks.update(await self.blockchain.get_block_records_in_range(fetch_from, tip_height))
+        self._recent_headers = headers
+        self._recent_records = blocks
+        return headers, blocks
+
     async def create_prev_sub_epoch_segments(self) -> None:
         log.debug("create prev sub_epoch_segments")
         heights = self.blockchain.get_ses_heights()
@@ -233,9 +429,13 @@ class WeightProofHandler:
         ses_sub_block = self.blockchain.height_to_block_record(heights[-2])
         prev_ses_sub_block = self.blockchain.height_to_block_record(heights[-3])
         assert prev_ses_sub_block.sub_epoch_summary_included is not None
-        segments = await self.__create_sub_epoch_segments(ses_sub_block, prev_ses_sub_block, uint32(count))
+        if self._segment_processes > 0:
+            segments = await self.__create_persist_segment(
+                prev_ses_sub_block, ses_sub_block, uint32(count), executor=self._segment_executor()
+            )
+        else:
+            segments = await self.__create_persist_segment(prev_ses_sub_block, ses_sub_block, uint32(count))
         assert segments is not None
-        await self.blockchain.persist_sub_epoch_challenge_segments(ses_sub_block.header_hash, segments)
         log.debug("sub_epoch_segments done")
         return None
 
@@ -262,6 +462,7 @@ class WeightProofHandler:
         if ses_blocks is None:
             return None
 
+        jobs: List[Tuple[BlockRecord, BlockRecord, uint32]] = []
         for sub_epoch_n, ses_height in enumerate(summary_heights):
             log.debug(f"check db for sub epoch {sub_epoch_n}")
             if ses_height > peak_height:
@@ -270,29 +471,102 @@ class WeightProofHandler:
             if ses_block is None or ses_block.sub_epoch_summary_included is None:
                 log.error("error while building proof")
                 return None
-            await self.__create_persist_segment(prev_ses_block, ses_block, ses_height, sub_epoch_n)
+            if self._segment_processes > 0:
+                jobs.append((prev_ses_block, ses_block, uint32(sub_epoch_n)))
+            else:
+                await self.__create_persist_segment(prev_ses_block, ses_block, uint32(sub_epoch_n))
+                await asyncio.sleep(2)
             prev_ses_block = ses_block
-            await asyncio.sleep(2)
+
+        if len(jobs) > 0:
+            # one sub epoch per task. Submit them in batches, so the segments
+            # waiting to be persisted don't pile up
+            for batch in to_batches(jobs, self._segment_processes * 2):
+                executor = self._segment_executor()
+                await asyncio.gather(*(self.__create_persist_segment(*job, executor=executor) for job in batch.entries))
         log.debug("done checking segments")
         return None
 
+    def _segment_executor(self) -> ProcessPoolExecutor:
+        if self._segment_pool is None:
+            self._segment_pool = ProcessPoolExecutor(
+                max_workers=self._segment_processes,
+                mp_context=self.multiprocessing_context,
+                initializer=setproctitle,
+                initargs=(f"{getproctitle()}_worker",),
+            )
+        return self._segment_pool
+
+    async def shut_down(self) -> None:
+        pool = self._segment_pool
+        self._segment_pool = None
+        if pool is not None:
+            # waiting for the processes to exit blocks, don't hold up the
+            # event loop
+            await asyncio.get_running_loop().run_in_executor(None, pool.shutdown)
+
     async def __create_persist_segment(
-        self, prev_ses_block: BlockRecord, ses_block: BlockRecord, ses_height: uint32, sub_epoch_n: int
-    ) -> None:
+        self,
+        prev_ses_block: BlockRecord,
+        ses_block: BlockRecord,
+        sub_epoch_n: uint32,
+        executor: Optional[ProcessPoolExecutor] = None,
+    ) -> Optional[List[SubEpochChallengeSegment]]:
         segments = await self.blockchain.get_sub_epoch_challenge_segments(ses_block.header_hash)
         if segments is None:
-            segments = await self.__create_sub_epoch_segments(ses_block, prev_ses_block, uint32(sub_epoch_n))
+            if executor is not None:
+                segments = await self.__create_sub_epoch_segments_in_process(
+                    executor, ses_block, prev_ses_block, sub_epoch_n
+                )
+            else:
+                segments = await self.__create_sub_epoch_segments(ses_block, prev_ses_block, sub_epoch_n)
             if segments is None:
-                log.error(f"failed while building segments for sub epoch {sub_epoch_n}, ses height {ses_height} ")
+                log.error(f"failed while building segments for sub epoch {sub_epoch_n}, ses height {ses_block.height} ")
                 return None
             await self.blockchain.persist_sub_epoch_challenge_segments(ses_block.header_hash, segments)
+        return segments
+
+    async def __create_sub_epoch_segments_in_process(
+        self, executor: ProcessPoolExecutor, ses_block: BlockRecord, se_start: BlockRecord, sub_epoch_n: uint32
+    ) -> Optional[List[SubEpochChallengeSegment]]:
+        assert self._db_path is not None
+        start_height = await self.get_prev_two_slots_height(se_start)
+        try:
+            segments_bytes = await asyncio.get_running_loop().run_in_executor(
+                executor,
+                _create_sub_epoch_segments_worker,
+                self.constants,
+                str(self._db_path),
+                bytes(ses_block),
+                bytes(se_start),
+                sub_epoch_n,
+                start_height,
+            )
+        except BrokenProcessPool as e:
+            log.error(f"exception while building segments for sub epoch {sub_epoch_n}: {e}")
+            # a worker died, the pool can't be used anymore. Start a new one
+            # next time
+            if self._segment_pool is executor:
+                self._segment_pool = None
+                executor.shutdown(wait=False)
+            return None
+        except Exception as e:
+            log.error(f"exception while building segments for sub epoch {sub_epoch_n}: {e}")
+            return None
+        if segments_bytes is None:
+            return None
+        return SubEpochSegments.from_bytes(segments_bytes).challenge_segments
 
     async def __create_sub_epoch_segments(
         self, ses_block: BlockRecord, se_start: BlockRecord, sub_epoch_n: uint32
     ) -> Optional[List[SubEpochChallengeSegment]]:
-        segments: List[SubEpochChallengeSegment] = []
         start_height = await self.get_prev_two_slots_height(se_start)
+        return await self._build_sub_epoch_segments(ses_block, se_start, sub_epoch_n, start_height)
 
+    async def _build_sub_epoch_segments(
+        self, ses_block: BlockRecord, se_start: BlockRecord, sub_epoch_n: uint32, start_height: uint32
+    ) -> Optional[List[SubEpochChallengeSegment]]:
+        segments: List[SubEpochChallengeSegment] = []
         blocks = await self.blockchain.get_block_records_in_range(
             start_height, ses_block.height + self.constants.MAX_SUB_SLOT_BLOCKS
         )
@@ -590,6 +864,14 @@ class WeightProofHandler:
         return True, fork_point
 
     async def validate_weight_proof(self, weight_proof: WeightProof) -> Tuple[bool, uint32, List[SubEpochSummary]]:
+        metrics = WeightProofValidationMetrics()
+        valid, fork_point, summaries = await self._validate_weight_proof(weight_proof, metrics)
+        self.validation_stats.record(metrics, valid)
+        return valid, fork_point, summaries
+
+    async def _validate_weight_proof(
+        self, weight_proof: WeightProof, metrics: WeightProofValidationMetrics
+    ) -> Tuple[bool, uint32, List[SubEpochSummary]]:
         assert self.blockchain is not None
         if len(weight_proof.sub_epochs) == 0:
             return False, uint32(0), []
@@ -625,6 +907,7 @@ class WeightProofHandler:
                         sub_epoch_weight_list,
                         False,
                         ses_fork_idx,
+                        metrics,
                     )
                 )
                 valid, _ = await task
@@ -714,6 +997,48 @@ def _create_sub_epoch_data(
     return SubEpochData(reward_chain_hash, previous_sub_epoch_overflows, sub_slot_iters, new_difficulty)
 
 
+def _create_sub_epoch_segments_worker(
+    constants: ConsensusConstants,
+    db_path: str,
+    ses_block_bytes: bytes,
+    se_start_bytes: bytes,
+    sub_epoch_n: uint32,
+    start_height: uint32,
+) -> Optional[bytes]:
+    """
+    Creates the challenge segments of one sub epoch in a worker process,
+    reading the blocks from a read-only connection to the (v2) blockchain
+    database. Returns the segments serialized as SubEpochSegments.
+    """
+    ses_block = BlockRecord.from_bytes(ses_block_bytes)
+    se_start = BlockRecord.from_bytes(se_start_bytes)
+    conn = sqlite3.connect(f"{Path(db_path).resolve().as_uri()}?mode=ro", uri=True)
+    try:
+        rows = conn.execute(
+            "SELECT header_hash, block_record, block FROM full_blocks "
+            "WHERE height >= ? AND height <= ? AND in_main_chain=1",
+            (start_height, ses_block.height + constants.MAX_SUB_SLOT_BLOCKS),
+        ).fetchall()
+    finally:
+        conn.close()
+
+    blocks: Dict[bytes32, BlockRecord] = {}
+    headers: Dict[bytes32, HeaderBlock] = {}
+    height_to_hash: Dict[uint32, bytes32] = {}
+    for row in rows:
+        header_hash = bytes32(row[0])
+        block_record = BlockRecord.from_bytes(row[1])
+        blocks[header_hash] = block_record
+        headers[header_hash] = get_block_header(FullBlock.from_bytes(decompress_blob(row[2])), [], [])
+        height_to_hash[block_record.height] = header_hash
+
+    handler = WeightProofHandler(constants, BlockCache(blocks, headers, height_to_hash))
+    segments = asyncio.run(handler._build_sub_epoch_segments(ses_block, se_start, sub_epoch_n, start_height))
+    if segments is None:
+        return None
+    return bytes(SubEpochSegments(segments))
+
+
 async def _challenge_block_vdfs(
     constants: ConsensusConstants,
     header_block: HeaderBlock,
@@ -924,14 +1249,36 @@ def _validate_sub_epoch_segments(
 ) -> Optional[List[Tuple[VDFProof, ClassgroupElement, VDFInfo]]]:
     summaries = summaries_from_bytes(summaries_bytes)
     sub_epoch_segments: SubEpochSegments = SubEpochSegments.from_bytes(weight_proof_bytes)
+    vdfs_to_validate: List[Tuple[VDFProof, ClassgroupElement, VDFInfo]] = []
+    for vdfs in _iter_sub_epoch_segments(
+        constants, rng, sub_epoch_segments.challenge_segments, summaries, height, validate_from
+    ):
+        if vdfs is None:
+            return None
+        vdfs_to_validate.extend(vdfs)
+    return vdfs_to_validate
+
+
+def _iter_sub_epoch_segments(
+    constants: ConsensusConstants,
+    rng: random.Random,
+    challenge_segments: List[SubEpochChallengeSegment],
+    summaries: List[SubEpochSummary],
+    height: uint32,
+    validate_from: int = 0,
+) -> Iterator[Optional[List[Tuple[VDFProof, ClassgroupElement, VDFInfo]]]]:
+    """
+    Validates the segments one sub epoch at a time, yielding the VDFs left to
+    validate for each sub epoch, so they can be validated while the next one
+    is checked. Yields None, and stops, at the first invalid sub epoch
+    """
     rc_sub_slot_hash = constants.GENESIS_CHALLENGE
     total_blocks, total_ip_iters = 0, 0
     total_slot_iters, total_slots = 0, 0
     total_ip_iters = 0
     prev_ses: Optional[SubEpochSummary] = None
-    segments_by_sub_epoch = map_segments_by_sub_epoch(sub_epoch_segments.challenge_segments)
+    segments_by_sub_epoch = map_segments_by_sub_epoch(challenge_segments)
     curr_ssi = constants.SUB_SLOT_ITERS_STARTING
-    vdfs_to_validate = []
     for sub_epoch_n, segments in segments_by_sub_epoch.items():
         prev_ssi = curr_ssi
         curr_difficulty, curr_ssi = _get_curr_diff_ssi(constants, sub_epoch_n, summaries)
@@ -944,12 +1291,14 @@ def _validate_sub_epoch_segments(
             rc_sub_slot_hash = rc_sub_slot.get_hash()
         if not summaries[sub_epoch_n].reward_chain_hash == rc_sub_slot_hash:
             log.error(f"failed reward_chain_hash validation sub_epoch {sub_epoch_n}")
-            return None
+            yield None
+            return
 
         # skip validation up to fork height
         if sub_epoch_n < validate_from:
             continue
 
+        vdfs_to_validate: List[Tuple[VDFProof, ClassgroupElement, VDFInfo]] = []
         for idx, segment in enumerate(segments):
             valid_segment, ip_iters, slot_iters, slots, vdf_list = _validate_segment(
                 constants,
@@ -965,13 +1314,14 @@ def _validate_sub_epoch_segments(
             vdfs_to_validate.extend(vdf_list)
             if not valid_segment:
                 log.error(f"failed to validate sub_epoch {segment.sub_epoch_n} segment {idx} slots")
-                return None
+                yield None
+                return
             prev_ses = None
             total_blocks += 1
             total_slot_iters += slot_iters
             total_slots += slots
             total_ip_iters += ip_iters
-    return vdfs_to_validate
+        yield vdfs_to_validate
 
 
 def _validate_segment(
@@ -1640,11 +1990,14 @@ async def validate_weight_proof_inner(
     sub_epoch_weight_list: List[uint128],
     skip_segment_validation: bool,
     validate_from: int,
+    metrics: Optional[WeightProofValidationMetrics] = None,
 ) -> Tuple[bool, List[BlockRecord]]:
     assert len(weight_proof.sub_epochs) > 0
     if len(weight_proof.sub_epochs) == 0:
         return False, []
 
+    if metrics is None:
+        metrics = WeightProofValidationMetrics()
     peak_height = weight_proof.recent_chain_data[-1].reward_chain_block.height
     log.info(f"validate weight proof peak height {peak_height}")
     seed = summaries[-2].get_hash()
@@ -1654,7 +2007,8 @@ async def validate_weight_proof_inner(
         return False, []
 
     loop = asyncio.get_running_loop()
-    summary_bytes, wp_segment_bytes, wp_recent_chain_bytes = vars_to_bytes(summaries, weight_proof)
+    summary_bytes = [bytes(summary) for summary in summaries]
+    wp_recent_chain_bytes = bytes(RecentChainData(weight_proof.recent_chain_data))
     recent_blocks_validation_task = loop.run_in_executor(
         executor,
         validate_recent_blocks,
@@ -1663,38 +2017,48 @@ async def validate_weight_proof_inner(
         summary_bytes,
         pathlib.Path(shutdown_file_name),
     )
+    _track_work(metrics, recent_blocks_validation_task, len(wp_recent_chain_bytes))
+
+    vdf_tasks: List[asyncio.Future[bool]] = []
+    try:
+        if not skip_segment_validation:
+            # the VDFs of every sub epoch are sent to the workers as soon as
+            # its segments are checked, and we stop at the first failure
+            for vdfs_to_validate in _iter_sub_epoch_segments(
+                constants, rng, weight_proof.sub_epoch_segments, summaries, peak_height, validate_from
+            ):
+                if vdfs_to_validate is None:
+                    return False, []
 
-    if not skip_segment_validation:
-        vdfs_to_validate = _validate_sub_epoch_segments(
-            constants, rng, wp_segment_bytes, summary_bytes, peak_height, validate_from
-        )
-        await asyncio.sleep(0)  # break up otherwise multi-second sync code
-
-        if vdfs_to_validate is None:
-            return False, []
-
-        vdf_tasks = []
-        for batch in to_batches(vdfs_to_validate, num_processes):
-            byte_chunks = []
-            for vdf_proof, classgroup, vdf_info in batch.entries:
-                byte_chunks.append((bytes(vdf_proof), bytes(classgroup), bytes(vdf_info)))
-            vdf_task = asyncio.get_running_loop().run_in_executor(
-                executor,
-                _validate_vdf_batch,
-                constants,
-                byte_chunks,
-                pathlib.Path(shutdown_file_name),
-            )
-            vdf_tasks.append(vdf_task)
-            # give other stuff a turn
-            await asyncio.sleep(0)
+                for batch in to_batches(vdfs_to_validate, num_processes):
+                    byte_chunks = []
+                    for vdf_proof, classgroup, vdf_info in batch.entries:
+                        byte_chunks.append((bytes(vdf_proof), bytes(classgroup), bytes(vdf_info)))
+                    vdf_task = loop.run_in_executor(
+                        executor,
+                        _validate_vdf_batch,
+                        constants,
+                        byte_chunks,
+                        pathlib.Path(shutdown_file_name),
+                    )
+                    _track_work(metrics, vdf_task, sum(len(a) + len(b) + len(c) for a, b, c in byte_chunks))
+                    vdf_tasks.append(vdf_task)
+                # give other stuff a turn
+                await asyncio.sleep(0)
+                if any(task.done() and not task.cancelled() and not task.result() for task in vdf_tasks):
+                    return False, []
 
-        for vdf_task in asyncio.as_completed(fs=vdf_tasks):
-            validated = await vdf_task
-            if not validated:
-                return False, []
+            for vdf_task in asyncio.as_completed(fs=vdf_tasks):
+                validated = await vdf_task
+                if not validated:
+                    return False, []
 
-    valid_recent_blocks, records_bytes = await recent_blocks_validation_task
+        valid_recent_blocks, records_bytes = await recent_blocks_validation_task
+    finally:
+        # drop the work that hasn't started yet, if we bailed out early
+        for vdf_task in vdf_tasks:
+            vdf_task.cancel()
+        recent_blocks_validation_task.cancel()
 
     if not valid_recent_blocks or records_bytes is None:
         log.error("failed validating weight proof recent blocks")
@@ -1703,3 +2067,8 @@ async def validate_weight_proof_inner(
 
     records = [BlockRecord.from_bytes(b) for b in records_bytes]
     return True, records
+
+
+def _track_work(metrics: WeightProofValidationMetrics, task: asyncio.Future[Any], size: int) -> None:
+    metrics.add_work(size)
+    task.add_done_callback(lambda _: metrics.remove_work(size))
@@ -163,6 +163,31 @@ class RequestMempoolTransactions(Streamable):
     filter: bytes
 
 
+@streamable
+@dataclass(frozen=True)
+class RequestMempoolInventory(Streamable):
+    max_items: uint32
+    # the key of the short ids, picked at random by the requesting peer
+    salt: uint64
+
+
+@streamable
+@dataclass(frozen=True)
+class RespondMempoolInventory(Streamable):
+    # the short ids (8 byte hashes of the spend bundle names, keyed with the
+    # salt of the request) of the transactions in the mempool, highest fee per
+    # cost first
+    short_ids: List[uint64]
+
+
+@streamable
+@dataclass(frozen=True)
+class RequestMempoolTransactionsByShortId(Streamable):
+    short_ids: List[uint64]
+    # the salt of the RequestMempoolInventory the short ids came from
+    salt: uint64
+
+
 @streamable
 @dataclass(frozen=True)
 class NewCompactVDF(Streamable):
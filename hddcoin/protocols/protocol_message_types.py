@@ -1,8 +1,9 @@
 from __future__ import annotations
 
-from enum import Enum
+from enum import Enum, unique
 
 
+@unique
 class ProtocolMessageTypes(Enum):
     # Shared protocol (all services)
     handshake = 1
@@ -114,4 +115,12 @@ class ProtocolMessageTypes(Enum):
     request_fee_estimates = 89
     respond_fee_estimates = 90
 
+    # Mempool sync by short transaction ids
+    request_mempool_inventory = 94
+    respond_mempool_inventory = 95
+    request_mempool_transactions_by_short_id = 96
+
+    # 254 is not a message type, it marks compressed messages on the wire. See
+    # hddcoin/server/message_compression.py
+
     error = 255
@@ -10,6 +10,7 @@ NO_REPLY_EXPECTED = [
     pmt.new_unfinished_block,
     pmt.new_signage_point_or_end_of_sub_slot,
     pmt.request_mempool_transactions,
+    pmt.request_mempool_transactions_by_short_id,
     pmt.new_compact_vdf,
     pmt.coin_state_update,
 ]
@@ -26,6 +27,7 @@ VALID_REPLY_MESSAGE_MAP = {
     # pmt.handshake is handled in WSHDDcoinConnection.perform_handshake
     # full_node -> full_node protocol messages
     pmt.request_transaction: [pmt.respond_transaction],
+    pmt.request_mempool_inventory: [pmt.respond_mempool_inventory],
     pmt.request_proof_of_weight: [pmt.respond_proof_of_weight],
     pmt.request_block: [pmt.respond_block, pmt.reject_block],
     pmt.request_blocks: [pmt.respond_blocks, pmt.reject_blocks],
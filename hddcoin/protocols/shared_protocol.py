@@ -31,6 +31,13 @@ class Capability(IntEnum):
     # a node can handle a None response and not wait the full timeout
     NONE_RESPONSE = 4
 
+    # introduces RequestMempoolInventory and RequestMempoolTransactionsByShortId. Peers supporting it sync their
+    # mempools by exchanging short transaction ids first, instead of sending a filter of their whole mempool
+    MEMPOOL_SHORT_IDS = 5
+
+    # messages of at least 16 KiB are sent zstd compressed, see hddcoin/server/message_compression.py
+    MESSAGE_COMPRESSION = 6
+
 
 @streamable
 @dataclass(frozen=True)
@@ -48,6 +55,8 @@ capabilities = [
     (uint16(Capability.BASE.value), "1"),
     (uint16(Capability.BLOCK_HEADERS.value), "1"),
     (uint16(Capability.RATE_LIMITS_V2.value), "1"),
+    (uint16(Capability.MEMPOOL_SHORT_IDS.value), "1"),
+    (uint16(Capability.MESSAGE_COMPRESSION.value), "1"),
     # (uint16(Capability.NONE_RESPONSE.value), "1"), # capability removed but functionality is still supported
 ]
 
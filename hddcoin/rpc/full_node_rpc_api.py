@@ -107,9 +107,14 @@ class FullNodeRpcApi:
             "/get_initial_freeze_period": self.get_initial_freeze_period,
             "/get_network_info": self.get_network_info,
             "/get_recent_signage_point_or_eos": self.get_recent_signage_point_or_eos,
+            "/get_sync_pipeline_stats": self.get_sync_pipeline_stats,
+            "/get_cache_stats": self.get_cache_stats,
+            "/get_weight_proof_stats": self.get_weight_proof_stats,
+            "/get_transaction_queue_stats": self.get_transaction_queue_stats,
             # Coins
             "/get_coin_records_by_puzzle_hash": self.get_coin_records_by_puzzle_hash,
             "/get_coin_records_by_puzzle_hashes": self.get_coin_records_by_puzzle_hashes,
+            "/get_coin_states_by_puzzle_hashes": self.get_coin_states_by_puzzle_hashes,
             "/get_coin_record_by_name": self.get_coin_record_by_name,
             "/get_coin_records_by_names": self.get_coin_records_by_names,
             "/get_coin_records_by_parent_ids": self.get_coin_records_by_parent_ids,
@@ -121,6 +126,7 @@ class FullNodeRpcApi:
             "/get_all_mempool_items": self.get_all_mempool_items,
             "/get_mempool_item_by_tx_id": self.get_mempool_item_by_tx_id,
             "/get_mempool_items_by_coin_name": self.get_mempool_items_by_coin_name,
+            "/get_mempool_fee_histogram": self.get_mempool_fee_histogram,
             # Fee estimation
             "/get_fee_estimate": self.get_fee_estimate,
         }
@@ -284,11 +290,48 @@ class FullNodeRpcApi:
         self.cached_blockchain_state = dict(response["blockchain_state"])
         return response
 
+    async def get_cache_stats(self, _: Dict[str, Any]) -> EndpointResult:
+        """
+        Returns the size and hit/miss counters of the block, generator, coin and BLS pairing caches. Disabled caches are
+        None.
+        """
+        unspent_index = self.service.coin_store.unspent_index
+        pairing_cache = self.service.pairing_cache
+        return {
+            "block_cache": self.service.block_store.blob_cache.get_stats(),
+            "generator_cache": self.service.block_store.get_generator_stats(),
+            "unspent_coin_index": None if unspent_index is None else unspent_index.get_stats(),
+            "pairing_cache": None if pairing_cache is None else pairing_cache.get_stats(),
+        }
+
+    async def get_transaction_queue_stats(self, _: Dict[str, Any]) -> EndpointResult:
+        """
+        Returns the number of transactions waiting to be validated, and for every peer, the number and estimated cost
+        of its queued transactions, its scheduling weight and how many of its transactions were accepted, rejected and
+        dropped because its queue was full.
+        """
+        return {"transaction_queue_stats": self.service.transaction_queue.get_stats()}
+
+    async def get_weight_proof_stats(self, _: Dict[str, Any]) -> EndpointResult:
+        """
+        Returns the number of weight proofs validated and rejected, how long rejecting them took and the peak
+        number of bytes queued to the validation workers.
+        """
+        handler = self.service.weight_proof_handler
+        return {"weight_proof_stats": None if handler is None else handler.validation_stats.to_json_dict()}
+
     async def get_network_info(self, _: Dict[str, Any]) -> EndpointResult:
         network_name = self.service.config["selected_network"]
         address_prefix = self.service.config["network_overrides"]["config"][network_name]["address_prefix"]
         return {"network_name": network_name, "network_prefix": address_prefix}
 
+    async def get_sync_pipeline_stats(self, _: Dict[str, Any]) -> EndpointResult:
+        """
+        Returns the per-stage timing of the current (or last) long sync, or None if there hasn't been one.
+        """
+        stats = self.service.sync_pipeline_stats
+        return {"sync_pipeline_stats": None if stats is None else stats.to_json_dict()}
+
     async def get_recent_signage_point_or_eos(self, request: Dict[str, Any]) -> EndpointResult:
         if "sp_hash" not in request:
             challenge_hash: bytes32 = bytes32.from_hexstr(request["challenge_hash"])
@@ -652,6 +695,33 @@ class FullNodeRpcApi:
 
         return {"coin_records": [coin_record_dict_backwards_compat(cr.to_json_dict()) for cr in coin_records]}
 
+    async def get_coin_states_by_puzzle_hashes(self, request: Dict[str, Any]) -> EndpointResult:
+        """
+        Retrieves one page of the coin states for the given puzzle hashes, ordered by confirmed height and coin id.
+        Pass the returned next_height and next_start_after as start_height and start_after to get the next page.
+        They are None after the last page.
+        """
+        if "puzzle_hashes" not in request:
+            raise ValueError("Puzzle hashes not in request")
+        max_items = int(request.get("max_items", 10000))
+        if max_items <= 0 or max_items > 100000:
+            raise ValueError("max_items must be between 1 and 100000")
+
+        start_after = request.get("start_after")
+        states, next_page = await self.service.blockchain.coin_store.get_coin_states_by_puzzle_hashes_paginated(
+            bool(request.get("include_spent_coins", True)),
+            [bytes32.from_hexstr(ph) for ph in request["puzzle_hashes"]],
+            uint32(request.get("min_height", 0)),
+            start_height=uint32(request.get("start_height", 0)),
+            start_after=None if start_after is None else bytes32.from_hexstr(start_after),
+            max_items=max_items,
+        )
+        return {
+            "coin_states": [state.to_json_dict() for state in states],
+            "next_height": None if next_page is None else next_page[0],
+            "next_start_after": None if next_page is None else next_page[1].hex(),
+        }
+
     async def get_coin_record_by_name(self, request: Dict[str, Any]) -> EndpointResult:
         """
         Retrieves a coin record by its name.
@@ -837,6 +907,14 @@ class FullNodeRpcApi:
 
         return {"mempool_items": [item.to_json_dict() for item in items]}
 
+    async def get_mempool_fee_histogram(self, _: Dict[str, Any]) -> EndpointResult:
+        """
+        Returns the cost of the mempool items by fee per cost (highest first, along with the cost of the items paying
+        at least as much), the cost weighted percentiles of the fee per cost, and the fee per cost needed to get into
+        the next block. Unlike get_all_mempool_items, this doesn't go through the items, it's cheap enough to poll.
+        """
+        return {"fee_histogram": self.service.mempool_manager.mempool.get_fee_histogram()}
+
     def _get_spendbundle_type_cost(self, name: str) -> uint64:
         """
         This is a stopgap until we modify the wallet RPCs to get exact costs for created SpendBundles
@@ -4,6 +4,7 @@ from typing import Any, Dict, List, Optional, Tuple, cast
 
 from hddcoin.consensus.block_record import BlockRecord
 from hddcoin.full_node.signage_point import SignagePoint
+from hddcoin.protocols.wallet_protocol import CoinState
 from hddcoin.rpc.rpc_client import RpcClient
 from hddcoin.types.blockchain_format.sized_bytes import bytes32
 from hddcoin.types.coin_record import CoinRecord
@@ -65,6 +66,27 @@ class FullNodeRpcClient(RpcClient):
             return None
         return BlockRecord.from_json_dict(response["block_record"])
 
+    async def get_sync_pipeline_stats(self) -> Optional[Dict[str, Any]]:
+        response = await self.fetch("get_sync_pipeline_stats", {})
+        return cast(Optional[Dict[str, Any]], response["sync_pipeline_stats"])
+
+    async def get_cache_stats(self) -> Dict[str, Any]:
+        response = await self.fetch("get_cache_stats", {})
+        return {
+            "block_cache": response["block_cache"],
+            "generator_cache": response["generator_cache"],
+            "unspent_coin_index": response["unspent_coin_index"],
+            "pairing_cache": response["pairing_cache"],
+        }
+
+    async def get_weight_proof_stats(self) -> Optional[Dict[str, Any]]:
+        response = await self.fetch("get_weight_proof_stats", {})
+        return cast(Optional[Dict[str, Any]], response["weight_proof_stats"])
+
+    async def get_transaction_queue_stats(self) -> Dict[str, Any]:
+        response = await self.fetch("get_transaction_queue_stats", {})
+        return cast(Dict[str, Any], response["transaction_queue_stats"])
+
     async def get_unfinished_block_headers(self) -> List[UnfinishedHeaderBlock]:
         response = await self.fetch("get_unfinished_block_headers", {})
         return [UnfinishedHeaderBlock.from_json_dict(r) for r in response["headers"]]
@@ -142,6 +164,31 @@ class FullNodeRpcClient(RpcClient):
         response = await self.fetch("get_coin_records_by_puzzle_hashes", d)
         return [CoinRecord.from_json_dict(coin_record_dict_backwards_compat(coin)) for coin in response["coin_records"]]
 
+    async def get_coin_states_by_puzzle_hashes(
+        self,
+        puzzle_hashes: List[bytes32],
+        include_spent_coins: bool = True,
+        min_height: int = 0,
+        start_height: int = 0,
+        start_after: Optional[bytes32] = None,
+        max_items: int = 10000,
+    ) -> Tuple[List[CoinState], Optional[Tuple[uint32, bytes32]]]:
+        d: Dict[str, Any] = {
+            "puzzle_hashes": [ph.hex() for ph in puzzle_hashes],
+            "include_spent_coins": include_spent_coins,
+            "min_height": min_height,
+            "start_height": start_height,
+            "max_items": max_items,
+        }
+        if start_after is not None:
+            d["start_after"] = start_after.hex()
+        response = await self.fetch("get_coin_states_by_puzzle_hashes", d)
+        next_height = response["next_height"]
+        return (
+            [CoinState.from_json_dict(state) for state in response["coin_states"]],
+            None if next_height is None else (uint32(next_height), bytes32.from_hexstr(response["next_start_after"])),
+        )
+
     async def get_coin_records_by_parent_ids(
         self,
         parent_ids: List[bytes32],
@@ -257,6 +304,10 @@ class FullNodeRpcClient(RpcClient):
         response = await self.fetch("get_mempool_items_by_coin_name", {"coin_name": coin_name.hex()})
         return response
 
+    async def get_mempool_fee_histogram(self) -> Dict[str, Any]:
+        response = await self.fetch("get_mempool_fee_histogram", {})
+        return cast(Dict[str, Any], response["fee_histogram"])
+
     async def get_recent_signage_point_or_eos(
         self, sp_hash: Optional[bytes32], challenge_hash: Optional[bytes32]
     ) -> Optional[Any]:
@@ -102,6 +102,19 @@ class RpcClient:
     async def close_connection(self, node_id: bytes32) -> Dict:
         return await self.fetch("close_connection", {"node_id": node_id.hex()})
 
+    async def get_peer_rate_limits(self, node_id: Optional[bytes32] = None) -> List[Dict]:
+        request = {}
+        if node_id is not None:
+            request["node_id"] = node_id.hex()
+        response = await self.fetch("get_peer_rate_limits", request)
+        for peer in response["peers"]:
+            peer["node_id"] = hexstr_to_bytes(peer["node_id"])
+        return response["peers"]
+
+    async def get_inbound_dispatch_stats(self) -> Dict[str, Dict]:
+        response = await self.fetch("get_inbound_dispatch_stats", {})
+        return response["classes"]
+
     async def stop_node(self) -> Dict:
         return await self.fetch("stop_node", {})
 
@@ -20,9 +20,11 @@ from hddcoin.server.ws_connection import WSHDDcoinConnection
 from hddcoin.types.peer_info import PeerInfo
 from hddcoin.util.byte_types import hexstr_to_bytes
 from hddcoin.util.config import str2bool
+from hddcoin.util.db_wrapper import low_priority_reads
 from hddcoin.util.ints import uint16
 from hddcoin.util.json_util import dict_to_json_str
 from hddcoin.util.network import WebServer, resolve
+from hddcoin.util.prometheus import METRICS_CONTENT_TYPE, MetricsWriter
 from hddcoin.util.ws_message import WsRpcMessage, create_payload, create_payload_dict, format_response, pong
 
 log = logging.getLogger(__name__)
@@ -113,6 +115,9 @@ def default_get_connections(server: HDDcoinServer, request_node_type: Optional[N
             "creation_time": con.creation_time,
             "bytes_read": con.bytes_read,
             "bytes_written": con.bytes_written,
+            "compression": con.compression_stats.to_json_dict(),
+            "stats": con.stats.to_json_dict(),
+            "outbound_queue": con.outgoing_queue.qsize(),
             "last_message_time": con.last_message_time,
         }
         for con in connections
@@ -174,7 +179,10 @@ class RpcServer(Generic[_T_RpcApiProtocol]):
             hostname=self_hostname,
             port=rpc_port,
             max_request_body_size=max_request_body_size,
-            routes=[web.post(route, wrap_http_handler(func)) for (route, func) in self._get_routes().items()],
+            routes=[
+                *(web.post(route, wrap_http_handler(func)) for (route, func) in self._get_routes().items()),
+                web.get("/metrics", self.metrics),
+            ],
             ssl_context=self.ssl_context,
             prefer_ipv6=self.prefer_ipv6,
         )
@@ -238,6 +246,8 @@ class RpcServer(Generic[_T_RpcApiProtocol]):
             "/get_connections": self.get_connections,
             "/open_connection": self.open_connection,
             "/close_connection": self.close_connection,
+            "/get_peer_rate_limits": self.get_peer_rate_limits,
+            "/get_inbound_dispatch_stats": self.get_inbound_dispatch_stats,
             "/stop_node": self.stop_node,
             "/get_routes": self.get_routes,
             "/healthz": self.healthz,
@@ -281,6 +291,51 @@ class RpcServer(Generic[_T_RpcApiProtocol]):
             await connection.close()
         return {}
 
+    async def get_peer_rate_limits(self, request: Dict[str, Any]) -> EndpointResult:
+        """
+        How much of the rate limits each peer uses, in both directions.
+        """
+        if self.rpc_api.service.server is None:
+            raise web.HTTPInternalServerError()
+        node_id: Optional[bytes] = None
+        if "node_id" in request:
+            node_id = hexstr_to_bytes(request["node_id"])
+        peers = []
+        for connection in self.rpc_api.service.server.get_connections():
+            if node_id is not None and connection.peer_node_id != node_id:
+                continue
+            peers.append(
+                {
+                    "node_id": connection.peer_node_id,
+                    "peer_host": connection.peer_info.host,
+                    "peer_port": connection.peer_info.port,
+                    "type": connection.connection_type,
+                    "inbound": connection.inbound_rate_limiter.get_utilization(),
+                    "outbound": connection.outbound_rate_limiter.get_utilization(),
+                }
+            )
+        return {"peers": peers}
+
+    async def get_inbound_dispatch_stats(self, request: Dict[str, Any]) -> EndpointResult:
+        """
+        The worker pools handling the messages from peers, by class of message:
+        how busy they are, and how long messages waited in their queues.
+        """
+        if self.rpc_api.service.server is None:
+            raise web.HTTPInternalServerError()
+        dispatcher = self.rpc_api.service.server.inbound_dispatcher
+        return {"classes": {} if dispatcher is None else dispatcher.get_stats()}
+
+    async def metrics(self, request: web.Request) -> web.Response:
+        """
+        The metrics of the service's peer connections, in the Prometheus text
+        format, for scraping with the private certificate.
+        """
+        writer = MetricsWriter()
+        if self.rpc_api.service.server is not None:
+            self.rpc_api.service.server.write_metrics(writer)
+        return web.Response(body=writer.text().encode(), headers={"Content-Type": METRICS_CONTENT_TYPE})
+
     async def stop_node(self, request: Dict[str, Any]) -> EndpointResult:
         """
         Shuts down the node.
@@ -323,7 +378,8 @@ class RpcServer(Generic[_T_RpcApiProtocol]):
         try:
             message = json.loads(payload)
             log.debug(f"Rpc call <- {message['command']}")
-            response = await self.ws_api(message)
+            with low_priority_reads():
+                response = await self.ws_api(message)
 
             # Only respond if we return something from api call
             if response is not None:
@@ -7,6 +7,7 @@ from typing import Any, Callable, Coroutine, Dict, List, Optional, Tuple
 import aiohttp
 
 from hddcoin.types.blockchain_format.coin import Coin
+from hddcoin.util.db_wrapper import low_priority_reads
 from hddcoin.util.json_util import obj_to_response
 from hddcoin.wallet.conditions import Condition, ConditionValidTimes, conditions_from_json_dicts, parse_timelock_info
 from hddcoin.wallet.util.tx_config import TXConfig, TXConfigLoader
@@ -18,7 +19,10 @@ def wrap_http_handler(f) -> Callable:
     async def inner(request) -> aiohttp.web.Response:
         request_data = await request.json()
         try:
-            res_object = await f(request_data)
+            # RPC requests may scan large parts of the database, don't let
+            # them hold up the reads of the service itself
+            with low_priority_reads():
+                res_object = await f(request_data)
             if res_object is None:
                 res_object = {}
             if "success" not in res_object:
@@ -102,6 +102,18 @@ class CrawlerAPI:
     ) -> Optional[Message]:
         pass
 
+    @api_request()
+    async def request_mempool_inventory(self, request: full_node_protocol.RequestMempoolInventory) -> Optional[Message]:
+        pass
+
+    @api_request(peer_required=True)
+    async def request_mempool_transactions_by_short_id(
+        self,
+        request: full_node_protocol.RequestMempoolTransactionsByShortId,
+        peer: WSHDDcoinConnection,
+    ) -> Optional[Message]:
+        pass
+
     @api_request()
     async def request_block_header(self, request: wallet_protocol.RequestBlockHeader) -> Optional[Message]:
         pass
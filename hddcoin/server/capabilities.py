@@ -22,3 +22,12 @@ def known_active_capabilities(values: Iterable[Tuple[uint16, str]]) -> List[Capa
 
     # TODO: consider changing all uses to sets instead of lists
     return list(filtered)
+
+
+def negotiated(
+    capability: Capability, local_capabilities: Iterable[Capability], peer_capabilities: Iterable[Capability]
+) -> bool:
+    """
+    A capability can be used on a connection when both sides support it.
+    """
+    return capability in local_capabilities and capability in peer_capabilities
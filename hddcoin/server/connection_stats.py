@@ -0,0 +1,66 @@
+from __future__ import annotations
+
+import dataclasses
+from typing import Any, Dict, Optional
+
+from hddcoin.util.latency_histogram import LatencyHistogram
+
+
+@dataclasses.dataclass
+class ConnectionStats:
+    """
+    Timings of the messages of a connection, by message type name: the round
+    trips of our requests to the peer, the time our API took to handle the
+    peer's messages, and the time our rate limiter held back messages to the
+    peer. Also the most messages that waited in the outbound queue at once.
+    """
+
+    request_latency: Dict[str, LatencyHistogram] = dataclasses.field(default_factory=dict)
+    request_timeouts: Dict[str, int] = dataclasses.field(default_factory=dict)
+    handler_latency: Dict[str, LatencyHistogram] = dataclasses.field(default_factory=dict)
+    rate_limited_seconds: Dict[str, float] = dataclasses.field(default_factory=dict)
+    rate_limited_messages: Dict[str, int] = dataclasses.field(default_factory=dict)
+    max_outbound_queue: int = 0
+
+    def add_request(self, message_type: str, seconds: Optional[float]) -> None:
+        """
+        seconds is None for requests that got no response
+        """
+        if seconds is None:
+            self.request_timeouts[message_type] = self.request_timeouts.get(message_type, 0) + 1
+        else:
+            self.request_latency.setdefault(message_type, LatencyHistogram()).add(seconds)
+
+    def add_handler(self, message_type: str, seconds: float) -> None:
+        self.handler_latency.setdefault(message_type, LatencyHistogram()).add(seconds)
+
+    def add_rate_limited(self, message_type: str, seconds: float) -> None:
+        self.rate_limited_seconds[message_type] = self.rate_limited_seconds.get(message_type, 0.0) + seconds
+        self.rate_limited_messages[message_type] = self.rate_limited_messages.get(message_type, 0) + 1
+
+    def add_outbound_queue(self, depth: int) -> None:
+        if depth > self.max_outbound_queue:
+            self.max_outbound_queue = depth
+
+    def merge(self, other: ConnectionStats) -> None:
+        for message_type, histogram in other.request_latency.items():
+            self.request_latency.setdefault(message_type, LatencyHistogram()).merge(histogram)
+        for message_type, histogram in other.handler_latency.items():
+            self.handler_latency.setdefault(message_type, LatencyHistogram()).merge(histogram)
+        for message_type, count in other.request_timeouts.items():
+            self.request_timeouts[message_type] = self.request_timeouts.get(message_type, 0) + count
+        for message_type, seconds in other.rate_limited_seconds.items():
+            self.rate_limited_seconds[message_type] = self.rate_limited_seconds.get(message_type, 0.0) + seconds
+        for message_type, count in other.rate_limited_messages.items():
+            self.rate_limited_messages[message_type] = self.rate_limited_messages.get(message_type, 0) + count
+        self.max_outbound_queue = max(self.max_outbound_queue, other.max_outbound_queue)
+
+    def to_json_dict(self) -> Dict[str, Any]:
+        return {
+            "request_latency": {t: h.to_json_dict() for t, h in self.request_latency.items()},
+            "request_timeouts": dict(self.request_timeouts),
+            "handler_latency": {t: h.to_json_dict() for t, h in self.handler_latency.items()},
+            "rate_limited_seconds": dict(self.rate_limited_seconds),
+            "rate_limited_messages": dict(self.rate_limited_messages),
+            "max_outbound_queue": self.max_outbound_queue,
+        }
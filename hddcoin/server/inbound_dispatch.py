@@ -0,0 +1,349 @@
+from __future__ import annotations
+
+import asyncio
+import dataclasses
+import logging
+import time
+from collections import OrderedDict, deque
+from enum import Enum
+from typing import Any, Deque, Dict, List, Optional, Tuple
+
+from typing_extensions import Protocol
+
+from hddcoin.protocols.protocol_message_types import ProtocolMessageTypes
+from hddcoin.server.outbound_message import Message
+from hddcoin.util.db_wrapper import normal_priority_reads
+from hddcoin.util.latency_histogram import LatencyHistogram
+
+# how often dropped messages are logged, per class
+DROPPED_LOG_INTERVAL = 60
+
+
+class DispatchClass(Enum):
+    consensus = "consensus"
+    requests = "requests"
+    sync = "sync"
+    tx = "tx"
+    wallet = "wallet"
+    misc = "misc"
+
+
+# (workers, queue_size, peer_queue_size) of each class, unless set in the config
+DEFAULT_DISPATCH_CONFIG: Dict[DispatchClass, Tuple[int, int, int]] = {
+    DispatchClass.consensus: (16, 1000, 100),
+    DispatchClass.requests: (8, 500, 50),
+    DispatchClass.sync: (8, 200, 20),
+    DispatchClass.tx: (16, 5000, 500),
+    DispatchClass.wallet: (32, 2000, 200),
+    DispatchClass.misc: (8, 500, 50),
+}
+
+# the classes whose messages wait for room in their queue, rather than being
+# dropped. Missing a new peak or block can leave us behind the chain, so the
+# connection holds its messages back until there is room. The inbound rate
+# limits bound how many it holds
+BACKPRESSURE_CLASSES = {DispatchClass.consensus}
+
+_consensus = [
+    # full node
+    ProtocolMessageTypes.new_peak,
+    ProtocolMessageTypes.respond_block,
+    ProtocolMessageTypes.reject_block,
+    ProtocolMessageTypes.new_unfinished_block,
+    ProtocolMessageTypes.respond_unfinished_block,
+    ProtocolMessageTypes.new_signage_point_or_end_of_sub_slot,
+    ProtocolMessageTypes.respond_signage_point,
+    ProtocolMessageTypes.respond_end_of_sub_slot,
+    # farmer and harvester
+    ProtocolMessageTypes.new_signage_point,
+    ProtocolMessageTypes.declare_proof_of_space,
+    ProtocolMessageTypes.request_signed_values,
+    ProtocolMessageTypes.signed_values,
+    ProtocolMessageTypes.farming_info,
+    ProtocolMessageTypes.new_signage_point_harvester,
+    ProtocolMessageTypes.new_proof_of_space,
+    ProtocolMessageTypes.request_signatures,
+    ProtocolMessageTypes.respond_signatures,
+    # timelord
+    ProtocolMessageTypes.new_peak_timelord,
+    ProtocolMessageTypes.new_unfinished_block_timelord,
+    ProtocolMessageTypes.new_infusion_point_vdf,
+    ProtocolMessageTypes.new_signage_point_vdf,
+    ProtocolMessageTypes.new_end_of_sub_slot_vdf,
+    # simulator
+    ProtocolMessageTypes.farm_new_block,
+]
+
+# peers asking us for the blocks and signage points they heard of from us
+_requests = [
+    ProtocolMessageTypes.request_block,
+    ProtocolMessageTypes.request_unfinished_block,
+    ProtocolMessageTypes.request_signage_point_or_end_of_sub_slot,
+]
+
+_sync = [
+    ProtocolMessageTypes.request_proof_of_weight,
+    ProtocolMessageTypes.respond_proof_of_weight,
+    ProtocolMessageTypes.request_blocks,
+    ProtocolMessageTypes.respond_blocks,
+    ProtocolMessageTypes.reject_blocks,
+    ProtocolMessageTypes.request_compact_vdf,
+    ProtocolMessageTypes.respond_compact_vdf,
+    ProtocolMessageTypes.new_compact_vdf,
+    ProtocolMessageTypes.request_compact_proof_of_time,
+    ProtocolMessageTypes.respond_compact_proof_of_time,
+]
+
+_tx = [
+    ProtocolMessageTypes.new_transaction,
+    ProtocolMessageTypes.request_transaction,
+    ProtocolMessageTypes.respond_transaction,
+    ProtocolMessageTypes.request_mempool_transactions,
+    ProtocolMessageTypes.request_mempool_inventory,
+    ProtocolMessageTypes.respond_mempool_inventory,
+    ProtocolMessageTypes.request_mempool_transactions_by_short_id,
+    ProtocolMessageTypes.send_transaction,
+    ProtocolMessageTypes.transaction_ack,
+]
+
+_wallet = [
+    ProtocolMessageTypes.request_puzzle_solution,
+    ProtocolMessageTypes.respond_puzzle_solution,
+    ProtocolMessageTypes.reject_puzzle_solution,
+    ProtocolMessageTypes.new_peak_wallet,
+    ProtocolMessageTypes.request_block_header,
+    ProtocolMessageTypes.respond_block_header,
+    ProtocolMessageTypes.reject_header_request,
+    ProtocolMessageTypes.request_removals,
+    ProtocolMessageTypes.respond_removals,
+    ProtocolMessageTypes.reject_removals_request,
+    ProtocolMessageTypes.request_additions,
+    ProtocolMessageTypes.respond_additions,
+    ProtocolMessageTypes.reject_additions_request,
+    ProtocolMessageTypes.request_header_blocks,
+    ProtocolMessageTypes.reject_header_blocks,
+    ProtocolMessageTypes.respond_header_blocks,
+    ProtocolMessageTypes.coin_state_update,
+    ProtocolMessageTypes.register_interest_in_puzzle_hash,
+    ProtocolMessageTypes.respond_to_ph_update,
+    ProtocolMessageTypes.register_interest_in_coin,
+    ProtocolMessageTypes.respond_to_coin_update,
+    ProtocolMessageTypes.request_children,
+    ProtocolMessageTypes.respond_children,
+    ProtocolMessageTypes.request_ses_hashes,
+    ProtocolMessageTypes.respond_ses_hashes,
+    ProtocolMessageTypes.request_block_headers,
+    ProtocolMessageTypes.reject_block_headers,
+    ProtocolMessageTypes.respond_block_headers,
+    ProtocolMessageTypes.request_fee_estimates,
+    ProtocolMessageTypes.respond_fee_estimates,
+]
+
+# message type value -> class. Message types not in here (peers, plot sync,
+# handshakes and errors) are misc
+dispatch_classes: Dict[int, DispatchClass] = {
+    **{t.value: DispatchClass.consensus for t in _consensus},
+    **{t.value: DispatchClass.requests for t in _requests},
+    **{t.value: DispatchClass.sync for t in _sync},
+    **{t.value: DispatchClass.tx for t in _tx},
+    **{t.value: DispatchClass.wallet for t in _wallet},
+}
+
+
+def get_dispatch_class(message_type: int) -> DispatchClass:
+    return dispatch_classes.get(message_type, DispatchClass.misc)
+
+
+class DispatchTarget(Protocol):
+    closed: bool
+
+    async def run_api_call(self, message: Message) -> None:
+        ...
+
+
+# a message waiting for a worker, with the connection it came from and the time
+# it was queued
+QueuedMessage = Tuple[DispatchTarget, Message, float]
+
+
+@dataclasses.dataclass
+class DispatchPool:
+    """
+    The workers handling the messages of a dispatch class, and the messages
+    waiting for them. The messages wait in a queue per connection, and the
+    workers take them from the connections in turn, so a peer sending a flood
+    of messages only holds up its own.
+    """
+
+    dispatch_class: DispatchClass
+    workers: int
+    # the most messages waiting, from all the connections and from any one
+    queue_size: int
+    peer_queue_size: int
+    backpressure: bool
+    # the queues of the connections with messages waiting, by id() of the
+    # connection, in the order the workers take turns at them
+    waiting: OrderedDict[int, Deque[QueuedMessage]] = dataclasses.field(default_factory=OrderedDict)
+    queued: int = 0
+    # created when the dispatcher starts, in the event loop. ready counts the
+    # messages waiting, room is notified when one is taken off the queues
+    ready: Optional[asyncio.Semaphore] = None
+    room: Optional[asyncio.Condition] = None
+    # the connections waiting for room to queue a message
+    blocked: int = 0
+    busy: int = 0
+    processed: int = 0
+    dropped: int = 0
+    last_dropped_log: float = 0.0
+    # the time messages spent in the queue
+    wait: LatencyHistogram = dataclasses.field(default_factory=LatencyHistogram)
+
+    def has_room(self, connection: DispatchTarget) -> bool:
+        if self.queued >= self.queue_size:
+            return False
+        queue = self.waiting.get(id(connection))
+        return queue is None or len(queue) < self.peer_queue_size
+
+    def put(self, connection: DispatchTarget, message: Message) -> None:
+        queue = self.waiting.get(id(connection))
+        if queue is None:
+            queue = deque()
+            self.waiting[id(connection)] = queue
+        queue.append((connection, message, time.monotonic()))
+        self.queued += 1
+
+    def take(self) -> QueuedMessage:
+        key, queue = next(iter(self.waiting.items()))
+        ret = queue.popleft()
+        if len(queue) == 0:
+            del self.waiting[key]
+        else:
+            self.waiting.move_to_end(key)
+        self.queued -= 1
+        return ret
+
+    def to_json_dict(self) -> Dict[str, Any]:
+        return {
+            "workers": self.workers,
+            "queue_size": self.queue_size,
+            "peer_queue_size": self.peer_queue_size,
+            "queued": self.queued,
+            "queued_peers": len(self.waiting),
+            "blocked": self.blocked,
+            "busy": self.busy,
+            "processed": self.processed,
+            "dropped": self.dropped,
+            "wait": self.wait.to_json_dict(),
+        }
+
+
+@dataclasses.dataclass
+class InboundDispatcher:
+    """
+    Handles the messages peers send us, other than responses to our requests.
+    Each class of messages has its own queues and a fixed number of workers,
+    so a flood of transactions or peer requests can't hold up the handling of
+    new peaks and blocks. The workers are shared by all the connections of the
+    server. A message that arrives when there's no room for it is dropped,
+    unless its class applies backpressure.
+    """
+
+    log: logging.Logger
+    pools: Dict[DispatchClass, DispatchPool]
+    tasks: List[asyncio.Task[None]] = dataclasses.field(default_factory=list)
+
+    @classmethod
+    def create(cls, config: Dict[str, Any], log: logging.Logger) -> InboundDispatcher:
+        """
+        config maps class names to their workers, queue_size and
+        peer_queue_size, the default ones are used for anything missing.
+        """
+        pools: Dict[DispatchClass, DispatchPool] = {}
+        for dispatch_class, (workers, queue_size, peer_queue_size) in DEFAULT_DISPATCH_CONFIG.items():
+            class_config = config.get(dispatch_class.value, {})
+            workers = int(class_config.get("workers", workers))
+            queue_size = int(class_config.get("queue_size", queue_size))
+            peer_queue_size = min(int(class_config.get("peer_queue_size", peer_queue_size)), queue_size)
+            if workers < 1 or peer_queue_size < 1:
+                raise ValueError(f"inbound_dispatch.{dispatch_class.value} needs at least one worker and queue slot")
+            pools[dispatch_class] = DispatchPool(
+                dispatch_class, workers, queue_size, peer_queue_size, dispatch_class in BACKPRESSURE_CLASSES
+            )
+        return cls(log, pools)
+
+    @property
+    def running(self) -> bool:
+        return len(self.tasks) > 0
+
+    def start(self) -> None:
+        """
+        Starts the workers, when the server starts.
+        """
+        if self.running:
+            return
+        for pool in self.pools.values():
+            pool.ready = asyncio.Semaphore(pool.queued)
+            pool.room = asyncio.Condition()
+            # the workers handle the messages of all the connections, they
+            # don't inherit the reads priority of the task starting them
+            with normal_priority_reads():
+                for _ in range(pool.workers):
+                    self.tasks.append(asyncio.create_task(self._worker(pool)))
+
+    async def submit(self, connection: DispatchTarget, message: Message) -> bool:
+        """
+        Queues the message for a worker of its class. Returns False if there
+        was no room for it, and it was dropped. The messages of classes
+        applying backpressure wait for room instead.
+        """
+        pool = self.pools[get_dispatch_class(message.type)]
+        assert pool.ready is not None and pool.room is not None, "the inbound dispatcher isn't running"
+        if not pool.has_room(connection):
+            if not pool.backpressure:
+                pool.dropped += 1
+                now = time.monotonic()
+                if now - pool.last_dropped_log >= DROPPED_LOG_INTERVAL:
+                    pool.last_dropped_log = now
+                    self.log.warning(
+                        f"Inbound {pool.dispatch_class.value} message queue is full, "
+                        f"{pool.dropped} messages dropped so far"
+                    )
+                return False
+            pool.blocked += 1
+            try:
+                async with pool.room:
+                    await pool.room.wait_for(lambda: pool.has_room(connection))
+            finally:
+                pool.blocked -= 1
+        pool.put(connection, message)
+        pool.ready.release()
+        return True
+
+    async def _worker(self, pool: DispatchPool) -> None:
+        assert pool.ready is not None and pool.room is not None
+        while True:
+            await pool.ready.acquire()
+            connection, message, queued_time = pool.take()
+            if pool.blocked > 0:
+                async with pool.room:
+                    pool.room.notify_all()
+            pool.wait.add(time.monotonic() - queued_time)
+            if connection.closed:
+                continue
+            pool.busy += 1
+            try:
+                await connection.run_api_call(message)
+            except Exception as e:
+                self.log.error(f"Exception in inbound {pool.dispatch_class.value} message worker: {e}")
+            finally:
+                pool.busy -= 1
+                pool.processed += 1
+
+    async def stop(self) -> None:
+        for task in self.tasks:
+            task.cancel()
+        await asyncio.gather(*self.tasks, return_exceptions=True)
+        self.tasks = []
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {dispatch_class.value: pool.to_json_dict() for dispatch_class, pool in self.pools.items()}
@@ -0,0 +1,193 @@
+from __future__ import annotations
+
+import dataclasses
+import struct
+from typing import Any, Dict, List, Tuple
+
+import zstd
+
+# Peers that negotiated Capability.MESSAGE_COMPRESSION send messages at least
+# this big compressed
+COMPRESSION_THRESHOLD = 16 * 1024
+
+# The first byte of a compressed message on the wire. Uncompressed messages
+# start with their type, and no message type has this value. It's followed by
+# zstd frames, each prefixed by its length, which decompress to the message
+COMPRESSED_MESSAGE_MARKER = 0xFE
+
+# Compressed messages can't decompress to more than this, the same as the
+# websocket limit on the size of a message
+MAX_DECOMPRESSED_SIZE = 50 * 1024 * 1024
+
+# Messages bigger than this (uncompressed) are compressed and decompressed in
+# a thread, rather than blocking the event loop. zstd releases the GIL
+THREAD_THRESHOLD = 1024 * 1024
+
+FRAME_LENGTH = struct.Struct("!I")
+
+ZSTD_MAGIC = b"\x28\xb5\x2f\xfd"
+
+
+@dataclasses.dataclass
+class CompressionStats:
+    """
+    The messages of a connection that were sent or received compressed: their
+    size before and after compression, and the time it took to compress and
+    decompress them.
+    """
+
+    uncompressed_bytes_written: int = 0
+    compressed_bytes_written: int = 0
+    compression_seconds: float = 0.0
+    uncompressed_bytes_read: int = 0
+    compressed_bytes_read: int = 0
+    decompression_seconds: float = 0.0
+
+    def to_json_dict(self) -> Dict[str, Any]:
+        ret = dataclasses.asdict(self)
+        ret["compression_ns_per_byte"] = _ns_per_byte(self.compression_seconds, self.uncompressed_bytes_written)
+        ret["decompression_ns_per_byte"] = _ns_per_byte(self.decompression_seconds, self.uncompressed_bytes_read)
+        return ret
+
+
+def _ns_per_byte(seconds: float, size: int) -> float:
+    if size == 0:
+        return 0.0
+    return seconds * 1e9 / size
+
+
+class PrecompressedBytes(bytes):
+    """
+    Message data, parts of which are already available zstd compressed, like
+    blocks as they're stored in the database. When the message is sent
+    compressed, these parts are sent as they are, rather than compressed
+    again. segments holds the offset and length of each of these parts in the
+    data, with its compressed form, in order.
+    """
+
+    segments: List[Tuple[int, int, bytes]]
+
+    def __new__(cls, data: bytes, segments: List[Tuple[int, int, bytes]]) -> PrecompressedBytes:
+        ret = super().__new__(cls, data)
+        ret.segments = segments
+        return ret
+
+
+def _frame(compressed: bytes) -> bytes:
+    return FRAME_LENGTH.pack(len(compressed)) + compressed
+
+
+def compress_message(encoded: bytes, data: bytes) -> bytes:
+    """
+    Compresses a serialized message, whose data (at the end of it) is data.
+    Returns the message in its compressed wire format.
+    """
+    parts: List[bytes] = [bytes([COMPRESSED_MESSAGE_MARKER])]
+    data_offset = len(encoded) - len(data)
+    pos = 0
+    if isinstance(data, PrecompressedBytes):
+        for offset, length, compressed in data.segments:
+            try:
+                # the peer won't accept frames that don't state their size
+                if frame_content_size(compressed) != length:
+                    continue
+            except ValueError:
+                continue
+            if data_offset + offset > pos:
+                parts.append(_frame(zstd.compress(encoded[pos : data_offset + offset])))
+            parts.append(_frame(compressed))
+            pos = data_offset + offset + length
+    if pos < len(encoded):
+        parts.append(_frame(zstd.compress(encoded[pos:])))
+    return b"".join(parts)
+
+
+def frame_content_size(frame: bytes) -> int:
+    """
+    The size of the decompressed content of a zstd frame, as stated by its
+    header. Raises ValueError unless frame is exactly one zstd frame stating
+    its content size, since zstd would decompress any frames following it too.
+    """
+    if len(frame) < 6 or frame[:4] != ZSTD_MAGIC:
+        raise ValueError("invalid zstd frame")
+    descriptor = frame[4]
+    size_flag = descriptor >> 6
+    single_segment = (descriptor >> 5) & 1
+    checksum = (descriptor >> 2) & 1
+    dictionary_id_flag = descriptor & 3
+    pos = 5
+    if not single_segment:
+        # window descriptor
+        pos += 1
+    pos += [0, 1, 2, 4][dictionary_id_flag]
+    size_bytes = [single_segment, 2, 4, 8][size_flag]
+    if size_bytes == 0:
+        raise ValueError("zstd frame without content size")
+    size = int.from_bytes(frame[pos : pos + size_bytes], "little")
+    if size_bytes == 2:
+        size += 256
+    pos += size_bytes
+
+    # walk the blocks to find the end of the frame
+    while True:
+        if pos + 3 > len(frame):
+            raise ValueError("truncated zstd frame")
+        header = int.from_bytes(frame[pos : pos + 3], "little")
+        pos += 3
+        # RLE blocks hold a single byte, repeated block size times
+        pos += 1 if (header >> 1) & 3 == 1 else header >> 3
+        if header & 1:
+            break
+    pos += 4 * checksum
+    if pos != len(frame):
+        raise ValueError("invalid zstd frame length")
+    return size
+
+
+def read_frames(wire: bytes, max_size: int) -> Tuple[List[bytes], int]:
+    """
+    Splits a message in the compressed wire format into its zstd frames, and
+    returns them along with the size they decompress to. The frames' sizes are
+    checked without decompressing them, so a peer can't make us decompress
+    more than max_size bytes. Raises ValueError if the message is invalid.
+    """
+    if len(wire) == 0 or wire[0] != COMPRESSED_MESSAGE_MARKER:
+        raise ValueError("not a compressed message")
+    frames: List[bytes] = []
+    total_size = 0
+    pos = 1
+    while pos < len(wire):
+        if pos + FRAME_LENGTH.size > len(wire):
+            raise ValueError("truncated compressed message")
+        (length,) = FRAME_LENGTH.unpack_from(wire, pos)
+        pos += FRAME_LENGTH.size
+        frame = wire[pos : pos + length]
+        if len(frame) != length:
+            raise ValueError("truncated compressed message")
+        pos += length
+        total_size += frame_content_size(frame)
+        if total_size > max_size:
+            raise ValueError(f"compressed message too big: more than {max_size} bytes")
+        frames.append(frame)
+    return frames, total_size
+
+
+def decompress_frames(frames: List[bytes], total_size: int) -> bytes:
+    """
+    Decompresses the frames returned by read_frames(). Raises ValueError if
+    they're invalid.
+    """
+    try:
+        ret = b"".join(zstd.decompress(frame) for frame in frames)
+    except zstd.Error as e:
+        raise ValueError(f"invalid zstd frame: {e}") from e
+    if len(ret) != total_size:
+        raise ValueError("zstd frame content size mismatch")
+    return ret
+
+
+def decompress_message(wire: bytes, max_size: int) -> bytes:
+    """
+    Decompresses a message in the compressed wire format, see read_frames().
+    """
+    return decompress_frames(*read_frames(wire, max_size))
@@ -1,10 +1,12 @@
 from __future__ import annotations
 
+import asyncio
 from dataclasses import dataclass
 from enum import IntEnum
-from typing import Optional, SupportsBytes, Union
+from typing import Callable, Optional, SupportsBytes, Union
 
 from hddcoin.protocols.protocol_message_types import ProtocolMessageTypes
+from hddcoin.server.message_compression import THREAD_THRESHOLD, compress_message
 from hddcoin.util.ints import uint8, uint16
 from hddcoin.util.streamable import Streamable, streamable
 
@@ -30,4 +32,70 @@ class Message(Streamable):
 
 
 def make_msg(msg_type: ProtocolMessageTypes, data: Union[bytes, SupportsBytes]) -> Message:
-    return Message(uint8(msg_type.value), None, bytes(data))
+    # bytes are passed on as they are, which keeps PrecompressedBytes intact
+    return Message(uint8(msg_type.value), None, data if isinstance(data, bytes) else bytes(data))
+
+
+@dataclass
+class EncodedMessage:
+    """
+    A message serialized once, to be sent to many peers. The connections it's
+    queued on share its bytes, and its compressed bytes, rather than each of
+    them serializing (and compressing) the message again.
+    """
+
+    message: Message
+    encoded: bytes
+    _compressed: Optional[bytes] = None
+    # the compression of a big message, running in a thread
+    _compressing: Optional[asyncio.Future[bytes]] = None
+    # the number of connections the message still has to be sent on, and what
+    # to call once it's been sent on all of them
+    _pending: int = 0
+    _on_sent: Optional[Callable[[], None]] = None
+
+    @classmethod
+    def create(cls, message: Message) -> EncodedMessage:
+        return cls(message, bytes(message))
+
+    def compressed(self) -> bytes:
+        if self._compressed is None:
+            self._compressed = compress_message(self.encoded, self.message.data)
+        return self._compressed
+
+    async def compress(self) -> bytes:
+        """
+        Like compressed(), but big messages are compressed in a thread. The
+        connections sending the message at the same time wait for the same
+        compression.
+        """
+        if self._compressed is not None:
+            return self._compressed
+        if len(self.encoded) < THREAD_THRESHOLD:
+            return self.compressed()
+        if self._compressing is None:
+            self._compressing = asyncio.get_running_loop().run_in_executor(
+                None, compress_message, self.encoded, self.message.data
+            )
+        # a connection closing while it waits doesn't cancel the compression
+        # for the others
+        self._compressed = await asyncio.shield(self._compressing)
+        return self._compressed
+
+    def track_sends(self, connections: int, on_sent: Callable[[], None]) -> None:
+        assert connections > 0
+        self._pending = connections
+        self._on_sent = on_sent
+
+    def sent(self) -> None:
+        """
+        Called by each connection once it's done with the message, whether it
+        sent it or dropped it.
+        """
+        if self._on_sent is None:
+            return
+        self._pending -= 1
+        if self._pending == 0:
+            on_sent = self._on_sent
+            self._on_sent = None
+            on_sent()
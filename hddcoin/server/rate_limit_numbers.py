@@ -107,6 +107,9 @@ rate_limits = {
             ProtocolMessageTypes.respond_signage_point: RLSettings(200, 50 * 1024),
             ProtocolMessageTypes.respond_end_of_sub_slot: RLSettings(100, 50 * 1024),
             ProtocolMessageTypes.request_mempool_transactions: RLSettings(5, 1024 * 1024),
+            ProtocolMessageTypes.request_mempool_inventory: RLSettings(5, 100),
+            ProtocolMessageTypes.respond_mempool_inventory: RLSettings(5, 128 * 1024),
+            ProtocolMessageTypes.request_mempool_transactions_by_short_id: RLSettings(5, 16 * 1024),
             ProtocolMessageTypes.request_compact_vdf: RLSettings(200, 1024),
             ProtocolMessageTypes.respond_compact_vdf: RLSettings(200, 100 * 1024),
             ProtocolMessageTypes.new_compact_vdf: RLSettings(100, 1024),
@@ -3,8 +3,7 @@ from __future__ import annotations
 import dataclasses
 import logging
 import time
-from collections import Counter
-from typing import List
+from typing import Any, Dict, List, Optional, Tuple
 
 from hddcoin.protocols.protocol_message_types import ProtocolMessageTypes
 from hddcoin.protocols.shared_protocol import Capability
@@ -14,16 +13,139 @@ from hddcoin.server.rate_limit_numbers import RLSettings, get_rate_limits_to_use
 log = logging.getLogger(__name__)
 
 
+@dataclasses.dataclass(frozen=True)
+class MessageLimits:
+    frequency: int
+    max_size: int
+    max_total_size: int
+    # counted towards the non_tx_freq and non_tx_max_total_size limits
+    non_tx: bool
+    # the message type isn't in the rate limits, and uses the default settings
+    default: bool
+
+
+@dataclasses.dataclass(frozen=True)
+class RateLimitTable:
+    """
+    The rate limits of a version, resolved for each message type
+    """
+
+    messages: Dict[int, MessageLimits]
+    non_tx_freq: int
+    non_tx_max_total_size: int
+
+
+# id of a rate limits dict -> (the dict, its table). The dicts are the module
+# level ones from rate_limit_numbers, holding on to them keeps their ids unique
+rate_limit_tables: Dict[int, Tuple[Dict[str, Any], RateLimitTable]] = {}
+
+
+def _message_limits(settings: RLSettings, non_tx: bool, default: bool) -> MessageLimits:
+    max_total_size = settings.max_total_size
+    if max_total_size is None:
+        max_total_size = settings.frequency * settings.max_size
+    return MessageLimits(settings.frequency, settings.max_size, max_total_size, non_tx, default)
+
+
+def get_rate_limit_table(our_capabilities: List[Capability], peer_capabilities: List[Capability]) -> RateLimitTable:
+    rate_limits = get_rate_limits_to_use(our_capabilities, peer_capabilities)
+    cached = rate_limit_tables.get(id(rate_limits))
+    if cached is not None:
+        return cached[1]
+
+    messages: Dict[int, MessageLimits] = {}
+    for message_type in ProtocolMessageTypes:
+        if message_type in rate_limits["rate_limits_tx"]:
+            limits = _message_limits(rate_limits["rate_limits_tx"][message_type], False, False)
+        elif message_type in rate_limits["rate_limits_other"]:
+            limits = _message_limits(rate_limits["rate_limits_other"][message_type], True, False)
+        else:
+            limits = _message_limits(rate_limits["default_settings"], False, True)
+        messages[message_type.value] = limits
+    table = RateLimitTable(messages, rate_limits["non_tx_freq"], rate_limits["non_tx_max_total_size"])
+    rate_limit_tables[id(rate_limits)] = (rate_limits, table)
+    return table
+
+
+class TokenBucket:
+    """
+    Allows up to limit units (messages or bytes) at once, and refills
+    continuously at limit units per period, so there's no time at which the
+    whole limit becomes available again. To keep the accounting in integers,
+    the level is kept in units of 1 / (100 * period_ns), which makes refilling
+    by the nanosecond a multiplication by limit * percentage_of_limit.
+    """
+
+    __slots__ = ("rate", "capacity", "scale", "used", "peak", "last_refill")
+
+    rate: int
+    capacity: int
+    scale: int
+    used: int
+    peak: int
+    last_refill: int
+
+    def __init__(self, limit: int, percentage_of_limit: int, period_ns: int, now: int) -> None:
+        self.rate = limit * percentage_of_limit
+        self.capacity = self.rate * period_ns
+        self.scale = 100 * period_ns
+        self.used = 0
+        self.peak = 0
+        self.last_refill = now
+
+    def refill(self, now: int) -> None:
+        self.used = max(0, self.used - (now - self.last_refill) * self.rate)
+        self.last_refill = now
+
+    def fits(self, amount: int) -> bool:
+        return self.used + amount * self.scale <= self.capacity
+
+    def take(self, amount: int) -> None:
+        # incoming messages are taken even when they don't fit. The bucket
+        # never holds more than the limit, so it recovers within a period
+        self.used = min(self.used + amount * self.scale, self.capacity)
+        if self.used > self.peak:
+            self.peak = self.used
+
+    def utilization(self) -> float:
+        if self.capacity == 0:
+            return 1.0
+        return self.used / self.capacity
+
+    def peak_utilization(self) -> float:
+        if self.capacity == 0:
+            return 1.0
+        return self.peak / self.capacity
+
+
+@dataclasses.dataclass
+class MessageBuckets:
+    limits: MessageLimits
+    count: TokenBucket
+    size: TokenBucket
+    rejected: int = 0
+
+
+def _bucket_utilization(count: TokenBucket, size: TokenBucket) -> Dict[str, float]:
+    return {
+        "count": count.utilization(),
+        "size": size.utilization(),
+        "peak_count": count.peak_utilization(),
+        "peak_size": size.peak_utilization(),
+    }
+
+
 # TODO: only full node disconnects based on rate limits
 class RateLimiter:
     incoming: bool
     reset_seconds: int
-    current_minute: int
-    message_counts: Counter[ProtocolMessageTypes]
-    message_cumulative_sizes: Counter[ProtocolMessageTypes]
     percentage_of_limit: int
-    non_tx_message_counts: int = 0
-    non_tx_cumulative_size: int = 0
+    _our_capabilities: Optional[List[Capability]]
+    _peer_capabilities: Optional[List[Capability]]
+    _table: Optional[RateLimitTable]
+    _buckets: Dict[int, MessageBuckets]
+    _non_tx_count: Optional[TokenBucket]
+    _non_tx_size: Optional[TokenBucket]
 
     def __init__(self, incoming: bool, reset_seconds: int = 60, percentage_of_limit: int = 100):
         """
@@ -32,15 +154,49 @@ class RateLimiter:
         incremented. For outgoing messages, the counters are only incremented
         if they are allowed to be sent by the rate limiter, since we won't send
         the messages otherwise.
+
+        The limits are per reset_seconds, the time it takes a token bucket to
+        refill completely.
         """
         self.incoming = incoming
         self.reset_seconds = reset_seconds
-        self.current_minute = int(time.time() // reset_seconds)
-        self.message_counts = Counter()
-        self.message_cumulative_sizes = Counter()
         self.percentage_of_limit = percentage_of_limit
-        self.non_tx_message_counts = 0
-        self.non_tx_cumulative_size = 0
+        self._our_capabilities = None
+        self._peer_capabilities = None
+        self._table = None
+        self._buckets = {}
+        self._non_tx_count = None
+        self._non_tx_size = None
+
+    def _resolve(self, our_capabilities: List[Capability], peer_capabilities: List[Capability]) -> None:
+        # the limits depend on the capabilities, which are set once by the
+        # handshake
+        self._our_capabilities = our_capabilities
+        self._peer_capabilities = peer_capabilities
+        table = get_rate_limit_table(our_capabilities, peer_capabilities)
+        if table is self._table:
+            return
+        self._table = table
+        self._buckets = {}
+        now = time.monotonic_ns()
+        period_ns = self.reset_seconds * 1_000_000_000
+        self._non_tx_count = TokenBucket(table.non_tx_freq, self.percentage_of_limit, period_ns, now)
+        self._non_tx_size = TokenBucket(table.non_tx_max_total_size, self.percentage_of_limit, period_ns, now)
+
+    def _add_buckets(self, message_type: int) -> Optional[MessageBuckets]:
+        assert self._table is not None
+        limits = self._table.messages.get(message_type)
+        if limits is None:
+            return None
+        now = time.monotonic_ns()
+        period_ns = self.reset_seconds * 1_000_000_000
+        buckets = MessageBuckets(
+            limits,
+            TokenBucket(limits.frequency, self.percentage_of_limit, period_ns, now),
+            TokenBucket(limits.max_total_size, self.percentage_of_limit, period_ns, now),
+        )
+        self._buckets[message_type] = buckets
+        return buckets
 
     def process_msg_and_check(
         self, message: Message, our_capabilities: List[Capability], peer_capabilities: List[Capability]
@@ -49,65 +205,70 @@ class RateLimiter:
         Returns True if message can be processed successfully, false if a rate limit is passed.
         """
 
-        current_minute = int(time.time() // self.reset_seconds)
-        if current_minute != self.current_minute:
-            self.current_minute = current_minute
-            self.message_counts = Counter()
-            self.message_cumulative_sizes = Counter()
-            self.non_tx_message_counts = 0
-            self.non_tx_cumulative_size = 0
-        try:
-            message_type = ProtocolMessageTypes(message.type)
-        except Exception as e:
-            log.warning(f"Invalid message: {message.type}, {e}")
-            return True
-
-        new_message_counts: int = self.message_counts[message_type] + 1
-        new_cumulative_size: int = self.message_cumulative_sizes[message_type] + len(message.data)
-        new_non_tx_count: int = self.non_tx_message_counts
-        new_non_tx_size: int = self.non_tx_cumulative_size
-        proportion_of_limit: float = self.percentage_of_limit / 100
-
-        ret: bool = False
-        rate_limits = get_rate_limits_to_use(our_capabilities, peer_capabilities)
-
-        try:
-            limits: RLSettings = rate_limits["default_settings"]
-            if message_type in rate_limits["rate_limits_tx"]:
-                limits = rate_limits["rate_limits_tx"][message_type]
-            elif message_type in rate_limits["rate_limits_other"]:
-                limits = rate_limits["rate_limits_other"][message_type]
-                non_tx_freq = rate_limits["non_tx_freq"]
-                non_tx_max_total_size = rate_limits["non_tx_max_total_size"]
-                new_non_tx_count = self.non_tx_message_counts + 1
-                new_non_tx_size = self.non_tx_cumulative_size + len(message.data)
-                if new_non_tx_count > non_tx_freq * proportion_of_limit:
-                    return False
-                if new_non_tx_size > non_tx_max_total_size * proportion_of_limit:
-                    return False
-            else:
-                log.warning(f"Message type {message_type} not found in rate limits")
-
-            if limits.max_total_size is None:
-                limits = dataclasses.replace(limits, max_total_size=limits.frequency * limits.max_size)
-            assert limits.max_total_size is not None
-
-            if new_message_counts > limits.frequency * proportion_of_limit:
-                return False
-            if len(message.data) > limits.max_size:
-                return False
-            if new_cumulative_size > limits.max_total_size * proportion_of_limit:
-                return False
-
-            ret = True
-            return True
-        finally:
-            if self.incoming or ret:
-                # now that we determined that it's OK to send the message, commit the
-                # updates to the counters. Alternatively, if this was an
-                # incoming message, we already received it and it should
-                # increment the counters unconditionally
-                self.message_counts[message_type] = new_message_counts
-                self.message_cumulative_sizes[message_type] = new_cumulative_size
-                self.non_tx_message_counts = new_non_tx_count
-                self.non_tx_cumulative_size = new_non_tx_size
+        if our_capabilities is not self._our_capabilities or peer_capabilities is not self._peer_capabilities:
+            self._resolve(our_capabilities, peer_capabilities)
+        buckets = self._buckets.get(message.type)
+        if buckets is None:
+            buckets = self._add_buckets(message.type)
+            if buckets is None:
+                log.warning(f"Invalid message: {message.type}")
+                return True
+
+        limits = buckets.limits
+        if limits.default:
+            log.warning(f"Message type {ProtocolMessageTypes(message.type)} not found in rate limits")
+        size = len(message.data)
+        now = time.monotonic_ns()
+        count_bucket = buckets.count
+        size_bucket = buckets.size
+        count_bucket.refill(now)
+        size_bucket.refill(now)
+        allowed = size <= limits.max_size and count_bucket.fits(1) and size_bucket.fits(size)
+
+        non_tx_count = self._non_tx_count
+        non_tx_size = self._non_tx_size
+        assert non_tx_count is not None and non_tx_size is not None
+        if limits.non_tx:
+            non_tx_count.refill(now)
+            non_tx_size.refill(now)
+            allowed = allowed and non_tx_count.fits(1) and non_tx_size.fits(size)
+
+        if allowed or self.incoming:
+            # now that we determined that it's OK to send the message, take it
+            # from the buckets. Alternatively, if this was an incoming message,
+            # we already received it and it should be taken unconditionally
+            count_bucket.take(1)
+            size_bucket.take(size)
+            if limits.non_tx:
+                non_tx_count.take(1)
+                non_tx_size.take(size)
+        if not allowed:
+            buckets.rejected += 1
+        return allowed
+
+    def get_utilization(self) -> Dict[str, Any]:
+        """
+        How much of each limit is currently used, and the most that was used
+        at any time, as fractions of the limit. Only the message types that
+        were seen are included.
+        """
+        now = time.monotonic_ns()
+        messages: Dict[str, Any] = {}
+        for message_type, buckets in self._buckets.items():
+            buckets.count.refill(now)
+            buckets.size.refill(now)
+            messages[ProtocolMessageTypes(message_type).name] = {
+                **_bucket_utilization(buckets.count, buckets.size),
+                "rejected": buckets.rejected,
+            }
+        non_tx: Optional[Dict[str, float]] = None
+        if self._non_tx_count is not None and self._non_tx_size is not None:
+            self._non_tx_count.refill(now)
+            self._non_tx_size.refill(now)
+            non_tx = _bucket_utilization(self._non_tx_count, self._non_tx_size)
+        return {
+            "reset_seconds": self.reset_seconds,
+            "percentage_of_limit": self.percentage_of_limit,
+            "non_tx": non_tx,
+            "messages": messages,
+        }
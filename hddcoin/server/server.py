@@ -1,14 +1,17 @@
 from __future__ import annotations
 
 import asyncio
+import dataclasses
+import functools
 import logging
 import ssl
 import time
 import traceback
+from collections import deque
 from dataclasses import dataclass, field
 from ipaddress import IPv4Network, IPv6Network, ip_network
 from pathlib import Path
-from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple, Union, cast
+from typing import Any, Awaitable, Callable, Deque, Dict, List, Optional, Tuple, Union, cast
 
 from aiohttp import (
     ClientResponseError,
@@ -29,20 +32,28 @@ from hddcoin.protocols.protocol_state_machine import message_requires_reply
 from hddcoin.protocols.protocol_timing import INVALID_PROTOCOL_BAN_SECONDS
 from hddcoin.protocols.shared_protocol import protocol_version
 from hddcoin.server.api_protocol import ApiProtocol
+from hddcoin.server.connection_stats import ConnectionStats
+from hddcoin.server.inbound_dispatch import InboundDispatcher
 from hddcoin.server.introducer_peers import IntroducerPeers
-from hddcoin.server.outbound_message import Message, NodeType
+from hddcoin.server.outbound_message import EncodedMessage, Message, NodeType
 from hddcoin.server.ssl_context import private_ssl_paths, public_ssl_paths
 from hddcoin.server.ws_connection import ConnectionCallback, WSHDDcoinConnection
 from hddcoin.types.blockchain_format.sized_bytes import bytes32
 from hddcoin.types.peer_info import PeerInfo
+from hddcoin.util.db_wrapper import normal_priority_reads
 from hddcoin.util.errors import Err, ProtocolError
 from hddcoin.util.ints import uint16
+from hddcoin.util.latency_histogram import LatencyHistogram
 from hddcoin.util.network import WebServer, is_in_network, is_localhost, is_trusted_peer
+from hddcoin.util.prometheus import Labels, MetricsWriter
 from hddcoin.util.ssl_check import verify_ssl_certs_and_keys
 from hddcoin.util.streamable import Streamable
 
 max_message_size = 50 * 1024 * 1024  # 50MB
 
+# the number of recent broadcasts whose fan-out latency is kept
+BROADCAST_HISTORY = 100
+
 
 def ssl_context_for_server(
     ca_cert: Path,
@@ -112,6 +123,18 @@ def calculate_node_id(cert_path: Path) -> bytes32:
     return bytes32(der_cert.fingerprint(hashes.SHA256()))
 
 
+@dataclass(frozen=True)
+class BroadcastLatency:
+    """
+    The time from queuing a broadcast message until it was sent to all the
+    peers it was queued for.
+    """
+
+    message_type: str
+    peers: int
+    seconds: float
+
+
 @final
 @dataclass
 class HDDcoinServer:
@@ -140,6 +163,15 @@ class HDDcoinServer:
     connection_close_task: Optional[asyncio.Task[None]] = None
     received_message_callback: Optional[ConnectionCallback] = None
     banned_peers: Dict[str, float] = field(default_factory=dict)
+    broadcast_latencies: Deque[BroadcastLatency] = field(default_factory=lambda: deque(maxlen=BROADCAST_HISTORY))
+    # broadcast fan-out latency by message type, over the server's lifetime
+    broadcast_latency: Dict[str, LatencyHistogram] = field(default_factory=dict)
+    inbound_dispatcher: Optional[InboundDispatcher] = None
+    # the stats and traffic of the connections that were closed, which
+    # get_connection_stats() adds to those of the open connections
+    closed_connection_stats: ConnectionStats = field(default_factory=ConnectionStats)
+    closed_bytes_read: int = 0
+    closed_bytes_written: int = 0
     invalid_protocol_ban_seconds = INVALID_PROTOCOL_BAN_SECONDS
 
     @classmethod
@@ -233,6 +265,7 @@ class HDDcoinServer:
             node_id=calculate_node_id(node_id_cert_path),
             exempt_peer_networks=[ip_network(net, strict=False) for net in config.get("exempt_peer_networks", [])],
             introducer_peers=IntroducerPeers() if local_type is NodeType.INTRODUCER else None,
+            inbound_dispatcher=InboundDispatcher.create(config.get("inbound_dispatch", {}), log),
         )
 
     def set_received_message_callback(self, callback: ConnectionCallback) -> None:
@@ -283,6 +316,8 @@ class HDDcoinServer:
             raise RuntimeError("HDDcoinServer already started")
         if self.gc_task is None:
             self.gc_task = asyncio.create_task(self.garbage_collect_connections_task())
+        if self.inbound_dispatcher is not None:
+            self.inbound_dispatcher.start()
 
         if self._port is not None:
             self.on_connect = on_connect
@@ -333,6 +368,7 @@ class HDDcoinServer:
                 inbound_rate_limit_percent=self._inbound_rate_limit_percent,
                 outbound_rate_limit_percent=self._outbound_rate_limit_percent,
                 local_capabilities_for_handshake=self._local_capabilities_for_handshake,
+                inbound_dispatcher=self.inbound_dispatcher,
             )
             await connection.perform_handshake(self._network_id, protocol_version, self.get_port(), self._local_type)
             assert connection.connection_type is not None, "handshake failed to set connection type, still None"
@@ -414,6 +450,17 @@ class HDDcoinServer:
         Tries to connect to the target node, adding one connection into the pipeline, if successful.
         An on connect method can also be specified, and this will be saved into the instance variables.
         """
+        # RPC requests may connect to peers, the tasks of the connection
+        # outlive them
+        with normal_priority_reads():
+            return await self._start_client(target_node, on_connect, is_feeler)
+
+    async def _start_client(
+        self,
+        target_node: PeerInfo,
+        on_connect: Optional[ConnectionCallback],
+        is_feeler: bool,
+    ) -> bool:
         if self.is_duplicate_or_self_connection(target_node):
             self.log.warning(f"cannot connect to {target_node.host}, duplicate/self connection")
             return False
@@ -484,6 +531,7 @@ class HDDcoinServer:
                 outbound_rate_limit_percent=self._outbound_rate_limit_percent,
                 local_capabilities_for_handshake=self._local_capabilities_for_handshake,
                 session=session,
+                inbound_dispatcher=self.inbound_dispatcher,
             )
             await connection.perform_handshake(self._network_id, protocol_version, server_port, self._local_type)
             await self.connection_added(connection, on_connect)
@@ -555,6 +603,9 @@ class HDDcoinServer:
                     f" while closing. Handshake never finished."
                 )
             connection.cancel_tasks()
+            self.closed_connection_stats.merge(connection.stats)
+            self.closed_bytes_read += connection.bytes_read
+            self.closed_bytes_written += connection.bytes_written
             on_disconnect = getattr(self.node, "on_disconnect", None)
             if on_disconnect is not None:
                 await on_disconnect(connection)
@@ -580,10 +631,123 @@ class HDDcoinServer:
         exclude: Optional[bytes32] = None,
     ) -> None:
         await self.validate_broadcast_message_type(messages, node_type)
-        for _, connection in self.all_connections.items():
-            if connection.connection_type is node_type and connection.peer_node_id != exclude:
-                for message in messages:
-                    await connection.send_message(message)
+        connections = [
+            connection
+            for connection in self.all_connections.values()
+            if connection.connection_type is node_type and connection.peer_node_id != exclude
+        ]
+        if len(connections) == 0:
+            return
+
+        # the messages are serialized once, and the bytes shared by all the
+        # connections
+        start = time.monotonic()
+        encoded_messages = [EncodedMessage.create(message) for message in messages]
+        for encoded in encoded_messages:
+            encoded.track_sends(
+                len(connections), functools.partial(self._broadcast_sent, encoded.message, len(connections), start)
+            )
+        for connection in connections:
+            for encoded in encoded_messages:
+                await connection.send_message(encoded)
+
+    def _broadcast_sent(self, message: Message, peers: int, start: float) -> None:
+        latency = BroadcastLatency(ProtocolMessageTypes(message.type).name, peers, time.monotonic() - start)
+        self.broadcast_latencies.append(latency)
+        self.broadcast_latency.setdefault(latency.message_type, LatencyHistogram()).add(latency.seconds)
+        self.log.debug(f"Broadcast {latency.message_type} to {peers} peers in {latency.seconds:0.3f}s")
+
+    def get_broadcast_latencies(self) -> List[Dict[str, Any]]:
+        """
+        The fan-out latency of the recent broadcasts, oldest first.
+        """
+        return [dataclasses.asdict(latency) for latency in self.broadcast_latencies]
+
+    def get_connection_stats(self) -> Tuple[ConnectionStats, int, int]:
+        """
+        The stats of all the connections of the server, closed or open, and
+        the bytes they read and wrote.
+        """
+        stats = ConnectionStats()
+        stats.merge(self.closed_connection_stats)
+        bytes_read = self.closed_bytes_read
+        bytes_written = self.closed_bytes_written
+        for connection in self.all_connections.values():
+            stats.merge(connection.stats)
+            bytes_read += connection.bytes_read
+            bytes_written += connection.bytes_written
+        return stats, bytes_read, bytes_written
+
+    def write_metrics(self, writer: MetricsWriter) -> None:
+        """
+        Adds the server's connection, dispatch and broadcast metrics to writer.
+        """
+        stats, bytes_read, bytes_written = self.get_connection_stats()
+        connections: Dict[Labels, float] = {}
+        queued = 0
+        for connection in self.all_connections.values():
+            node_type = "unknown" if connection.connection_type is None else connection.connection_type.name.lower()
+            connections[(("node_type", node_type),)] = connections.get((("node_type", node_type),), 0) + 1
+            queued += connection.outgoing_queue.qsize()
+        writer.gauge("connections", "Open peer connections", connections)
+        writer.counter("peer_bytes_read", "Bytes read from peers", {(): bytes_read})
+        writer.counter("peer_bytes_written", "Bytes written to peers", {(): bytes_written})
+        writer.gauge("outbound_queued_messages", "Messages waiting to be sent to peers", {(): queued})
+        writer.gauge(
+            "max_outbound_queue", "The most messages waiting to be sent to a peer", {(): stats.max_outbound_queue}
+        )
+        writer.histogram(
+            "peer_request_seconds",
+            "Round trip of requests to peers",
+            {(("message_type", t),): h.to_json_dict() for t, h in stats.request_latency.items()},
+        )
+        writer.counter(
+            "peer_request_timeouts",
+            "Requests to peers without a response",
+            {(("message_type", t),): count for t, count in stats.request_timeouts.items()},
+        )
+        writer.histogram(
+            "api_handler_seconds",
+            "Time taken to handle messages from peers",
+            {(("message_type", t),): h.to_json_dict() for t, h in stats.handler_latency.items()},
+        )
+        writer.counter(
+            "rate_limited_seconds",
+            "Time messages to peers were held back by the rate limiter",
+            {(("message_type", t),): seconds for t, seconds in stats.rate_limited_seconds.items()},
+        )
+        writer.counter(
+            "rate_limited_messages",
+            "Times messages to peers were held back by the rate limiter",
+            {(("message_type", t),): count for t, count in stats.rate_limited_messages.items()},
+        )
+        writer.histogram(
+            "broadcast_seconds",
+            "Time from queuing a broadcast until it was sent to all the peers",
+            {(("message_type", t),): h.to_json_dict() for t, h in self.broadcast_latency.items()},
+        )
+        if self.inbound_dispatcher is not None:
+            dispatch = self.inbound_dispatcher.get_stats()
+            writer.histogram(
+                "inbound_dispatch_wait_seconds",
+                "Time messages from peers waited for a worker",
+                {(("class", c),): pool["wait"] for c, pool in dispatch.items()},
+            )
+            writer.gauge(
+                "inbound_dispatch_queued",
+                "Messages from peers waiting for a worker",
+                {(("class", c),): pool["queued"] for c, pool in dispatch.items()},
+            )
+            writer.gauge(
+                "inbound_dispatch_blocked",
+                "Connections waiting for room in the queue to hand over a message",
+                {(("class", c),): pool["blocked"] for c, pool in dispatch.items()},
+            )
+            writer.counter(
+                "inbound_dispatch_dropped",
+                "Messages from peers dropped because their queue was full",
+                {(("class", c),): pool["dropped"] for c, pool in dispatch.items()},
+            )
 
     async def send_to_specific(self, messages: List[Message], node_id: bytes32) -> None:
         if node_id in self.all_connections:
@@ -633,6 +797,8 @@ class HDDcoinServer:
         await self.shut_down_event.wait()
         if self.connection_close_task is not None:
             await self.connection_close_task
+        if self.inbound_dispatcher is not None:
+            await self.inbound_dispatcher.stop()
         if self.webserver is not None:
             await self.webserver.await_closed()
             self.webserver = None
@@ -24,8 +24,19 @@ from hddcoin.protocols.protocol_timing import (
 )
 from hddcoin.protocols.shared_protocol import Capability, Error, Handshake
 from hddcoin.server.api_protocol import ApiProtocol
-from hddcoin.server.capabilities import known_active_capabilities
-from hddcoin.server.outbound_message import Message, NodeType, make_msg
+from hddcoin.server.capabilities import known_active_capabilities, negotiated
+from hddcoin.server.connection_stats import ConnectionStats
+from hddcoin.server.inbound_dispatch import InboundDispatcher
+from hddcoin.server.message_compression import (
+    COMPRESSED_MESSAGE_MARKER,
+    COMPRESSION_THRESHOLD,
+    MAX_DECOMPRESSED_SIZE,
+    THREAD_THRESHOLD,
+    CompressionStats,
+    decompress_frames,
+    read_frames,
+)
+from hddcoin.server.outbound_message import EncodedMessage, Message, NodeType, make_msg
 from hddcoin.server.rate_limits import RateLimiter
 from hddcoin.types.blockchain_format.sized_bytes import bytes32
 from hddcoin.types.peer_info import PeerInfo
@@ -90,15 +101,23 @@ class WSHDDcoinConnection:
     # Messaging
     received_message_callback: Optional[ConnectionCallback] = field(repr=False)
     incoming_queue: asyncio.Queue[Message] = field(default_factory=asyncio.Queue, repr=False)
-    outgoing_queue: asyncio.Queue[Message] = field(default_factory=asyncio.Queue, repr=False)
+    # broadcasts are queued as EncodedMessage, shared by all the connections
+    outgoing_queue: asyncio.Queue[Union[Message, EncodedMessage]] = field(default_factory=asyncio.Queue, repr=False)
     api_tasks: Dict[bytes32, asyncio.Task[None]] = field(default_factory=dict, repr=False)
+    # the server's worker pools for inbound messages. Without one, each message
+    # is handled in a task of its own as soon as it arrives
+    inbound_dispatcher: Optional[InboundDispatcher] = field(default=None, repr=False)
     # Contains task ids of api tasks which should not be canceled
     execute_tasks: Set[bytes32] = field(default_factory=set, repr=False)
 
     # ChiaConnection metrics
     creation_time: float = field(default_factory=time.time)
+    # the bytes sent over the wire, which are the compressed bytes of
+    # compressed messages
     bytes_read: int = 0
     bytes_written: int = 0
+    compression_stats: CompressionStats = field(default_factory=CompressionStats)
+    stats: ConnectionStats = field(default_factory=ConnectionStats)
     last_message_time: float = 0
 
     peer_server_port: Optional[uint16] = None
@@ -139,6 +158,7 @@ class WSHDDcoinConnection:
         outbound_rate_limit_percent: int,
         local_capabilities_for_handshake: List[Tuple[uint16, str]],
         session: Optional[ClientSession] = None,
+        inbound_dispatcher: Optional[InboundDispatcher] = None,
     ) -> WSHDDcoinConnection:
         assert ws._writer is not None
         peername = ws._writer.transport.get_extra_info("peername")
@@ -170,6 +190,7 @@ class WSHDDcoinConnection:
             is_outbound=is_outbound,
             received_message_callback=received_message_callback,
             session=session,
+            inbound_dispatcher=inbound_dispatcher,
         )
 
     def _get_extra_info(self, name: str) -> Optional[Any]:
@@ -305,6 +326,7 @@ class WSHDDcoinConnection:
             self.log.warning(f"Exception closing socket: {error_stack}")
             raise
         finally:
+            self._drop_outgoing_messages()
             with log_exceptions(self.log, consume=True):
                 if self.close_callback is not None:
                     await self.close_callback(self, ban_time, closed_connection=False)
@@ -326,6 +348,14 @@ class WSHDDcoinConnection:
             except Exception as e:
                 self.log.error(f"Failed setting event for {message_id}: {e} {traceback.format_exc()}")
 
+    def _drop_outgoing_messages(self) -> None:
+        # the messages still queued when the connection is closed are done
+        # with, as far as broadcasts tracking their sends are concerned
+        while not self.outgoing_queue.empty():
+            message = self.outgoing_queue.get_nowait()
+            if isinstance(message, EncodedMessage):
+                message.sent()
+
     def cancel_tasks(self) -> None:
         for task_id, task in self.api_tasks.copy().items():
             if task_id in self.execute_tasks:
@@ -336,6 +366,8 @@ class WSHDDcoinConnection:
         try:
             while not self.closed:
                 msg = await self.outgoing_queue.get()
+                # including the message just taken
+                self.stats.add_outbound_queue(self.outgoing_queue.qsize() + 1)
                 if msg is not None:
                     await self._send_message(msg)
         except asyncio.CancelledError:
@@ -358,6 +390,7 @@ class WSHDDcoinConnection:
     async def _api_call(self, full_message: Message, task_id: bytes32) -> None:
         start_time = time.time()
         message_type = ""
+        handler_start: Optional[float] = None
         try:
             if self.received_message_callback is not None:
                 await self.received_message_callback(self)
@@ -422,6 +455,7 @@ class WSHDDcoinConnection:
                     raise
                 return None
 
+            handler_start = time.monotonic()
             response: Optional[Message] = await asyncio.wait_for(wrapped_coroutine(), timeout=timeout)
             self.log.debug(
                 f"Time taken to process {message_type} from {self.peer_node_id} is "
@@ -456,17 +490,34 @@ class WSHDDcoinConnection:
             # TODO: actually throw one of the errors from errors.py and pass this to close
             await self.close(ban_time, WSCloseCode.PROTOCOL_ERROR, Err.UNKNOWN)
         finally:
+            if handler_start is not None:
+                self.stats.add_handler(message_type, time.monotonic() - handler_start)
             if task_id in self.api_tasks:
                 self.api_tasks.pop(task_id)
             if task_id in self.execute_tasks:
                 self.execute_tasks.remove(task_id)
 
+    def _start_api_call(self, message: Message) -> asyncio.Task[None]:
+        task_id: bytes32 = bytes32.secret()
+        api_task = asyncio.create_task(self._api_call(message, task_id))
+        self.api_tasks[task_id] = api_task
+        return api_task
+
+    async def run_api_call(self, message: Message) -> None:
+        """
+        Handles an inbound message for a worker of the inbound dispatcher. The
+        API call runs in a task of its own, which closing the connection
+        cancels, without cancelling the worker.
+        """
+        await asyncio.wait([self._start_api_call(message)])
+
     async def incoming_message_handler(self) -> None:
         while True:
             message = await self.incoming_queue.get()
-            task_id: bytes32 = bytes32.secret()
-            api_task = asyncio.create_task(self._api_call(message, task_id))
-            self.api_tasks[task_id] = api_task
+            if self.inbound_dispatcher is not None and self.inbound_dispatcher.running:
+                await self.inbound_dispatcher.submit(self, message)
+            else:
+                self._start_api_call(message)
 
     async def inbound_handler(self) -> None:
         try:
@@ -488,9 +539,11 @@ class WSHDDcoinConnection:
             self.log.error(f"Exception: {e}")
             self.log.error(f"Exception Stack: {error_stack}")
 
-    async def send_message(self, message: Message) -> bool:
+    async def send_message(self, message: Union[Message, EncodedMessage]) -> bool:
         """Send message sends a message with no tracking / callback."""
         if self.closed:
+            if isinstance(message, EncodedMessage):
+                message.sent()
             return False
         await self.outgoing_queue.put(message)
         return True
@@ -558,6 +611,7 @@ class WSHDDcoinConnection:
         message = Message(message_no_id.type, request_id, message_no_id.data)
         assert message.id is not None
         self.pending_requests[message.id] = event
+        start = time.monotonic()
         await self.outgoing_queue.put(message)
 
         try:
@@ -574,49 +628,79 @@ class WSHDDcoinConnection:
                 f"<- {ProtocolMessageTypes(result.type).name} from: {self.peer_info.host}:{self.peer_info.port}"
             )
             self.request_results.pop(message.id)
+            self.stats.add_request(ProtocolMessageTypes(message.type).name, time.monotonic() - start)
+        else:
+            self.stats.add_request(ProtocolMessageTypes(message.type).name, None)
 
         return result
 
-    async def _wait_and_retry(self, msg: Message) -> None:
+    async def _wait_and_retry(self, msg: Union[Message, EncodedMessage]) -> None:
         try:
+            start = time.monotonic()
             await asyncio.sleep(1)
-            await self.outgoing_queue.put(msg)
+            message = msg.message if isinstance(msg, EncodedMessage) else msg
+            self.stats.add_rate_limited(ProtocolMessageTypes(message.type).name, time.monotonic() - start)
         except Exception as e:
             self.log.debug(f"Exception {e} while waiting to retry sending rate limited message")
-            return None
-
-    async def _send_message(self, message: Message) -> None:
-        encoded: bytes = bytes(message)
-        size = len(encoded)
-        assert len(encoded) < (2 ** (LENGTH_BYTES * 8))
-        if not self.outbound_rate_limiter.process_msg_and_check(
-            message, self.local_capabilities, self.peer_capabilities
-        ):
-            if not is_localhost(self.peer_info.host):
-                message_type = ProtocolMessageTypes(message.type)
-                last_time = self.log_rate_limit_last_time[message_type]
-                now = time.monotonic()
-                self.log_rate_limit_last_time[message_type] = now
-                if now - last_time >= 60:
-                    msg = f"Rate limiting ourselves. message type: {message_type.name}, peer: {self.peer_info.host}"
-                    self.log.debug(msg)
+        finally:
+            # queued again, or dropped if the connection was closed meanwhile
+            await self.send_message(msg)
 
-                # TODO: fix this special case. This function has rate limits which are too low.
-                if ProtocolMessageTypes(message.type) != ProtocolMessageTypes.respond_peers:
-                    asyncio.create_task(self._wait_and_retry(message))
+    async def _send_message(self, message_to_send: Union[Message, EncodedMessage]) -> None:
+        if isinstance(message_to_send, EncodedMessage):
+            encoded_message = message_to_send
+        else:
+            encoded_message = EncodedMessage.create(message_to_send)
+        # sent() is called once we're done with the message, whether it was
+        # sent, dropped or failed to send, unless it's queued again for a retry
+        retrying = False
+        try:
+            message = encoded_message.message
+            encoded = encoded_message.encoded
+            size = len(encoded)
+            assert len(encoded) < (2 ** (LENGTH_BYTES * 8))
+            if not self.outbound_rate_limiter.process_msg_and_check(
+                message, self.local_capabilities, self.peer_capabilities
+            ):
+                if not is_localhost(self.peer_info.host):
+                    message_type = ProtocolMessageTypes(message.type)
+                    last_time = self.log_rate_limit_last_time[message_type]
+                    now = time.monotonic()
+                    self.log_rate_limit_last_time[message_type] = now
+                    if now - last_time >= 60:
+                        msg = f"Rate limiting ourselves. message type: {message_type.name}, peer: {self.peer_info.host}"
+                        self.log.debug(msg)
+
+                    # TODO: fix this special case. This function has rate limits which are too low.
+                    if ProtocolMessageTypes(message.type) != ProtocolMessageTypes.respond_peers:
+                        asyncio.create_task(self._wait_and_retry(message_to_send))
+                        retrying = True
 
-                return None
-            else:
-                self.log.debug(
-                    f"Not rate limiting ourselves. message type: {ProtocolMessageTypes(message.type).name}, "
-                    f"peer: {self.peer_info.host}"
-                )
+                    return None
+                else:
+                    self.log.debug(
+                        f"Not rate limiting ourselves. message type: {ProtocolMessageTypes(message.type).name}, "
+                        f"peer: {self.peer_info.host}"
+                    )
 
-        await self.ws.send_bytes(encoded)
-        self.log.debug(
-            f"-> {ProtocolMessageTypes(message.type).name} to peer {self.peer_info.host} {self.peer_node_id}"
-        )
-        self.bytes_written += size
+            if size >= COMPRESSION_THRESHOLD and negotiated(
+                Capability.MESSAGE_COMPRESSION, self.local_capabilities, self.peer_capabilities
+            ):
+                # broadcasts are compressed by the first connection sending them
+                start = time.perf_counter()
+                encoded = await encoded_message.compress()
+                self.compression_stats.compression_seconds += time.perf_counter() - start
+                self.compression_stats.uncompressed_bytes_written += size
+                self.compression_stats.compressed_bytes_written += len(encoded)
+
+            await self.ws.send_bytes(encoded)
+            self.log.debug(
+                f"-> {ProtocolMessageTypes(message.type).name} to peer {self.peer_info.host} {self.peer_node_id}"
+            )
+            self.bytes_written += len(encoded)
+        finally:
+            if not retrying:
+                encoded_message.sent()
 
     async def _read_one_message(self) -> Optional[Message]:
         try:
@@ -656,8 +740,26 @@ class WSHDDcoinConnection:
                 return None
         elif message.type == WSMsgType.BINARY:
             data = message.data
-            full_message_loaded: Message = Message.from_bytes(data)
             self.bytes_read += len(data)
+            if (
+                len(data) > 0
+                and data[0] == COMPRESSED_MESSAGE_MARKER
+                and negotiated(Capability.MESSAGE_COMPRESSION, self.local_capabilities, self.peer_capabilities)
+            ):
+                start = time.perf_counter()
+                try:
+                    frames, size = read_frames(data, MAX_DECOMPRESSED_SIZE)
+                    if size >= THREAD_THRESHOLD:
+                        data = await asyncio.get_running_loop().run_in_executor(None, decompress_frames, frames, size)
+                    else:
+                        data = decompress_frames(frames, size)
+                except ValueError as e:
+                    await self.ban_peer_bad_protocol(f"invalid compressed message: {e}")
+                    return None
+                self.compression_stats.decompression_seconds += time.perf_counter() - start
+                self.compression_stats.compressed_bytes_read += len(message.data)
+                self.compression_stats.uncompressed_bytes_read += len(data)
+            full_message_loaded: Message = Message.from_bytes(data)
             self.last_message_time = time.time()
             try:
                 message_type = ProtocolMessageTypes(full_message_loaded.type).name
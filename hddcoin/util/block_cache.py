@@ -107,3 +107,9 @@ class BlockCache(BlockchainInterface):
         if segments is None:
             return None
         return segments.challenge_segments
+
+    async def get_sub_epoch_challenge_segments_bytes(self, sub_epoch_summary_hash: bytes32) -> Optional[bytes]:
+        segments = self._sub_epoch_segments.get(sub_epoch_summary_hash)
+        if segments is None:
+            return None
+        return bytes(segments)
@@ -1,18 +1,20 @@
 from __future__ import annotations
 
 import functools
-from typing import Dict, List, Optional, Sequence
+from typing import Dict, List, Optional, Sequence, Union
 
 from chia_rs import AugSchemeMPL, G1Element, G2Element, GTElement
 
 from hddcoin.types.blockchain_format.sized_bytes import bytes32, bytes48
 from hddcoin.util.hash import std_hash
 from hddcoin.util.lru_cache import LRUCache
+from hddcoin.util.setproctitle import setproctitle
+from hddcoin.util.shared_pairing_cache import SharedPairingCache
 
+PairingCache = Union[LRUCache[bytes32, GTElement], SharedPairingCache]
 
-def get_pairings(
-    cache: LRUCache[bytes32, GTElement], pks: List[bytes48], msgs: Sequence[bytes], force_cache: bool
-) -> List[GTElement]:
+
+def get_pairings(cache: PairingCache, pks: List[bytes48], msgs: Sequence[bytes], force_cache: bool) -> List[GTElement]:
     pairings: List[Optional[GTElement]] = []
     missing_count: int = 0
     for pk, msg in zip(pks, msgs):
@@ -56,14 +58,38 @@ def get_pairings(
 # Increasing this number will increase RAM usage, but decrease BLS validation time for blocks and unfinished blocks.
 LOCAL_CACHE: LRUCache[bytes32, GTElement] = LRUCache(50000)
 
+# When set, used instead of LOCAL_CACHE, by this process and the validation
+# worker processes it started
+_shared_cache: Optional[SharedPairingCache] = None
+
+
+def set_shared_cache(cache: Optional[SharedPairingCache]) -> None:
+    global _shared_cache
+    _shared_cache = cache
+
+
+def get_shared_cache() -> Optional[SharedPairingCache]:
+    return _shared_cache
+
+
+def init_validation_worker(process_title: str, shared_cache: Optional[SharedPairingCache]) -> None:
+    """
+    The initializer of the validation worker process pools. The shared
+    pairing cache is attached to by name, when it's unpickled.
+    """
+    setproctitle(process_title)
+    set_shared_cache(shared_cache)
+
 
 def aggregate_verify(
     pks: List[bytes48],
     msgs: Sequence[bytes],
     sig: G2Element,
     force_cache: bool = False,
-    cache: LRUCache[bytes32, GTElement] = LOCAL_CACHE,
+    cache: Optional[PairingCache] = None,
 ) -> bool:
+    if cache is None:
+        cache = LOCAL_CACHE if _shared_cache is None else _shared_cache
     pairings: List[GTElement] = get_pairings(cache, pks, msgs, force_cache)
     if len(pairings) == 0:
         # Using AugSchemeMPL.aggregate_verify, so it's safe to use from_bytes_unchecked
@@ -2,19 +2,24 @@ from __future__ import annotations
 
 import asyncio
 import contextlib
+import contextvars
 import functools
+import logging
 import random
 import sqlite3
 import sys
+import time
 from dataclasses import dataclass, field
 from datetime import datetime
 from pathlib import Path
-from typing import Any, AsyncIterator, Dict, Iterable, Optional, TextIO, Type, Union
+from typing import Any, AsyncIterator, Callable, Dict, Iterable, Iterator, List, Optional, TextIO, Type, Union
 
 import aiosqlite
 import anyio
 from typing_extensions import final
 
+from hddcoin.util.latency_histogram import LatencyHistogram
+
 if aiosqlite.sqlite_version_info < (3, 32, 0):
     SQLITE_MAX_VARIABLE_NUMBER = 900
 else:
@@ -23,6 +28,43 @@ else:
 # integers in sqlite are limited by int64
 SQLITE_INT_MAX = 2**63 - 1
 
+# the number of statements logged with a slow use of a connection
+MAX_LOGGED_STATEMENTS = 10
+
+log = logging.getLogger(__name__)
+
+# whether the reads of the current task are low priority. RPC requests, which
+# may scan large parts of the database, make low priority reads, so they don't
+# hold up the reads needed to validate blocks and serve peers
+_low_priority_reads: contextvars.ContextVar[bool] = contextvars.ContextVar("low_priority_reads", default=False)
+
+
+@contextlib.contextmanager
+def low_priority_reads() -> Iterator[None]:
+    """
+    Makes the database reads of the current task (and the tasks it creates)
+    use the low priority read connections, if there are any.
+    """
+    token = _low_priority_reads.set(True)
+    try:
+        yield
+    finally:
+        _low_priority_reads.reset(token)
+
+
+@contextlib.contextmanager
+def normal_priority_reads() -> Iterator[None]:
+    """
+    Undoes low_priority_reads(), for work an RPC request starts that outlives
+    it, like connecting to a peer. The tasks created inside don't inherit the
+    request's low priority reads.
+    """
+    token = _low_priority_reads.set(False)
+    try:
+        yield
+    finally:
+        _low_priority_reads.reset(token)
+
 
 def generate_in_memory_db_uri() -> str:
     # We need to use shared cache as our DB wrapper uses different types of connections
@@ -43,11 +85,17 @@ async def _create_connection(
     uri: bool = False,
     log_file: Optional[TextIO] = None,
     name: Optional[str] = None,
+    statement_cache_size: int = 128,
+    statements: Optional[List[str]] = None,
 ) -> aiosqlite.Connection:
-    connection = await aiosqlite.connect(database=database, uri=uri)
+    # sqlite3 keeps the most recently used statements of the connection
+    # prepared, by SQL text
+    connection = await aiosqlite.connect(database=database, uri=uri, cached_statements=statement_cache_size)
 
-    if log_file is not None:
-        await connection.set_trace_callback(functools.partial(sql_trace_callback, file=log_file, name=name))
+    if log_file is not None or statements is not None:
+        await connection.set_trace_callback(
+            functools.partial(sql_trace_callback, file=log_file, name=name, statements=statements)
+        )
 
     return connection
 
@@ -58,9 +106,18 @@ async def manage_connection(
     uri: bool = False,
     log_file: Optional[TextIO] = None,
     name: Optional[str] = None,
+    statement_cache_size: int = 128,
+    statements: Optional[List[str]] = None,
 ) -> AsyncIterator[aiosqlite.Connection]:
     connection: aiosqlite.Connection
-    connection = await _create_connection(database=database, uri=uri, log_file=log_file, name=name)
+    connection = await _create_connection(
+        database=database,
+        uri=uri,
+        log_file=log_file,
+        name=name,
+        statement_cache_size=statement_cache_size,
+        statements=statements,
+    )
 
     try:
         yield connection
@@ -69,7 +126,15 @@ async def manage_connection(
             await connection.close()
 
 
-def sql_trace_callback(req: str, file: TextIO, name: Optional[str] = None) -> None:
+def sql_trace_callback(
+    req: str, file: Optional[TextIO], name: Optional[str] = None, statements: Optional[List[str]] = None
+) -> None:
+    # the statements run since the connection was last released, to be logged
+    # if it was held for too long
+    if statements is not None and len(statements) < MAX_LOGGED_STATEMENTS:
+        statements.append(req)
+    if file is None:
+        return
     timestamp = datetime.now().strftime("%H:%M:%S.%f")
     if name is not None:
         line = f"{timestamp} {name} {req}\n"
@@ -109,16 +174,73 @@ class DBWrapper2:
     _lock: asyncio.Lock = field(default_factory=asyncio.Lock)
     _read_connections: asyncio.Queue[aiosqlite.Connection] = field(default_factory=asyncio.Queue)
     _num_read_connections: int = 0
+    # the read connections of low priority reads, see low_priority_reads().
+    # Without any, low priority reads use the regular read connections
+    _low_priority_read_connections: asyncio.Queue[aiosqlite.Connection] = field(default_factory=asyncio.Queue)
+    _num_low_priority_read_connections: int = 0
     _in_use: Dict[asyncio.Task[object], aiosqlite.Connection] = field(default_factory=dict)
     _current_writer: Optional[asyncio.Task[object]] = None
     _savepoint_name: int = 0
-
-    async def add_connection(self, c: aiosqlite.Connection) -> None:
+    # the callbacks waiting for the current write transaction to commit, see
+    # after_commit()
+    _on_commit: List[Callable[[], None]] = field(default_factory=list)
+    # the uses of a connection that take longer than this are logged, with the
+    # statements run on it. None disables this
+    slow_query_seconds: Optional[float] = None
+    # the statements run on each connection since it was last released, for
+    # logging slow uses of it. Only kept when slow_query_seconds is set
+    _statements: Dict[aiosqlite.Connection, List[str]] = field(default_factory=dict)
+    # the time spent waiting for a connection, and using it, by kind of
+    # connection ("writer", "reader" and "low_priority_reader")
+    _wait_latency: Dict[str, LatencyHistogram] = field(default_factory=dict)
+    _use_latency: Dict[str, LatencyHistogram] = field(default_factory=dict)
+
+    async def add_connection(self, c: aiosqlite.Connection, *, low_priority: bool = False) -> None:
         # this guarantees that reader connections can only be used for reading
         assert c != self._write_connection
         await c.execute("pragma query_only")
-        self._read_connections.put_nowait(c)
-        self._num_read_connections += 1
+        if low_priority:
+            self._low_priority_read_connections.put_nowait(c)
+            self._num_low_priority_read_connections += 1
+        else:
+            self._read_connections.put_nowait(c)
+            self._num_read_connections += 1
+
+    def _record(self, kind: str, wait: float, use: float, c: aiosqlite.Connection) -> None:
+        self._wait_latency.setdefault(kind, LatencyHistogram()).add(wait)
+        self._use_latency.setdefault(kind, LatencyHistogram()).add(use)
+        statements = self._statements.get(c)
+        if statements is None:
+            return
+        if self.slow_query_seconds is not None and use > self.slow_query_seconds:
+            log.warning(f"slow database {kind} use: {use:0.3f}s (waited {wait:0.3f}s), ran: {statements}")
+        statements.clear()
+
+    def _clear_statements(self) -> None:
+        for statements in self._statements.values():
+            statements.clear()
+
+    def get_latency_stats(self) -> Dict[str, Any]:
+        """
+        Histograms of the time tasks waited for a database connection, and
+        of the time they held it, by kind of connection.
+        """
+        return {
+            "wait": {kind: histogram.to_json_dict() for kind, histogram in self._wait_latency.items()},
+            "use": {kind: histogram.to_json_dict() for kind, histogram in self._use_latency.items()},
+        }
+
+    async def _close_read_connections(self, *, close: bool) -> None:
+        while self._num_read_connections > 0:
+            c = await self._read_connections.get()
+            if close:
+                await c.close()
+            self._num_read_connections -= 1
+        while self._num_low_priority_read_connections > 0:
+            c = await self._low_priority_read_connections.get()
+            if close:
+                await c.close()
+            self._num_low_priority_read_connections -= 1
 
     @classmethod
     @contextlib.asynccontextmanager
@@ -129,11 +251,14 @@ class DBWrapper2:
         db_version: int = 1,
         uri: bool = False,
         reader_count: int = 4,
+        low_priority_reader_count: int = 0,
         log_path: Optional[Path] = None,
         journal_mode: str = "WAL",
         synchronous: Optional[str] = None,
         foreign_keys: bool = False,
         row_factory: Optional[Type[aiosqlite.Row]] = None,
+        statement_cache_size: int = 128,
+        slow_query_seconds: Optional[float] = None,
     ) -> AsyncIterator[DBWrapper2]:
         async with contextlib.AsyncExitStack() as async_exit_stack:
             if log_path is None:
@@ -142,8 +267,16 @@ class DBWrapper2:
                 log_path.parent.mkdir(parents=True, exist_ok=True)
                 log_file = async_exit_stack.enter_context(log_path.open("a", encoding="utf-8"))
 
+            write_statements: Optional[List[str]] = None if slow_query_seconds is None else []
             write_connection = await async_exit_stack.enter_async_context(
-                manage_connection(database=database, uri=uri, log_file=log_file, name="writer"),
+                manage_connection(
+                    database=database,
+                    uri=uri,
+                    log_file=log_file,
+                    name="writer",
+                    statement_cache_size=statement_cache_size,
+                    statements=write_statements,
+                ),
             )
             await (await write_connection.execute(f"pragma journal_mode={journal_mode}")).close()
             if synchronous is not None:
@@ -153,27 +286,40 @@ class DBWrapper2:
 
             write_connection.row_factory = row_factory
 
-            self = cls(_write_connection=write_connection, db_version=db_version, _log_file=log_file)
+            self = cls(
+                _write_connection=write_connection,
+                db_version=db_version,
+                _log_file=log_file,
+                slow_query_seconds=slow_query_seconds,
+            )
+            if write_statements is not None:
+                self._statements[write_connection] = write_statements
 
-            for index in range(reader_count):
+            for index in range(reader_count + low_priority_reader_count):
+                low_priority = index >= reader_count
+                read_statements: Optional[List[str]] = None if slow_query_seconds is None else []
                 read_connection = await async_exit_stack.enter_async_context(
                     manage_connection(
                         database=database,
                         uri=uri,
                         log_file=log_file,
-                        name=f"reader-{index}",
+                        name=f"low-priority-reader-{index - reader_count}" if low_priority else f"reader-{index}",
+                        statement_cache_size=statement_cache_size,
+                        statements=read_statements,
                     ),
                 )
                 read_connection.row_factory = row_factory
-                await self.add_connection(c=read_connection)
+                if read_statements is not None:
+                    self._statements[read_connection] = read_statements
+                await self.add_connection(c=read_connection, low_priority=low_priority)
+            # don't log the statements setting the connections up
+            self._clear_statements()
 
             try:
                 yield self
             finally:
                 with anyio.CancelScope(shield=True):
-                    while self._num_read_connections > 0:
-                        await self._read_connections.get()
-                        self._num_read_connections -= 1
+                    await self._close_read_connections(close=False)
 
     @classmethod
     async def create(
@@ -183,11 +329,14 @@ class DBWrapper2:
         db_version: int = 1,
         uri: bool = False,
         reader_count: int = 4,
+        low_priority_reader_count: int = 0,
         log_path: Optional[Path] = None,
         journal_mode: str = "WAL",
         synchronous: Optional[str] = None,
         foreign_keys: bool = False,
         row_factory: Optional[Type[aiosqlite.Row]] = None,
+        statement_cache_size: int = 128,
+        slow_query_seconds: Optional[float] = None,
     ) -> DBWrapper2:
         # WARNING: please use .managed() instead
         if log_path is None:
@@ -195,7 +344,15 @@ class DBWrapper2:
         else:
             log_path.parent.mkdir(parents=True, exist_ok=True)
             log_file = log_path.open("a", encoding="utf-8")
-        write_connection = await _create_connection(database=database, uri=uri, log_file=log_file, name="writer")
+        write_statements: Optional[List[str]] = None if slow_query_seconds is None else []
+        write_connection = await _create_connection(
+            database=database,
+            uri=uri,
+            log_file=log_file,
+            name="writer",
+            statement_cache_size=statement_cache_size,
+            statements=write_statements,
+        )
         await (await write_connection.execute(f"pragma journal_mode={journal_mode}")).close()
         if synchronous is not None:
             await (await write_connection.execute(f"pragma synchronous={synchronous}")).close()
@@ -204,26 +361,39 @@ class DBWrapper2:
 
         write_connection.row_factory = row_factory
 
-        self = cls(_write_connection=write_connection, db_version=db_version, _log_file=log_file)
-
-        for index in range(reader_count):
+        self = cls(
+            _write_connection=write_connection,
+            db_version=db_version,
+            _log_file=log_file,
+            slow_query_seconds=slow_query_seconds,
+        )
+        if write_statements is not None:
+            self._statements[write_connection] = write_statements
+
+        for index in range(reader_count + low_priority_reader_count):
+            low_priority = index >= reader_count
+            read_statements: Optional[List[str]] = None if slow_query_seconds is None else []
             read_connection = await _create_connection(
                 database=database,
                 uri=uri,
                 log_file=log_file,
-                name=f"reader-{index}",
+                name=f"low-priority-reader-{index - reader_count}" if low_priority else f"reader-{index}",
+                statement_cache_size=statement_cache_size,
+                statements=read_statements,
             )
             read_connection.row_factory = row_factory
-            await self.add_connection(c=read_connection)
+            if read_statements is not None:
+                self._statements[read_connection] = read_statements
+            await self.add_connection(c=read_connection, low_priority=low_priority)
+        # don't log the statements setting the connections up
+        self._clear_statements()
 
         return self
 
     async def close(self) -> None:
         # WARNING: please use .managed() instead
         try:
-            while self._num_read_connections > 0:
-                await (await self._read_connections.get()).close()
-                self._num_read_connections -= 1
+            await self._close_read_connections(close=True)
             await self._write_connection.close()
         finally:
             if self._log_file is not None:
@@ -237,17 +407,49 @@ class DBWrapper2:
     @contextlib.asynccontextmanager
     async def _savepoint_ctx(self) -> AsyncIterator[None]:
         name = self._next_savepoint()
+        on_commit = len(self._on_commit)
         await self._write_connection.execute(f"SAVEPOINT {name}")
         try:
             yield
         except:  # noqa E722
             await self._write_connection.execute(f"ROLLBACK TO {name}")
+            # the changes the callbacks were waiting for are gone
+            del self._on_commit[on_commit:]
             raise
         finally:
             # rollback to a savepoint doesn't cancel the transaction, it
             # just rolls back the state. We need to cancel it regardless
             await self._write_connection.execute(f"RELEASE {name}")
 
+    def in_write_transaction(self) -> bool:
+        """
+        Returns True if the current task is in a write transaction
+        """
+        return self._current_writer == asyncio.current_task()
+
+    def after_commit(self, callback: Callable[[], None]) -> None:
+        """
+        Calls callback once the write transaction of the current task commits,
+        or right away if the task isn't in one. It's never called if the
+        changes made so far are rolled back. This is for updating in-memory
+        state along with the database, without concurrent readers of the
+        database seeing it before the changes.
+        """
+        if not self.in_write_transaction():
+            callback()
+            return
+        self._on_commit.append(callback)
+
+    def _run_on_commit(self) -> None:
+        callbacks = self._on_commit
+        self._on_commit = []
+        for callback in callbacks:
+            # the transaction is committed, the other callbacks still run
+            try:
+                callback()
+            except Exception:
+                log.exception("Exception in database commit callback")
+
     @contextlib.asynccontextmanager
     async def writer(self) -> AsyncIterator[aiosqlite.Connection]:
         """
@@ -268,13 +470,22 @@ class DBWrapper2:
                 yield self._write_connection
             return
 
+        start = time.perf_counter()
         async with self._lock:
-            async with self._savepoint_ctx():
-                self._current_writer = task
-                try:
-                    yield self._write_connection
-                finally:
-                    self._current_writer = None
+            acquired = time.perf_counter()
+            try:
+                async with self._savepoint_ctx():
+                    self._current_writer = task
+                    try:
+                        yield self._write_connection
+                    finally:
+                        self._current_writer = None
+            except BaseException:
+                self._on_commit.clear()
+                raise
+            finally:
+                self._record("writer", acquired - start, time.perf_counter() - acquired, self._write_connection)
+            self._run_on_commit()
 
     @contextlib.asynccontextmanager
     async def writer_maybe_transaction(self) -> AsyncIterator[aiosqlite.Connection]:
@@ -292,13 +503,22 @@ class DBWrapper2:
             yield self._write_connection
             return
 
+        start = time.perf_counter()
         async with self._lock:
-            async with self._savepoint_ctx():
-                self._current_writer = task
-                try:
-                    yield self._write_connection
-                finally:
-                    self._current_writer = None
+            acquired = time.perf_counter()
+            try:
+                async with self._savepoint_ctx():
+                    self._current_writer = task
+                    try:
+                        yield self._write_connection
+                    finally:
+                        self._current_writer = None
+            except BaseException:
+                self._on_commit.clear()
+                raise
+            finally:
+                self._record("writer", acquired - start, time.perf_counter() - acquired, self._write_connection)
+            self._run_on_commit()
 
     @contextlib.asynccontextmanager
     async def reader(self) -> AsyncIterator[aiosqlite.Connection]:
@@ -337,7 +557,15 @@ class DBWrapper2:
         if task in self._in_use:
             yield self._in_use[task]
         else:
-            c = await self._read_connections.get()
+            if _low_priority_reads.get() and self._num_low_priority_read_connections > 0:
+                kind = "low_priority_reader"
+                pool = self._low_priority_read_connections
+            else:
+                kind = "reader"
+                pool = self._read_connections
+            start = time.perf_counter()
+            c = await pool.get()
+            acquired = time.perf_counter()
             try:
                 # record our connection in this dict to allow nested calls in
                 # the same task to use the same connection
@@ -345,4 +573,5 @@ class DBWrapper2:
                 yield c
             finally:
                 del self._in_use[task]
-                self._read_connections.put_nowait(c)
+                pool.put_nowait(c)
+                self._record(kind, acquired - start, time.perf_counter() - acquired, c)
@@ -267,6 +267,33 @@ def block_info_from_block(buf: memoryview) -> GeneratorBlockInfo:
     return GeneratorBlockInfo(prev_hash, generator, refs)
 
 
+def block_without_generator(buf: memoryview) -> Tuple[memoryview, memoryview]:
+    """
+    Splits a serialized FullBlock around its transactions_generator field.
+    Joining the two halves with a 0 byte (an absent Optional) in between
+    serializes the block with transactions_generator set to None, without
+    copying or parsing the rest of the block.
+    """
+    buf2 = buf[:]
+    buf2 = skip_list(buf2, skip_end_of_sub_slot_bundle)  # finished_sub_slots
+    buf2 = skip_reward_chain_block(buf2)  # reward_chain_block
+    buf2 = skip_optional(buf2, skip_vdf_proof)  # challenge_chain_sp_proof
+    buf2 = skip_vdf_proof(buf2)  # challenge_chain_ip_proof
+    buf2 = skip_optional(buf2, skip_vdf_proof)  # reward_chain_sp_proof
+    buf2 = skip_vdf_proof(buf2)  # reward_chain_ip_proof
+    buf2 = skip_optional(buf2, skip_vdf_proof)  # infused_challenge_chain_ip_proof
+    buf2 = skip_foliage(buf2)  # foliage
+    buf2 = skip_optional(buf2, skip_foliage_transaction_block)  # foliage_transaction_block
+    buf2 = skip_optional(buf2, skip_transactions_info)  # transactions_info
+    head = buf[: len(buf) - len(buf2)]
+
+    # this is the transactions_generator optional
+    if buf2[0] == 0:
+        return head, buf2[1:]
+    buf2 = buf2[1:]
+    return head, buf2[serialized_length(buf2) :]
+
+
 def header_block_from_block(
     buf: memoryview, request_filter: bool = True, tx_addition_coins: List[Coin] = [], removal_names: List[bytes32] = []
 ) -> bytes:
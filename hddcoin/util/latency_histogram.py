@@ -0,0 +1,30 @@
+from __future__ import annotations
+
+from bisect import bisect_left
+from dataclasses import dataclass, field
+from typing import Any, Dict, List
+
+# the upper bounds, in seconds, of the buckets of the latency histograms
+LATENCY_BUCKETS = [0.001, 0.002, 0.005, 0.01, 0.02, 0.05, 0.1, 0.2, 0.5, 1.0, 2.0, 5.0]
+
+
+@dataclass
+class LatencyHistogram:
+    counts: List[int] = field(default_factory=lambda: [0] * (len(LATENCY_BUCKETS) + 1))
+    total_seconds: float = 0.0
+
+    def add(self, seconds: float) -> None:
+        self.counts[bisect_left(LATENCY_BUCKETS, seconds)] += 1
+        self.total_seconds += seconds
+
+    def merge(self, other: LatencyHistogram) -> None:
+        self.counts = [a + b for a, b in zip(self.counts, other.counts)]
+        self.total_seconds += other.total_seconds
+
+    def to_json_dict(self) -> Dict[str, Any]:
+        return {
+            "count": sum(self.counts),
+            "total_seconds": self.total_seconds,
+            # the last bucket has no upper bound
+            "buckets": [{"le": le, "count": count} for le, count in zip(LATENCY_BUCKETS + [None], self.counts)],
+        }
@@ -0,0 +1,68 @@
+from __future__ import annotations
+
+from typing import Any, Dict, List, Mapping, Tuple
+
+# labels of a sample, as (name, value) pairs
+Labels = Tuple[Tuple[str, str], ...]
+
+METRICS_CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_labels(labels: Labels) -> str:
+    if len(labels) == 0:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in labels) + "}"
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class MetricsWriter:
+    """
+    Builds a page of metrics in the Prometheus text exposition format.
+    """
+
+    def __init__(self, prefix: str = "hddcoin_") -> None:
+        self.prefix = prefix
+        self.lines: List[str] = []
+
+    def _header(self, name: str, kind: str, help_text: str) -> str:
+        name = self.prefix + name
+        self.lines.append(f"# HELP {name} {help_text}")
+        self.lines.append(f"# TYPE {name} {kind}")
+        return name
+
+    def gauge(self, name: str, help_text: str, samples: Mapping[Labels, float]) -> None:
+        name = self._header(name, "gauge", help_text)
+        for labels, value in samples.items():
+            self.lines.append(f"{name}{_format_labels(labels)} {_format_value(value)}")
+
+    def counter(self, name: str, help_text: str, samples: Mapping[Labels, float]) -> None:
+        # in the 0.0.4 format, the HELP and TYPE lines name the sample series, _total suffix included
+        name = self._header(name + "_total", "counter", help_text)
+        for labels, value in samples.items():
+            self.lines.append(f"{name}{_format_labels(labels)} {_format_value(value)}")
+
+    def histogram(self, name: str, help_text: str, samples: Mapping[Labels, Dict[str, Any]]) -> None:
+        """
+        samples are histograms in the form of LatencyHistogram.to_json_dict()
+        """
+        name = self._header(name, "histogram", help_text)
+        for labels, histogram in samples.items():
+            cumulative = 0
+            for bucket in histogram["buckets"]:
+                cumulative += bucket["count"]
+                le = "+Inf" if bucket["le"] is None else repr(float(bucket["le"]))
+                self.lines.append(f"{name}_bucket{_format_labels(labels + (('le', le),))} {cumulative}")
+            self.lines.append(f"{name}_sum{_format_labels(labels)} {_format_value(histogram['total_seconds'])}")
+            self.lines.append(f"{name}_count{_format_labels(labels)} {histogram['count']}")
+
+    def text(self) -> str:
+        return "".join(line + "\n" for line in self.lines)
@@ -0,0 +1,169 @@
+from __future__ import annotations
+
+import hashlib
+import struct
+import time
+from multiprocessing.shared_memory import SharedMemory
+from typing import Any, Callable, Dict, Optional, Tuple
+
+from chia_rs import GTElement
+
+from hddcoin.types.blockchain_format.sized_bytes import bytes32
+
+MAGIC = b"HDDPAIR1"
+
+# magic, number of buckets, slots per bucket
+HEADER = struct.Struct("<8sII")
+# hits, misses, inserts, evictions
+COUNTERS = struct.Struct("<4Q")
+COUNTER = struct.Struct("<Q")
+COUNTERS_OFFSET = HEADER.size
+SLOTS_OFFSET = 64
+
+# every slot holds the time it was last used, a checksum of the key and value,
+# the key (the hash of the public key and message) and the pairing
+TICK = struct.Struct("<Q")
+CHECKSUM_SIZE = 16
+KEY_OFFSET = TICK.size + CHECKSUM_SIZE
+VALUE_OFFSET = KEY_OFFSET + 32
+SLOT_SIZE = VALUE_OFFSET + GTElement.SIZE
+
+# the number of slots a key can be stored in. When all of them are taken, the
+# least recently used one is evicted
+WAYS = 4
+
+HITS, MISSES, INSERTS, EVICTIONS = range(4)
+
+
+def _checksum(key: bytes, value: bytes) -> bytes:
+    return hashlib.blake2b(key + value, digest_size=CHECKSUM_SIZE).digest()
+
+
+class SharedPairingCache:
+    """
+    A fixed size cache of BLS pairings, keyed by the hash of the public key and
+    message, in shared memory. The process creating it passes it to the
+    validation worker processes (it's pickled by the name of the shared memory
+    block), and they all read and write it directly.
+
+    The cache is a hash table with WAYS slots per bucket. There are no locks,
+    instead every slot is checksummed, and a slot that's being written by
+    another process, or that two processes wrote at the same time, fails the
+    checksum and is treated as a miss. The hit and miss counters are updated
+    the same way, so they're approximate when several processes use the cache
+    at the same time.
+    """
+
+    _shm: SharedMemory
+    _owner: bool
+    _buckets: int
+    _ways: int
+
+    def __init__(self, shm: SharedMemory, owner: bool) -> None:
+        magic, buckets, ways = HEADER.unpack_from(shm.buf, 0)
+        if magic != MAGIC:
+            shm.close()
+            raise ValueError(f"shared memory block {shm.name} is not a pairing cache")
+        self._shm = shm
+        self._owner = owner
+        self._buckets = buckets
+        self._ways = ways
+
+    @classmethod
+    def create(cls, capacity: int) -> SharedPairingCache:
+        """
+        Creates a new cache with room for (at least) capacity pairings. The
+        shared memory block is removed when the returned cache is closed.
+        """
+        buckets = max((capacity + WAYS - 1) // WAYS, 1)
+        shm = SharedMemory(create=True, size=SLOTS_OFFSET + buckets * WAYS * SLOT_SIZE)
+        HEADER.pack_into(shm.buf, 0, MAGIC, buckets, WAYS)
+        return cls(shm, owner=True)
+
+    @classmethod
+    def attach(cls, name: str) -> SharedPairingCache:
+        return cls(SharedMemory(name=name), owner=False)
+
+    def __reduce__(self) -> Tuple[Callable[[str], SharedPairingCache], Tuple[str]]:
+        return SharedPairingCache.attach, (self.name,)
+
+    @property
+    def name(self) -> str:
+        return self._shm.name
+
+    @property
+    def capacity(self) -> int:
+        return self._buckets * self._ways
+
+    def get(self, key: bytes32) -> Optional[GTElement]:
+        buf = self._shm.buf
+        for offset in self._slots(key):
+            if bytes(buf[offset + KEY_OFFSET : offset + VALUE_OFFSET]) != key:
+                continue
+            value = bytes(buf[offset + VALUE_OFFSET : offset + SLOT_SIZE])
+            if bytes(buf[offset + TICK.size : offset + KEY_OFFSET]) != _checksum(key, value):
+                break
+            TICK.pack_into(buf, offset, time.monotonic_ns())
+            self._count(HITS)
+            return GTElement.from_bytes_unchecked(value)
+        self._count(MISSES)
+        return None
+
+    def put(self, key: bytes32, value: GTElement) -> None:
+        buf = self._shm.buf
+        victim = -1
+        victim_tick = 0
+        for offset in self._slots(key):
+            tick: int = TICK.unpack_from(buf, offset)[0]
+            if bytes(buf[offset + KEY_OFFSET : offset + VALUE_OFFSET]) == key:
+                # either another process just added it, or it's being
+                # overwritten. Either way, write it again
+                victim = offset
+                victim_tick = 0
+                break
+            if victim == -1 or tick < victim_tick:
+                victim = offset
+                victim_tick = tick
+        if victim_tick != 0:
+            self._count(EVICTIONS)
+
+        value_bytes = bytes(value)
+        # invalidate the slot before writing the new key and value, so readers
+        # don't mistake the new value for the old key's one
+        buf[victim + TICK.size : victim + KEY_OFFSET] = bytes(CHECKSUM_SIZE)
+        buf[victim + KEY_OFFSET : victim + VALUE_OFFSET] = key
+        buf[victim + VALUE_OFFSET : victim + SLOT_SIZE] = value_bytes
+        buf[victim + TICK.size : victim + KEY_OFFSET] = _checksum(key, value_bytes)
+        TICK.pack_into(buf, victim, time.monotonic_ns())
+        self._count(INSERTS)
+
+    def get_stats(self) -> Dict[str, Any]:
+        hits, misses, inserts, evictions = COUNTERS.unpack_from(self._shm.buf, COUNTERS_OFFSET)
+        entries = sum(
+            1
+            for slot in range(self.capacity)
+            if TICK.unpack_from(self._shm.buf, SLOTS_OFFSET + slot * SLOT_SIZE)[0] != 0
+        )
+        return {
+            "entries": entries,
+            "capacity": self.capacity,
+            "hits": hits,
+            "misses": misses,
+            "hit_rate": 0.0 if hits + misses == 0 else hits / (hits + misses),
+            "inserts": inserts,
+            "evictions": evictions,
+        }
+
+    def close(self) -> None:
+        self._shm.close()
+        if self._owner:
+            self._shm.unlink()
+
+    def _slots(self, key: bytes32) -> range:
+        start = SLOTS_OFFSET + (int.from_bytes(key[:8], "little") % self._buckets) * self._ways * SLOT_SIZE
+        return range(start, start + self._ways * SLOT_SIZE, SLOT_SIZE)
+
+    def _count(self, counter: int) -> None:
+        offset = COUNTERS_OFFSET + counter * COUNTER.size
+        buf = self._shm.buf
+        COUNTER.pack_into(buf, offset, COUNTER.unpack_from(buf, offset)[0] + 1)
@@ -17,6 +17,7 @@ from clvm.casts import int_to_bytes
 from hddcoin.consensus.blockchain import Blockchain
 from hddcoin.consensus.default_constants import DEFAULT_CONSTANTS
 from hddcoin.consensus.full_block_to_block_record import header_block_to_sub_block_record
+from hddcoin.full_node import block_store
 from hddcoin.full_node.block_store import BlockStore
 from hddcoin.full_node.coin_store import CoinStore
 from hddcoin.simulator.block_tools import BlockTools
@@ -207,6 +208,44 @@ async def test_rollback(bt: BlockTools, tmp_dir: Path, use_cache: bool) -> None:
                 count += 1
 
 
+@pytest.mark.limit_consensus_modes(reason="save time")
+@pytest.mark.anyio
+async def test_rollback_concurrent_reads(bt: BlockTools, tmp_dir: Path) -> None:
+    blocks = bt.get_consecutive_blocks(10)
+
+    # a file, so readers see the database as of the last commit
+    async with PathDBConnection(2) as db_wrapper:
+        coin_store = await CoinStore.create(db_wrapper)
+        block_store = await BlockStore.create(db_wrapper)
+        bc = await Blockchain.create(coin_store, block_store, bt.constants, tmp_dir, 2)
+        for block in blocks:
+            await _validate_and_add_block(bc, block)
+
+        rolled_back = asyncio.Event()
+        commit = asyncio.Event()
+
+        async def rollback() -> None:
+            async with db_wrapper.writer():
+                await block_store.rollback(5)
+                rolled_back.set()
+                await commit.wait()
+
+        task = asyncio.create_task(rollback())
+        await rolled_back.wait()
+        # until the rollback is committed, readers still see the blocks above
+        # the fork point in the main chain, and cache them
+        assert len(await block_store.get_block_blobs_in_range(6, 9)) == 4
+        commit.set()
+        await task
+
+        # they're dropped from the cache once it is
+        for height in range(6, 10):
+            assert block_store.blob_cache.get_at_height(uint32(height)) is None
+        with pytest.raises(ValueError):
+            await block_store.get_block_blobs_in_range(6, 9)
+        assert [blob for blob, _ in await block_store.get_block_blobs_in_range(0, 5)] == [bytes(b) for b in blocks[:6]]
+
+
 @pytest.mark.limit_consensus_modes(reason="save time")
 @pytest.mark.anyio
 async def test_count_compactified_blocks(bt: BlockTools, tmp_dir: Path, db_version: int, use_cache: bool) -> None:
@@ -334,6 +373,93 @@ async def test_get_generator(bt: BlockTools, db_version: int, use_cache: bool) -
         assert await store.get_generator(blocks[7].header_hash) == new_blocks[7].transactions_generator
 
 
+@pytest.mark.limit_consensus_modes(reason="save time")
+@pytest.mark.anyio
+async def test_generator_lookups(bt: BlockTools, db_version: int) -> None:
+    blocks = bt.get_consecutive_blocks(10)
+
+    def generator(i: int) -> SerializedProgram:
+        return SerializedProgram.from_bytes(int_to_bytes(i + 1))
+
+    async with DBConnection(db_version) as db_wrapper:
+        store = await BlockStore.create(db_wrapper, use_cache=True, generator_cache_size=5)
+
+        new_blocks = []
+        for i, block in enumerate(blocks):
+            block = dataclasses.replace(block, transactions_generator=generator(i))
+            block_record = header_block_to_sub_block_record(
+                DEFAULT_CONSTANTS, uint64(0), block, uint64(0), False, uint8(0), uint32(max(0, block.height - 1)), None
+            )
+            await store.add_full_block(block.header_hash, block, block_record)
+            await store.set_in_chain([(block_record.header_hash,)])
+            await store.set_peak(block_record.header_hash)
+            new_blocks.append(block)
+
+        heights = [uint32(x) for x in range(1, 4)]
+        expected_generators = [new_blocks[h].transactions_generator for h in heights]
+
+        # the first lookup reads the generators table, the second one hits the cache
+        assert await store.get_generators_at(heights) == expected_generators
+        stats = store.get_generator_stats()
+        assert stats["table_reads"] == 3 and stats["cache_hits"] == 0 and stats["block_reads"] == 0
+        assert await store.get_generators_at(heights) == expected_generators
+        stats = store.get_generator_stats()
+        assert stats["table_reads"] == 3 and stats["cache_hits"] == 3 and stats["entries"] == 3
+
+        # the cached generators above the fork point are dropped on rollback
+        await store.rollback(1)
+        assert store.get_generator_stats()["entries"] == 1
+        with pytest.raises(KeyError):
+            await store.get_generators_at([uint32(2)])
+
+        # blocks added before the generators table was are parsed
+        async with db_wrapper.writer_maybe_transaction() as conn:
+            await conn.execute("DELETE FROM generators")
+        assert await store.get_generators_at([uint32(1), uint32(0)]) == [
+            new_blocks[1].transactions_generator,
+            new_blocks[0].transactions_generator,
+        ]
+        stats = store.get_generator_stats()
+        assert stats["cache_hits"] == 4 and stats["block_reads"] == 1
+        assert await store.get_generator(blocks[5].header_hash) == new_blocks[5].transactions_generator
+
+
+@pytest.mark.limit_consensus_modes(reason="save time")
+@pytest.mark.anyio
+@pytest.mark.parametrize("generator_table_blocks", [0, 3])
+async def test_generator_table_size(bt: BlockTools, generator_table_blocks: int) -> None:
+    blocks = bt.get_consecutive_blocks(10)
+
+    async with DBConnection(2) as db_wrapper:
+        store = await BlockStore.create(db_wrapper, use_cache=False, generator_table_blocks=generator_table_blocks)
+
+        new_blocks = []
+        for i, block in enumerate(blocks):
+            block = dataclasses.replace(block, transactions_generator=SerializedProgram.from_bytes(int_to_bytes(i + 1)))
+            block_record = header_block_to_sub_block_record(
+                DEFAULT_CONSTANTS, uint64(0), block, uint64(0), False, uint8(0), uint32(max(0, block.height - 1)), None
+            )
+            await store.add_full_block(block.header_hash, block, block_record)
+            await store.set_in_chain([(block_record.header_hash,)])
+            new_blocks.append(block)
+
+        # only the generators of the most recent blocks are kept in the table
+        async with db_wrapper.reader_no_transaction() as conn:
+            async with conn.execute("SELECT height FROM generators ORDER BY height") as cursor:
+                heights = [row[0] for row in await cursor.fetchall()]
+        assert heights == ([] if generator_table_blocks == 0 else [6, 7, 8, 9])
+
+        # the older ones are still found, by parsing their blocks
+        assert await store.get_generators_at([uint32(2), uint32(8)]) == [
+            new_blocks[2].transactions_generator,
+            new_blocks[8].transactions_generator,
+        ]
+        table_reads = 0 if generator_table_blocks == 0 else 1
+        stats = store.get_generator_stats()
+        assert stats["table_reads"] == table_reads
+        assert stats["block_reads"] == 2 - table_reads
+
+
 @pytest.mark.limit_consensus_modes(reason="save time")
 @pytest.mark.anyio
 async def test_get_blocks_by_hash(tmp_dir: Path, bt: BlockTools, db_version: int, use_cache: bool) -> None:
@@ -375,7 +501,9 @@ async def test_get_blocks_by_hash(tmp_dir: Path, bt: BlockTools, db_version: int
 
 @pytest.mark.limit_consensus_modes(reason="save time")
 @pytest.mark.anyio
-async def test_get_block_bytes_in_range(tmp_dir: Path, bt: BlockTools, db_version: int, use_cache: bool) -> None:
+async def test_get_block_bytes_in_range(
+    tmp_dir: Path, bt: BlockTools, db_version: int, use_cache: bool, monkeypatch: pytest.MonkeyPatch
+) -> None:
     assert sqlite3.threadsafety >= 1
     blocks = bt.get_consecutive_blocks(10)
 
@@ -401,6 +529,13 @@ async def test_get_block_bytes_in_range(tmp_dir: Path, bt: BlockTools, db_versio
             with pytest.raises(ValueError):
                 await store_2.get_block_bytes_in_range(0, 10)
 
+            # bigger ranges are decompressed in a thread
+            monkeypatch.setattr(block_store, "THREAD_DECOMPRESSION_THRESHOLD", 0)
+            store_2.blob_cache.clear_main_chain()
+            blobs = await store_2.get_block_blobs_in_range(2, 7)
+            assert [blob for blob, _ in blobs] == [bytes(b) for b in blocks[2:8]]
+            assert all(compressed is not None for _, compressed in blobs)
+
 
 @pytest.mark.anyio
 async def test_unsupported_version(tmp_dir: Path, use_cache: bool) -> None:
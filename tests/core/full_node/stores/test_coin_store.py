@@ -9,9 +9,11 @@ import pytest
 from hddcoin.consensus.block_rewards import calculate_base_farmer_reward, calculate_pool_reward
 from hddcoin.consensus.blockchain import AddBlockResult, Blockchain
 from hddcoin.consensus.coinbase import create_farmer_coin, create_pool_coin
+from hddcoin.full_node import coin_store as coin_store_module
 from hddcoin.full_node.block_store import BlockStore
 from hddcoin.full_node.coin_store import CoinStore
 from hddcoin.full_node.mempool_check_conditions import get_name_puzzle_conditions
+from hddcoin.protocols.wallet_protocol import CoinState
 from hddcoin.simulator.block_tools import BlockTools, test_constants
 from hddcoin.simulator.wallet_tools import WalletTool
 from hddcoin.types.blockchain_format.coin import Coin
@@ -19,6 +21,7 @@ from hddcoin.types.blockchain_format.sized_bytes import bytes32
 from hddcoin.types.coin_record import CoinRecord
 from hddcoin.types.full_block import FullBlock
 from hddcoin.types.generator_types import BlockGenerator
+from hddcoin.util.db_wrapper import SQLITE_MAX_VARIABLE_NUMBER
 from hddcoin.util.generator_tools import tx_removals_and_additions
 from hddcoin.util.hash import std_hash
 from hddcoin.util.ints import uint32, uint64
@@ -493,8 +496,161 @@ async def test_get_coin_states(db_version: int) -> None:
         assert len(await coin_store.get_coin_states_by_ids(True, coins, uint32(0), max_items=10000)) == 600
 
 
+@pytest.mark.anyio
+@pytest.mark.parametrize("max_variable_number", [2, SQLITE_MAX_VARIABLE_NUMBER])
+async def test_get_coin_states_paginated(
+    db_version: int, max_variable_number: int, monkeypatch: pytest.MonkeyPatch
+) -> None:
+    # a small variable number splits the puzzle hashes into several queries,
+    # whose results have to be merged
+    monkeypatch.setattr(coin_store_module, "SQLITE_MAX_VARIABLE_NUMBER", max_variable_number)
+    puzzle_hashes = [std_hash(i.to_bytes(4, byteorder="big")) for i in range(5)]
+    async with DBConnection(db_version) as db_wrapper:
+        crs = [
+            CoinRecord(
+                Coin(std_hash(i.to_bytes(4, byteorder="big")), puzzle_hashes[i % 5], uint64(100)),
+                uint32(i // 2 + 1),
+                uint32(i + 1 if i % 3 == 0 else 0),
+                False,
+                uint64(12321312),
+            )
+            for i in range(100)
+        ]
+        # a height with more coins than fit in a page
+        crs += [
+            CoinRecord(
+                Coin(std_hash(b"X" + i.to_bytes(4, byteorder="big")), puzzle_hashes[i % 5], uint64(100)),
+                uint32(20),
+                uint32(0),
+                False,
+                uint64(12321312),
+            )
+            for i in range(30)
+        ]
+        coin_store = await CoinStore.create(db_wrapper)
+        await coin_store._add_coin_records(crs)
+
+        for include_spent_coins, min_height in [(True, 0), (True, 30), (False, 0), (False, 30)]:
+            expected = await coin_store.get_coin_states_by_puzzle_hashes(
+                include_spent_coins, set(puzzle_hashes), uint32(min_height)
+            )
+            assert len(expected) > 0
+            for max_items in [1, 7, 25, 1000]:
+                states: List[CoinState] = []
+                next_page: Optional[Tuple[uint32, Optional[bytes32]]] = (uint32(0), None)
+                while next_page is not None:
+                    page, next_page = await coin_store.get_coin_states_by_puzzle_hashes_paginated(
+                        include_spent_coins,
+                        puzzle_hashes,
+                        uint32(min_height),
+                        start_height=next_page[0],
+                        start_after=next_page[1],
+                        max_items=max_items,
+                    )
+                    # only the last page is short, and the next one starts
+                    # after the last coin of this one
+                    assert len(page) == max_items or next_page is None
+                    assert next_page is None or next_page == (page[-1].created_height, page[-1].coin.name())
+                    states.extend(page)
+                keys = [(uint32(s.created_height or 0), s.coin.name()) for s in states]
+                assert keys == sorted(keys)
+                assert len(states) == len(expected)
+                assert set(states) == expected
+
+                streamed: List[CoinState] = []
+                async for chunk in coin_store.stream_coin_states_by_puzzle_hashes(
+                    include_spent_coins, puzzle_hashes, uint32(min_height), chunk_size=max_items
+                ):
+                    assert len(chunk) > 0
+                    streamed.extend(chunk)
+                assert streamed == states
+
+        assert await coin_store.get_coin_states_by_puzzle_hashes_paginated(True, []) == ([], None)
+
+
 @pytest.mark.anyio
 async def test_unsupported_version() -> None:
     with pytest.raises(RuntimeError, match="CoinStore does not support database schema v1"):
         async with DBConnection(1) as db_wrapper:
             await CoinStore.create(db_wrapper)
+
+
+@pytest.mark.anyio
+@pytest.mark.parametrize("unspent_index_mb", [0, 1])
+async def test_unspent_index(db_version: int, unspent_index_mb: int) -> None:
+    async with DBConnection(db_version) as db_wrapper:
+        crs = [
+            CoinRecord(
+                Coin(std_hash(i.to_bytes(4, byteorder="big")), std_hash(bytes([i % 3])), uint64(100)),
+                uint32(i),
+                uint32(0),
+                False,
+                uint64(12321312),
+            )
+            for i in range(1, 101)
+        ]
+        # the index is loaded from the database on startup
+        coin_store = await CoinStore.create(db_wrapper)
+        await coin_store._add_coin_records(crs[:50])
+        coin_store = await CoinStore.create(db_wrapper, unspent_index_mb=unspent_index_mb)
+        assert (coin_store.unspent_index is not None) == (unspent_index_mb > 0)
+        if coin_store.unspent_index is not None:
+            assert coin_store.unspent_index.complete
+            assert len(coin_store.unspent_index) == 50
+        await coin_store._add_coin_records(crs[50:])
+
+        spent = [cr.name for cr in crs[90:]]
+        await coin_store._set_spent(spent, uint32(101))
+        names = [cr.name for cr in crs]
+
+        assert await coin_store.get_coin_record(crs[0].name) == crs[0]
+        spent_record = await coin_store.get_coin_record(crs[95].name)
+        assert spent_record is not None
+        assert spent_record.spent_block_index == 101
+        assert len(await coin_store.get_coin_records(names)) == 100
+        assert len(await coin_store.get_coin_records_by_names(False, names)) == 90
+        assert len(await coin_store.get_coin_records_by_names(True, names)) == 100
+        assert len(await coin_store.get_coin_records_by_names(False, names, uint32(10), uint32(20))) == 10
+        by_ph = await coin_store.get_coin_records_by_puzzle_hash(False, std_hash(bytes([1])))
+        assert len(by_ph) == 30
+        assert all(cr.spent_block_index == 0 for cr in by_ph)
+        assert len(await coin_store.get_coin_records_by_puzzle_hashes(False, [std_hash(bytes([0]))], uint32(50))) == 14
+
+        # rolling back un-spends the coins spent at height 101, and removes
+        # the coins created after height 80
+        await coin_store.rollback_to_block(80)
+        assert len(await coin_store.get_coin_records(names)) == 80
+        assert len(await coin_store.get_coin_records_by_names(False, names)) == 80
+        assert await coin_store.get_coin_record(crs[95].name) is None
+        assert len(await coin_store.get_coin_records_by_puzzle_hash(False, std_hash(bytes([1])))) == 27
+
+        if coin_store.unspent_index is not None:
+            assert coin_store.unspent_index.hits > 0
+
+        # the index only changes once the transaction commits. Until then the
+        # task writing reads its changes from the database
+        with pytest.raises(RuntimeError, match="failed"):
+            async with db_wrapper.writer():
+                await coin_store._set_spent([crs[0].name], uint32(40))
+                await coin_store._add_coin_records(crs[90:])
+                await coin_store.rollback_to_block(50)
+                assert len(await coin_store.get_coin_records_by_names(False, names)) == 49
+                assert len(await coin_store.get_coin_records_by_puzzle_hash(False, std_hash(bytes([1])))) == 16
+                if coin_store.unspent_index is not None:
+                    assert len(coin_store.unspent_index) == 80
+                raise RuntimeError("failed")
+        assert await coin_store.get_coin_record(crs[0].name) == crs[0]
+        assert len(await coin_store.get_coin_records(names)) == 80
+        assert len(await coin_store.get_coin_records_by_names(False, names)) == 80
+        assert len(await coin_store.get_coin_records_by_puzzle_hash(False, std_hash(bytes([1])))) == 27
+        if coin_store.unspent_index is not None:
+            assert coin_store.unspent_index.complete
+            assert len(coin_store.unspent_index) == 80
+
+        async with db_wrapper.writer():
+            await coin_store._set_spent([crs[0].name], uint32(40))
+            await coin_store.rollback_to_block(50)
+        assert len(await coin_store.get_coin_records_by_names(False, names)) == 49
+        assert len(await coin_store.get_coin_records_by_puzzle_hash(False, std_hash(bytes([1])))) == 16
+        if coin_store.unspent_index is not None:
+            assert len(coin_store.unspent_index) == 49
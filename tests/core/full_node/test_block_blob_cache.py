@@ -0,0 +1,142 @@
+from __future__ import annotations
+
+from pathlib import Path
+
+import pytest
+
+from hddcoin.full_node.block_blob_cache import ENTRY_HEADER, BlockBlobCache, BlockBlobFile, BlockBlobLRU
+from hddcoin.types.blockchain_format.sized_bytes import bytes32
+from hddcoin.util.ints import uint32
+
+
+def hh(i: int) -> bytes32:
+    return bytes32(i.to_bytes(32, "big"))
+
+
+def blob(i: int, size: int = 100) -> bytes:
+    return bytes([i % 256]) * size
+
+
+def test_lru_byte_budget() -> None:
+    cache = BlockBlobLRU(max_bytes=1000)
+    for i in range(10):
+        assert cache.put(hh(i), uint32(i), blob(i)) == []
+    assert cache.size == 1000
+
+    # reading a block makes it the most recently used one
+    assert cache.get(hh(0)) == blob(0)
+    assert cache.put(hh(10), uint32(10), blob(10, 250)) == [(hh(1), uint32(1)), (hh(2), uint32(2)), (hh(3), uint32(3))]
+    assert cache.size == 950
+    assert cache.get(hh(1)) is None
+    assert cache.get(hh(0)) == blob(0)
+
+    # blocks larger than the whole cache are not cached
+    assert cache.put(hh(11), uint32(11), blob(11, 1001)) == []
+    assert cache.get(hh(11)) is None
+
+    cache.remove(hh(10))
+    assert cache.size == 700
+    assert cache.get_stats() == {"entries": 7, "size": 700, "max_size": 1000, "hits": 2, "misses": 2}
+
+
+@pytest.mark.anyio
+async def test_file_ring_buffer(tmp_dir: Path) -> None:
+    entry_size = ENTRY_HEADER.size + 100
+    cache = await BlockBlobFile.create(tmp_dir / "block-cache", entry_size * 10 + 50)
+    for i in range(10):
+        assert cache.put(hh(i), uint32(i), blob(i)) == []
+    for i in range(10):
+        assert cache.get(hh(i)) == blob(i)
+
+    # there's no room left at the end of the file, wrap around and overwrite
+    # the oldest blocks
+    assert cache.put(hh(10), uint32(10), blob(10, 150)) == [(hh(0), uint32(0)), (hh(1), uint32(1))]
+    assert cache.get(hh(0)) is None
+    assert cache.get(hh(2)) == blob(2)
+    assert cache.get(hh(10)) == blob(10, 150)
+    assert len(cache) == 9
+
+    # blocks too large for the cache are skipped
+    assert cache.put(hh(11), uint32(11), blob(11, entry_size * 3)) == []
+    assert cache.get(hh(11)) is None
+    await cache.close()
+
+
+@pytest.mark.anyio
+async def test_file_restart(tmp_dir: Path) -> None:
+    path = tmp_dir / "block-cache"
+    entry_size = ENTRY_HEADER.size + 100
+    cache = await BlockBlobFile.create(path, entry_size * 10)
+    for i in range(15):
+        cache.put(hh(i), uint32(i), blob(i))
+    await cache.flush()
+    index_path = path.with_name(path.name + "-index")
+    saved_index = index_path.read_bytes()
+    # the index is saved periodically, so some blocks may be missing from it,
+    # and overwrite blocks it knows about
+    cache.put(hh(15), uint32(15), blob(15))
+    await cache.close()
+    # like the node was killed before saving the index again
+    index_path.write_bytes(saved_index)
+
+    cache = await BlockBlobFile.create(path, entry_size * 10)
+    assert len(cache) == 10
+    # this block was overwritten after the index was saved
+    assert cache.get(hh(5)) is None
+    for i in range(6, 15):
+        assert cache.get(hh(i)) == blob(i)
+    assert cache.get(hh(15)) is None
+    cache.put(hh(16), uint32(16), blob(16))
+    assert cache.get(hh(16)) == blob(16)
+    assert cache.get(hh(7)) == blob(7)
+    # closing the cache saves the index
+    await cache.close()
+    await cache.close()
+
+    cache = await BlockBlobFile.create(path, entry_size * 10)
+    assert cache.get(hh(16)) == blob(16)
+    await cache.close()
+
+    # resizing the cache discards it
+    cache = await BlockBlobFile.create(path, entry_size * 20)
+    assert len(cache) == 0
+    assert cache.get(hh(7)) is None
+    await cache.close()
+
+
+@pytest.mark.anyio
+@pytest.mark.parametrize("disk_mb", [0, 1])
+async def test_main_chain(tmp_dir: Path, disk_mb: int) -> None:
+    cache = await BlockBlobCache.create(1, tmp_dir / "block-cache", disk_mb)
+    assert (cache.disk is not None) == (disk_mb > 0)
+
+    # blocks are not known to be in the main chain until they're set in it
+    cache.add_new_block(hh(1), uint32(1), blob(1))
+    cache.add_new_block(hh(2), uint32(2), blob(2))
+    assert cache.get_at_height(uint32(1)) is None
+    cache.set_in_chain([hh(1), hh(2), hh(3)])
+    assert cache.get_at_height(uint32(1)) == blob(1)
+    assert cache.get_at_height(uint32(2)) == blob(2)
+    assert cache.get_at_height(uint32(3)) is None
+
+    cache.rollback(1)
+    assert cache.get_at_height(uint32(2)) is None
+    assert cache.get(hh(2)) == blob(2)
+
+    cache.put(hh(5), uint32(5), blob(5), in_main_chain=True)
+    assert cache.get_at_height(uint32(5)) == blob(5)
+    cache.remove(hh(5))
+    assert cache.get_at_height(uint32(5)) is None
+
+    cache.clear_main_chain()
+    assert cache.get_at_height(uint32(1)) is None
+
+    stats = cache.get_stats()
+    assert stats["memory"]["entries"] == 2
+    assert stats["memory"]["hits"] == 4
+    assert (stats["disk"] is None) == (disk_mb == 0)
+
+    # the in-memory tier still works after closing the cache
+    await cache.close()
+    assert cache.disk is None
+    assert cache.get(hh(1)) == blob(1)
@@ -138,7 +138,7 @@ class TestBlockHeightMap:
 
             await height_map.maybe_flush()
 
-            del height_map
+            height_map.close()
 
             # To ensure we're actually loading from cache, and not the DB, clear
             # the table (but we still need the peak). We need at least 20 blocks
@@ -204,7 +204,7 @@ class TestBlockHeightMap:
 
             height_map = await BlockHeightMap.create(tmp_dir, db_wrapper)
             await height_map.maybe_flush()
-            del height_map
+            height_map.close()
 
             # corrupt the sub epoch cache
             ses_cache = []
@@ -247,7 +247,7 @@ class TestBlockHeightMap:
 
             await height_map.maybe_flush()
 
-            del height_map
+            height_map.close()
 
         async with DBConnection(db_version) as db_wrapper:
             await setup_db(db_wrapper)
@@ -419,7 +419,7 @@ class TestBlockHeightMap:
         async with DBConnection(db_version) as db_wrapper:
             await setup_db(db_wrapper)
             await setup_chain(db_wrapper, 10000, ses_every=20)
-            await BlockHeightMap.create(tmp_dir, db_wrapper)
+            (await BlockHeightMap.create(tmp_dir, db_wrapper)).close()
             # To ensure we're actually loading from cache, and not the DB, clear
             # the table.
             async with db_wrapper.writer_maybe_transaction() as conn:
@@ -429,7 +429,7 @@ class TestBlockHeightMap:
             with open(tmp_dir / "height-to-hash", "rb") as f:
                 heights = bytearray(f.read())
                 assert len(heights) == (10000 + 1) * 32
-            await BlockHeightMap.create(tmp_dir, db_wrapper)
+            (await BlockHeightMap.create(tmp_dir, db_wrapper)).close()
             # Make sure we didn't alter the cache (nothing new to write)
             with open(tmp_dir / "height-to-hash", "rb") as f:
                 # pytest doesn't behave very well comparing large buffers
@@ -451,7 +451,7 @@ class TestBlockHeightMap:
             await write_file_async(tmp_dir / "height-to-hash", heights)
             await setup_db(db_wrapper)
             await setup_chain(db_wrapper, 10000, ses_every=20)
-            await BlockHeightMap.create(tmp_dir, db_wrapper)
+            (await BlockHeightMap.create(tmp_dir, db_wrapper)).close()
             # We replaced the whole cache at this point so all values should be different
             with open(tmp_dir / "height-to-hash", "rb") as f:
                 new_heights = bytearray(f.read())
@@ -469,7 +469,7 @@ class TestBlockHeightMap:
         async with DBConnection(db_version) as db_wrapper:
             await setup_db(db_wrapper)
             await setup_chain(db_wrapper, 2000, ses_every=20)
-            await BlockHeightMap.create(tmp_dir, db_wrapper)
+            (await BlockHeightMap.create(tmp_dir, db_wrapper)).close()
         async with DBConnection(db_version) as db_wrapper:
             await setup_db(db_wrapper)
             # Add 2000 blocks to the chain
@@ -478,7 +478,7 @@ class TestBlockHeightMap:
             with open(tmp_dir / "height-to-hash", "rb") as f:
                 heights = f.read()
                 assert len(heights) == (2000 + 1) * 32
-            await BlockHeightMap.create(tmp_dir, db_wrapper)
+            (await BlockHeightMap.create(tmp_dir, db_wrapper)).close()
             # Make sure we properly wrote the additional data to the cache
             with open(tmp_dir / "height-to-hash", "rb") as f:
                 new_heights = f.read()
@@ -497,6 +497,7 @@ class TestBlockHeightMap:
             await setup_chain(db_wrapper, 2000, ses_every=20)
             bh = await BlockHeightMap.create(tmp_dir, db_wrapper)
             await bh.maybe_flush()
+            bh.close()
 
             # extend the cache file
             with open(tmp_dir / "height-to-hash", "r+b") as f:
@@ -505,6 +506,7 @@ class TestBlockHeightMap:
 
             bh = await BlockHeightMap.create(tmp_dir, db_wrapper)
             await bh.maybe_flush()
+            bh.close()
 
             with open(tmp_dir / "height-to-hash", "rb") as f:
                 new_heights = f.read()
@@ -514,12 +516,66 @@ class TestBlockHeightMap:
                 for idx in range(0, 2000):
                     assert new_heights[idx * 32 : idx * 32 + 32] == gen_block_hash(idx)
 
+    @pytest.mark.anyio
+    async def test_restore_from_tail(self, tmp_dir: Path, db_version: int) -> None:
+        # without any sub epoch summaries, only the checksummed tail file tells
+        # us how much of the cache we can trust
+        async with DBConnection(db_version) as db_wrapper:
+            await setup_db(db_wrapper)
+            await setup_chain(db_wrapper, 10000)
+            (await BlockHeightMap.create(tmp_dir, db_wrapper)).close()
+
+            # only keep the most recent blocks in the DB. We must not need more
+            # than that to reconcile the cache
+            async with db_wrapper.writer_maybe_transaction() as conn:
+                await conn.execute("DELETE FROM full_blocks WHERE height < 9990")
+
+            height_map = await BlockHeightMap.create(tmp_dir, db_wrapper)
+            for height in reversed(range(10000)):
+                assert height_map.get_hash(uint32(height)) == gen_block_hash(height)
+            height_map.close()
+
+            # without the tail file, we can't tell where the cache is valid
+            os.remove(tmp_dir / "height-to-hash-tail")
+            with pytest.raises(ValueError, match="block with header hash is missing from your blockchain database"):
+                await BlockHeightMap.create(tmp_dir, db_wrapper)
+
+    @pytest.mark.anyio
+    async def test_reorg_flushed_blocks(self, tmp_dir: Path, db_version: int) -> None:
+        async with DBConnection(db_version) as db_wrapper:
+            await setup_db(db_wrapper)
+            await setup_chain(db_wrapper, 2000, ses_every=20)
+            height_map = await BlockHeightMap.create(tmp_dir, db_wrapper)
+
+            # reorg below the flushed height, and extend past the end of the
+            # file
+            height_map.rollback(1500)
+            for height in range(1501, 3000):
+                height_map.update_height(uint32(height), gen_block_hash(height + 100000), None)
+            assert not height_map.contains_height(uint32(3000))
+            for height in range(1501, 3000):
+                assert height_map.get_hash(uint32(height)) == gen_block_hash(height + 100000)
+            await height_map.maybe_flush()
+
+            with open(tmp_dir / "height-to-hash", "rb") as f:
+                heights = f.read()
+            assert len(heights) == 3000 * 32
+            for height in range(3000):
+                expected = gen_block_hash(height if height <= 1500 else height + 100000)
+                assert heights[height * 32 : height * 32 + 32] == expected
+
+            # roll back blocks that were never written to the file
+            height_map.update_height(uint32(3000), gen_block_hash(3000), None)
+            height_map.rollback(2999)
+            assert not height_map.contains_height(uint32(3000))
+            assert height_map.get_hash(uint32(2999)) == gen_block_hash(2999 + 100000)
+
 
 @pytest.mark.anyio
 async def test_unsupported_version(tmp_dir: Path) -> None:
     with pytest.raises(RuntimeError, match="BlockHeightMap does not support database schema v1"):
         async with DBConnection(1) as db_wrapper:
-            await BlockHeightMap.create(tmp_dir, db_wrapper)
+            (await BlockHeightMap.create(tmp_dir, db_wrapper)).close()
 
 
 @pytest.mark.anyio
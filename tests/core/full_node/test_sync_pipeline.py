@@ -0,0 +1,97 @@
+from __future__ import annotations
+
+import asyncio
+from dataclasses import dataclass
+from typing import List, cast
+
+import pytest
+
+from hddcoin.consensus.block_record import BlockRecord
+from hddcoin.full_node.sync_pipeline import SyncPipelineStats, UncommittedChain
+from hddcoin.types.blockchain_format.sized_bytes import bytes32
+from hddcoin.types.full_block import FullBlock
+from hddcoin.util.ints import uint32
+
+
+@dataclass(frozen=True)
+class FakeBlock:
+    header_hash: bytes32
+    prev_header_hash: bytes32
+    height: uint32
+
+
+def make_chain(start_height: int, count: int, prev: bytes32) -> List[FullBlock]:
+    blocks: List[FullBlock] = []
+    for height in range(start_height, start_height + count):
+        header_hash = bytes32(height.to_bytes(32, "big"))
+        blocks.append(cast(FullBlock, FakeBlock(header_hash, prev, uint32(height))))
+        prev = header_hash
+    return blocks
+
+
+def fake_records(blocks: List[FullBlock]) -> List[BlockRecord]:
+    return [cast(BlockRecord, b) for b in blocks]
+
+
+@pytest.mark.anyio
+async def test_uncommitted_chain_extends_peak() -> None:
+    chain = UncommittedChain()
+    batch1 = make_chain(10, 5, bytes32([0] * 32))
+    batch2 = make_chain(15, 5, batch1[-1].header_hash)
+    assert chain.can_extend(batch1[0])
+
+    chain.add(batch1, fake_records(batch1), extends_peak=True)
+    assert len(chain) == 5
+    assert chain.tip == batch1[-1].header_hash
+    assert chain.height_to_hash[uint32(12)] == batch1[2].header_hash
+    assert chain.can_extend(batch2[0])
+    assert not chain.can_extend(batch2[1])
+
+    chain.add(batch2, fake_records(batch2), extends_peak=False)
+    # only the first batch decides whether the chain extends the peak
+    assert chain.extends_peak
+    assert len(chain) == 10
+
+    chain.remove(batch1)
+    assert len(chain) == 5
+    assert uint32(12) not in chain.height_to_hash
+    assert chain.tip == batch2[-1].header_hash
+
+    waiter = asyncio.create_task(chain.wait_empty())
+    await asyncio.sleep(0)
+    assert not waiter.done()
+    chain.remove(batch2)
+    await asyncio.wait_for(waiter, timeout=1)
+    assert chain.tip is None
+    assert not chain.extends_peak
+
+
+@pytest.mark.anyio
+async def test_uncommitted_chain_fork() -> None:
+    chain = UncommittedChain()
+    batch1 = make_chain(10, 5, bytes32([0] * 32))
+    batch2 = make_chain(15, 5, batch1[-1].header_hash)
+    chain.add(batch1, fake_records(batch1), extends_peak=False)
+    # when not extending the peak, the next batch has to wait for the writer
+    assert not chain.can_extend(batch2[0])
+    # removing blocks that were never added is a no-op
+    chain.remove(batch2)
+    assert len(chain) == 5
+    chain.remove(batch1)
+    assert chain.can_extend(batch2[0])
+
+
+def test_sync_pipeline_stats() -> None:
+    stats = SyncPipelineStats(uint32(0), uint32(100))
+    stats.fetch.record(32, 1.0)
+    stats.pre_validate.record(32, 4.0)
+    stats.commit.record(32, 2.0)
+    stats.commit.record(32, 2.5)
+    assert stats.bottleneck() == "commit"
+
+    json_dict = stats.to_json_dict()
+    assert json_dict["running"]
+    assert json_dict["bottleneck"] == "commit"
+    assert json_dict["stages"]["commit"]["batches"] == 2
+    assert json_dict["stages"]["commit"]["blocks"] == 64
+    assert json_dict["stages"]["pre_validate"]["blocks_per_second"] == 8.0
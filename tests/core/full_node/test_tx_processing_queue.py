@@ -8,7 +8,7 @@ from typing import List, Optional, cast
 
 import pytest
 
-from hddcoin.full_node.tx_processing_queue import TransactionQueue, TransactionQueueFull
+from hddcoin.full_node.tx_processing_queue import ESTIMATED_COST_PER_BYTE, TransactionQueue, TransactionQueueFull
 from hddcoin.types.blockchain_format.sized_bytes import bytes32
 from hddcoin.types.transaction_queue_entry import TransactionQueueEntry
 
@@ -19,10 +19,15 @@ log = logging.getLogger(__name__)
 class FakeTransactionQueueEntry:
     index: int
     peer_id: Optional[bytes32]
+    transaction_bytes: bytes = b""
 
 
-def get_transaction_queue_entry(peer_id: Optional[bytes32], tx_index: int) -> TransactionQueueEntry:  # easy shortcut
-    return cast(TransactionQueueEntry, FakeTransactionQueueEntry(index=tx_index, peer_id=peer_id))
+def get_transaction_queue_entry(
+    peer_id: Optional[bytes32], tx_index: int, size: int = 0
+) -> TransactionQueueEntry:  # easy shortcut
+    return cast(
+        TransactionQueueEntry, FakeTransactionQueueEntry(index=tx_index, peer_id=peer_id, transaction_bytes=bytes(size))
+    )
 
 
 @pytest.mark.anyio
@@ -152,3 +157,83 @@ async def test_queue_cleanup_and_fairness(seeded_random: random.Random) -> None:
     for _ in range(2):  # we validate that we properly queue the last 2 transactions
         second_resulting_ids.append((await transaction_queue.pop()).peer_id)  # type: ignore[attr-defined]
     assert [peer_a, peer_c] == second_resulting_ids
+
+
+@pytest.mark.anyio
+async def test_pop_many(seeded_random: random.Random) -> None:
+    transaction_queue = TransactionQueue(1000, log)
+    peer_ids = [bytes32.random(seeded_random) for _ in range(2)]
+    list_txs = [get_transaction_queue_entry(peer_ids[i % 2], i) for i in range(10)]
+    for tx in list_txs:
+        await transaction_queue.put(tx, tx.peer_id)  # type: ignore[attr-defined]
+    local_tx = get_transaction_queue_entry(None, 10)
+    await transaction_queue.put(local_tx, None)
+
+    # local transactions first, then round-robin between the peers
+    assert await transaction_queue.pop_many(3) == [local_tx, list_txs[0], list_txs[1]]
+    # it doesn't wait for more transactions than there are queued
+    assert await transaction_queue.pop_many(100) == list_txs[2:]
+
+    task = asyncio.create_task(transaction_queue.pop_many(5))
+    await asyncio.sleep(0.1)
+    assert not task.done()
+    await transaction_queue.put(local_tx, None)
+    assert await task == [local_tx]
+
+
+@pytest.mark.anyio
+async def test_cost_fairness(seeded_random: random.Random) -> None:
+    # every peer may spend the cost of a 100 byte spend bundle per round
+    transaction_queue = TransactionQueue(1000, log, quantum=100 * ESTIMATED_COST_PER_BYTE)
+    peer_a = bytes32.random(seeded_random)
+    peer_b = bytes32.random(seeded_random)
+    for i in range(10):
+        await transaction_queue.put(get_transaction_queue_entry(peer_a, i, 400), peer_a)
+    for i in range(20):
+        await transaction_queue.put(get_transaction_queue_entry(peer_b, i, 100), peer_b)
+
+    # peer a's transactions cost 4 times as much, so it gets a turn every 4
+    # rounds. Once peer b is done, peer a doesn't have to wait for its turns
+    expected_ids = []
+    for i in range(1, 21):
+        if i % 4 == 0:
+            expected_ids.append(peer_a)
+        expected_ids.append(peer_b)
+    expected_ids += [peer_a] * 5
+
+    resulting_ids = [(await transaction_queue.pop()).peer_id for _ in range(10)]  # type: ignore[attr-defined]
+    stats = transaction_queue.get_stats()
+    assert [(p["peer_id"], p["queued"]) for p in stats["peers"]] == [(peer_b.hex(), 12), (peer_a.hex(), 8)]
+    assert stats["peers"][1]["queued_cost"] == 8 * 400 * ESTIMATED_COST_PER_BYTE
+    resulting_ids += [(await transaction_queue.pop()).peer_id for _ in range(20)]  # type: ignore[attr-defined]
+    assert resulting_ids == expected_ids
+
+
+@pytest.mark.anyio
+async def test_rejected_peer_weight(seeded_random: random.Random) -> None:
+    transaction_queue = TransactionQueue(1000, log, quantum=100 * ESTIMATED_COST_PER_BYTE)
+    peer_a = bytes32.random(seeded_random)
+    peer_b = bytes32.random(seeded_random)
+    # all of peer a's transactions were invalid, it gets a tenth of the quantum
+    for _ in range(20):
+        transaction_queue.record_result(peer_a, False)
+    transaction_queue.record_result(peer_b, True)
+    for i in range(5):
+        await transaction_queue.put(get_transaction_queue_entry(peer_a, i, 50), peer_a)
+    for i in range(10):
+        await transaction_queue.put(get_transaction_queue_entry(peer_b, i, 50), peer_b)
+
+    resulting_ids = [(await transaction_queue.pop()).peer_id for _ in range(6)]  # type: ignore[attr-defined]
+    assert resulting_ids == [peer_b] * 4 + [peer_a, peer_b]
+
+    stats = {p["peer_id"]: p for p in transaction_queue.get_stats()["peers"]}
+    assert stats[peer_a.hex()]["weight"] == pytest.approx(0.1)
+    assert stats[peer_a.hex()]["rejected"] == 20
+    assert stats[peer_b.hex()]["weight"] == 1
+    assert stats[peer_b.hex()]["accepted"] == 1
+
+    with pytest.raises(TransactionQueueFull):
+        full_queue = TransactionQueue(1, log)
+        await full_queue.put(get_transaction_queue_entry(peer_a, 0), peer_a)
+        await full_queue.put(get_transaction_queue_entry(peer_a, 1), peer_a)
+    assert full_queue.get_stats()["peers"][0]["dropped"] == 1
@@ -0,0 +1,75 @@
+from __future__ import annotations
+
+from typing import List
+
+from hddcoin.full_node.unspent_coin_index import UnspentCoinIndex
+from hddcoin.types.blockchain_format.coin import Coin
+from hddcoin.types.blockchain_format.sized_bytes import bytes32
+from hddcoin.types.coin_record import CoinRecord
+from hddcoin.util.hash import std_hash
+from hddcoin.util.ints import uint32, uint64
+
+
+def make_records(count: int, spent_index: int = 0) -> List[CoinRecord]:
+    return [
+        CoinRecord(
+            Coin(std_hash(i.to_bytes(4, byteorder="big")), std_hash(bytes([i % 2])), uint64(i)),
+            uint32(i),
+            uint32(spent_index),
+            False,
+            uint64(0),
+        )
+        for i in range(count)
+    ]
+
+
+def test_add_remove() -> None:
+    index = UnspentCoinIndex(capacity=100)
+    records = make_records(10)
+    index.load(records, complete=True)
+    assert index.complete
+    assert len(index) == 10
+    assert index.get(records[3].name) == records[3]
+    assert index.get(bytes32([0] * 32)) is None
+    assert index.hits == 1
+    assert index.misses == 1
+
+    index.remove([records[3].name, records[4].name])
+    found, missing = index.get_many([r.name for r in records])
+    assert len(found) == 8
+    assert missing == [records[3].name, records[4].name]
+
+    by_ph = index.get_by_puzzle_hashes([std_hash(bytes([1]))])
+    assert by_ph is not None
+    assert {r.name for r in by_ph} == {r.name for r in records[1::2]} - {records[3].name}
+
+    # spent coins are never added
+    index.add(make_records(20, spent_index=5)[10:])
+    assert len(index) == 8
+
+
+def test_eviction() -> None:
+    index = UnspentCoinIndex(capacity=5)
+    records = make_records(8)
+    index.load(records[:5], complete=True)
+    assert index.complete
+    index.add(records[5:])
+    assert len(index) == 5
+    # the oldest entries are evicted first, and the index can no longer serve
+    # puzzle hash lookups
+    assert not index.complete
+    assert index.get(records[0].name) is None
+    assert index.get(records[7].name) == records[7]
+    assert index.get_by_puzzle_hashes([std_hash(bytes([1]))]) is None
+    assert index.get_stats()["size"] == 5
+
+
+def test_load_too_many() -> None:
+    index = UnspentCoinIndex.create(1)
+    assert index.capacity > 0
+    index = UnspentCoinIndex(capacity=3)
+    index.load(make_records(4), complete=True)
+    assert not index.complete
+    index.clear()
+    assert len(index) == 0
+    assert index.get_by_puzzle_hashes([std_hash(bytes([1]))]) is None
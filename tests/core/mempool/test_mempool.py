@@ -15,7 +15,7 @@ from hddcoin.consensus.cost_calculator import NPCResult
 from hddcoin.full_node.bitcoin_fee_estimator import create_bitcoin_fee_estimator
 from hddcoin.full_node.fee_estimation import EmptyMempoolInfo, MempoolInfo
 from hddcoin.full_node.full_node_api import FullNodeAPI
-from hddcoin.full_node.mempool import Mempool
+from hddcoin.full_node.mempool import Mempool, MempoolRemoveReason
 from hddcoin.full_node.mempool_check_conditions import get_name_puzzle_conditions, get_puzzle_and_solution_for_coin
 from hddcoin.full_node.mempool_manager import MEMPOOL_MIN_FEE_INCREASE
 from hddcoin.full_node.pending_tx_cache import ConflictTxCache, PendingTxCache
@@ -2788,6 +2788,52 @@ def test_full_mempool(items: List[int], add: int, expected: List[int]) -> None:
         assert mi.cost == expected_cost
 
 
+def test_fee_histogram() -> None:
+    fee_estimator = create_bitcoin_fee_estimator(uint64(11000000000))
+    mempool_info = MempoolInfo(
+        CLVMCost(uint64(1000)),
+        FeeRate(uint64(1000000)),
+        CLVMCost(uint64(100)),
+    )
+    mempool = Mempool(mempool_info, fee_estimator)
+    histogram = mempool.get_fee_histogram()
+    assert histogram["count"] == 0
+    assert histogram["next_block_fee_per_cost"] == 0
+    assert histogram["percentiles"] == {}
+    assert histogram["buckets"] == []
+
+    items = [item_cost(cost, fee_rate) for cost, fee_rate in [(60, 10.0), (30, 10.0), (50, 5.0), (60, 0.0)]]
+    for item in items:
+        mempool.add_to_pool(item)
+    histogram = mempool.get_fee_histogram()
+    # the snapshot is reused until the mempool changes
+    assert mempool.get_fee_histogram() is histogram
+    assert histogram["count"] == 4
+    assert histogram["total_cost"] == 200
+    assert [(b["count"], b["cost"], b["cumulative_cost"]) for b in histogram["buckets"]] == [
+        (2, 90, 90),
+        (1, 50, 140),
+        (1, 60, 200),
+    ]
+    assert histogram["buckets"][0]["fee_per_cost"] <= 10.0 < histogram["buckets"][0]["fee_per_cost"] * 1.05
+    assert histogram["buckets"][2]["fee_per_cost"] == 0
+    # the first 90 cost of the block is taken by the items paying 10, so an
+    # item has to pay more than the 5 of the next item to get in
+    assert 5.0 < histogram["next_block_fee_per_cost"] <= 5.0 * 1.05
+    # 30% of the cost pays nothing, 25% pays 5 and the rest pays 10
+    percentiles = histogram["percentiles"]
+    assert percentiles["5"] == percentiles["25"] == 0
+    assert percentiles["50"] == histogram["buckets"][1]["fee_per_cost"]
+    assert percentiles["75"] == percentiles["95"] == histogram["buckets"][0]["fee_per_cost"]
+
+    # everything left fits in a block
+    mempool.remove_from_pool([items[0].name, items[2].name], MempoolRemoveReason.BLOCK_INCLUSION)
+    invariant_check_mempool(mempool)
+    histogram = mempool.get_fee_histogram()
+    assert histogram["next_block_fee_per_cost"] == 0
+    assert [(b["count"], b["cost"], b["cumulative_cost"]) for b in histogram["buckets"]] == [(1, 30, 30), (1, 60, 90)]
+
+
 @pytest.mark.parametrize("height", [True, False])
 @pytest.mark.parametrize(
     "items,expected,increase_fee",
@@ -2901,6 +2947,41 @@ def test_get_items_by_coin_ids(items: List[MempoolItem], coin_ids: List[bytes32]
     assert set(result) == set(expected)
 
 
+def test_priority_index_in_sync() -> None:
+    fee_estimator = create_bitcoin_fee_estimator(uint64(11000000000))
+    mempool_info = MempoolInfo(
+        CLVMCost(uint64(100)),
+        FeeRate(uint64(1000000)),
+        CLVMCost(uint64(100)),
+    )
+    mempool = Mempool(mempool_info, fee_estimator)
+    items = [
+        mk_item(coins[0:1], fee=100, cost=50),
+        mk_item(coins[1:3], fee=30, cost=30),
+        mk_item(coins[2:3], fee=20, cost=20),
+    ]
+    for i in items:
+        assert mempool.add_to_pool(i) is None
+        invariant_check_mempool(mempool)
+
+    # items with the same fee rate are ordered by when they were added
+    assert list(mempool.items_by_feerate()) == items
+    assert mempool.get_min_fee_rate(10) == 1.0
+    assert mempool.get_min_fee_rate(60) == 2.0
+
+    # evicting the lowest fee rate items removes them from the coin index too
+    assert mempool.add_to_pool(mk_item(coins[3:4], fee=150, cost=50)) is None
+    invariant_check_mempool(mempool)
+    assert mempool.size() == 2
+    assert mempool.get_items_by_coin_id(coins[2].name()) == []
+    assert mempool.get_item_by_id(items[1].name) is None
+    assert mempool.get_items_by_coin_id(coins[0].name()) == [items[0]]
+
+    mempool.remove_from_pool([items[0].name], MempoolRemoveReason.CONFLICT)
+    invariant_check_mempool(mempool)
+    assert mempool.get_items_by_coin_ids([coins[0].name(), coins[3].name()]) == list(mempool.all_items())
+
+
 def test_aggregating_on_a_solution_then_a_more_cost_saving_one_appears() -> None:
     def always(_: bytes32) -> bool:
         return True
@@ -2,16 +2,20 @@ from __future__ import annotations
 
 from dataclasses import dataclass
 from typing import Any, Awaitable, Callable, Dict, List, Optional, Set, Tuple
+from unittest.mock import patch
 
 import pytest
 from chia_rs import ELIGIBLE_FOR_DEDUP, G1Element, G2Element
 from chiabip158 import PyBIP158
 
+from hddcoin.consensus.block_creation import compute_block_cost
 from hddcoin.consensus.constants import ConsensusConstants
 from hddcoin.consensus.cost_calculator import NPCResult
 from hddcoin.consensus.default_constants import DEFAULT_CONSTANTS
 from hddcoin.full_node.bundle_tools import simple_solution_generator
+from hddcoin.full_node.mempool import MempoolRemoveReason
 from hddcoin.full_node.mempool_check_conditions import get_name_puzzle_conditions, mempool_check_time_locks
+from hddcoin.full_node.mempool_index import short_id
 from hddcoin.full_node.mempool_manager import (
     MEMPOOL_MIN_FEE_INCREASE,
     MempoolManager,
@@ -414,6 +418,25 @@ async def test_empty_spend_bundle() -> None:
         await mempool_manager.pre_validate_spendbundle(sb, None, sb.name())
 
 
+@pytest.mark.anyio
+async def test_pre_validate_spendbundles() -> None:
+    mempool_manager = await instantiate_mempool_manager(zero_calls_get_coin_record)
+    sb1 = spend_bundle_from_conditions([[ConditionOpcode.CREATE_COIN, IDENTITY_PUZZLE_HASH, 1]])
+    sb2 = spend_bundle_from_conditions([[ConditionOpcode.CREATE_COIN, IDENTITY_PUZZLE_HASH, -1]])
+    sb3 = spend_bundle_from_conditions([[ConditionOpcode.CREATE_COIN, IDENTITY_PUZZLE_HASH, 2]], TEST_COIN2)
+    empty = SpendBundle([], G2Element())
+    # every spend bundle is validated on its own, and the results are in the
+    # same order as the spend bundles
+    results = await mempool_manager.pre_validate_spendbundles(
+        [(sb1, None), (sb2, bytes(sb2)), (empty, None), (sb3, None)]
+    )
+    assert len(results) == 4
+    assert results[0] == await mempool_manager.pre_validate_spendbundle(sb1, None, sb1.name())
+    assert results[1] == Err.COIN_AMOUNT_NEGATIVE
+    assert results[2] == Err.INVALID_SPEND_BUNDLE
+    assert results[3] == await mempool_manager.pre_validate_spendbundle(sb3, None, sb3.name())
+
+
 @pytest.mark.anyio
 async def test_negative_addition_amount() -> None:
     mempool_manager = await instantiate_mempool_manager(zero_calls_get_coin_record)
@@ -891,6 +914,40 @@ async def test_get_items_not_in_filter() -> None:
     assert result == [sb1]
 
 
+@pytest.mark.anyio
+async def test_mempool_inventory() -> None:
+    mempool_manager = await instantiate_mempool_manager(get_coin_record_for_test_coins)
+    conditions = [[ConditionOpcode.CREATE_COIN, IDENTITY_PUZZLE_HASH, 1]]
+    sb1, sb1_name, _ = await generate_and_add_spendbundle(mempool_manager, conditions)
+    conditions2 = [[ConditionOpcode.CREATE_COIN, IDENTITY_PUZZLE_HASH, 2]]
+    sb2, sb2_name, _ = await generate_and_add_spendbundle(mempool_manager, conditions2, TEST_COIN2)
+    conditions3 = [[ConditionOpcode.CREATE_COIN, IDENTITY_PUZZLE_HASH, 3]]
+    sb3, sb3_name, _ = await generate_and_add_spendbundle(mempool_manager, conditions3, TEST_COIN3)
+    salt = uint64(1234)
+    ids = [uint64(short_id(name, salt)) for name in [sb3_name, sb2_name, sb1_name]]
+
+    # highest fee per cost first
+    assert mempool_manager.get_inventory(10, salt) == ids
+    assert mempool_manager.get_inventory(1, salt) == ids[:1]
+    # the short ids depend on the salt
+    assert mempool_manager.get_inventory(10, uint64(4321)) != ids
+    assert mempool_manager.get_missing_short_ids(ids, uint64(4321)) == ids
+
+    unknown = [uint64(short_id(bytes32(b"\x01" * 32), salt)), uint64(short_id(bytes32(b"\x02" * 32), salt))]
+    assert mempool_manager.get_missing_short_ids([unknown[0], ids[1], unknown[1]], salt) == unknown
+    assert mempool_manager.get_items_by_short_ids([unknown[0], ids[1], ids[2]], salt) == [sb2, sb1]
+    assert mempool_manager.get_items_by_short_ids([ids[0], ids[1]], salt, limit=1) == [sb3]
+
+    # items sharing a short id are all sent
+    with patch("hddcoin.full_node.mempool_index.short_id", return_value=42):
+        assert mempool_manager.get_items_by_short_ids([uint64(42)], salt) == [sb1, sb2, sb3]
+        assert mempool_manager.get_items_by_short_ids([uint64(42)], salt, limit=2) == [sb1, sb2]
+
+    mempool_manager.mempool.remove_from_pool([sb2_name], MempoolRemoveReason.BLOCK_INCLUSION)
+    assert mempool_manager.get_inventory(10, salt) == [ids[0], ids[2]]
+    assert mempool_manager.get_missing_short_ids(ids, salt) == [ids[1]]
+
+
 @pytest.mark.anyio
 async def test_total_mempool_fees() -> None:
     coin_records: Dict[bytes32, CoinRecord] = {}
@@ -992,6 +1049,59 @@ async def test_create_bundle_from_mempool_on_max_cost() -> None:
     assert agg.removals() == [coins[1]]
 
 
+@pytest.mark.anyio
+async def test_block_template() -> None:
+    mempool_manager, coins = await setup_mempool_with_coins(coin_amounts=list(range(1000000000, 1000000010)))
+    assert mempool_manager.peak is not None
+    peak_hash = mempool_manager.peak.header_hash
+    assert mempool_manager.create_block_template(peak_hash) is None
+
+    async def add_spend(coin: Coin, fee: int) -> SpendBundle:
+        conditions = [[ConditionOpcode.CREATE_COIN, IDENTITY_PUZZLE_HASH, coin.amount - fee]]
+        sb, _, res = await generate_and_add_spendbundle(mempool_manager, conditions, coin)
+        assert res[1] == MempoolInclusionStatus.SUCCESS
+        return sb
+
+    def fresh_bundle() -> SpendBundle:
+        # passing a filter builds the bundle from scratch
+        result = mempool_manager.create_bundle_from_mempool(peak_hash, lambda _: True)
+        assert result is not None
+        return result[0]
+
+    await add_spend(coins[0], 1000)
+    template = mempool_manager.create_block_template(peak_hash)
+    assert template is not None
+    assert template.spend_bundles == 1
+    assert mempool_manager.create_block_template(bytes32([1] * 32)) is None
+
+    # a transaction with a lower fee goes at the end of the template
+    await add_spend(coins[1], 10)
+    assert mempool_manager.create_block_template(peak_hash) is template
+    assert template.spend_bundles == 2
+    assert template.spend_bundle() == fresh_bundle()
+
+    # the generator and its cost are kept until the template changes
+    generator = template.generator(backrefs=True)
+    assert template.generator(backrefs=True) is generator
+    cost = template.compute_cost(generator, DEFAULT_CONSTANTS, uint32(10))
+    assert cost == compute_block_cost(generator, DEFAULT_CONSTANTS, uint32(10))
+    assert template._costs == {(True, uint32(10)): cost}
+
+    # a transaction with a higher fee means picking the transactions again
+    sb = await add_spend(coins[2], 100000)
+    new_template = mempool_manager.create_block_template(peak_hash)
+    assert new_template is not None and new_template is not template
+    assert new_template.spend_bundles == 3
+    assert new_template.spend_bundle() == fresh_bundle()
+    assert new_template.spend_bundle().coin_spends[0] == sb.coin_spends[0]
+
+    # and so does removing one
+    mempool_manager.mempool.remove_from_pool([sb.name()], MempoolRemoveReason.CONFLICT)
+    template = mempool_manager.create_block_template(peak_hash)
+    assert template is not None and template is not new_template
+    assert template.spend_bundle() == fresh_bundle()
+
+
 @pytest.mark.parametrize(
     "opcode,arg,expect_eviction, expect_limit",
     [
@@ -1397,6 +1507,53 @@ async def test_coin_spending_different_ways_then_finding_it_spent_in_new_peak(ne
     assert len(list(mempool_manager.mempool.items_by_feerate())) == 0
 
 
+@pytest.mark.anyio
+@pytest.mark.parametrize("recreated", [True, False])
+async def test_new_peak_reorg_revalidates_affected_items(recreated: bool) -> None:
+    """
+    After a reorg, only the mempool items spending coins that changed are
+    re-validated. The coin created in the rolled back block may or may not be
+    created again by the new chain.
+    """
+    coins = [Coin(IDENTITY_PUZZLE_HASH, IDENTITY_PUZZLE_HASH, uint64(amount)) for amount in range(1000, 1003)]
+    test_coin_records = {
+        coins[0].name(): CoinRecord(coins[0], uint32(1), uint32(0), False, uint64(0)),
+        coins[1].name(): CoinRecord(coins[1], TEST_HEIGHT, uint32(0), False, uint64(0)),
+        coins[2].name(): CoinRecord(coins[2], uint32(1), uint32(0), False, uint64(0)),
+    }
+    lookups: List[bytes32] = []
+
+    async def get_coin_record(coin_id: bytes32) -> Optional[CoinRecord]:
+        lookups.append(coin_id)
+        return test_coin_records.get(coin_id)
+
+    mempool_manager = await instantiate_mempool_manager(get_coin_record)
+    sbs = [await make_and_send_spendbundle(mempool_manager, coin) for coin in coins]
+    item = mempool_manager.get_mempool_item(sbs[0].name())
+
+    # the peak block, which created coins[1], is replaced by a block that
+    # spends coins[2]
+    del test_coin_records[coins[1].name()]
+    if recreated:
+        test_coin_records[coins[1].name()] = CoinRecord(coins[1], TEST_HEIGHT, uint32(0), False, uint64(0))
+    test_coin_records[coins[2].name()] = CoinRecord(coins[2], uint32(1), TEST_HEIGHT, False, uint64(0))
+    block_record = TestBlockRecord(
+        header_hash=height_hash(100),
+        height=TEST_HEIGHT,
+        timestamp=TEST_TIMESTAMP,
+        prev_transaction_block_height=uint32(TEST_HEIGHT - 1),
+        prev_transaction_block_hash=height_hash(TEST_HEIGHT - 1),
+    )
+    lookups.clear()
+    await mempool_manager.new_peak(block_record, [coins[2].name()], [coins[1].name()])
+    invariant_check_mempool(mempool_manager.mempool)
+
+    assert lookups == [coins[1].name()]
+    assert mempool_manager.get_mempool_item(sbs[0].name()) is item
+    assert (mempool_manager.get_mempool_item(sbs[1].name()) is not None) == recreated
+    assert_sb_not_in_pool(mempool_manager, sbs[2])
+
+
 @pytest.mark.anyio
 async def test_bundle_coin_spends() -> None:
     # This tests the construction of bundle_coin_spends map for mempool items
@@ -5,7 +5,7 @@ from typing import List, Tuple
 import pytest
 
 from hddcoin.protocols.shared_protocol import Capability
-from hddcoin.server.capabilities import known_active_capabilities
+from hddcoin.server.capabilities import known_active_capabilities, negotiated
 from hddcoin.util.ints import uint16
 
 
@@ -66,3 +66,10 @@ def test_known_active_capabilities_filter(
         expected = []
 
     assert known_active_capabilities(values=values) == expected
+
+
+def test_negotiated() -> None:
+    local = [Capability.BASE, Capability.MEMPOOL_SHORT_IDS]
+    assert negotiated(Capability.MEMPOOL_SHORT_IDS, local, [Capability.MEMPOOL_SHORT_IDS])
+    assert not negotiated(Capability.MEMPOOL_SHORT_IDS, local, [Capability.BASE])
+    assert not negotiated(Capability.RATE_LIMITS_V2, local, [Capability.RATE_LIMITS_V2])
@@ -0,0 +1,47 @@
+from __future__ import annotations
+
+from hddcoin.server.connection_stats import ConnectionStats
+
+
+def test_connection_stats() -> None:
+    stats = ConnectionStats()
+    stats.add_request("request_block", 0.1)
+    stats.add_request("request_block", None)
+    stats.add_handler("new_peak", 0.003)
+    stats.add_rate_limited("respond_peers", 1.0)
+    stats.add_outbound_queue(5)
+    stats.add_outbound_queue(2)
+
+    ret = stats.to_json_dict()
+    assert ret["request_latency"]["request_block"]["count"] == 1
+    assert ret["request_timeouts"] == {"request_block": 1}
+    assert ret["handler_latency"]["new_peak"]["total_seconds"] == 0.003
+    assert ret["rate_limited_seconds"] == {"respond_peers": 1.0}
+    assert ret["rate_limited_messages"] == {"respond_peers": 1}
+    assert ret["max_outbound_queue"] == 5
+
+
+def test_merge() -> None:
+    a = ConnectionStats()
+    a.add_request("request_block", 0.1)
+    a.add_rate_limited("respond_peers", 1.0)
+    a.add_outbound_queue(3)
+    b = ConnectionStats()
+    b.add_request("request_block", 0.2)
+    b.add_request("request_blocks", None)
+    b.add_rate_limited("respond_peers", 2.0)
+    b.add_outbound_queue(7)
+
+    total = ConnectionStats()
+    total.merge(a)
+    total.merge(b)
+    assert total.request_latency["request_block"].counts == [
+        x + y for x, y in zip(a.request_latency["request_block"].counts, b.request_latency["request_block"].counts)
+    ]
+    assert abs(total.request_latency["request_block"].total_seconds - 0.3) < 1e-9
+    assert total.request_timeouts == {"request_blocks": 1}
+    assert total.rate_limited_seconds == {"respond_peers": 3.0}
+    assert total.rate_limited_messages == {"respond_peers": 2}
+    assert total.max_outbound_queue == 7
+    # merging doesn't share the histograms
+    assert total.request_latency["request_block"] is not a.request_latency["request_block"]
@@ -0,0 +1,179 @@
+from __future__ import annotations
+
+import asyncio
+import logging
+from typing import List
+
+import pytest
+
+from hddcoin.protocols.protocol_message_types import ProtocolMessageTypes
+from hddcoin.server.inbound_dispatch import DispatchClass, InboundDispatcher, get_dispatch_class
+from hddcoin.server.outbound_message import Message, make_msg
+
+log = logging.getLogger(__name__)
+
+
+class FakeConnection:
+    def __init__(self) -> None:
+        self.closed = False
+        self.handled: List[Message] = []
+        self.running = 0
+        self.max_running = 0
+        self.release = asyncio.Event()
+
+    async def run_api_call(self, message: Message) -> None:
+        self.running += 1
+        self.max_running = max(self.max_running, self.running)
+        await self.release.wait()
+        self.running -= 1
+        self.handled.append(message)
+
+
+def test_dispatch_classes() -> None:
+    assert get_dispatch_class(ProtocolMessageTypes.new_peak.value) == DispatchClass.consensus
+    assert get_dispatch_class(ProtocolMessageTypes.respond_block.value) == DispatchClass.consensus
+    assert get_dispatch_class(ProtocolMessageTypes.request_block.value) == DispatchClass.requests
+    assert get_dispatch_class(ProtocolMessageTypes.request_blocks.value) == DispatchClass.sync
+    assert get_dispatch_class(ProtocolMessageTypes.new_transaction.value) == DispatchClass.tx
+    assert get_dispatch_class(ProtocolMessageTypes.register_interest_in_coin.value) == DispatchClass.wallet
+    assert get_dispatch_class(ProtocolMessageTypes.request_peers.value) == DispatchClass.misc
+
+
+def test_config() -> None:
+    dispatcher = InboundDispatcher.create({"tx": {"workers": 2, "peer_queue_size": 10}, "misc": {"queue_size": 3}}, log)
+    stats = dispatcher.get_stats()
+    assert set(stats.keys()) == {c.value for c in DispatchClass}
+    assert stats["tx"]["workers"] == 2
+    assert stats["tx"]["queue_size"] == 5000
+    assert stats["tx"]["peer_queue_size"] == 10
+    assert stats["misc"]["workers"] == 8
+    assert stats["misc"]["queue_size"] == 3
+    # a peer can't have more messages waiting than all of them
+    assert stats["misc"]["peer_queue_size"] == 3
+    assert dispatcher.pools[DispatchClass.consensus].backpressure
+    assert not dispatcher.pools[DispatchClass.requests].backpressure
+
+    with pytest.raises(ValueError, match="at least one worker"):
+        InboundDispatcher.create({"consensus": {"workers": 0}}, log)
+
+
+async def wait_for_handled(connection: FakeConnection, count: int) -> None:
+    for _ in range(100):
+        if len(connection.handled) == count:
+            break
+        await asyncio.sleep(0.01)
+    assert len(connection.handled) == count
+
+
+@pytest.mark.anyio
+async def test_worker_pools() -> None:
+    dispatcher = InboundDispatcher.create({"tx": {"workers": 2, "queue_size": 3}}, log)
+    dispatcher.start()
+    connection = FakeConnection()
+    try:
+        new_tx = make_msg(ProtocolMessageTypes.new_transaction, b"")
+        assert await dispatcher.submit(connection, new_tx)
+        assert await dispatcher.submit(connection, new_tx)
+        await asyncio.sleep(0.01)
+        assert connection.running == 2
+
+        # the workers are busy, three messages wait in the queue and the rest
+        # are dropped
+        results = [await dispatcher.submit(connection, new_tx) for _ in range(8)]
+        assert results == [True] * 3 + [False] * 5
+
+        # a flood of transactions doesn't hold up new peaks
+        new_peak = make_msg(ProtocolMessageTypes.new_peak, b"")
+        assert await dispatcher.submit(connection, new_peak)
+        await asyncio.sleep(0.01)
+        assert connection.running == 3
+
+        connection.release.set()
+        await wait_for_handled(connection, 6)
+        assert connection.max_running == 3
+
+        stats = dispatcher.get_stats()
+        assert stats["tx"]["processed"] == 5
+        assert stats["tx"]["dropped"] == 5
+        assert stats["tx"]["wait"]["count"] == 5
+        assert stats["consensus"]["processed"] == 1
+    finally:
+        await dispatcher.stop()
+    assert not dispatcher.running
+
+
+@pytest.mark.anyio
+async def test_peer_queues() -> None:
+    dispatcher = InboundDispatcher.create({"tx": {"workers": 1, "peer_queue_size": 2}}, log)
+    dispatcher.start()
+    flooding = FakeConnection()
+    other = FakeConnection()
+    try:
+        new_tx = make_msg(ProtocolMessageTypes.new_transaction, b"")
+        assert await dispatcher.submit(flooding, new_tx)
+        await asyncio.sleep(0.01)
+        assert flooding.running == 1
+
+        # a peer can only have so many messages waiting, the others still get
+        # to queue theirs
+        results = [await dispatcher.submit(flooding, new_tx) for _ in range(4)]
+        assert results == [True, True, False, False]
+        assert await dispatcher.submit(other, new_tx)
+        assert dispatcher.get_stats()["tx"]["queued_peers"] == 2
+
+        # and the worker takes the messages of the peers in turn
+        flooding.release.set()
+        await wait_for_handled(flooding, 2)
+        assert other.running == 1
+        assert len(flooding.handled) == 2
+        other.release.set()
+        await wait_for_handled(flooding, 3)
+        await wait_for_handled(other, 1)
+    finally:
+        await dispatcher.stop()
+
+
+@pytest.mark.anyio
+async def test_backpressure() -> None:
+    dispatcher = InboundDispatcher.create({"consensus": {"workers": 1, "queue_size": 2}}, log)
+    dispatcher.start()
+    connection = FakeConnection()
+    try:
+        new_peak = make_msg(ProtocolMessageTypes.new_peak, b"")
+        for _ in range(3):
+            assert await dispatcher.submit(connection, new_peak)
+        await asyncio.sleep(0.01)
+        assert dispatcher.get_stats()["consensus"]["queued"] == 2
+
+        # consensus messages wait for room, rather than being dropped
+        submit = asyncio.create_task(dispatcher.submit(connection, new_peak))
+        await asyncio.sleep(0.01)
+        assert not submit.done()
+        assert dispatcher.get_stats()["consensus"]["blocked"] == 1
+
+        connection.release.set()
+        assert await submit
+        await wait_for_handled(connection, 4)
+        stats = dispatcher.get_stats()["consensus"]
+        assert stats["dropped"] == 0
+        assert stats["blocked"] == 0
+    finally:
+        await dispatcher.stop()
+
+
+@pytest.mark.anyio
+async def test_closed_connection() -> None:
+    dispatcher = InboundDispatcher.create({}, log)
+    dispatcher.start()
+    connection = FakeConnection()
+    connection.release.set()
+    connection.closed = True
+    try:
+        assert await dispatcher.submit(connection, make_msg(ProtocolMessageTypes.new_peak, b""))
+        await asyncio.sleep(0.01)
+        # the message is taken off the queue, but not handled
+        assert connection.handled == []
+        assert dispatcher.get_stats()["consensus"]["wait"]["count"] == 1
+        assert dispatcher.get_stats()["consensus"]["processed"] == 0
+    finally:
+        await dispatcher.stop()
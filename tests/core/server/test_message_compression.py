@@ -0,0 +1,94 @@
+from __future__ import annotations
+
+import random
+
+import pytest
+import zstd
+
+from hddcoin.protocols.protocol_message_types import ProtocolMessageTypes
+from hddcoin.server.message_compression import (
+    COMPRESSED_MESSAGE_MARKER,
+    FRAME_LENGTH,
+    PrecompressedBytes,
+    compress_message,
+    decompress_message,
+    frame_content_size,
+)
+from hddcoin.server.outbound_message import Message, make_msg
+from hddcoin.util.ints import uint16
+
+
+def test_marker_is_not_a_message_type() -> None:
+    assert COMPRESSED_MESSAGE_MARKER not in {t.value for t in ProtocolMessageTypes}
+
+
+@pytest.mark.parametrize("size", [0, 1, 300, 1000, 100000, 300000])
+def test_frame_content_size(size: int) -> None:
+    rng = random.Random(size)
+    data = bytes(rng.getrandbits(2) for _ in range(size))
+    assert frame_content_size(zstd.compress(data)) == size
+
+
+def test_round_trip() -> None:
+    msg = make_msg(ProtocolMessageTypes.respond_blocks, b"\x00" * 100000)
+    msg = Message(msg.type, uint16(7), msg.data)
+    encoded = bytes(msg)
+    compressed = compress_message(encoded, msg.data)
+    assert compressed[0] == COMPRESSED_MESSAGE_MARKER
+    assert len(compressed) < len(encoded)
+    assert Message.from_bytes(decompress_message(compressed, len(encoded))) == msg
+
+
+def test_precompressed_segments() -> None:
+    blocks = [b"block-1" * 1000, b"block-2" * 2000]
+    header = b"\x00" * 12
+    stored = [zstd.compress(block) for block in blocks]
+    data = PrecompressedBytes(
+        header + b"".join(blocks),
+        [(12, len(blocks[0]), stored[0]), (12 + len(blocks[0]), len(blocks[1]), stored[1])],
+    )
+    msg = make_msg(ProtocolMessageTypes.respond_blocks, data)
+    encoded = bytes(msg)
+    compressed = compress_message(encoded, msg.data)
+
+    # the stored blocks are sent as they are
+    assert FRAME_LENGTH.pack(len(stored[0])) + stored[0] + FRAME_LENGTH.pack(len(stored[1])) + stored[1] in compressed
+    assert decompress_message(compressed, len(encoded)) == encoded
+
+
+def test_precompressed_segment_mismatch() -> None:
+    # a segment whose frame doesn't state the size of its part of the data is
+    # compressed again, the peer wouldn't accept it
+    data = PrecompressedBytes(b"a" * 1000 + b"b" * 1000, [(0, 1000, zstd.compress(b"a" * 999)), (1000, 1000, b"")])
+    compressed = compress_message(data, data)
+    assert zstd.compress(b"a" * 999) not in compressed
+    assert decompress_message(compressed, len(data)) == data
+
+
+def test_too_big() -> None:
+    data = b"\x00" * 100000
+    compressed = compress_message(data, data)
+    assert decompress_message(compressed, 100000) == data
+    with pytest.raises(ValueError, match="too big"):
+        decompress_message(compressed, 99999)
+
+
+def test_invalid_messages() -> None:
+    frame = zstd.compress(b"\x00" * 1000)
+    framed = FRAME_LENGTH.pack(len(frame)) + frame
+    marker = bytes([COMPRESSED_MESSAGE_MARKER])
+
+    with pytest.raises(ValueError, match="not a compressed message"):
+        decompress_message(framed, 10000)
+    with pytest.raises(ValueError, match="truncated"):
+        decompress_message(marker + framed[:-1], 10000)
+    with pytest.raises(ValueError, match="truncated"):
+        decompress_message(marker + framed + b"\x00", 10000)
+    with pytest.raises(ValueError, match="invalid zstd frame"):
+        decompress_message(marker + FRAME_LENGTH.pack(6) + b"\x00" * 6, 10000)
+
+    # zstd decompresses all the frames following the first one, which would
+    # get around the size check
+    two_frames = frame + zstd.compress(b"\x00" * 1000000)
+    with pytest.raises(ValueError, match="invalid zstd frame length"):
+        decompress_message(marker + FRAME_LENGTH.pack(len(two_frames)) + two_frames, 10000)
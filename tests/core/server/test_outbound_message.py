@@ -0,0 +1,56 @@
+from __future__ import annotations
+
+import asyncio
+from typing import List
+
+import pytest
+
+from hddcoin.protocols.protocol_message_types import ProtocolMessageTypes
+from hddcoin.server.message_compression import THREAD_THRESHOLD, decompress_message
+from hddcoin.server.outbound_message import EncodedMessage, make_msg
+
+
+def test_encoded_message() -> None:
+    msg = make_msg(ProtocolMessageTypes.new_peak, b"\x01" * 100000)
+    encoded = EncodedMessage.create(msg)
+    assert encoded.encoded == bytes(msg)
+
+    # the message is compressed once, and shared
+    compressed = encoded.compressed()
+    assert encoded.compressed() is compressed
+    assert decompress_message(compressed, len(encoded.encoded)) == encoded.encoded
+
+
+@pytest.mark.anyio
+async def test_encoded_message_compress() -> None:
+    small = EncodedMessage.create(make_msg(ProtocolMessageTypes.new_peak, b"\x01" * 100000))
+    assert await small.compress() is small.compressed()
+    assert small._compressing is None
+
+    # big messages are compressed in a thread, once for all the connections
+    # sending them
+    big = EncodedMessage.create(make_msg(ProtocolMessageTypes.respond_blocks, b"\x02" * THREAD_THRESHOLD))
+    results = await asyncio.gather(*(big.compress() for _ in range(3)))
+    assert big._compressing is not None
+    assert all(r is results[0] for r in results)
+    assert big.compressed() is results[0]
+    assert decompress_message(results[0], len(big.encoded)) == big.encoded
+
+
+def test_encoded_message_sent() -> None:
+    calls: List[int] = []
+    encoded = EncodedMessage.create(make_msg(ProtocolMessageTypes.new_peak, b"\x01"))
+
+    # not tracked
+    encoded.sent()
+
+    encoded.track_sends(3, lambda: calls.append(1))
+    encoded.sent()
+    encoded.sent()
+    assert calls == []
+    encoded.sent()
+    assert calls == [1]
+
+    # the callback is only called once
+    encoded.sent()
+    assert calls == [1]
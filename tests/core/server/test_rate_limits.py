@@ -10,7 +10,7 @@ from hddcoin.protocols.shared_protocol import Capability
 from hddcoin.server.outbound_message import make_msg
 from hddcoin.server.rate_limit_numbers import compose_rate_limits, get_rate_limits_to_use
 from hddcoin.server.rate_limit_numbers import rate_limits as rl_numbers
-from hddcoin.server.rate_limits import RateLimiter
+from hddcoin.server.rate_limits import RateLimiter, get_rate_limit_table
 from hddcoin.server.server import HDDcoinServer
 from hddcoin.server.ws_connection import WSHDDcoinConnection
 from hddcoin.types.peer_info import PeerInfo
@@ -169,6 +169,51 @@ class TestRateLimits:
         await asyncio.sleep(6)
         assert r.process_msg_and_check(new_tx_message, rl_v2, rl_v2)
 
+    @pytest.mark.anyio
+    async def test_smooth_refill(self):
+        r = RateLimiter(True, 2)
+        new_peak_message = make_msg(ProtocolMessageTypes.new_peak, bytes([1] * 40))
+        for i in range(200):
+            assert r.process_msg_and_check(new_peak_message, rl_v2, rl_v2)
+        assert not r.process_msg_and_check(new_peak_message, rl_v2, rl_v2)
+
+        # after half the period, half of the limit is available again
+        await asyncio.sleep(1)
+        passed = 0
+        while r.process_msg_and_check(new_peak_message, rl_v2, rl_v2):
+            passed += 1
+        assert 90 <= passed <= 110
+
+    @pytest.mark.anyio
+    async def test_utilization(self):
+        r = RateLimiter(incoming=False)
+        new_peers_message = make_msg(ProtocolMessageTypes.respond_peers, bytes([1] * 100))
+        for i in range(11):
+            r.process_msg_and_check(new_peers_message, rl_v2, rl_v2)
+
+        utilization = r.get_utilization()
+        assert utilization["reset_seconds"] == 60
+        respond_peers = utilization["messages"]["respond_peers"]
+        assert respond_peers["count"] > 0.99
+        assert respond_peers["peak_count"] >= respond_peers["count"]
+        assert respond_peers["rejected"] == 1
+        assert 0.009 < utilization["non_tx"]["count"] <= 0.01
+        assert list(utilization["messages"].keys()) == ["respond_peers"]
+
+    @pytest.mark.anyio
+    async def test_rate_limit_table(self):
+        # the tables are only built once
+        assert get_rate_limit_table(rl_v2, rl_v2) is get_rate_limit_table(rl_v2, rl_v2)
+        assert get_rate_limit_table(rl_v1, rl_v1) is get_rate_limit_table(rl_v2, rl_v1)
+
+        v1 = get_rate_limit_table(rl_v1, rl_v1)
+        v2 = get_rate_limit_table(rl_v2, rl_v2)
+        assert v1.messages[ProtocolMessageTypes.respond_children.value].non_tx
+        assert not v2.messages[ProtocolMessageTypes.respond_children.value].non_tx
+        # a v2 message missing from v1 uses the default settings
+        assert v1.messages[ProtocolMessageTypes.request_block_headers.value].default
+        assert not v2.messages[ProtocolMessageTypes.request_block_headers.value].default
+
     @pytest.mark.anyio
     async def test_percentage_limits(self):
         r = RateLimiter(True, 60, 40)
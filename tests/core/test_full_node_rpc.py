@@ -152,6 +152,9 @@ async def test1(two_nodes_sim_and_wallets_services, self_hostname, consensus_mod
 
         assert len(await client.get_all_mempool_items()) == 1
         assert len(await client.get_all_mempool_tx_ids()) == 1
+        fee_histogram = await client.get_mempool_fee_histogram()
+        assert fee_histogram["count"] == 1
+        assert fee_histogram["next_block_fee_per_cost"] == 0
         assert (
             SpendBundle.from_json_dict(list((await client.get_all_mempool_items()).values())[0]["spend_bundle"])
             == spend_bundle
@@ -0,0 +1,105 @@
+from __future__ import annotations
+
+import pickle
+from typing import List
+
+from chia_rs import AugSchemeMPL, G1Element, GTElement
+
+from hddcoin.types.blockchain_format.sized_bytes import bytes32, bytes48
+from hddcoin.util import cached_bls
+from hddcoin.util.hash import std_hash
+from hddcoin.util.shared_pairing_cache import KEY_OFFSET, SLOT_SIZE, SharedPairingCache
+
+
+def pairings(n: int) -> List[GTElement]:
+    sk = AugSchemeMPL.key_gen(b"a" * 32)
+    pk = sk.get_g1()
+    return [AugSchemeMPL.g2_from_message(bytes(pk) + bytes([i])).pair(pk) for i in range(n)]
+
+
+def test_get_put() -> None:
+    cache = SharedPairingCache.create(100)
+    try:
+        values = pairings(3)
+        keys = [std_hash(bytes([i])) for i in range(3)]
+        assert cache.get(keys[0]) is None
+        for key, value in zip(keys, values):
+            cache.put(key, value)
+        for key, value in zip(keys, values):
+            assert cache.get(key) == value
+
+        # other processes attach to it by name, when it's unpickled
+        other = pickle.loads(pickle.dumps(cache))
+        assert other.name == cache.name
+        assert other.get(keys[1]) == values[1]
+        other.put(keys[1], values[2])
+        assert cache.get(keys[1]) == values[2]
+        other.close()
+
+        stats = cache.get_stats()
+        assert stats["entries"] == 3
+        assert stats["capacity"] == 100
+        assert stats["hits"] == 5
+        assert stats["misses"] == 1
+        assert stats["inserts"] == 4
+        assert stats["evictions"] == 0
+    finally:
+        cache.close()
+
+
+def test_eviction() -> None:
+    # a single bucket, every key competes for the same 4 slots
+    cache = SharedPairingCache.create(1)
+    try:
+        assert cache.capacity == 4
+        value = pairings(1)[0]
+        keys = [std_hash(bytes([i])) for i in range(5)]
+        for key in keys[:4]:
+            cache.put(key, value)
+        # reading the first key makes the second one the least recently used
+        assert cache.get(keys[0]) == value
+        cache.put(keys[4], value)
+        assert cache.get(keys[1]) is None
+        for key in [keys[0], keys[2], keys[3], keys[4]]:
+            assert cache.get(key) == value
+        assert cache.get_stats()["evictions"] == 1
+    finally:
+        cache.close()
+
+
+def test_torn_slot() -> None:
+    cache = SharedPairingCache.create(1)
+    try:
+        value = pairings(1)[0]
+        key = bytes32(std_hash(b"a"))
+        cache.put(key, value)
+        # find the slot, and corrupt the pairing as if another process was
+        # half way through overwriting it
+        buf = cache._shm.buf
+        offset = bytes(buf).index(key) - KEY_OFFSET
+        buf[offset + SLOT_SIZE - 1] ^= 1
+        assert cache.get(key) is None
+    finally:
+        cache.close()
+
+
+def test_aggregate_verify() -> None:
+    n_keys = 10
+    sks = [AugSchemeMPL.key_gen(b"a" * 31 + bytes([i])) for i in range(n_keys)]
+    pks = [bytes48(sk.get_g1()) for sk in sks]
+    msgs = [f"msg-{i}".encode() for i in range(n_keys)]
+    agg_sig = AugSchemeMPL.aggregate([AugSchemeMPL.sign(sk, msg) for sk, msg in zip(sks, msgs)])
+    assert AugSchemeMPL.aggregate_verify([G1Element.from_bytes(pk) for pk in pks], msgs, agg_sig)
+
+    cache = SharedPairingCache.create(100)
+    try:
+        cached_bls.set_shared_cache(cache)
+        # the shared cache is used instead of LOCAL_CACHE, when it's set
+        assert cached_bls.aggregate_verify(pks, msgs, agg_sig, True)
+        assert cache.get_stats()["inserts"] == n_keys
+        assert cached_bls.aggregate_verify(pks, msgs, agg_sig)
+        assert cache.get_stats()["hits"] == n_keys
+        assert not cached_bls.aggregate_verify(pks[1:], msgs[1:], agg_sig)
+    finally:
+        cached_bls.set_shared_cache(None)
+        cache.close()
@@ -2,6 +2,7 @@ from __future__ import annotations
 
 import asyncio
 import contextlib
+import logging
 from typing import TYPE_CHECKING, Callable, List
 
 import aiosqlite
@@ -10,7 +11,7 @@ import pytest
 # TODO: update after resolution in https://github.com/pytest-dev/pytest/issues/7469
 from _pytest.fixtures import SubRequest
 
-from hddcoin.util.db_wrapper import DBWrapper2
+from hddcoin.util.db_wrapper import DBWrapper2, generate_in_memory_db_uri, low_priority_reads, normal_priority_reads
 from tests.util.db_connection import DBConnection, PathDBConnection
 
 if TYPE_CHECKING:
@@ -429,3 +430,125 @@ async def test_cancelled_reader_does_not_cancel_writer() -> None:
             assert await query_value(connection=writer) == 1
 
         assert await query_value(connection=writer) == 1
+
+
+@pytest.mark.anyio
+async def test_after_commit() -> None:
+    async with DBConnection(2) as db_wrapper:
+        await setup_table(db_wrapper)
+        calls: List[str] = []
+
+        # outside of a transaction, the callback is called right away
+        db_wrapper.after_commit(lambda: calls.append("now"))
+        assert calls == ["now"]
+
+        async with db_wrapper.writer() as writer:
+            await writer.execute("UPDATE counter SET value = 1")
+            db_wrapper.after_commit(lambda: calls.append("committed"))
+            async with db_wrapper.writer_maybe_transaction():
+                db_wrapper.after_commit(lambda: calls.append("nested"))
+            with pytest.raises(UniqueError):
+                async with db_wrapper.writer():
+                    db_wrapper.after_commit(lambda: calls.append("rolled back savepoint"))
+                    raise UniqueError()
+            assert calls == ["now"]
+            # readers don't see the changes yet
+            async with db_wrapper.reader_no_transaction() as reader:
+                if reader is not writer:
+                    assert await query_value(connection=reader) == 0
+        assert calls == ["now", "committed", "nested"]
+
+        with pytest.raises(UniqueError):
+            async with db_wrapper.writer():
+                db_wrapper.after_commit(lambda: calls.append("rolled back"))
+                raise UniqueError()
+        assert calls == ["now", "committed", "nested"]
+
+        # a failing callback doesn't stop the others
+        async with db_wrapper.writer():
+            db_wrapper.after_commit(lambda: [][0])
+            db_wrapper.after_commit(lambda: calls.append("after failure"))
+        assert calls[-1] == "after failure"
+
+
+@pytest.mark.anyio
+async def test_low_priority_reads() -> None:
+    async with DBWrapper2.managed(
+        database=generate_in_memory_db_uri(), uri=True, reader_count=1, low_priority_reader_count=1, db_version=2
+    ) as db_wrapper:
+        await setup_table(db_wrapper)
+
+        release = asyncio.Event()
+
+        async def scan() -> None:
+            with low_priority_reads():
+                async with db_wrapper.reader_no_transaction() as connection:
+                    await query_value(connection=connection)
+                    await release.wait()
+
+        # a low priority read holding its connection doesn't hold up the
+        # regular reads
+        task = asyncio.create_task(scan())
+        await asyncio.sleep(0.1)
+        async with db_wrapper.reader_no_transaction() as connection:
+            assert await query_value(connection=connection) == 0
+        release.set()
+        await task
+
+        stats = db_wrapper.get_latency_stats()
+        assert stats["use"]["reader"]["count"] == 1
+        assert stats["use"]["low_priority_reader"]["count"] == 1
+        assert stats["use"]["low_priority_reader"]["total_seconds"] >= 0.1
+        assert stats["wait"]["writer"]["count"] == 1
+
+
+@pytest.mark.anyio
+async def test_low_priority_reads_without_connections() -> None:
+    async with DBConnection(2) as db_wrapper:
+        await setup_table(db_wrapper)
+
+        with low_priority_reads():
+            async with db_wrapper.reader_no_transaction() as connection:
+                assert await query_value(connection=connection) == 0
+
+        assert list(db_wrapper.get_latency_stats()["use"].keys()) == ["writer", "reader"]
+
+
+@pytest.mark.anyio
+async def test_normal_priority_reads() -> None:
+    async with DBWrapper2.managed(
+        database=generate_in_memory_db_uri(), uri=True, reader_count=1, low_priority_reader_count=1, db_version=2
+    ) as db_wrapper:
+        await setup_table(db_wrapper)
+
+        async def read() -> None:
+            async with db_wrapper.reader_no_transaction() as connection:
+                await query_value(connection=connection)
+
+        with low_priority_reads():
+            # tasks inherit the low priority reads of the task creating them
+            await asyncio.create_task(read())
+            with normal_priority_reads():
+                task = asyncio.create_task(read())
+            await task
+
+        stats = db_wrapper.get_latency_stats()
+        assert stats["use"]["low_priority_reader"]["count"] == 1
+        assert stats["use"]["reader"]["count"] == 1
+
+
+@pytest.mark.anyio
+async def test_slow_query_logging(caplog: pytest.LogCaptureFixture) -> None:
+    async with DBWrapper2.managed(
+        database=generate_in_memory_db_uri(), uri=True, reader_count=1, db_version=2, slow_query_seconds=0.0
+    ) as db_wrapper:
+        await setup_table(db_wrapper)
+
+        caplog.clear()
+        with caplog.at_level(logging.WARNING):
+            async with db_wrapper.reader_no_transaction() as connection:
+                await query_value(connection=connection)
+
+        assert "slow database reader use" in caplog.text
+        assert "SELECT value FROM counter" in caplog.text
+        assert "pragma" not in caplog.text
@@ -6,10 +6,11 @@ from typing import List
 import pytest
 
 from hddcoin.full_node.bitcoin_fee_estimator import create_bitcoin_fee_estimator
+from hddcoin.full_node.fee_estimate_store import FeeStore
 from hddcoin.full_node.fee_estimation import FeeBlockInfo, MempoolItemInfo
 from hddcoin.full_node.fee_estimator_constants import INFINITE_FEE_RATE, INITIAL_STEP
 from hddcoin.full_node.fee_estimator_interface import FeeEstimatorInterface
-from hddcoin.full_node.fee_tracker import get_bucket_index, init_buckets
+from hddcoin.full_node.fee_tracker import FeeStat, get_bucket_index, init_buckets
 from hddcoin.types.fee_rate import FeeRateV2
 from hddcoin.util.ints import uint32, uint64
 from hddcoin.util.math import make_monotonically_decreasing
@@ -133,6 +134,29 @@ def test_get_bucket_index() -> None:
         assert result_index == expected_index
 
 
+def test_fee_stat_decay() -> None:
+    buckets = [1.0, 2.0, 3.0]
+    stat = FeeStat(buckets, 2, 0.5, 1, FeeStore(), "test")
+    item = MempoolItemInfo(cost=uint64(1000), fee=uint64(4), height_added_to_mempool=uint32(0))
+    expected = 0.0
+    # the moving averages are rescaled every ~330 blocks with this decay
+    for _ in range(1000):
+        stat.update_moving_averages()
+        stat.tx_confirmed(1, item)
+        expected = expected * 0.5 + 1
+        assert stat.tx_ct_avg[2] * stat.avg_scale == pytest.approx(expected)
+    assert stat.avg_scale > 1e-100
+
+    backup = stat.create_backup()
+    assert [float.fromhex(v) for v in backup.tx_ct_avg] == pytest.approx([0, 0, expected])
+    assert [float.fromhex(v) for v in backup.m_fee_rate_avg] == pytest.approx([0, 0, 4 * expected])
+    assert [float.fromhex(v) for v in backup.confirmed_average[0]] == pytest.approx([0, 0, expected])
+
+    restored = FeeStat(buckets, 2, 0.5, 1, FeeStore(), "test")
+    restored.import_backup(backup)
+    assert restored.create_backup() == backup
+
+
 def test_monotonically_decrease() -> None:
     inputs: List[List[float]]
     output: List[List[float]]
@@ -54,6 +54,9 @@ def visit_full_node(visitor: Callable[[Any, str], None]) -> None:
     visitor(respond_signage_point, "respond_signage_point")
     visitor(respond_end_of_subslot, "respond_end_of_subslot")
     visitor(request_mempool_transaction, "request_mempool_transaction")
+    visitor(request_mempool_inventory, "request_mempool_inventory")
+    visitor(respond_mempool_inventory, "respond_mempool_inventory")
+    visitor(request_mempool_transactions_by_short_id, "request_mempool_transactions_by_short_id")
     visitor(new_compact_vdf, "new_compact_vdf")
     visitor(request_compact_vdf, "request_compact_vdf")
     visitor(respond_compact_vdf, "respond_compact_vdf")
@@ -424,3 +424,7 @@ def invariant_check_mempool(mempool: Mempool) -> None:
         if val is None:
             val = 0
     assert mempool._total_fee == val
+
+    histogram = mempool.get_fee_histogram()
+    assert histogram["count"] == mempool.size()
+    assert histogram["total_cost"] == mempool._total_cost
@@ -462,6 +462,20 @@ request_mempool_transaction = full_node_protocol.RequestMempoolTransactions(
     bytes([0] * 32),
 )
 
+request_mempool_inventory = full_node_protocol.RequestMempoolInventory(
+    uint32(10000),
+    uint64(6530418592734091447),
+)
+
+respond_mempool_inventory = full_node_protocol.RespondMempoolInventory(
+    [uint64(5942839212), uint64(18161298420127312931)],
+)
+
+request_mempool_transactions_by_short_id = full_node_protocol.RequestMempoolTransactionsByShortId(
+    [uint64(18161298420127312931)],
+    uint64(6530418592734091447),
+)
+
 new_compact_vdf = full_node_protocol.NewCompactVDF(
     uint32(1333973478),
     bytes32(bytes.fromhex("e2188779d4a8e8fdf9cbe3103878b4c3f5f25a999fa8d04551c4ae01046c634e")),
@@ -1174,6 +1174,15 @@ request_mempool_transaction_json: Dict[str, Any] = {
     "filter": "0x0000000000000000000000000000000000000000000000000000000000000000"
 }
 
+request_mempool_inventory_json: Dict[str, Any] = {"max_items": 10000, "salt": 6530418592734091447}
+
+respond_mempool_inventory_json: Dict[str, Any] = {"short_ids": [5942839212, 18161298420127312931]}
+
+request_mempool_transactions_by_short_id_json: Dict[str, Any] = {
+    "short_ids": [18161298420127312931],
+    "salt": 6530418592734091447,
+}
+
 new_compact_vdf_json: Dict[str, Any] = {
     "height": 1333973478,
     "header_hash": "0xe2188779d4a8e8fdf9cbe3103878b4c3f5f25a999fa8d04551c4ae01046c634e",
@@ -13,6 +13,8 @@ async def validate_get_routes(client: RpcClient, api: RpcApiProtocol) -> None:
         "/get_connections",
         "/open_connection",
         "/close_connection",
+        "/get_peer_rate_limits",
+        "/get_inbound_dispatch_stats",
         "/stop_node",
         "/get_routes",
         "/healthz",
@@ -1,5 +1,7 @@
 from __future__ import annotations
 
+import dataclasses
+import itertools
 import random
 from typing import Generator, Iterator, List, Optional
 
@@ -23,7 +25,12 @@ from hddcoin.types.blockchain_format.vdf import VDFInfo, VDFProof
 from hddcoin.types.end_of_slot_bundle import EndOfSubSlotBundle
 from hddcoin.types.full_block import FullBlock
 from hddcoin.types.header_block import HeaderBlock
-from hddcoin.util.full_block_utils import block_info_from_block, generator_from_block, header_block_from_block
+from hddcoin.util.full_block_utils import (
+    block_info_from_block,
+    block_without_generator,
+    generator_from_block,
+    header_block_from_block,
+)
 from hddcoin.util.generator_tools import get_block_header
 from hddcoin.util.ints import uint8, uint32, uint64, uint128
 
@@ -269,3 +276,12 @@ async def test_header_block():
         hb: HeaderBlock = get_block_header(block, [], [])
         hb_bytes = header_block_from_block(memoryview(bytes(block)))
         assert HeaderBlock.from_bytes(hb_bytes) == hb
+
+
+def test_block_without_generator() -> None:
+    # a sample of the combinations test_parser() goes through
+    for block in itertools.islice(get_full_blocks(), 0, 2000, 5):
+        expected = bytes(dataclasses.replace(block, transactions_generator=None))
+        for b in [block, dataclasses.replace(block, transactions_generator=None)]:
+            head, tail = block_without_generator(memoryview(bytes(b)))
+            assert b"".join([head, b"\x00", tail]) == expected
@@ -68,6 +68,17 @@ def test_protocol_json() -> None:
         type(request_mempool_transaction).from_json_dict(request_mempool_transaction_json)
         == request_mempool_transaction
     )
+    assert str(request_mempool_inventory_json) == str(request_mempool_inventory.to_json_dict())
+    assert type(request_mempool_inventory).from_json_dict(request_mempool_inventory_json) == request_mempool_inventory
+    assert str(respond_mempool_inventory_json) == str(respond_mempool_inventory.to_json_dict())
+    assert type(respond_mempool_inventory).from_json_dict(respond_mempool_inventory_json) == respond_mempool_inventory
+    assert str(request_mempool_transactions_by_short_id_json) == str(
+        request_mempool_transactions_by_short_id.to_json_dict()
+    )
+    assert (
+        type(request_mempool_transactions_by_short_id).from_json_dict(request_mempool_transactions_by_short_id_json)
+        == request_mempool_transactions_by_short_id
+    )
     assert str(new_compact_vdf_json) == str(new_compact_vdf.to_json_dict())
     assert type(new_compact_vdf).from_json_dict(new_compact_vdf_json) == new_compact_vdf
     assert str(request_compact_vdf_json) == str(request_compact_vdf.to_json_dict())
@@ -40,10 +40,10 @@ def test_missing_messages_state_machine() -> None:
     # to the visitor in build_network_protocol_files.py and rerun it. Then
     # update this test
     assert (
-        len(VALID_REPLY_MESSAGE_MAP) == 20
+        len(VALID_REPLY_MESSAGE_MAP) == 21
     ), "A message was added to the protocol state machine. Make sure to update the protocol message regression test to include the new message"
     assert (
-        len(NO_REPLY_EXPECTED) == 7
+        len(NO_REPLY_EXPECTED) == 8
     ), "A message was added to the protocol state machine. Make sure to update the protocol message regression test to include the new message"
 
 
@@ -104,7 +104,9 @@ def test_missing_messages() -> None:
         "RequestBlock",
         "RequestBlocks",
         "RequestCompactVDF",
+        "RequestMempoolInventory",
         "RequestMempoolTransactions",
+        "RequestMempoolTransactionsByShortId",
         "RequestPeers",
         "RequestProofOfWeight",
         "RequestSignagePointOrEndOfSubSlot",
@@ -114,6 +116,7 @@ def test_missing_messages() -> None:
         "RespondBlocks",
         "RespondCompactVDF",
         "RespondEndOfSubSlot",
+        "RespondMempoolInventory",
         "RespondPeers",
         "RespondProofOfWeight",
         "RespondSignagePoint",
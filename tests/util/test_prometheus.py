@@ -0,0 +1,36 @@
+from __future__ import annotations
+
+from hddcoin.util.latency_histogram import LatencyHistogram
+from hddcoin.util.prometheus import MetricsWriter
+
+
+def test_gauge_and_counter() -> None:
+    writer = MetricsWriter()
+    writer.gauge("connections", "Open connections", {(("node_type", "full_node"),): 3, (): 4})
+    writer.counter("bytes_read", "Bytes read", {(): 1.5})
+    assert writer.text() == (
+        "# HELP hddcoin_connections Open connections\n"
+        "# TYPE hddcoin_connections gauge\n"
+        'hddcoin_connections{node_type="full_node"} 3\n'
+        "hddcoin_connections 4\n"
+        "# HELP hddcoin_bytes_read_total Bytes read\n"
+        "# TYPE hddcoin_bytes_read_total counter\n"
+        "hddcoin_bytes_read_total 1.5\n"
+    )
+
+
+def test_histogram() -> None:
+    histogram = LatencyHistogram()
+    histogram.add(0.0015)
+    histogram.add(0.0015)
+    histogram.add(100)
+    writer = MetricsWriter()
+    writer.histogram("seconds", "Latency", {(("message_type", 'a"b'),): histogram.to_json_dict()})
+    lines = writer.text().splitlines()
+    assert lines[2] == 'hddcoin_seconds_bucket{message_type="a\\"b",le="0.001"} 0'
+    assert lines[3] == 'hddcoin_seconds_bucket{message_type="a\\"b",le="0.002"} 2'
+    # the buckets are cumulative
+    assert lines[-4] == 'hddcoin_seconds_bucket{message_type="a\\"b",le="5.0"} 2'
+    assert lines[-3] == 'hddcoin_seconds_bucket{message_type="a\\"b",le="+Inf"} 3'
+    assert lines[-2] == 'hddcoin_seconds_sum{message_type="a\\"b"} 100.003'
+    assert lines[-1] == 'hddcoin_seconds_count{message_type="a\\"b"} 3'
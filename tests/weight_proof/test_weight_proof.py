@@ -1,6 +1,8 @@
 from __future__ import annotations
 
 import dataclasses
+import time
+from pathlib import Path
 from typing import Dict, List, Optional, Tuple
 
 import pytest
@@ -10,14 +12,24 @@ from hddcoin.consensus.constants import ConsensusConstants
 from hddcoin.consensus.default_constants import DEFAULT_CONSTANTS
 from hddcoin.consensus.full_block_to_block_record import block_to_block_record
 from hddcoin.consensus.pot_iterations import calculate_iterations_quality
-from hddcoin.full_node.weight_proof import WeightProofHandler, _map_sub_epoch_summaries, _validate_summaries_weight
+from hddcoin.full_node.block_store import BlockStore
+from hddcoin.full_node.weight_proof import (
+    WeightProofHandler,
+    WeightProofValidationMetrics,
+    WeightProofValidationStats,
+    _create_sub_epoch_segments_worker,
+    _map_sub_epoch_summaries,
+    _validate_summaries_weight,
+)
 from hddcoin.simulator.block_tools import BlockTools
 from hddcoin.types.blockchain_format.proof_of_space import calculate_prefix_bits, verify_and_get_quality_string
 from hddcoin.types.blockchain_format.sized_bytes import bytes32
 from hddcoin.types.blockchain_format.sub_epoch_summary import SubEpochSummary
 from hddcoin.types.full_block import FullBlock
 from hddcoin.types.header_block import HeaderBlock
+from hddcoin.types.weight_proof import SubEpochSegments, WeightProof
 from hddcoin.util.block_cache import BlockCache
+from hddcoin.util.db_wrapper import DBWrapper2
 from hddcoin.util.generator_tools import get_block_header
 from hddcoin.util.ints import uint32, uint64
 
@@ -175,8 +187,8 @@ class TestWeightProof:
         wpf = WeightProofHandler(blockchain_constants, BlockCache(sub_blocks, header_cache, height_to_hash, summaries))
         wp = await wpf.get_proof_of_weight(blocks[-1].header_hash)
         assert wp is not None
-        wp = await wpf.get_proof_of_weight(blocks[-1].header_hash)
-        assert wp is not None
+        # the parsed proof is cached along with the serialized one
+        assert await wpf.get_proof_of_weight(blocks[-1].header_hash) is wp
 
     @pytest.mark.anyio
     async def test_weight_proof_edge_cases(self, bt: BlockTools, default_400_blocks: List[FullBlock]) -> None:
@@ -281,6 +293,68 @@ class TestWeightProof:
         assert valid
         assert fork_point == 0
 
+    @pytest.mark.anyio
+    async def test_weight_proof_bytes_cached_parts(
+        self, default_1000_blocks: List[FullBlock], blockchain_constants: ConsensusConstants
+    ) -> None:
+        blocks = default_1000_blocks
+        header_cache, height_to_hash, sub_blocks, summaries = await load_blocks_dont_validate(
+            blocks, blockchain_constants
+        )
+        wpf = WeightProofHandler(blockchain_constants, BlockCache(sub_blocks, header_cache, height_to_hash, summaries))
+        # the second proof reuses the serialized parts of the first one
+        for block in [blocks[-10], blocks[-1]]:
+            wp_bytes = await wpf.get_proof_of_weight_bytes(block.header_hash)
+            assert wp_bytes is not None
+            wp = WeightProof.from_bytes(wp_bytes)
+            assert wp.recent_chain_data[-1].header_hash == block.header_hash
+            assert bytes(wp) == wp_bytes
+
+            fresh = WeightProofHandler(
+                blockchain_constants, BlockCache(sub_blocks, header_cache, height_to_hash, summaries)
+            )
+            assert await fresh.get_proof_of_weight_bytes(block.header_hash) == wp_bytes
+
+    @pytest.mark.anyio
+    async def test_create_segments_in_worker(
+        self, tmp_dir: Path, default_1000_blocks: List[FullBlock], blockchain_constants: ConsensusConstants
+    ) -> None:
+        blocks = default_1000_blocks
+        header_cache, height_to_hash, sub_blocks, summaries = await load_blocks_dont_validate(
+            blocks, blockchain_constants
+        )
+        db_path = tmp_dir / "blockchain.sqlite"
+        async with DBWrapper2.managed(database=db_path, db_version=2) as db_wrapper:
+            block_store = await BlockStore.create(db_wrapper)
+            for block in blocks:
+                await block_store.add_full_block(block.header_hash, block, sub_blocks[block.header_hash])
+            await block_store.set_in_chain([(block.header_hash,) for block in blocks])
+
+        wpf = WeightProofHandler(blockchain_constants, BlockCache(sub_blocks, header_cache, height_to_hash, summaries))
+        ses_heights = wpf.blockchain.get_ses_heights()
+        se_start = sub_blocks[height_to_hash[ses_heights[0]]]
+        ses_block = sub_blocks[height_to_hash[ses_heights[1]]]
+        start_height = await wpf.get_prev_two_slots_height(se_start)
+        segments = await wpf._build_sub_epoch_segments(ses_block, se_start, uint32(1), start_height)
+        assert segments is not None
+
+        # the worker process reads the same blocks from the database
+        segments_bytes = _create_sub_epoch_segments_worker(
+            blockchain_constants, str(db_path), bytes(ses_block), bytes(se_start), uint32(1), start_height
+        )
+        assert segments_bytes == bytes(SubEpochSegments(segments))
+
+    @pytest.mark.anyio
+    async def test_segment_pool(self, tmp_dir: Path) -> None:
+        wpf = WeightProofHandler(DEFAULT_CONSTANTS, BlockCache({}), db_path=tmp_dir / "db", segment_processes=1)
+        # the pool is kept around, until the handler is shut down
+        pool = wpf._segment_executor()
+        assert wpf._segment_executor() is pool
+        await wpf.shut_down()
+        with pytest.raises(RuntimeError):
+            pool.submit(print)
+        await wpf.shut_down()
+
     @pytest.mark.anyio
     async def test_weight_proof1000_pre_genesis_empty_slots(
         self, pre_genesis_empty_slots_1000_blocks: List[FullBlock], blockchain_constants: ConsensusConstants
@@ -476,6 +550,26 @@ class TestWeightProof:
         assert fork_point != 0
 
 
+def test_weight_proof_validation_stats() -> None:
+    stats = WeightProofValidationStats()
+    metrics = WeightProofValidationMetrics(start_time=time.monotonic() - 2)
+    metrics.add_work(100)
+    metrics.add_work(50)
+    metrics.remove_work(100)
+    metrics.add_work(20)
+    assert metrics.work_bytes == 70
+    assert metrics.peak_work_bytes == 150
+    stats.record(metrics, False)
+    stats.record(WeightProofValidationMetrics(), True)
+
+    json_dict = stats.to_json_dict()
+    assert json_dict["validated"] == 1
+    assert json_dict["rejected"] == 1
+    assert json_dict["avg_time_to_reject"] >= 2
+    assert json_dict["last_peak_work_bytes"] == 0
+    assert json_dict["max_peak_work_bytes"] == 150
+
+
 @pytest.mark.parametrize("height,expected", [(0, 3), (5496000, 2), (10542000, 1), (15592000, 0), (20643000, 0)])
 def test_calculate_prefix_bits_clamp_zero(height: uint32, expected: int) -> None:
     constants = dataclasses.replace(DEFAULT_CONSTANTS, NUMBER_ZERO_BITS_PLOT_FILTER=3)